@@ -20,11 +20,58 @@ Where:
     <param> (optional) is a string to override COSMOSIS parameter values.
     <summary> (optional) is the SUMMARY.YAML output path (default is './SUMMARY.YAML').
 
+Additional options:
+    --max-attempts N   Retry transient stage failures up to N attempts per stage.
+    --sacc FILE        Reuse an existing SACC file and skip Stage 0.
+    --stage0 MODE      'subprocess' (generate_sn_data.py) or 'inprocess' (sacc_builder).
+    --survey HD COV    Add a survey (files in <path>) to a joint analysis; Stage 0 runs in-process
+                       and keeps the covariance block by block (block_cov.py).
+    --cross-cov I J F  Cross-covariance block F between surveys I and J (0 is <hd>/<cov>,
+                       1... follow --survey).
+    --plots MODE       inline, background, deferred (PLOTS/make_plots.sh) or off.
+    --plot-backend B   cosmosis (cosmosis-postprocess) or native (marginal_plots.py).
+    --plot-pairs A:B   Parameter pairs for native 2-D plots.
+    --extract-params   Chain columns summarized in Stage 3 (mean, std, median, percentiles, HPD).
+    --compress-chains M  Compress finished chains with gzip, xz or zstd after Stage 2.
+    --incremental      Update means, covariance, FoM and min -2logL while Stage 1 runs
+                       (PLOTS/PROVISIONAL); the final values are ready when it exits.
+    --perf-db PATH     Performance database receiving one row per stage (Default:
+                       $FIRECROWN_PERF_DB or ~/.firecrown/perf.sqlite; 'none' disables it).
+    --result-store DIR Reuse the outputs of an identical earlier run (same inputs, options and
+                       toolchain) from DIR and publish successful runs there (Default:
+                       $FIRECROWN_RESULT_STORE; 'none' disables it).
+    --proposal-cache DIR  Start Metropolis runs from the nearest cached posterior covariance and
+                       best fit (same parameters, similar data) and add finished runs to DIR
+                       (Default: $FIRECROWN_PROPOSAL_CACHE; 'none' disables it).
+    --stall-timeout S  Kill a stage after S seconds without chain, log or output growth; wall
+                       limits come from the ini's history in the performance database.
+    --cpus N           Run on N cores no concurrent run on this node holds, with OpenMP/BLAS
+                       thread counts and MPI binding sized to them (sweep jobs: cores_per_job).
+    --no-thin          Do not write COSMOSIS-CHAINS/THINNED_<ini>.txt, the post-burn-in chain
+                       thinned by its autocorrelation time.
+    --stage-dir DIR    Run in node-local scratch (DIR, or 'auto' for $TMPDIR or /dev/shm) and
+                       stage the outputs out to <outdir> after Stage 1 and at the end.
+    --stage-out M      Bulk stage-out method: copy (swap directories in) or tar (one file).
+    --profile          Profile each stage (cProfile/tracemalloc for in-process work, timings
+                       and child rusage for subprocess stages) into ERROR_LOGS.
+    --fisher           Forecast FoM and marginal errors from a Fisher matrix of the HD/COV
+                       in seconds, without running a chain (see --omega-m-prior).
+    --reweight CHAIN   Importance-reweight CHAIN (sampled with --reference-hd/--reference-cov)
+                       to the given HD/COV instead of running a new chain.
+    --sweep SPEC       Expand a YAML sweep of -p overrides/ini variants sharing one Stage 0.
+    --cores N          Core budget for parallel sweep jobs.
+    --queue DIR        Submit the run to a shared-filesystem work queue (work_queue.py) instead
+                       of running it; workers on any node pull and run queued jobs.
+    --warm-worker DIR  Run Stage 1 through a warm in-process COSMOSIS worker (warm_worker.py).
+
 This script has been structured into several functions for modularity and readability:
     parse_arguments() - Parses and validates command-line arguments.
     setup_directories() - Sets up the necessary output directories.
     check_files_and_paths() - Checks if specified files and directories exist.
+    run_subprocess_stage() - Runs one subprocess stage with retries and records it.
     run_stages() - Runs the various stages of the analysis.
+    RunContext - Holds the summary, timer, paths and executor of one run;
+                 runs with separate contexts can share one interpreter.
     burnin() - Calculates the burn-in length for a MCMC chain.
     main() - The main function that calls all the above functions in sequence.
 
@@ -33,9 +80,12 @@ consistent error handling, logging, and timeout management.
 """
 
 import argparse
+import copy
 import os
 import pathlib
+import shutil
 import sys
+import threading
 import time
 import traceback
 import numpy as np
@@ -44,7 +94,32 @@ import yaml
 import logging
 import itertools
 from contextlib import contextmanager
-from subprocess_executor import get_executor
+from chain_io import COMPRESSION_SUFFIXES, compress_chain, open_chain
+from chain_thinning import thin_chain
+from incremental_stats import IncrementalChainStats
+from marginal_plots import native_plot_command, render_marginals
+from param_stats import DEFAULT_PARAMETERS, summarize_chain
+from fingerprint import file_digest, input_fingerprint, result_key, run_fingerprint
+from perfdb import default_db_path, historical_wall_limit, record_run
+from profiling import StageProfiler
+from proposal_cache import (
+    CACHE_ENV_VARIABLE,
+    PROPOSAL_SAMPLERS,
+    ProposalCache,
+    best_fit,
+    dataset_descriptor,
+    read_covmat,
+    start_overrides,
+    varied_parameters,
+    write_proposal,
+)
+from resources import ResourceSpec, allocate_cores, pin_thread
+from result_store import STORE_ENV_VARIABLE, ResultStore
+from samplers import MCMC, WEIGHTED, chain_burn_in, detect_sampler, log_evidence, sampler_from_ini
+from staging import STAGE_OUT_METHODS, ScratchStage
+from subprocess_executor import Heartbeat, RetryPolicy, TimeoutPolicy, get_executor
+from telemetry import ChainTelemetry, expected_rows_from_ini, mpi_ranks
+from work_queue import submit_job
 
 time0 = time.time()
 
@@ -54,7 +129,7 @@ logging.basicConfig(filename='wrapper.log', level=logging.INFO)
 OUTPUT_PATH = os.getcwd()
 SUMMARY_PATH = pathlib.Path(OUTPUT_PATH) / "SUMMARY.YAML"
 
-summary = {
+INITIAL_SUMMARY = {
     "STAGE0": "NOT_STARTED",
     "STAGE1": "NOT_STARTED",
     "STAGE2": "NOT_STARTED",
@@ -77,16 +152,190 @@ summary = {
     "w0ran": None,
     "waran": None,
     "OMran": None,
+    "ATTEMPTS": {},
+    "PLOT_STATUS": None,
+    "PARAMS": None,
+}
+
+# Summary of the CLI run and of calls made without a RunContext
+summary = copy.deepcopy(INITIAL_SUMMARY)
+
+PLOT_MODES = ["inline", "background", "deferred", "off"]
+
+# Chain columns reported under their historical SUMMARY.YAML names
+# (<key>, <key>sig_marg and <key>ran, the latter the 68% HPD interval)
+LEGACY_SUMMARY_KEYS = {
+    "cosmological_parameters--w": "w0",
+    "cosmological_parameters--wa": "wa",
+    "cosmological_parameters--omega_m": "OM",
+}
+
+# Failures worth retrying: flaky shared filesystems during Stage 0 and MPI
+# start-up races during Stage 1. Anything else fails the stage immediately.
+FILESYSTEM_ERROR_PATTERNS = [
+    r"Input/output error",
+    r"Stale file handle",
+    r"Resource temporarily unavailable",
+    r"No space left on device",
+]
+MPI_STARTUP_ERROR_PATTERNS = [
+    r"MPI_Init",
+    r"PMI",
+    r"ORTE",
+    r"orted",
+    r"Connection refused",
+]
+
+DEFAULT_RETRY_POLICIES = {
+    "STAGE0": RetryPolicy(
+        max_attempts=3,
+        transient_patterns=FILESYSTEM_ERROR_PATTERNS,
+    ),
+    "STAGE1": RetryPolicy(
+        max_attempts=3,
+        backoff_initial=30.0,
+        transient_patterns=FILESYSTEM_ERROR_PATTERNS + MPI_STARTUP_ERROR_PATTERNS,
+    ),
+    "STAGE2": RetryPolicy(
+        max_attempts=2,
+        transient_patterns=FILESYSTEM_ERROR_PATTERNS,
+    ),
 }
 
+# A stage is killed when its heartbeat (outputs and logs) stops moving for
+# stall_seconds. The one-hour wall limit is replaced by the ini's history in
+# the performance database once there is enough of it; past the wall limit a
+# stage that still makes progress keeps running.
+DEFAULT_TIMEOUT_POLICIES = {
+    "STAGE0": TimeoutPolicy(wall_seconds=3600, stall_seconds=600, overrun_stall_seconds=120),
+    "STAGE1": TimeoutPolicy(wall_seconds=3600, stall_seconds=1800, overrun_stall_seconds=600),
+    "STAGE2": TimeoutPolicy(wall_seconds=3600, stall_seconds=900, overrun_stall_seconds=300),
+}
+
+def _dump_summary(state, summary_path) -> None:
+    """Atomically write a summary dict to SUMMARY.YAML."""
+    summary_path = pathlib.Path(summary_path)
+    summary_path.parent.mkdir(parents=True, exist_ok=True)
+    # Replace atomically: deferred plot jobs and downstream readers may read it concurrently.
+    # The thread id keeps concurrent runs in one process from sharing a temporary file.
+    tmp_path = summary_path.with_name(f"{summary_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as summary_file:
+        yaml.dump(state, summary_file)
+    os.replace(tmp_path, summary_path)
+
+
 def write_summary(summary_path=None) -> None:
     """Write the current summary state to disk."""
     if summary_path is None:
         summary_path = SUMMARY_PATH
-    summary_path = pathlib.Path(summary_path)
-    summary_path.parent.mkdir(parents=True, exist_ok=True)
-    with summary_path.open("w", encoding="utf-8") as summary_file:
-        yaml.dump(summary, summary_file)
+    _dump_summary(summary, summary_path)
+
+
+class RunContext:
+    """
+    State of one pipeline run: summary, timer, paths, working directory and executor.
+    
+    Every stage function takes an optional ``context``. Runs with their own
+    contexts share no state, so several of them can go through a thread pool
+    in one interpreter:
+    
+        contexts = [RunContext(outdir) for outdir in outdirs]
+        with ThreadPoolExecutor() as pool:
+            pool.map(lambda c: c.run_stages(path, hd, cov, ini), contexts)
+    
+    Without a context the functions fall back to the module-level ``summary``
+    dict and ``time0``, as used by the command-line interface.
+    
+    Attributes:
+        outdir (str): Output directory holding ERROR_LOGS, COSMOSIS-CHAINS and PLOTS
+        summary (dict): SUMMARY.YAML contents of this run
+        summary_path (pathlib.Path): Where the summary is written
+        start_time (float): time.time() at the start of the run
+        workdir (str): Working directory of subprocess stages; generate_sn_data.py
+            writes its SACC file here
+        executor (SubprocessExecutor, optional): Executor for subprocess stages
+            (Default: a new one per run_stages call)
+        stager (ScratchStage, optional): Node-local staging of the run; outdir
+            is then its scratch directory and checkpoints are staged out
+    """
+    
+    def __init__(self, outdir=None, summary_path=None, executor=None, workdir=None, summary=None, start_time=None):
+        """
+        Create the state of a run.
+        
+        Args:
+            outdir (str, optional): Output directory (Default: the current directory)
+            summary_path (str, optional): SUMMARY.YAML path (Default: <outdir>/SUMMARY.YAML)
+            executor (SubprocessExecutor, optional): Executor for subprocess stages
+            workdir (str, optional): Working directory of subprocess stages (Default: outdir)
+            summary (dict, optional): Summary dict to fill (Default: a fresh copy of INITIAL_SUMMARY)
+            start_time (float, optional): Start of the run (Default: now)
+        """
+        self.outdir = outdir if outdir is not None else os.getcwd()
+        self.summary = copy.deepcopy(INITIAL_SUMMARY) if summary is None else summary
+        if summary_path is None:
+            summary_path = os.path.join(self.outdir, "SUMMARY.YAML")
+        self.summary_path = pathlib.Path(summary_path)
+        self.executor = executor
+        self.workdir = workdir if workdir is not None else self.outdir
+        self.start_time = time.time() if start_time is None else start_time
+        self.stager = None
+    
+    @property
+    def error_path(self):
+        return os.path.join(self.outdir, "ERROR_LOGS")
+    
+    @property
+    def output_path(self):
+        return os.path.join(self.outdir, "COSMOSIS-CHAINS")
+    
+    @property
+    def plot_path(self):
+        return os.path.join(self.outdir, "PLOTS")
+    
+    def write_summary(self) -> None:
+        """Write this run's summary to its SUMMARY.YAML."""
+        _dump_summary(self.summary, self.summary_path)
+    
+    def cpu_minutes(self) -> float:
+        """Return the wall-clock minutes since the start of the run."""
+        return round((time.time() - self.start_time) / 60, 2)
+    
+    def checkpoint(self, label: str) -> None:
+        """Stage the outputs written so far out to the shared filesystem, if staging."""
+        if self.stager is not None:
+            self.stager.stage_out(label)
+    
+    def run_stages(self, path, hd, cov, ini, **kwargs):
+        """
+        Run Stages 0-3 into this context's output directory.
+        
+        Args:
+            path (str): Path to HD and COV files
+            hd (str): HD file name
+            cov (str): COV file name
+            ini (str): COSMOSIS ini file name
+            **kwargs: Further options of run_stages()
+            
+        Returns:
+            list: List of executed commands
+        """
+        setup_directories(self.outdir)
+        return run_stages(
+            path, hd, cov, ini, self.error_path, self.output_path, self.plot_path, context=self, **kwargs
+        )
+
+
+def _resolve_context(context, summary_path=None):
+    """Return ``context``, or a context bound to the module-level summary."""
+    if context is not None:
+        return context
+    return RunContext(
+        os.getcwd(),
+        summary_path=summary_path if summary_path is not None else SUMMARY_PATH,
+        summary=summary,
+        start_time=time0,
+    )
 
 @contextmanager
 def redirect_stdout(out_file):
@@ -133,6 +382,178 @@ def parse_arguments():
         default=SUMMARY_PATH,
         help="-s SUMMARY.YAML output path (Default: %s)" % (OUTPUT_PATH),
     )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=None,
+        help="Maximum attempts per stage for transient failures (Default: per-stage policy)",
+    )
+    parser.add_argument(
+        "--sacc",
+        default=None,
+        help="Reuse an existing SACC file and skip Stage 0",
+    )
+    parser.add_argument(
+        "--stage0",
+        choices=["subprocess", "inprocess"],
+        default="subprocess",
+        help="Run Stage 0 through generate_sn_data.py or build the SACC file in-process "
+        "(in-process also accepts .npy/.bin covariances) (Default: subprocess)",
+    )
+    parser.add_argument(
+        "--survey",
+        nargs=2,
+        action="append",
+        default=None,
+        metavar=("HD", "COV"),
+        help="Further survey of a joint analysis, files relative to <path>; repeat for more surveys",
+    )
+    parser.add_argument(
+        "--cross-cov",
+        nargs=3,
+        action="append",
+        default=None,
+        metavar=("I", "J", "FILE"),
+        help="Cross-covariance block (n_I x n_J, relative to <path>) between surveys I and J; "
+        "survey 0 is <hd>/<cov>, 1... the --survey entries in order",
+    )
+    parser.add_argument(
+        "--plots",
+        choices=PLOT_MODES,
+        default="inline",
+        help="When to render plots: inline in Stage 2, in the background or deferred "
+        "to a separate job after SUMMARY.YAML is written, or off (Default: inline)",
+    )
+    parser.add_argument(
+        "--plot-backend",
+        choices=["cosmosis", "native"],
+        default="cosmosis",
+        help="Render plots with cosmosis-postprocess or the built-in parallel renderer (Default: cosmosis)",
+    )
+    parser.add_argument(
+        "--plot-pairs",
+        nargs="*",
+        default=None,
+        help="Parameter pairs (a:b) for native 2-D plots, or 'none' (Default: all pairs)",
+    )
+    parser.add_argument(
+        "--extract-params",
+        nargs="+",
+        default=list(DEFAULT_PARAMETERS),
+        help="Chain columns summarized in Stage 3 (Default: w, wa and omega_m)",
+    )
+    parser.add_argument(
+        "--compress-chains",
+        choices=sorted(COMPRESSION_SUFFIXES),
+        default=None,
+        help="Compress finished chains after Stage 2; all later readers stream from them (Default: off)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Update provisional means, covariance, FoM and min -2logL in PLOTS/PROVISIONAL while Stage 1 runs",
+    )
+    parser.add_argument(
+        "--perf-db",
+        default=None,
+        help="SQLite performance database that gets one row per stage of the run, or 'none' "
+        "(Default: $FIRECROWN_PERF_DB or ~/.firecrown/perf.sqlite)",
+    )
+    parser.add_argument(
+        "--result-store",
+        default=None,
+        help="Shared store of finished runs: restore an identical earlier run instead of running it, and "
+        "publish successful runs, or 'none' (Default: $FIRECROWN_RESULT_STORE, else disabled)",
+    )
+    parser.add_argument(
+        "--proposal-cache",
+        default=None,
+        help="Directory of posterior covariances and best fits that warm-start Metropolis runs, or 'none' "
+        "(Default: $FIRECROWN_PROPOSAL_CACHE, else disabled)",
+    )
+    parser.add_argument(
+        "--stall-timeout",
+        type=float,
+        default=None,
+        help="Seconds without chain, log or output growth before a stage is killed "
+        "(Default: 600 for Stage 0, 1800 for Stage 1, 900 for Stage 2)",
+    )
+    parser.add_argument(
+        "--cpus",
+        type=int,
+        default=None,
+        help="Cores of this run, not shared with concurrent runs on the node; sets the OpenMP/BLAS "
+        "thread counts and MPI binding of the stages (Default: all cores, unpinned)",
+    )
+    parser.add_argument(
+        "--no-thin",
+        action="store_true",
+        help="Do not write the autocorrelation-thinned chain COSMOSIS-CHAINS/THINNED_<ini>.txt",
+    )
+    parser.add_argument(
+        "--stage-dir",
+        default=None,
+        help="Run in a node-local scratch directory under DIR ('auto': $TMPDIR, $SLURM_TMPDIR or "
+        "/dev/shm) and stage the outputs out to --outdir in bulk (Default: write to --outdir directly)",
+    )
+    parser.add_argument(
+        "--stage-out",
+        choices=STAGE_OUT_METHODS,
+        default="copy",
+        help="Stage-out method for --stage-dir: copy the directories in or write one tar file (Default: copy)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile every stage; .pstats, collapsed stacks and PROFILE_<ini>.yaml go to ERROR_LOGS",
+    )
+    parser.add_argument(
+        "--fisher",
+        action="store_true",
+        help="Only forecast the FoM and marginal errors from a Fisher matrix of the HD/COV",
+    )
+    parser.add_argument(
+        "--omega-m-prior",
+        type=float,
+        default=None,
+        help="Width of a Gaussian Omega_m prior for --fisher (Default: none)",
+    )
+    parser.add_argument(
+        "--reweight",
+        default=None,
+        help="Existing chain to importance-reweight to the given HD/COV instead of running the stages",
+    )
+    parser.add_argument(
+        "--reference-hd",
+        default=None,
+        help="HD file the --reweight chain was sampled with",
+    )
+    parser.add_argument(
+        "--reference-cov",
+        default=None,
+        help="COV file the --reweight chain was sampled with",
+    )
+    parser.add_argument(
+        "--sweep",
+        default=None,
+        help="YAML sweep specification (grid or list of -p overrides and ini variants)",
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help="Core budget shared by parallel sweep jobs (Default: all cores)",
+    )
+    parser.add_argument(
+        "--queue",
+        default=None,
+        help="Submit the run to this work queue directory for work_queue.py workers instead of running it",
+    )
+    parser.add_argument(
+        "--warm-worker",
+        default=None,
+        help="Queue directory of a warm_worker.py process that runs Stage 1 in-process",
+    )
     args = parser.parse_args()
     return args
 
@@ -251,7 +672,8 @@ def burnin(chain: str) -> int:
     FileNotFoundError: If chain file does not exist
     """
     try:
-        a = pd.read_csv(chain, comment="#", header=None, sep=r"\s+")
+        with open_chain(chain) as chain_file:
+            a = pd.read_csv(chain_file, comment="#", header=None, sep=r"\s+")
         L = int(0.15 * a.shape[0])
         return L
     except FileNotFoundError:
@@ -265,6 +687,782 @@ def burnin(chain: str) -> int:
         raise
 
 
+def chain_has_samples(chain: str) -> bool:
+    """
+    Check whether a COSMOSIS chain file already contains sample rows.
+
+    Parameters
+    ----------
+    chain : str
+        The path to the MCMC chain file.
+
+    Returns
+    -------
+    bool
+        True if the file exists and holds at least one non-comment line.
+    """
+    try:
+        with open_chain(chain) as chain_file:
+            return any(line.strip() and not line.startswith("#") for line in chain_file)
+    except OSError:
+        return False
+
+
+def run_subprocess_stage(
+    executor,
+    stage,
+    command,
+    output_file,
+    error_file,
+    description,
+    failure_message,
+    summary_path=None,
+    retry_policy=None,
+    retry_command=None,
+    monitor=None,
+    cwd=None,
+    timeout_policy=None,
+    heartbeat=None,
+    resources=None,
+    context=None,
+):
+    """
+    Run one subprocess stage and record its outcome in the summary.
+    
+    Args:
+        executor (SubprocessExecutor): Executor used to run the command
+        stage (str): Summary key of the stage, e.g. "STAGE1"
+        command (str): Shell command for the first attempt
+        output_file (str): Path to file for stdout
+        error_file (str): Path to file for stderr
+        description (str): Human-readable description of the stage
+        failure_message (str): Message of the RuntimeError raised on failure
+        summary_path (str, optional): SUMMARY.YAML output path
+        retry_policy (RetryPolicy, optional): Retry policy for transient failures
+        retry_command (callable, optional): Builds the command for a retry attempt
+        monitor (ChainTelemetry, optional): Runs alongside every attempt
+        cwd (str, optional): Working directory of the command (Default: current)
+        timeout_policy (TimeoutPolicy, optional): When the stage counts as hung
+            (Default: the executor's fixed timeout)
+        heartbeat (Heartbeat, optional): Progress signal of the stage
+        resources (ResourceSpec, optional): CPU set and thread counts of the
+            stage (Default: inherited from the wrapper)
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+        
+    Raises:
+        RuntimeError: If the stage fails after all attempts
+    """
+    context = _resolve_context(context, summary_path)
+    context.summary[stage] = "STARTED"
+    if timeout_policy is not None:
+        context.summary.setdefault("TIMEOUTS", {})[stage] = timeout_policy.describe()
+    if resources is not None:
+        context.summary.setdefault("RESOURCES", {})[stage] = resources.describe()
+    context.write_summary()
+    
+    try:
+        returncode, attempts = executor.run_with_retry(
+            command,
+            output_file,
+            error_file,
+            retry_policy=retry_policy,
+            retry_command=retry_command,
+            description=description,
+            monitor=monitor,
+            cwd=cwd,
+            timeout_policy=timeout_policy,
+            heartbeat=heartbeat,
+            resources=resources,
+        )
+    except RuntimeError as e:
+        context.summary["ATTEMPTS"][stage] = getattr(e, "attempts", [])
+        killed = [attempt["killed"] for attempt in context.summary["ATTEMPTS"][stage] if "killed" in attempt]
+        if killed:
+            context.summary.setdefault("TIMEOUTS", {}).setdefault(stage, {})["killed"] = killed[-1]
+        context.summary[stage] = "FAILED"
+        context.summary["ABORT_IF_ZERO"] = 0
+        context.write_summary()
+        raise
+    
+    context.summary["ATTEMPTS"][stage] = attempts
+    if returncode != 0:
+        context.summary[stage] = "FAILED"
+        context.summary["ABORT_IF_ZERO"] = 0
+        context.write_summary()
+        raise RuntimeError(failure_message)
+    
+    context.summary[stage] = "SUCCESSFUL"
+    context.write_summary()
+    logging.info(f"{description} completed successfully.")
+
+
+def run_warm_worker_stage(
+    queue_dir,
+    job,
+    stage,
+    description,
+    failure_message,
+    summary_path=None,
+    timeout=None,
+    retry_policy=None,
+    retry_job=None,
+    timeout_policy=None,
+    heartbeat=None,
+    context=None,
+):
+    """
+    Run one stage through a warm worker queue and record its outcome.
+    
+    Failed jobs classified as transient by ``retry_policy`` are resubmitted.
+    A job past the limits of ``timeout_policy`` is abandoned, not retried:
+    it runs inside the worker and keeps it busy until it finishes.
+    
+    Args:
+        queue_dir (str): Queue directory served by a warm_worker.py process
+        job (dict): Job with 'ini', 'overrides', 'output_file' and 'error_file'
+        stage (str): Summary key of the stage, e.g. "STAGE1"
+        description (str): Human-readable description of the stage
+        failure_message (str): Message of the RuntimeError raised on failure
+        summary_path (str, optional): SUMMARY.YAML output path
+        timeout (float, optional): Seconds to wait for the job; ignored when
+            ``timeout_policy`` is given, as in the subprocess path
+        retry_policy (RetryPolicy, optional): Retry policy for transient failures
+        retry_job (callable, optional): Builds the job for a retry attempt
+        timeout_policy (TimeoutPolicy, optional): When to stop waiting for the job
+        heartbeat (Heartbeat, optional): Progress signal of the job
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+        
+    Raises:
+        RuntimeError: If the job fails or does not finish in time
+    """
+    from warm_worker import submit_job, wait_for_job
+
+    context = _resolve_context(context, summary_path)
+    context.summary[stage] = "STARTED"
+    if timeout_policy is not None:
+        context.summary.setdefault("TIMEOUTS", {})[stage] = timeout_policy.describe()
+    context.write_summary()
+    wait_options = {}
+    if timeout_policy is not None:
+        # The policy's stall and wall limits replace the fixed timeout
+        timeout = None
+        wait_options = {"timeout_policy": timeout_policy, "heartbeat": heartbeat,
+                        "poll_interval": timeout_policy.poll_interval}
+    policy = retry_policy or RetryPolicy()
+    attempts = []
+    context.summary["ATTEMPTS"][stage] = attempts
+    for attempt in range(1, policy.max_attempts + 1):
+        if attempt > 1 and retry_job is not None:
+            job = retry_job(attempt)
+        try:
+            job_id = submit_job(queue_dir, job)
+            result = wait_for_job(queue_dir, job_id, timeout=timeout, **wait_options)
+        except RuntimeError as e:
+            attempts.append({'attempt': attempt, 'returncode': None, 'transient': False, 'error': str(e),
+                             'worker': queue_dir})
+            context.summary[stage] = "FAILED"
+            context.summary["ABORT_IF_ZERO"] = 0
+            context.write_summary()
+            raise
+        record = {'attempt': attempt, 'returncode': result["returncode"], 'seconds': result.get("seconds"),
+                  'transient': False, 'worker': queue_dir}
+        if result["returncode"] != 0:
+            try:
+                with open(job["error_file"], errors="replace") as handle:
+                    stderr_text = handle.read()
+            except OSError:
+                stderr_text = ""
+            record['transient'] = policy.is_transient(result["returncode"], stderr_text)
+        attempts.append(record)
+        if result["returncode"] == 0 or not record['transient'] or attempt == policy.max_attempts:
+            break
+        for path in (job["output_file"], job["error_file"]):
+            if os.path.exists(path):
+                os.replace(path, f"{path}.attempt{attempt}")
+        delay = policy.delay(attempt)
+        logging.warning(f"Transient failure on attempt {attempt}/{policy.max_attempts}: {description}; "
+                        f"retrying in {delay:.1f}s")
+        time.sleep(delay)
+    
+    if result["returncode"] != 0:
+        context.summary[stage] = "FAILED"
+        context.summary["ABORT_IF_ZERO"] = 0
+        context.write_summary()
+        raise RuntimeError(failure_message)
+    
+    context.summary[stage] = "SUCCESSFUL"
+    context.write_summary()
+    logging.info(f"{description} completed successfully.")
+
+
+def generate_sacc_inprocess_stage(path, hd, cov, destination, commands, summary_path=None, surveys=None,
+                                  cross_covariances=None, context=None):
+    """
+    Run Stage 0 in-process with sacc_builder and record its outcome.
+    
+    Args:
+        path (str): Path to HD and COV files
+        hd (str): HD file name
+        cov (str): COV file name (text, .npy or .bin)
+        destination (str): Output SACC path (Default: srd-y1-converted.sacc in the CWD)
+        commands (list): Executed commands are appended to this list
+        summary_path (str, optional): SUMMARY.YAML output path
+        surveys (list, optional): (HD, COV) file names of further surveys
+        cross_covariances (list, optional): (i, j, file) cross-covariance
+            blocks between surveys; survey 0 is ``hd``/``cov``
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+        
+    Returns:
+        str: Path to the generated SACC file
+        
+    Raises:
+        RuntimeError: If SACC generation fails
+    """
+    from sacc_builder import generate_sacc_inprocess
+
+    context = _resolve_context(context, summary_path)
+    if destination is None:
+        destination = os.path.join(context.workdir, "srd-y1-converted.sacc")
+    inputs = " ".join(os.path.join(path, name) for pair in [(hd, cov)] + list(surveys or []) for name in pair)
+    commands.append(f"\nSACC Input Vector: in-process {inputs} -> {destination}\n")
+    context.summary["STAGE0"] = "STARTED"
+    if surveys or cross_covariances:
+        context.summary["SURVEYS"] = {
+            "hd": [os.path.join(path, name) for name, _ in [(hd, cov)] + list(surveys or [])],
+            "cross_covariances": [[int(i), int(j), os.path.join(path, name)] for i, j, name in cross_covariances or []],
+        }
+    context.write_summary()
+    try:
+        sacc_file = generate_sacc_inprocess(path, hd, cov, destination, surveys=surveys,
+                                            cross_covariances=cross_covariances)
+    except Exception as e:
+        context.summary["STAGE0"] = "FAILED"
+        context.summary["ABORT_IF_ZERO"] = 0
+        context.write_summary()
+        logging.error(f"Stage 0 failed with error: {str(e)}")
+        raise RuntimeError(f"Stage 0 (SACC generation) failed: {str(e)}") from e
+    
+    context.summary["STAGE0"] = "SUCCESSFUL"
+    context.write_summary()
+    logging.info("Stage 0 (SACC generation, in-process) completed successfully.")
+    return sacc_file
+
+
+def generate_sacc(
+    executor,
+    path,
+    hd,
+    cov,
+    error_path,
+    ini_stem,
+    commands,
+    summary_path=None,
+    destination=None,
+    retry_policy=None,
+    inprocess=False,
+    timeout_policy=None,
+    resources=None,
+    surveys=None,
+    cross_covariances=None,
+    context=None,
+):
+    """
+    Run Stage 0: generate the SACC file from the HD and COV files.
+    
+    Args:
+        executor (SubprocessExecutor): Executor used to run the command
+        path (str): Path to HD and COV files
+        hd (str): HD file name
+        cov (str): COV file name
+        error_path (str): Path for error/log files
+        ini_stem (str): Stem of the ini file, used to name the log files
+        commands (list): Executed commands are appended to this list
+        summary_path (str, optional): SUMMARY.YAML output path
+        destination (str, optional): Move the generated SACC file here
+        retry_policy (RetryPolicy, optional): Retry policy for transient failures
+        inprocess (bool): Build the SACC file in this process (sacc_builder)
+            instead of running generate_sn_data.py
+        timeout_policy (TimeoutPolicy, optional): When generate_sn_data.py counts as hung
+        resources (ResourceSpec, optional): CPU set and thread counts of generate_sn_data.py
+        surveys (list, optional): (HD, COV) file names of further surveys of a
+            joint analysis; Stage 0 then runs in-process
+        cross_covariances (list, optional): (i, j, file) cross-covariance blocks
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+        
+    Returns:
+        str: Path to the generated SACC file
+        
+    Raises:
+        RuntimeError: If SACC generation fails
+    """
+    context = _resolve_context(context, summary_path)
+    if (surveys or cross_covariances) and not inprocess:
+        # generate_sn_data.py takes exactly one HD/COV pair
+        logging.info("Joint analysis of several surveys: Stage 0 runs in-process.")
+        inprocess = True
+    if inprocess:
+        return generate_sacc_inprocess_stage(path, hd, cov, destination, commands, surveys=surveys,
+                                             cross_covariances=cross_covariances, context=context)
+
+    # generate_sn_data.py writes into its working directory, the run's workdir
+    sacc_file = os.path.join(context.workdir, "srd-y1-converted.sacc")
+    
+    # Remove any preexisting sacc file
+    try:
+        if os.path.exists(sacc_file):
+            os.remove(sacc_file)
+    except Exception as e:
+        logging.warning(f"Could not remove existing SACC file: {e}")
+
+    stage_0_command = f"python $FIRECROWN_EXAMPLES_DIR/srd_sn/generate_sn_data.py {os.path.abspath(path)} {hd} {cov}"
+    commands.append(f"\nSACC Input Vector: {stage_0_command}\n")
+    
+    run_subprocess_stage(
+        executor,
+        "STAGE0",
+        stage_0_command,
+        f"{error_path}/generate_sn_data_output_{ini_stem}.log",
+        f"{error_path}/generate_sn_data_output_ERROR_{ini_stem}.err",
+        "Stage 0 (SACC generation)",
+        "Stage 0 (SACC generation) failed. Check generate_sn_data error logs.",
+        retry_policy=retry_policy,
+        cwd=context.workdir,
+        timeout_policy=timeout_policy,
+        heartbeat=Heartbeat([
+            f"{error_path}/generate_sn_data_output_{ini_stem}.log",
+            f"{error_path}/generate_sn_data_output_ERROR_{ini_stem}.err",
+            sacc_file,
+        ]),
+        resources=resources,
+        context=context,
+    )
+    
+    if destination is not None:
+        destination = os.path.abspath(destination)
+        shutil.move(sacc_file, destination)
+        sacc_file = destination
+    return sacc_file
+
+
+def compress_finished_chain(chain_file, method, keep_raw=False, context=None):
+    """
+    Compress a finished chain in place; failures only leave it uncompressed.
+    
+    Args:
+        chain_file (str): Uncompressed chain written by Stage 1
+        method (str): "gzip", "xz" or "zstd"
+        keep_raw (bool): A later job needs the uncompressed chain; skip compression
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+    """
+    context = _resolve_context(context)
+    if keep_raw:
+        logging.warning(f"Chain {chain_file} left uncompressed for the cosmosis-postprocess plot job.")
+        return
+    try:
+        context.summary["CHAIN_COMPRESSION"] = compress_chain(chain_file, method)
+    except Exception as e:
+        logging.error(f"Compressing {chain_file} failed: {str(e)}")
+        return
+    context.write_summary()
+
+
+def warm_start_stage1(cache_dir, hd_file, cov_file, ini_file, param_override, destination, context=None):
+    """
+    Proposal covariance and starting point for Stage 1 from the proposal cache.
+    
+    Failures only leave Stage 1 on the ini's own proposal.
+    
+    Args:
+        cache_dir (str): Proposal cache directory (see proposal_cache.py)
+        hd_file (str): HD file of the run
+        cov_file (str): COV file of the run
+        ini_file (str): COSMOSIS ini file
+        param_override (str): COSMOSIS ``-p`` overrides of the run
+        destination (str): Where the proposal covariance is written
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+    
+    Returns:
+        tuple: (``-p`` overrides, ``-v`` overrides), both empty without a match
+    """
+    context = _resolve_context(context)
+    context.summary["PROPOSAL"] = None
+    sampler = sampler_from_ini(ini_file, param_override)
+    if sampler.name not in PROPOSAL_SAMPLERS:
+        return [], []
+    try:
+        parameters = varied_parameters(ini_file, param_override)
+        if not parameters:
+            return [], []
+        entry = ProposalCache(cache_dir).nearest(
+            [parameter[0] for parameter in parameters],
+            dataset_descriptor(hd_file),
+            input_hash=input_fingerprint([hd_file, cov_file, ini_file], param_override),
+        )
+        if entry is None:
+            logging.info(f"No cached proposal for {ini_file} in {cache_dir}")
+            return [], []
+        write_proposal(entry, parameters, destination)
+        values = start_overrides(entry, parameters)
+    except Exception as e:
+        logging.warning(f"Warm start from the proposal cache {cache_dir} failed: {str(e)}")
+        return [], []
+    context.summary["PROPOSAL"] = {
+        "covmat": os.path.abspath(destination),
+        "source": entry["path"],
+        "distance": round(float(entry["distance"]), 4),
+        "start": {name: entry["bestfit"][name] for name, *_ in parameters if name in entry["bestfit"]},
+    }
+    context.write_summary()
+    logging.info(f"Stage 1 warm-started from {entry['path']} (dataset distance {entry['distance']:.3f})")
+    return [f"{sampler.name}.covmat={os.path.abspath(destination)}"], values
+
+
+def update_proposal_cache(cache_dir, chain_file, covmat_file, hd_file, cov_file, ini_file, param_override):
+    """
+    Store the posterior covariance and best fit of a finished run; failures are only logged.
+    
+    Args:
+        cache_dir (str): Proposal cache directory
+        chain_file (str): Chain written by Stage 1
+        covmat_file (str): Posterior covariance written by Stage 2
+        hd_file (str): HD file of the run
+        cov_file (str): COV file of the run
+        ini_file (str): COSMOSIS ini file
+        param_override (str): COSMOSIS ``-p`` overrides of the run
+    """
+    try:
+        names = [parameter[0] for parameter in varied_parameters(ini_file, param_override)]
+        cov_names, cov = read_covmat(covmat_file)
+        if not names or not set(names) <= set(cov_names):
+            logging.info(f"{covmat_file} does not cover the varied parameters; proposal cache not updated")
+            return
+        index = [cov_names.index(name) for name in names]
+        ProposalCache(cache_dir).store(
+            names,
+            cov[np.ix_(index, index)],
+            best_fit(chain_file),
+            dataset_descriptor(hd_file),
+            input_fingerprint([hd_file, cov_file, ini_file], param_override),
+            ini=pathlib.Path(ini_file).stem,
+        )
+    except Exception as e:
+        logging.warning(f"Updating the proposal cache {cache_dir} failed: {str(e)}")
+
+
+def stage_timeout_policies(db_path, ini_stem, stall_timeout=None):
+    """
+    Timeout policies of the subprocess stages, with wall limits from the run history.
+    
+    Args:
+        db_path (str, optional): Performance database (see perfdb.py); None
+            keeps the default wall limits
+        ini_stem (str): Ini name the history is looked up for
+        stall_timeout (float, optional): Seconds without progress before any
+            stage is killed (Default: per stage, DEFAULT_TIMEOUT_POLICIES)
+    
+    Returns:
+        dict: TimeoutPolicy per stage key
+    """
+    policies = {}
+    for stage, default in DEFAULT_TIMEOUT_POLICIES.items():
+        policy = copy.copy(default)
+        if stall_timeout is not None:
+            policy.stall_seconds = stall_timeout
+        if db_path is not None:
+            try:
+                wall_limit = historical_wall_limit(db_path, ini_stem, stage)
+            except Exception as e:
+                logging.warning(f"Reading the {stage} history of {ini_stem} from {db_path} failed: {str(e)}")
+                wall_limit = None
+            if wall_limit is not None:
+                policy.wall_seconds = round(wall_limit, 1)
+                policy.source = "history"
+        policies[stage] = policy
+    return policies
+
+
+def stage_resource_specs(cpus, n_ranks=1):
+    """
+    Resource specs of the subprocess stages of a run holding ``cpus``.
+    
+    Stages 0 and 2 are single processes and get one thread per core. Stage 1
+    splits the cores between its MPI ranks, each bound to a core.
+    
+    Args:
+        cpus (list): Cores of the run (see resources.allocate_cores)
+        n_ranks (int): MPI ranks of Stage 1
+    
+    Returns:
+        dict: ResourceSpec per stage key, or {} without cores
+    """
+    if not cpus:
+        return {}
+    return {
+        "STAGE0": ResourceSpec(cpus),
+        "STAGE1": ResourceSpec(cpus, threads=max(1, len(cpus) // max(1, n_ranks)), mpi_bind="core"),
+        "STAGE2": ResourceSpec(cpus),
+    }
+
+
+def record_performance(db_path, args, profiler, context=None):
+    """
+    Add the stage timings of a run to the performance database; failures are only logged.
+    
+    Args:
+        db_path (str): SQLite database (see perfdb.py)
+        args (argparse.Namespace): Command-line arguments of the run
+        profiler (StageProfiler): Profiler with timing records of the stages
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary, written to ``args.summary``)
+    """
+    context = _resolve_context(context, args.summary)
+    stages = ("STAGE0", "STAGE1", "STAGE2", "STAGE3")
+    if any(context.summary.get(stage) == "FAILED" for stage in stages):
+        overall = "FAILED"
+    else:
+        overall = context.summary.get("STAGE3")
+    records = dict(profiler.records)
+    times = os.times()
+    records["TOTAL"] = {
+        "wall_seconds": round(time.time() - context.start_time, 4),
+        "cpu_seconds": round(times.user + times.system + times.children_user + times.children_system, 4),
+        "peak_rss_mb": max((r["peak_rss_mb"] for r in records.values() if r.get("peak_rss_mb")), default=None),
+    }
+    statuses = {name: context.summary.get(name) if name in stages else overall for name in records}
+    try:
+        fingerprint = run_fingerprint(
+            os.path.join(args.path, args.hd), os.path.join(args.path, args.cov), args.ini, args.param or ""
+        )
+        run_id = record_run(
+            db_path, fingerprint, records, statuses, rows=context.summary.get("CHAIN_ROWS"),
+            started=context.start_time,
+        )
+        context.summary["PERF_RUN_ID"] = run_id
+        if context.summary.get("PLOT_STATUS") == "QUEUED":
+            # The background plot job owns PLOT_STATUS on disk now; add only the run id
+            from deferred_plots import update_summary_fields
+
+            update_summary_fields(str(context.summary_path), PERF_RUN_ID=run_id)
+        else:
+            context.write_summary()
+    except Exception as e:
+        logging.warning(f"Recording the run in the performance database {db_path} failed: {str(e)}")
+
+
+def proposal_cache_dir(args):
+    """Return the proposal cache directory of a run (--proposal-cache or $FIRECROWN_PROPOSAL_CACHE), or None."""
+    cache_dir = args.proposal_cache or os.environ.get(CACHE_ENV_VARIABLE)
+    if not cache_dir or cache_dir == "none":
+        return None
+    return os.path.abspath(cache_dir)
+
+
+def survey_inputs(args):
+    """
+    Further surveys and cross-covariance blocks of a joint analysis.
+    
+    Namespaces built by hand for a single HD/COV may lack the options.
+    
+    Returns:
+        tuple: (--survey pairs, --cross-cov triples), each a list, empty for a single survey
+    """
+    return list(getattr(args, "survey", None) or []), list(getattr(args, "cross_cov", None) or [])
+
+
+def stage_retry_policies(max_attempts=None):
+    """
+    Retry policies of the stages, with ``max_attempts`` (--max-attempts) applied to each.
+    
+    Args:
+        max_attempts (int, optional): Attempts per stage (Default: DEFAULT_RETRY_POLICIES)
+    
+    Returns:
+        dict: RetryPolicy per stage key
+    """
+    if max_attempts is None:
+        return DEFAULT_RETRY_POLICIES
+    policies = {}
+    for stage, policy in DEFAULT_RETRY_POLICIES.items():
+        policies[stage] = copy.copy(policy)
+        policies[stage].max_attempts = max(1, max_attempts)
+    return policies
+
+
+def write_input_info(error_path, outdir, argv=None):
+    """
+    Write ERROR_LOGS/INPUT.INFO, the record of how a run was started.
+    
+    Args:
+        error_path (str): ERROR_LOGS directory of the run
+        outdir (str): Output directory given on the command line
+        argv (list, optional): Command line of the run (Default: sys.argv)
+    """
+    with open(os.path.join(error_path, 'INPUT.INFO'), 'w') as f:
+        f.write('STAGE 0 = Generate SACC file from SN data\n')
+        f.write('STAGE 1 = COSMOSIS parameter estimation\n')
+        f.write('STAGE 2 = POST PROCESSING (PLOT)\n')
+        f.write('STAGE 3 = Extract cosmological parameters\n\n')
+        f.write('#Required Info\n')
+        f.write(f'CWR: {os.getcwd()}\n')
+        f.write(f'ARG_LIST: {sys.argv if argv is None else argv}\n')
+        f.write(f'TIME_STAMP: {time.asctime()}\n')
+        f.write(f'OUTPUT DIR: {outdir}\n')
+
+
+def queue_job(args):
+    """
+    Job specification of a run for the work queue (see work_queue.py).
+    
+    Args:
+        args (argparse.Namespace): Command-line arguments of the run
+    
+    Returns:
+        dict: 'path', 'hd', 'cov', 'ini', 'outdir', 'summary', 'param',
+            'options' (run_stages() keywords), with absolute paths, the
+            submitting 'cwd' and 'argv', and the 'max_attempts' and
+            'stall_timeout' the worker builds the stage policies from
+    """
+    summary_path = pathlib.Path(args.summary)
+    if summary_path == SUMMARY_PATH:
+        # The submitting directory's SUMMARY.YAML would be shared by every queued run
+        summary_path = pathlib.Path(args.outdir) / "SUMMARY.YAML"
+    surveys, cross_covariances = survey_inputs(args)
+    return {
+        "path": os.path.abspath(args.path),
+        "hd": args.hd,
+        "cov": args.cov,
+        "ini": os.path.abspath(args.ini),
+        "outdir": os.path.abspath(args.outdir),
+        "summary": os.path.abspath(summary_path),
+        "param": args.param or "",
+        "cwd": os.getcwd(),
+        "argv": list(sys.argv),
+        "max_attempts": args.max_attempts,
+        "stall_timeout": args.stall_timeout,
+        "options": {
+            "sacc_file": os.path.abspath(args.sacc) if args.sacc else None,
+            "stage0_inprocess": args.stage0 == "inprocess",
+            "plot_mode": args.plots,
+            "plot_backend": args.plot_backend,
+            "plot_pairs": args.plot_pairs,
+            "extract_params": list(args.extract_params),
+            "compress_chains": args.compress_chains,
+            "thin_chains": not args.no_thin,
+            "incremental": args.incremental,
+            "proposal_cache": proposal_cache_dir(args),
+            "surveys": surveys or None,
+            "cross_covariances": cross_covariances or None,
+        },
+    }
+
+
+def run_result_key(args):
+    """
+    Result-store key of a run: inputs, the options that change its outputs and the toolchain.
+    
+    Args:
+        args (argparse.Namespace): Command-line arguments of the run
+    
+    Returns:
+        str: SHA-256 hex digest (see fingerprint.result_key)
+    """
+    options = {
+        "plots": args.plots,
+        "plot_backend": args.plot_backend,
+        "plot_pairs": args.plot_pairs,
+        "extract_params": list(args.extract_params),
+        "compress_chains": args.compress_chains,
+        "thin": not args.no_thin,
+        "incremental": args.incremental,
+        "sacc": file_digest(args.sacc) if args.sacc else None,
+    }
+    surveys, cross_covariances = survey_inputs(args)
+    if surveys or cross_covariances:
+        options["surveys"] = [[file_digest(os.path.join(args.path, name)) for name in pair] for pair in surveys]
+        options["cross_covariances"] = [[int(i), int(j), file_digest(os.path.join(args.path, name))]
+                                        for i, j, name in cross_covariances]
+    if getattr(args, "stage_dir", None) and args.stage_out == "tar":
+        # Such a run stores only STAGED_OUTPUTS.tar, which is no use to an unstaged run
+        options["stage_out"] = "tar"
+    return result_key(
+        os.path.join(args.path, args.hd), os.path.join(args.path, args.cov), args.ini, args.param or "", options
+    )
+
+
+# PLOT_STATUS values after which PLOTS/ is complete; None means plotting never started
+FINISHED_PLOT_STATES = (None, "INLINE", "SUCCESSFUL", "DISABLED")
+
+
+def publish_result(store, key, args):
+    """
+    Publish a finished run to the result store; failures are only logged.
+    
+    Only runs whose Stage 3 succeeded and whose plots are complete are stored.
+    
+    Args:
+        store (ResultStore): Result store
+        key (str): run_result_key() of the run
+        args (argparse.Namespace): Command-line arguments of the run
+    """
+    try:
+        with open(args.summary) as f:
+            state = yaml.safe_load(f) or {}
+        if state.get("STAGE3") != "SUCCESSFUL" or state.get("PLOT_STATUS") not in FINISHED_PLOT_STATES:
+            logging.info(f"Run not published to the result store (STAGE3 {state.get('STAGE3')}, "
+                         f"PLOT_STATUS {state.get('PLOT_STATUS')})")
+            return
+        store.publish(key, args.outdir, args.summary, metadata={"ini": pathlib.Path(args.ini).stem})
+    except Exception as e:
+        logging.warning(f"Publishing the run to the result store {store.root} failed: {str(e)}")
+
+
+def write_thinned_chain(chain_file, destination, burn, walkers=1, context=None):
+    """
+    Write the thinned, burn-in-trimmed chain; failures only skip the product.
+    
+    Args:
+        chain_file (str): Chain written by Stage 1
+        destination (str): Path of the thinned chain
+        burn (int): Burn-in length in rows
+        walkers (int): Number of interleaved walkers (emcee)
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+    """
+    context = _resolve_context(context)
+    try:
+        context.summary["THINNED_CHAIN"] = thin_chain(chain_file, destination, burn=burn, walkers=walkers)
+    except Exception as e:
+        logging.error(f"Thinning {chain_file} failed: {str(e)}")
+        return
+    context.write_summary()
+
+
+def record_parameter_summaries(parameter_summaries, context=None):
+    """
+    Store ParameterSummary records in the summary, including the legacy fields.
+    
+    Args:
+        parameter_summaries (list): ParameterSummary records from param_stats
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+    """
+    context = _resolve_context(context)
+    context.summary["PARAMS"] = {}
+    for result in parameter_summaries:
+        context.summary["PARAMS"][result.name] = result.to_dict()
+        if result.name in LEGACY_SUMMARY_KEYS:
+            key = LEGACY_SUMMARY_KEYS[result.name]
+            context.summary[key] = result.mean
+            context.summary[f"{key}sig_marg"] = result.std
+            context.summary[f"{key}ran"] = list(result.hpd[0.68]) if 0.68 in result.hpd else None
+
+
 def run_stages(
     path,
     hd,
@@ -275,6 +1473,24 @@ def run_stages(
     plot_path,
     param_override="",
     summary_path=None,
+    retry_policies=None,
+    sacc_file=None,
+    worker_queue=None,
+    stage0_inprocess=False,
+    plot_mode="inline",
+    plot_backend="cosmosis",
+    plot_pairs=None,
+    extract_params=DEFAULT_PARAMETERS,
+    profiler=None,
+    compress_chains=None,
+    thin_chains=True,
+    incremental=False,
+    timeout_policies=None,
+    proposal_cache=None,
+    resource_specs=None,
+    surveys=None,
+    cross_covariances=None,
+    context=None,
 ):
     """
     Run the various stages of the analysis using SubprocessExecutor.
@@ -292,6 +1508,46 @@ def run_stages(
         error_path (str): Path for error/log files
         output_path (str): Path for COSMOSIS output chains
         plot_path (str): Path for plots and analysis results
+        param_override (str, optional): Extra COSMOSIS ``-p`` overrides
+        summary_path (str, optional): SUMMARY.YAML output path
+        retry_policies (dict, optional): RetryPolicy per stage key
+            (Default: DEFAULT_RETRY_POLICIES)
+        sacc_file (str, optional): Existing SACC file to use; Stage 0 is skipped
+        worker_queue (str, optional): Queue directory of a warm worker that
+            runs Stage 1 in-process instead of a new ``cosmosis`` interpreter
+        stage0_inprocess (bool): Build the SACC file in-process and write it
+            next to the chains instead of running generate_sn_data.py
+        plot_mode (str): "inline" renders plots in Stage 2; "background" and
+            "deferred" render them after Stage 3 has published the numbers
+            (see deferred_plots.py); "off" skips them
+        plot_backend (str): "cosmosis" (cosmosis-postprocess) or "native"
+            (marginal_plots.py, parallel and vectorized)
+        plot_pairs (list, optional): "a:b" parameter pairs for native 2-D
+            plots (Default: all pairs)
+        extract_params (sequence): Chain columns summarized in Stage 3 with
+            mean, standard deviation, median, percentiles and HPD intervals
+        profiler (StageProfiler, optional): Profiles every stage when enabled
+            (Default: profiling disabled)
+        compress_chains (str, optional): Compress the finished chain after
+            Stage 2 with "gzip", "xz" or "zstd"; later readers stream from it
+        thin_chains (bool): Write COSMOSIS-CHAINS/THINNED_<ini>.txt, the
+            post-burn-in chain thinned by its autocorrelation time
+        incremental (bool): Update means, covariance, FoM and min -2logL while
+            Stage 1 runs (PLOTS/PROVISIONAL) and take the burn-in from them
+        timeout_policies (dict, optional): TimeoutPolicy per subprocess stage
+            key; a stage is killed only when its outputs and logs stop
+            growing (Default: DEFAULT_TIMEOUT_POLICIES)
+        proposal_cache (str, optional): Proposal cache directory; Metropolis
+            runs start from the nearest cached covariance and best fit, and
+            successful ones are added to it
+        resource_specs (dict, optional): ResourceSpec per subprocess stage
+            key (see stage_resource_specs; Default: no pinning)
+        surveys (list, optional): (HD, COV) file names, relative to ``path``,
+            of further surveys analysed jointly with ``hd``/``cov``
+        cross_covariances (list, optional): (i, j, file) cross-covariance
+            blocks between surveys; survey 0 is ``hd``/``cov``
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
         
     Returns:
         list: List of executed commands
@@ -299,174 +1555,586 @@ def run_stages(
     Raises:
         RuntimeError: If any stage fails
     """
-    # Initialize subprocess executor with 1-hour timeout
-    executor = get_executor(timeout=3600)
+    context = _resolve_context(context, summary_path)
+    # The fixed timeout only applies to stages without a timeout policy
+    executor = context.executor or get_executor(timeout=3600)
+    if profiler is None:
+        profiler = StageProfiler()
     commands = []
+    if retry_policies is None:
+        retry_policies = DEFAULT_RETRY_POLICIES
+    if timeout_policies is None:
+        timeout_policies = DEFAULT_TIMEOUT_POLICIES
+    if resource_specs is None:
+        resource_specs = {}
+    context.summary["ATTEMPTS"] = {}
+    context.summary["TIMEOUTS"] = {}
+    context.summary["PLOT_STATUS"] = None
     
     ini_path = pathlib.Path(ini)
     ini_stem = ini_path.stem
     # Stage 0: Generate SACC data
-    summary["STAGE0"] = "STARTED"
-    write_summary(summary_path)
-
-    PWD = os.getcwd()
-    sacc_file = os.path.join(PWD, "srd-y1-converted.sacc")
-    
-    # Remove any preexisting sacc file
-    try:
-        if os.path.exists(sacc_file):
-            os.remove(sacc_file)
-    except Exception as e:
-        logging.warning(f"Could not remove existing SACC file: {e}")
-
-    stage_0_command = f"python $FIRECROWN_EXAMPLES_DIR/srd_sn/generate_sn_data.py {path} {hd} {cov}"
-    commands.append(f"\nSACC Input Vector: {stage_0_command}\n")
-    
-    try:
-        returncode = executor.run(
-            stage_0_command, 
-            f"{error_path}/generate_sn_data_output_{ini_stem}.log", 
-            f"{error_path}/generate_sn_data_output_ERROR_{ini_stem}.err",
-            description="Stage 0: Generate SACC file from SN data"
-        )
-        
-        if returncode != 0:
-            summary["STAGE0"] = "FAILED"
-            summary["ABORT_IF_ZERO"] = 0
-            write_summary(summary_path)
-            raise RuntimeError("Stage 0 (SACC generation) failed. Check generate_sn_data error logs.")
-        else:
-            summary["STAGE0"] = "SUCCESSFUL"
-            write_summary(summary_path)
-            logging.info("Stage 0 (SACC generation) completed successfully.")
-    except RuntimeError:
-        summary["STAGE0"] = "FAILED"
-        summary["ABORT_IF_ZERO"] = 0
-        write_summary(summary_path)
-        raise
+    if sacc_file is None:
+        with profiler.span("STAGE0", external=not stage0_inprocess):
+            sacc_file = generate_sacc(
+                executor,
+                path,
+                hd,
+                cov,
+                error_path,
+                ini_stem,
+                commands,
+                destination=os.path.join(output_path, f"{ini_stem}.sacc") if stage0_inprocess else None,
+                retry_policy=retry_policies.get("STAGE0"),
+                inprocess=stage0_inprocess,
+                timeout_policy=timeout_policies.get("STAGE0"),
+                resources=resource_specs.get("STAGE0"),
+                surveys=surveys,
+                cross_covariances=cross_covariances,
+                context=context,
+            )
+    else:
+        sacc_file = os.path.abspath(sacc_file)
+        context.summary["STAGE0"] = "SKIPPED"
+        context.write_summary()
+        logging.info(f"Stage 0 skipped, reusing SACC file {sacc_file}")
 
     # Stage 1: Run COSMOSIS
-    summary["STAGE1"] = "STARTED"
-    write_summary(summary_path)
-    
+    chain_file = f"{output_path}/{ini_stem}.txt"
     stage_1_parts = [
         f"cosmosis {ini_path}",
         "-p",
-        f"firecrown_likelihood.sacc_file={os.getcwd()}/srd-y1-converted.sacc",
-        f"output.filename={output_path}/{ini_stem}.txt",
+        f"firecrown_likelihood.sacc_file={sacc_file}",
+        f"output.filename={chain_file}",
     ]
     param_override_stripped = param_override.strip()
+    start_values = []
+    if proposal_cache is not None:
+        proposal_overrides, start_values = warm_start_stage1(
+            proposal_cache,
+            os.path.join(path, hd),
+            os.path.join(path, cov),
+            str(ini_path),
+            param_override_stripped,
+            f"{output_path}/PROPOSAL_{ini_stem}.covmat",
+            context=context,
+        )
+        # Before the user's overrides, so an explicit covmat still wins
+        stage_1_parts += proposal_overrides
     if param_override_stripped:
         stage_1_parts.append(param_override_stripped)
-    stage_1_parts.append("--mpi")
-    stage_1_command = " ".join(stage_1_parts)
+    if start_values:
+        # Values-file overrides; the warm worker only takes -p overrides
+        start_values = ["-v"] + start_values
+    stage_1_command = " ".join(stage_1_parts + start_values + ["--mpi"])
     commands.append(f"\nCosmosis Input Vector: {stage_1_command}\n")
+
+    def stage_1_retry_command(attempt):
+        # Continue from the partial chain of the failed attempt if there is one
+        if chain_has_samples(chain_file):
+            logging.info(f"Resuming Stage 1 from partial chain {chain_file} (attempt {attempt})")
+            return " ".join(stage_1_parts + ["runtime.resume=T"] + start_values + ["--mpi"])
+        return stage_1_command
     
-    try:
-        returncode = executor.run(
-            stage_1_command, 
-            f"{error_path}/COSMOSIS_output_{ini_stem}.log", 
-            f"{error_path}/COSMOSIS_output_ERROR_{ini_stem}.err",
-            description="Stage 1: Run COSMOSIS for parameter estimation"
-        )
-        
-        if returncode != 0:
-            summary["STAGE1"] = "FAILED"
-            summary["ABORT_IF_ZERO"] = 0
-            write_summary(summary_path)
-            raise RuntimeError("Stage 1 (COSMOSIS) failed. Check COSMOSIS error logs.")
+    running_stats = IncrementalChainStats(chain_file, f"{plot_path}/PROVISIONAL") if incremental else None
+    telemetry = ChainTelemetry(
+        chain_file,
+        f"{error_path}/TELEMETRY_{ini_stem}.prom",
+        expected_rows=expected_rows_from_ini(str(ini_path), param_override_stripped, mpi_ranks()),
+        n_ranks=mpi_ranks(),
+        labels={"stage": "STAGE1", "ini": ini_stem},
+        consumer=running_stats,
+    )
+    context.summary["TELEMETRY"] = os.path.abspath(telemetry.metrics_file)
+    with profiler.span("STAGE1", external=True):
+        if worker_queue is None:
+            run_subprocess_stage(
+                executor,
+                "STAGE1",
+                stage_1_command,
+                f"{error_path}/COSMOSIS_output_{ini_stem}.log",
+                f"{error_path}/COSMOSIS_output_ERROR_{ini_stem}.err",
+                "Stage 1 (COSMOSIS)",
+                "Stage 1 (COSMOSIS) failed. Check COSMOSIS error logs.",
+                retry_policy=retry_policies.get("STAGE1"),
+                retry_command=stage_1_retry_command,
+                monitor=telemetry,
+                timeout_policy=timeout_policies.get("STAGE1"),
+                heartbeat=Heartbeat([
+                    chain_file,
+                    f"{error_path}/COSMOSIS_output_{ini_stem}.log",
+                    f"{error_path}/COSMOSIS_output_ERROR_{ini_stem}.err",
+                ]),
+                resources=resource_specs.get("STAGE1"),
+                context=context,
+            )
         else:
-            summary["STAGE1"] = "SUCCESSFUL"
-            write_summary(summary_path)
-            logging.info("Stage 1 (COSMOSIS) completed successfully.")
-    except RuntimeError:
-        summary["STAGE1"] = "FAILED"
-        summary["ABORT_IF_ZERO"] = 0
-        write_summary(summary_path)
-        raise
+            if start_values:
+                logging.warning("The warm worker takes no -v overrides; Stage 1 starts from the values file, "
+                                "not from the cached best fit")
+                context.summary["PROPOSAL"]["start_skipped"] = "warm worker"
+            # The worker runs in our working directory, so relative paths resolve as for cosmosis
+            warm_job = {
+                "ini": str(ini_path.resolve()),
+                "overrides": " ".join(stage_1_parts[2:]),
+                "output_file": os.path.abspath(f"{error_path}/COSMOSIS_output_{ini_stem}.log"),
+                "error_file": os.path.abspath(f"{error_path}/COSMOSIS_output_ERROR_{ini_stem}.err"),
+                "cwd": os.getcwd(),
+            }
+
+            def stage_1_retry_job(attempt):
+                # Continue from the partial chain of the failed attempt, as stage_1_retry_command does
+                if chain_has_samples(chain_file):
+                    logging.info(f"Resuming Stage 1 from partial chain {chain_file} (attempt {attempt})")
+                    return dict(warm_job, overrides=" ".join(stage_1_parts[2:] + ["runtime.resume=T"]))
+                return warm_job
+
+            with telemetry:
+                run_warm_worker_stage(
+                    worker_queue,
+                    warm_job,
+                    "STAGE1",
+                    "Stage 1 (COSMOSIS, warm worker)",
+                    "Stage 1 (COSMOSIS) failed in the warm worker. Check COSMOSIS error logs.",
+                    timeout=executor.default_timeout,
+                    retry_policy=retry_policies.get("STAGE1"),
+                    retry_job=stage_1_retry_job,
+                    timeout_policy=timeout_policies.get("STAGE1"),
+                    heartbeat=Heartbeat([
+                        chain_file,
+                        f"{error_path}/COSMOSIS_output_{ini_stem}.log",
+                        f"{error_path}/COSMOSIS_output_ERROR_{ini_stem}.err",
+                    ]),
+                    context=context,
+                )
+    context.summary["CHAIN_ROWS"] = telemetry.rows
+    # The chain is the expensive part; get it off node-local scratch early
+    context.checkpoint("STAGE1")
     
     # Stage 2: Post-processing
-    summary["STAGE2"] = "STARTED"
-    write_summary(summary_path)
-    
-    burnpath = os.path.join(output_path, f"{ini_stem}.txt")
-    burn_length = burnin(burnpath)
+    sampler = detect_sampler(chain_file, str(ini_path), param_override_stripped)
+    context.summary["SAMPLER"] = {"name": sampler.name, "kind": sampler.kind, "walkers": sampler.walkers}
+    if sampler.kind == WEIGHTED:
+        context.summary.update(log_evidence(chain_file))
+    incremental_final = running_stats is not None and bool(running_stats.latest and running_stats.latest["final"])
+    if incremental_final:
+        context.summary["INCREMENTAL"] = running_stats.latest
+    context.write_summary()
+    if sampler.kind == MCMC and incremental_final:
+        # The chain was read while it grew; no need to read it again for the burn-in
+        burn_length = running_stats.latest["burn"]
+    else:
+        with profiler.span("burnin"):
+            burn_length = sampler_burn_length(chain_file, sampler)
+    logging.info(f"Sampler {sampler.name or 'unknown'} ({sampler.kind}): burn-in of {burn_length} rows")
+    if thin_chains and sampler.kind == WEIGHTED:
+        logging.info("Weighted samples are not a Markov chain; no thinned chain is written.")
+    elif thin_chains:
+        # Not <ini>*.txt, which cosmosis-postprocess would read as a second chain
+        with profiler.span("thinning"):
+            write_thinned_chain(
+                chain_file,
+                f"{output_path}/THINNED_{ini_stem}.txt",
+                burn_length,
+                walkers=sampler.walkers,
+                context=context,
+            )
     
-    stage_2_command = (
+    numbers_command = (
         f"cosmosis-postprocess {output_path}/{ini_stem}*.txt "
         f"-o {plot_path} "
         f"--burn {burn_length}"
     )
+    if plot_backend == "native":
+        plot_command = native_plot_command(chain_file, plot_path, burn_length, plot_pairs)
+    else:
+        plot_command = numbers_command
+    # Stage 2 renders plots itself only for inline cosmosis plots
+    if plot_mode == "inline" and plot_backend == "cosmosis":
+        stage_2_command = numbers_command
+    else:
+        stage_2_command = f"{numbers_command} --no-plots"
     commands.append(f"\nCosmosis-postprocess Input Vector: {stage_2_command}\n")
     
-    try:
-        returncode = executor.run(
-            stage_2_command, 
-            f"{error_path}/PostProcess_output_{ini_stem}.log", 
+    with profiler.span("STAGE2", external=True):
+        run_subprocess_stage(
+            executor,
+            "STAGE2",
+            stage_2_command,
+            f"{error_path}/PostProcess_output_{ini_stem}.log",
             f"{error_path}/PostProcess_output_ERROR_{ini_stem}.err",
-            description="Stage 2: Post-process results and generate plots"
+            "Stage 2 (Post-processing)",
+            "Stage 2 (Post-processing) failed. Check PostProcess error logs.",
+            retry_policy=retry_policies.get("STAGE2"),
+            timeout_policy=timeout_policies.get("STAGE2"),
+            heartbeat=Heartbeat([
+                plot_path,
+                f"{error_path}/PostProcess_output_{ini_stem}.log",
+                f"{error_path}/PostProcess_output_ERROR_{ini_stem}.err",
+            ]),
+            resources=resource_specs.get("STAGE2"),
+            context=context,
+        )
+    
+    if plot_mode == "inline" and plot_backend == "native":
+        commands.append(f"\nNative plots: {plot_command}\n")
+        try:
+            with profiler.span("plots"):
+                render_marginals(chain_file, plot_path, burn=burn_length, pairs=plot_pairs)
+            context.summary["PLOT_STATUS"] = "SUCCESSFUL"
+        except Exception as e:
+            # Plots never invalidate the numbers
+            logging.error(f"Native plot rendering failed: {str(e)}")
+            context.summary["PLOT_STATUS"] = "FAILED"
+        context.write_summary()
+    
+    if compress_chains:
+        compress_finished_chain(
+            chain_file,
+            compress_chains,
+            # cosmosis-postprocess cannot read a compressed chain
+            keep_raw=plot_mode in ("background", "deferred") and plot_backend == "cosmosis",
+            context=context,
         )
-        
-        if returncode != 0:
-            summary["STAGE2"] = "FAILED"
-            summary["ABORT_IF_ZERO"] = 0
-            write_summary(summary_path)
-            raise RuntimeError("Stage 2 (Post-processing) failed. Check PostProcess error logs.")
-        else:
-            summary["STAGE2"] = "SUCCESSFUL"
-            write_summary(summary_path)
-            logging.info("Stage 2 (Post-processing) completed successfully.")
-    except RuntimeError:
-        summary["STAGE2"] = "FAILED"
-        summary["ABORT_IF_ZERO"] = 0
-        write_summary(summary_path)
-        raise
     
     # Stage 3: Extract cosmological parameters
-    summary["STAGE3"] = "STARTED"
-    write_summary(summary_path)
+    context.summary["STAGE3"] = "STARTED"
+    context.write_summary()
     
-    try:
-        f1 = os.path.join(path, hd)
-        HD_read = pd.read_csv(f1, comment="#", sep=r"\s+")
+    with profiler.span("STAGE3"):
+        try:
+            f1 = os.path.join(path, hd)
+            HD_read = pd.read_csv(f1, comment="#", sep=r"\s+")
         
-        cosmo_params = pd.read_csv(
-            os.path.join(plot_path, "means.txt"),
-            sep=r"\s+",
-            comment="#",
-            header=None,
-        ).T
-        cosmo_params = cosmo_params.T.set_index(0).T
+            parameter_summaries = summarize_chain(chain_file, extract_params, burn=burn_length)
         
-        summary["FoM"] = float(FoM(os.path.join(plot_path, "covmat.txt")))
-        summary["Ndof"] = np.shape(HD_read)[0]
-        summary["CPU_MINUTES"] = round((time.time() - time0) / 60, 2)
+            context.summary["FoM"] = float(FoM(os.path.join(plot_path, "covmat.txt")))
+            n_sn = np.shape(HD_read)[0]
+            for survey_hd, _ in surveys or []:
+                n_sn += np.shape(pd.read_csv(os.path.join(path, survey_hd), comment="#", sep=r"\s+"))[0]
+            context.summary["Ndof"] = n_sn
+            context.summary["CPU_MINUTES"] = context.cpu_minutes()
         
-        # TODO: Fix chi2 calculation. Currently hardcoded to 22 pending CHISQ module integration.
-        summary["chi2"] = None  # Placeholder - requires CHISQ module implementation
-        summary["sigint"] = 0.0
-        summary["label"] = "none"
-        summary["BLIND"] = 0
-        summary["NWARNINGS"] = 1
-        summary["w0"] = cosmo_params["cosmological_parameters--w"].iloc[0]
-        summary["w0sig_marg"] = cosmo_params["cosmological_parameters--w"].iloc[1]
-        summary["wa"] = cosmo_params["cosmological_parameters--wa"].iloc[0]
-        summary["wasig_marg"] = cosmo_params["cosmological_parameters--wa"].iloc[1]
-        summary["OM"] = cosmo_params["cosmological_parameters--omega_m"].iloc[0]
-        summary["OMsig_marg"] = cosmo_params["cosmological_parameters--omega_m"].iloc[1]
-        summary["STAGE3"] = "SUCCESSFUL"
-        write_summary(summary_path)
-        logging.info("Stage 3 (Parameter extraction) completed successfully.")
+            # TODO: Fix chi2 calculation. Currently hardcoded to 22 pending CHISQ module integration.
+            context.summary["chi2"] = None  # Placeholder - requires CHISQ module implementation
+            context.summary["sigint"] = 0.0
+            context.summary["label"] = "none"
+            context.summary["BLIND"] = 0
+            context.summary["NWARNINGS"] = 1
+            record_parameter_summaries(parameter_summaries, context)
+            context.summary["STAGE3"] = "SUCCESSFUL"
+            context.write_summary()
+            logging.info("Stage 3 (Parameter extraction) completed successfully.")
         
-    except Exception as e:
-        summary["STAGE3"] = "FAILED"
-        summary["ABORT_IF_ZERO"] = 0
-        write_summary(summary_path)
-        logging.error(f"Stage 3 failed with error: {str(e)}")
-        raise RuntimeError(f"Stage 3 (Parameter extraction) failed: {str(e)}") from e
+        except Exception as e:
+            context.summary["STAGE3"] = "FAILED"
+            context.summary["ABORT_IF_ZERO"] = 0
+            context.write_summary()
+            logging.error(f"Stage 3 failed with error: {str(e)}")
+            raise RuntimeError(f"Stage 3 (Parameter extraction) failed: {str(e)}") from e
+    
+    if proposal_cache is not None and sampler.name in PROPOSAL_SAMPLERS:
+        update_proposal_cache(
+            proposal_cache,
+            chain_file,
+            os.path.join(plot_path, "covmat.txt"),
+            os.path.join(path, hd),
+            os.path.join(path, cov),
+            str(ini_path),
+            param_override_stripped,
+        )
+    
+    report = profiler.write_report()
+    if report is not None:
+        context.summary["PROFILE"] = report
+        commands.append(f"\nProfile: {report}\n")
+    schedule_plots(plot_mode, plot_command, error_path, plot_path, ini_stem, commands, context=context)
+    return commands
+
+def schedule_plots(plot_mode, plot_command, error_path, plot_path, ini_stem, commands, summary_path=None,
+                   context=None):
+    """
+    Record or start the plot job once the numeric outputs are published.
+    
+    Args:
+        plot_mode (str): One of PLOT_MODES
+        plot_command (str): Command rendering the plots
+        error_path (str): Path for error/log files
+        plot_path (str): Path for plots and analysis results
+        ini_stem (str): Stem of the ini file, used to name the log files
+        commands (list): Executed commands are appended to this list
+        summary_path (str, optional): SUMMARY.YAML output path
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+    """
+    context = _resolve_context(context, summary_path)
+    if plot_mode == "inline":
+        if context.summary["PLOT_STATUS"] is None:
+            context.summary["PLOT_STATUS"] = "INLINE"
+            context.write_summary()
+        return
+    if plot_mode == "off":
+        context.summary["PLOT_STATUS"] = "DISABLED"
+        context.write_summary()
+        return
+    
+    from deferred_plots import launch_background, write_plot_script
+
+    context.summary["PLOT_COMMAND"] = plot_command
+    # The command may hold paths relative to this directory (a relative --outdir)
+    context.summary["PLOT_CWD"] = os.getcwd()
+    context.summary["PLOT_LOG"] = os.path.abspath(f"{error_path}/Plots_output_{ini_stem}.log")
+    context.summary["PLOT_ERR"] = os.path.abspath(f"{error_path}/Plots_output_ERROR_{ini_stem}.err")
+    script = write_plot_script(os.path.join(plot_path, "make_plots.sh"), str(context.summary_path))
+    commands.append(f"\nDeferred plots: {script}\n")
+    
+    if plot_mode == "deferred":
+        context.summary["PLOT_STATUS"] = "DEFERRED"
+        context.write_summary()
+        logging.info(f"Plots deferred; run {script} to render them.")
+        return
+    
+    # The background job updates PLOT_STATUS itself, so the summary must be final here
+    context.summary["PLOT_STATUS"] = "QUEUED"
+    context.write_summary()
+    launch_background(str(context.summary_path), f"{error_path}/Plots_runner_{ini_stem}.log")
+    logging.info("Plots rendering in the background.")
+
+
+def run_sweep_stages(args, error_path, retry_policies=None, context=None):
+    """
+    Run a parameter sweep: one shared Stage 0, then Stages 1-3 per sweep job.
     
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments
+        error_path (str): Path for error/log files
+        retry_policies (dict, optional): RetryPolicy per stage key
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+        
+    Returns:
+        list: List of executed commands
+        
+    Raises:
+        RuntimeError: If the shared Stage 0 fails
+    """
+    from sweep import run_sweep
+
+    context = _resolve_context(context, args.summary)
+    if retry_policies is None:
+        retry_policies = DEFAULT_RETRY_POLICIES
+    commands = []
+    sweep_dir = os.path.join(args.outdir, "SWEEP")
+    os.makedirs(sweep_dir, exist_ok=True)
+    ini_stem = pathlib.Path(args.ini).stem
+    sacc_file = args.sacc
+    if sacc_file is None:
+        sacc_file = generate_sacc(
+            context.executor or get_executor(timeout=3600),
+            args.path,
+            args.hd,
+            args.cov,
+            error_path,
+            ini_stem,
+            commands,
+            destination=os.path.join(sweep_dir, "shared.sacc"),
+            retry_policy=retry_policies.get("STAGE0"),
+            inprocess=args.stage0 == "inprocess",
+            surveys=args.survey,
+            cross_covariances=args.cross_cov,
+            context=context,
+        )
+
+    extra_args = []
+    if args.warm_worker:
+        extra_args += ["--warm-worker", os.path.abspath(args.warm_worker)]
+    if args.plots != "inline":
+        extra_args += ["--plots", args.plots]
+    if args.plot_backend != "cosmosis":
+        extra_args += ["--plot-backend", args.plot_backend]
+    if args.plot_pairs is not None:
+        extra_args += ["--plot-pairs"] + args.plot_pairs
+    if list(args.extract_params) != list(DEFAULT_PARAMETERS):
+        extra_args += ["--extract-params"] + list(args.extract_params)
+    if args.profile:
+        extra_args.append("--profile")
+    if args.compress_chains:
+        extra_args += ["--compress-chains", args.compress_chains]
+    if args.no_thin:
+        extra_args.append("--no-thin")
+    if args.perf_db:
+        extra_args += ["--perf-db", args.perf_db if args.perf_db == "none" else os.path.abspath(args.perf_db)]
+    if args.incremental:
+        extra_args.append("--incremental")
+    if args.stall_timeout is not None:
+        extra_args += ["--stall-timeout", str(args.stall_timeout)]
+    if args.proposal_cache:
+        extra_args += ["--proposal-cache",
+                       args.proposal_cache if args.proposal_cache == "none" else os.path.abspath(args.proposal_cache)]
+    if args.result_store:
+        extra_args += ["--result-store",
+                       args.result_store if args.result_store == "none" else os.path.abspath(args.result_store)]
+    if args.stage_dir:
+        # Every job stages its own run; the sweep directory stays on the shared filesystem
+        extra_args += ["--stage-dir", args.stage_dir, "--stage-out", args.stage_out]
+
+    # Each job enforces its own per-stage timeouts
+    table = run_sweep(
+        args.sweep,
+        get_executor(timeout=None),
+        os.path.abspath(args.path),
+        args.hd,
+        args.cov,
+        args.ini,
+        args.outdir,
+        os.path.abspath(sacc_file),
+        base_param=args.param or "",
+        cores=args.cores,
+        extra_args=extra_args,
+    )
+    failed = int((table["STAGE3"] != "SUCCESSFUL").sum())
+    context.summary["SWEEP_JOBS"] = len(table)
+    context.summary["SWEEP_FAILED"] = failed
+    context.summary["SWEEP_RESULTS"] = os.path.join(args.outdir, "SWEEP_RESULTS.csv")
+    if failed:
+        context.summary["ABORT_IF_ZERO"] = 0
+    context.summary["CPU_MINUTES"] = context.cpu_minutes()
+    context.write_summary()
     return commands
 
+
+def sampler_burn_length(chain_file, sampler):
+    """
+    Burn-in of a chain in rows for its sampler kind.
+    
+    Args:
+        chain_file (str): Chain to burn in
+        sampler (SamplerInfo): Its sampler (see samplers.detect_sampler)
+    
+    Returns:
+        int: No burn-in for weighted samples, the walker burn-in for ensemble
+            samplers, burnin() for single Markov chains
+    """
+    burn_length = chain_burn_in(chain_file, sampler)
+    return burnin(chain_file) if burn_length is None else burn_length
+
+
+def run_reweight_mode(args, output_path, plot_path, context=None):
+    """
+    Reweight an existing chain to the HD/COV given on the command line.
+    
+    Stages 0-2 are skipped; Stage 3 summarizes the importance-weighted chain.
+    
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments
+        output_path (str): Path for COSMOSIS output chains
+        plot_path (str): Path for plots and analysis results
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+        
+    Returns:
+        list: Description of what was run
+        
+    Raises:
+        ValueError: If the reference HD/COV are not given
+        RuntimeError: If the reweighting fails
+    """
+    from reweight import load_sn_likelihood, reweight_chain
+
+    context = _resolve_context(context, args.summary)
+    if not (args.reference_hd and args.reference_cov):
+        raise ValueError("--reweight requires --reference-hd and --reference-cov")
+
+    for stage in ("STAGE0", "STAGE1", "STAGE2"):
+        context.summary[stage] = "SKIPPED"
+    context.summary["STAGE3"] = "STARTED"
+    context.write_summary()
+    
+    ini_stem = pathlib.Path(args.ini).stem
+    output_chain = os.path.join(output_path, f"REWEIGHTED_{ini_stem}.txt")
+    covmat_file = os.path.join(plot_path, "covmat_reweighted.txt")
+    try:
+        # Same burn-in as Stage 2 would apply: none for nested/weighted samples
+        sampler = detect_sampler(args.reweight, args.ini, getattr(args, "param", "") or "")
+        context.summary["SAMPLER"] = {"name": sampler.name, "kind": sampler.kind, "walkers": sampler.walkers}
+        reference = load_sn_likelihood(args.reference_hd, args.reference_cov)
+        new = load_sn_likelihood(os.path.join(args.path, args.hd), os.path.join(args.path, args.cov))
+        result = reweight_chain(
+            args.reweight,
+            reference,
+            new,
+            output_chain,
+            covmat_file,
+            burn=sampler_burn_length(args.reweight, sampler),
+            parameters=args.extract_params,
+        )
+        record_parameter_summaries(result["params"], context)
+        context.summary["FoM"] = float(FoM(covmat_file))
+        context.summary["Ndof"] = int(new.z.size)
+        context.summary["REWEIGHT_ESS"] = round(result["ess"], 1)
+        context.summary["REWEIGHT_ESS_FRACTION"] = round(result["ess_fraction"], 4)
+        context.summary["REWEIGHT_WARNING"] = result["warning"]
+        context.summary["NWARNINGS"] = int(result["warning"] is not None)
+        context.summary["CPU_MINUTES"] = context.cpu_minutes()
+        context.summary["STAGE3"] = "SUCCESSFUL"
+        context.write_summary()
+    except Exception as e:
+        context.summary["STAGE3"] = "FAILED"
+        context.summary["ABORT_IF_ZERO"] = 0
+        context.write_summary()
+        logging.error(f"Reweighting failed with error: {str(e)}")
+        raise RuntimeError(f"Importance reweighting failed: {str(e)}") from e
+    
+    return [f"\nImportance reweighting: {args.reweight} -> {output_chain}\n"]
+
+
+def run_fisher_mode(args, context=None):
+    """
+    Forecast the FoM of the given HD/COV from a Fisher matrix, without running a chain.
+    
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments
+        context (RunContext, optional): State of the run (Default: the
+            module-level summary)
+        
+    Returns:
+        list: Description of what was run
+        
+    Raises:
+        RuntimeError: If the forecast fails
+    """
+    from fisher import fisher_forecast
+    from reweight import load_sn_likelihood
+
+    context = _resolve_context(context, args.summary)
+    for stage in ("STAGE0", "STAGE1", "STAGE2", "STAGE3"):
+        context.summary[stage] = "SKIPPED"
+    try:
+        surveys, cross_covariances = survey_inputs(args)
+        if surveys or cross_covariances:
+            from sacc_builder import load_surveys
+            from sn_cosmology import SNLikelihood
+
+            likelihood = SNLikelihood(*load_surveys(args.path, [(args.hd, args.cov)] + surveys, cross_covariances))
+        else:
+            likelihood = load_sn_likelihood(os.path.join(args.path, args.hd), os.path.join(args.path, args.cov))
+        forecast = fisher_forecast(likelihood, omega_m_prior=args.omega_m_prior)
+    except Exception as e:
+        context.summary["ABORT_IF_ZERO"] = 0
+        context.write_summary()
+        logging.error(f"Fisher forecast failed with error: {str(e)}")
+        raise RuntimeError(f"Fisher forecast failed: {str(e)}") from e
+    
+    context.summary["FISHER_FoM"] = round(forecast["FoM"], 2)
+    context.summary["FISHER_SIGMA"] = forecast["sigma"]
+    context.summary["FISHER_FIDUCIAL"] = forecast["fiducial"]
+    context.summary["Ndof"] = int(likelihood.z.size)
+    context.summary["CPU_MINUTES"] = context.cpu_minutes()
+    context.write_summary()
+    logging.info(f"Fisher forecast: FoM {forecast['FoM']:.2f}")
+    return [f"\nFisher forecast for {args.hd} / {args.cov}\n"]
+
+
 def main():
     """Main function that orchestrates the different stages of the analysis."""
     # Parse command-line arguments
@@ -487,37 +2155,119 @@ def main():
         ini_path = os.path.split(args.ini)[0]
     
     check_files_and_paths([os.path.split(args.ini)[1]], [ini_path])
+    if args.survey or args.cross_cov:
+        check_files_and_paths([name for pair in args.survey or [] for name in pair]
+                              + [name for _, _, name in args.cross_cov or []], [args.path])
+        if args.reweight:
+            print("--reweight takes one HD/COV, not --survey or --cross-cov", file=sys.stderr)
+            sys.exit(1)
     
+    if args.queue:
+        if args.fisher or args.reweight or args.sweep:
+            print("--queue only submits plain runs, not --fisher, --reweight or --sweep", file=sys.stderr)
+            sys.exit(1)
+        unsupported = [flag for flag, value in (
+            ("--warm-worker", args.warm_worker),
+            ("--stage-dir", args.stage_dir),
+            ("--result-store", args.result_store),
+            ("--perf-db", args.perf_db),
+            ("--profile", args.profile),
+            ("--cpus", args.cpus),
+        ) if value]
+        if unsupported:
+            # The worker's process runs the job; these belong to it (work_queue.py worker --perf-db/--cpus)
+            print(f"--queue cannot be combined with {', '.join(unsupported)}; "
+                  "give --perf-db and --cpus to the queue worker instead", file=sys.stderr)
+            sys.exit(1)
+        job_id = submit_job(args.queue, queue_job(args))
+        print(f"Submitted job {job_id} to the work queue {args.queue}.")
+        return
+
+    store_root = args.result_store or os.environ.get(STORE_ENV_VARIABLE)
+    store = None
+    if store_root and store_root != "none" and not (args.fisher or args.reweight or args.sweep):
+        store = ResultStore(store_root)
+        key = run_result_key(args)
+        if store.lookup(key) is not None:
+            store.restore(key, args.outdir, args.summary)
+            print(f"Restored the outputs of an identical run from the result store {store.root} ({key}).")
+            logging.info(f"Result store hit {key}; no stage was run.")
+            return
+
     # Construct paths for error logs, output, and plots
-    error_path = os.path.join(args.outdir, "ERROR_LOGS")
-    output_path = os.path.join(args.outdir, "COSMOSIS-CHAINS")
-    plot_path = os.path.join(args.outdir, "PLOTS")
+    run_dir = args.outdir
+    stager = None
+    context = None
+    if args.stage_dir and not args.sweep:
+        if args.plots in ("background", "deferred"):
+            # The plot job would read a scratch directory that is gone by then
+            print(f"--plots {args.plots} cannot be combined with --stage-dir", file=sys.stderr)
+            sys.exit(1)
+        stager = ScratchStage(args.outdir, args.summary, root=args.stage_dir, method=args.stage_out)
+        run_dir = stager.start()
+        setup_directories(run_dir)
+        context = RunContext(
+            run_dir, summary_path=stager.scratch_summary, summary=summary, start_time=time0, workdir=run_dir
+        )
+        context.stager = stager
+    error_path = os.path.join(run_dir, "ERROR_LOGS")
+    output_path = os.path.join(run_dir, "COSMOSIS-CHAINS")
+    plot_path = os.path.join(run_dir, "PLOTS")
 
-    # Write to INPUT.INFO file
-    with open(os.path.join(error_path, 'INPUT.INFO'), 'w') as f:
-        f.write('STAGE 0 = Generate SACC file from SN data\n')
-        f.write('STAGE 1 = COSMOSIS parameter estimation\n')
-        f.write('STAGE 2 = POST PROCESSING (PLOT)\n')
-        f.write('STAGE 3 = Extract cosmological parameters\n\n')
-        f.write('#Required Info\n')
-        f.write(f'CWR: {os.getcwd()}\n')
-        f.write(f'ARG_LIST: {sys.argv}\n')
-        f.write(f'TIME_STAMP: {time.asctime()}\n')
-        f.write(f'OUTPUT DIR: {args.outdir}\n')
+    write_input_info(error_path, args.outdir)
+    retry_policies = stage_retry_policies(args.max_attempts)
+
+    profiler = StageProfiler(error_path, pathlib.Path(args.ini).stem, enabled=args.profile, timing=True)
+    perf_db = None if args.perf_db == "none" else args.perf_db or default_db_path()
+    records_performance = perf_db is not None and not (args.fisher or args.reweight or args.sweep)
+    timeout_policies = stage_timeout_policies(perf_db, pathlib.Path(args.ini).stem, args.stall_timeout)
+    proposal_cache = proposal_cache_dir(args)
+    cores = None
+    if args.cpus and not args.sweep:
+        # Held until the process exits; sweep jobs allocate their own
+        cores = allocate_cores(args.cpus)
+        if cores.cpus:
+            # In-process work (Stage 3, plots) stays on the run's cores too
+            pin_thread(cores.cpus)
 
     # Run the various stages of the analysis
     try:
-        commands = run_stages(
-            args.path,
-            args.hd,
-            args.cov,
-            args.ini,
-            error_path,
-            output_path,
-            plot_path,
-            args.param,
-            pathlib.Path(args.summary),
-        )
+        if args.fisher:
+            commands = run_fisher_mode(args, context=context)
+        elif args.reweight:
+            commands = run_reweight_mode(args, output_path, plot_path, context=context)
+        elif args.sweep:
+            commands = run_sweep_stages(args, error_path, retry_policies)
+        else:
+            commands = run_stages(
+                args.path,
+                args.hd,
+                args.cov,
+                args.ini,
+                error_path,
+                output_path,
+                plot_path,
+                args.param,
+                pathlib.Path(args.summary),
+                retry_policies,
+                sacc_file=args.sacc,
+                worker_queue=args.warm_worker,
+                stage0_inprocess=args.stage0 == "inprocess",
+                plot_mode=args.plots,
+                plot_backend=args.plot_backend,
+                plot_pairs=args.plot_pairs,
+                extract_params=args.extract_params,
+                profiler=profiler,
+                compress_chains=args.compress_chains,
+                thin_chains=not args.no_thin,
+                incremental=args.incremental,
+                timeout_policies=timeout_policies,
+                proposal_cache=proposal_cache,
+                resource_specs=stage_resource_specs(cores.cpus, mpi_ranks()) if cores is not None else None,
+                surveys=args.survey,
+                cross_covariances=args.cross_cov,
+                context=context,
+            )
         
         # Remove duplicates from the command list
         commands = list(set(commands))
@@ -526,6 +2276,14 @@ def main():
         with open(os.path.join(error_path, 'INPUT.INFO'), 'a') as f:
             for command in commands:
                 f.write(f"{command}\n")
+        if records_performance:
+            record_performance(perf_db, args, profiler, context=context)
+        if stager is not None:
+            stager.finish()
+        if store is not None:
+            publish_result(store, key, args)
+        if cores is not None:
+            cores.release()
         
         print("All stages completed successfully.")
         logging.info("Pipeline execution completed successfully.")
@@ -536,6 +2294,16 @@ def main():
         traceback.print_exc()
         print(traceback_str, file=sys.stderr)
         logging.error(f"Pipeline failed: {traceback_str}")
+        if records_performance:
+            record_performance(perf_db, args, profiler, context=context)
+        if stager is not None:
+            # Stage out failed runs too, so their logs reach the shared filesystem
+            try:
+                stager.finish()
+            except Exception as stage_error:
+                logging.error(f"Stage-out of the failed run failed: {str(stage_error)}")
+        if cores is not None:
+            cores.release()
         sys.exit(1)
 
 if __name__ == "__main__":
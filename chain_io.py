@@ -0,0 +1,233 @@
+"""
+Readers for COSMOSIS text chains.
+
+A COSMOSIS text chain starts with a header line naming the columns
+(``#name1<TAB>name2...``), followed by ``#key=value`` metadata lines,
+``## ...`` comment lines and whitespace-separated sample rows.
+
+Finished chains may be stored compressed (``<chain>.gz``, ``.xz`` or
+``.zst``). All readers take the uncompressed name and stream from whichever
+form exists, so callers do not need to know whether a chain was compressed.
+"""
+
+import gzip
+import logging
+import lzma
+import os
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Columns that describe a sample rather than a sampled parameter
+NON_PARAMETER_COLUMNS = ("prior", "like", "post", "weight", "log_weight")
+
+# Compression method to file suffix, in the order readers look for them
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "xz": ".xz", "zstd": ".zst"}
+COPY_BLOCK_SIZE = 1 << 20
+
+
+def _zstd_open(path: str, mode: str, level: Optional[int] = None):
+    """Open a zstd stream with the stdlib module (Python 3.14+) or ``zstandard``."""
+    try:
+        from compression import zstd
+        options = {} if level is None else {"level": level}
+        return zstd.open(path, mode, **options)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("zstd chains need Python 3.14 or the 'zstandard' package") from e
+    options = {} if level is None else {"cctx": zstandard.ZstdCompressor(level=level)}
+    return zstandard.open(path, mode, **options)
+
+
+def _open_compressed(path: str, mode: str, method: Optional[str], level: Optional[int] = None):
+    """Open ``path`` with the given compression method (None: uncompressed)."""
+    if method is None:
+        return open(path, mode)
+    if method == "gzip":
+        return gzip.open(path, mode, compresslevel=6 if level is None else level)
+    if method == "xz":
+        return lzma.open(path, mode, preset=level)
+    if method == "zstd":
+        return _zstd_open(path, mode, level)
+    raise ValueError(f"Unknown chain compression '{method}', expected one of {sorted(COMPRESSION_SUFFIXES)}")
+
+
+def _compression_of(path: str) -> Optional[str]:
+    """Return the compression method implied by a file suffix."""
+    for method, suffix in COMPRESSION_SUFFIXES.items():
+        if path.endswith(suffix):
+            return method
+    return None
+
+
+def resolve_chain(chain: str) -> str:
+    """
+    Return the path under which a chain is stored.
+
+    Args:
+        chain (str): Uncompressed chain name (or an explicit compressed one)
+
+    Returns:
+        str: ``chain`` if it exists, else the first existing compressed form,
+            else ``chain`` unchanged so that opening it raises FileNotFoundError
+    """
+    if os.path.exists(chain):
+        return chain
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if os.path.exists(chain + suffix):
+            return chain + suffix
+    return chain
+
+
+def open_chain(chain: str, mode: str = "rt"):
+    """
+    Open a chain for streaming, decompressing on the fly.
+
+    Args:
+        chain (str): Chain name, compressed or not (see resolve_chain)
+        mode (str): ``"rt"`` or ``"rb"``
+
+    Returns:
+        file object: Stream of the uncompressed chain
+    """
+    path = resolve_chain(chain)
+    return _open_compressed(path, mode, _compression_of(path))
+
+
+def compress_chain(chain: str, method: str = "gzip", level: Optional[int] = None) -> Dict[str, object]:
+    """
+    Compress a finished chain and remove the uncompressed file.
+
+    The compressed file is written under a temporary name and renamed into
+    place, so a reader never sees a partial chain.
+
+    Args:
+        chain (str): Uncompressed chain
+        method (str): "gzip", "xz" or "zstd"
+        level (int, optional): Compression level (Default: per-method default)
+
+    Returns:
+        dict: 'path', 'method', 'raw_bytes', 'compressed_bytes' and 'seconds'
+
+    Raises:
+        ValueError: If the method is unknown
+    """
+    if method not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown chain compression '{method}', expected one of {sorted(COMPRESSION_SUFFIXES)}")
+    start = time.time()
+    destination = chain + COMPRESSION_SUFFIXES[method]
+    tmp_path = f"{destination}.{os.getpid()}.tmp"
+    try:
+        with open(chain, "rb") as source, _open_compressed(tmp_path, "wb", method, level) as target:
+            shutil.copyfileobj(source, target, COPY_BLOCK_SIZE)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    raw_bytes = os.path.getsize(chain)
+    os.remove(chain)
+    result = {
+        "path": destination,
+        "method": method,
+        "raw_bytes": raw_bytes,
+        "compressed_bytes": os.path.getsize(destination),
+        "seconds": round(time.time() - start, 2),
+    }
+    logger.info(f"Compressed {chain}: {raw_bytes} -> {result['compressed_bytes']} bytes")
+    return result
+
+
+def parse_header(lines) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Parse the column names and ``#key=value`` metadata from chain header lines.
+
+    Args:
+        lines (iterable): Lines of the chain file; only comment lines are used
+
+    Returns:
+        Tuple[List[str], Dict[str, str]]: (column names, metadata)
+    """
+    names = []
+    metadata = {}
+    for line in lines:
+        if not line.startswith("#"):
+            continue
+        if line.startswith("##"):
+            continue
+        body = line[1:].strip()
+        if not names and "=" not in body:
+            names = body.split()
+        elif "=" in body:
+            key, _, value = body.partition("=")
+            metadata[key.strip()] = value.strip()
+    return names, metadata
+
+
+def read_header(chain: str) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Read only the comment lines of a chain file.
+
+    Metadata written at the end of a chain (e.g. ``#log_z=``) is included,
+    but sample rows are skipped without being parsed.
+    """
+    with open_chain(chain) as chain_file:
+        return parse_header(line for line in chain_file if line.startswith("#"))
+
+
+def read_chain(chain: str) -> Tuple[List[str], np.ndarray, Dict[str, str]]:
+    """
+    Read a COSMOSIS text chain.
+
+    Parameters
+    ----------
+    chain : str
+        The path to the chain file, read from its compressed form if needed.
+
+    Returns
+    -------
+    Tuple[List[str], np.ndarray, Dict[str, str]]
+        The column names, the (n_samples, n_columns) sample array and the metadata.
+
+    Raises
+    ------
+    FileNotFoundError: If chain file does not exist
+    ValueError: If the number of columns does not match the header
+    """
+    names, metadata = read_header(chain)
+    try:
+        with open_chain(chain) as chain_file:
+            data = pd.read_csv(chain_file, comment="#", header=None, sep=r"\s+").to_numpy(dtype=float)
+    except pd.errors.EmptyDataError:
+        data = np.empty((0, len(names)))
+    if names and data.shape[1] != len(names):
+        raise ValueError(f"Chain {chain} has {data.shape[1]} columns but its header names {len(names)}")
+    return names, data, metadata
+
+
+def chain_weights(names: List[str], data: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Return the sample weights of a chain, or None if it is unweighted.
+
+    ``weight`` columns are used directly; ``log_weight`` columns are
+    exponentiated relative to their maximum.
+    """
+    if "weight" in names:
+        return data[:, names.index("weight")]
+    if "log_weight" in names:
+        log_weight = data[:, names.index("log_weight")]
+        return np.exp(log_weight - log_weight.max())
+    return None
+
+
+def parameter_columns(names: List[str]) -> List[str]:
+    """Return the sampled-parameter columns of a chain."""
+    return [name for name in names if name not in NON_PARAMETER_COLUMNS]
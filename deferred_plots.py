@@ -0,0 +1,149 @@
+"""
+Deferred plot generation, decoupled from the SUMMARY.YAML path.
+
+With ``--plots background`` or ``--plots deferred`` the wrapper runs Stage 2
+without plots, publishes the Stage 3 numbers and records the plotting job in
+SUMMARY.YAML (``PLOT_COMMAND``, ``PLOT_LOG``, ``PLOT_ERR`` and ``PLOT_CWD``,
+the directory the command runs in). This module runs that job later, either
+as a detached background process started by the wrapper or as a separately
+queued batch job:
+
+    python deferred_plots.py <SUMMARY.YAML>
+
+It tracks its progress in the ``PLOT_STATUS`` field of the same summary:
+QUEUED/DEFERRED -> RUNNING -> SUCCESSFUL or FAILED.
+"""
+
+import argparse
+import logging
+import os
+import pathlib
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import yaml
+
+from subprocess_executor import get_executor
+
+logger = logging.getLogger(__name__)
+
+
+def read_summary(summary_path: str) -> dict:
+    """Load a SUMMARY.YAML file."""
+    with open(summary_path, "r", encoding="utf-8") as handle:
+        return yaml.safe_load(handle) or {}
+
+
+def update_summary_fields(summary_path: str, **fields) -> dict:
+    """
+    Update selected fields of a SUMMARY.YAML file in place.
+
+    The file is re-read immediately before writing and replaced through an
+    atomic rename, so readers never see a partially written summary.
+
+    Returns:
+        dict: The updated summary
+    """
+    current = read_summary(summary_path)
+    current.update(fields)
+    tmp_path = f"{summary_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        yaml.dump(current, handle)
+    os.replace(tmp_path, summary_path)
+    return current
+
+
+def script_command(summary_path: str) -> str:
+    """Return the shell command that renders the plots recorded in a summary."""
+    script = os.path.abspath(__file__)
+    return f"{sys.executable} {script} {os.path.abspath(summary_path)}"
+
+
+def write_plot_script(script_path: str, summary_path: str) -> str:
+    """
+    Write a shell script that renders the deferred plots, for a batch queue.
+
+    Returns:
+        str: Path to the script
+    """
+    with open(script_path, "w") as handle:
+        handle.write("#!/bin/bash\n")
+        handle.write("# Deferred Firecrown wrapper plots; submit with sbatch or run directly.\n")
+        handle.write(f"{script_command(summary_path)}\n")
+    os.chmod(script_path, 0o755)
+    return script_path
+
+
+def launch_background(summary_path: str, log_file: str) -> subprocess.Popen:
+    """
+    Start the plot job as a detached process that outlives the wrapper.
+
+    Args:
+        summary_path (str): SUMMARY.YAML holding the plot job
+        log_file (str): File collecting the runner's own output
+
+    Returns:
+        subprocess.Popen: The started process
+    """
+    with open(log_file, "a") as log:
+        return subprocess.Popen(
+            script_command(summary_path),
+            shell=True,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+
+def run_plots(summary_path: str, timeout: Optional[int] = None) -> int:
+    """
+    Run the plot job recorded in a summary and track it in PLOT_STATUS.
+
+    Args:
+        summary_path (str): SUMMARY.YAML holding the plot job
+        timeout (int, optional): Timeout in seconds (Default: executor default)
+
+    Returns:
+        int: Return code of the plot command (1 if it could not be run)
+    """
+    job = read_summary(summary_path)
+    command = job.get("PLOT_COMMAND")
+    if not command:
+        logger.error(f"No PLOT_COMMAND recorded in {summary_path}")
+        return 1
+
+    start = time.time()
+    update_summary_fields(summary_path, PLOT_STATUS="RUNNING")
+    try:
+        returncode = get_executor().run(
+            command,
+            job["PLOT_LOG"],
+            job["PLOT_ERR"],
+            timeout=timeout,
+            description="Deferred plots",
+            cwd=job.get("PLOT_CWD"),
+        )
+    except RuntimeError as e:
+        logger.error(f"Deferred plots failed: {e}")
+        returncode = 1
+
+    status = "SUCCESSFUL" if returncode == 0 else "FAILED"
+    update_summary_fields(summary_path, PLOT_STATUS=status, PLOT_MINUTES=round((time.time() - start) / 60, 2))
+    return returncode
+
+
+def main(argv=None):
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description="Render plots deferred by the Firecrown wrapper")
+    parser.add_argument("summary", type=pathlib.Path, help="SUMMARY.YAML of the run")
+    parser.add_argument("--timeout", type=int, default=None, help="Timeout in seconds")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    return run_plots(str(args.summary), timeout=args.timeout)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
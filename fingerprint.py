@@ -0,0 +1,158 @@
+"""
+Fingerprints of a run's inputs and environment.
+
+The input fingerprint hashes the contents of the HD, COV and ini files
+together with the ``-p`` overrides, so two runs with the same fingerprint
+analyse the same data in the same way regardless of file names or
+locations. The environment fingerprint records what can make the same inputs
+run faster or slower: the Firecrown and COSMOSIS versions and the node type.
+
+The result key (result_store.py) combines the input fingerprint, the files
+the ini pulls in (values and priors), the toolchain versions and the
+wrapper options that change the outputs.
+"""
+
+import configparser
+import hashlib
+import json
+import os
+import platform
+import sys
+from typing import Dict, List, Optional, Sequence
+
+HASH_BLOCK_SIZE = 1 << 20
+# Distributions whose versions can change the results of a run
+TOOLCHAIN_PACKAGES = ("firecrown", "cosmosis", "sacc", "numpy")
+# [pipeline] options of a COSMOSIS ini naming further input files
+INI_FILE_OPTIONS = ("values", "priors")
+
+
+def file_digest(path: str) -> str:
+    """Return the SHA-256 hex digest of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def input_fingerprint(files: Sequence[str], param_override: str = "") -> str:
+    """
+    Hash the contents of the input files and the parameter overrides.
+
+    Args:
+        files (sequence): Input files, in a fixed order (e.g. HD, COV, ini)
+        param_override (str): COSMOSIS ``-p`` overrides
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+    digest = hashlib.sha256()
+    for path in files:
+        digest.update(file_digest(path).encode())
+    digest.update(" ".join(sorted(param_override.split())).encode())
+    return digest.hexdigest()
+
+
+def package_version(name: str) -> Optional[str]:
+    """Return the installed version of a distribution, or None."""
+    from importlib import metadata
+
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def cpu_model() -> Optional[str]:
+    """Return the CPU model name from /proc/cpuinfo, or platform.processor()."""
+    try:
+        with open("/proc/cpuinfo") as handle:
+            for line in handle:
+                if line.startswith("model name"):
+                    return line.partition(":")[2].strip()
+    except OSError:
+        pass
+    return platform.processor() or None
+
+
+def environment_fingerprint() -> Dict[str, object]:
+    """Return the software versions and node type of this process."""
+    return {
+        "firecrown_version": package_version("firecrown"),
+        "cosmosis_version": package_version("cosmosis"),
+        "python_version": platform.python_version(),
+        "host": platform.node(),
+        "cpu_model": cpu_model(),
+        "cpus": os.cpu_count(),
+        "executable": sys.executable,
+    }
+
+
+def run_fingerprint(hd_file: str, cov_file: str, ini_file: str, param_override: str = "") -> Dict[str, object]:
+    """
+    Fingerprint of one run: input hash, ini identity and environment.
+
+    Returns:
+        dict: 'input_hash', 'ini', 'ini_hash' and the environment_fingerprint() keys
+    """
+    fingerprint = {
+        "input_hash": input_fingerprint([hd_file, cov_file, ini_file], param_override),
+        "ini": os.path.splitext(os.path.basename(ini_file))[0],
+        "ini_hash": file_digest(ini_file),
+    }
+    fingerprint.update(environment_fingerprint())
+    return fingerprint
+
+
+def toolchain_versions() -> Dict[str, Optional[str]]:
+    """Return the versions of the packages and Python (major.minor) that shape the results."""
+    versions = {name: package_version(name) for name in TOOLCHAIN_PACKAGES}
+    versions["python"] = ".".join(platform.python_version_tuple()[:2])
+    return versions
+
+
+def ini_dependencies(ini_file: str) -> List[str]:
+    """
+    Return the existing files named by the ini's ``[pipeline]`` values and priors.
+
+    Relative names are tried against the working directory, as COSMOSIS does,
+    and then against the ini's directory.
+    """
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        parser.read(ini_file)
+    except configparser.Error:
+        return []
+    files = []
+    for option in INI_FILE_OPTIONS:
+        for name in parser.get("pipeline", option, fallback="").split():
+            for candidate in (name, os.path.join(os.path.dirname(ini_file), name)):
+                if os.path.isfile(candidate):
+                    files.append(candidate)
+                    break
+    return files
+
+
+def result_key(hd_file: str, cov_file: str, ini_file: str, param_override: str = "",
+               options: Optional[Dict[str, object]] = None) -> str:
+    """
+    Key under which the outputs of a run can be reused.
+
+    Args:
+        hd_file (str): Hubble diagram file
+        cov_file (str): Covariance file
+        ini_file (str): COSMOSIS ini file
+        param_override (str): COSMOSIS ``-p`` overrides
+        options (dict, optional): Wrapper options that change the outputs
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+    files = [hd_file, cov_file, ini_file] + ini_dependencies(ini_file)
+    description = {
+        "inputs": input_fingerprint(files, param_override),
+        "toolchain": toolchain_versions(),
+        "options": options or {},
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
@@ -0,0 +1,117 @@
+"""
+Fisher-matrix quick look at the Figure of Merit of an HD/COV pair.
+
+The derivatives of the distance moduli with respect to (Omega_m, w0, wa) are
+taken by central finite differences, with all shifted cosmologies evaluated
+in one vectorized call, and contracted with the Cholesky-whitened covariance
+(sn_cosmology.SNLikelihood). The magnitude offset is marginalized as in the
+likelihood. The result is the FoM and the marginal errors a chain on the same
+data would give if the posterior were Gaussian, in seconds instead of hours.
+
+Usage:
+    python fisher.py <hd> <cov> [--omega-m-prior SIGMA]
+"""
+
+import argparse
+import logging
+import sys
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from reweight import load_sn_likelihood
+from sn_cosmology import SNLikelihood, distance_modulus
+
+logger = logging.getLogger(__name__)
+
+FISHER_PARAMETERS = ("omega_m", "w0", "wa")
+DEFAULT_FIDUCIAL = (0.3, -1.0, 0.0)
+DEFAULT_STEPS = (0.005, 0.01, 0.05)
+
+
+def distance_modulus_derivatives(z: np.ndarray, fiducial: Sequence[float] = DEFAULT_FIDUCIAL,
+                                 steps: Sequence[float] = DEFAULT_STEPS) -> np.ndarray:
+    """
+    Central finite-difference derivatives of the distance modulus.
+
+    Args:
+        z (np.ndarray): (N,) redshifts
+        fiducial (sequence): Fiducial (Omega_m, w0, wa)
+        steps (sequence): Finite-difference step per parameter
+
+    Returns:
+        np.ndarray: (3, N) derivatives d mu / d theta
+    """
+    steps = np.asarray(steps, dtype=float)
+    shifts = np.diag(steps)
+    # Rows: theta + h_i e_i for every i, then theta - h_i e_i
+    points = np.asarray(fiducial, dtype=float) + np.concatenate([shifts, -shifts])
+    mu = distance_modulus(z, points[:, 0], points[:, 1], points[:, 2])
+    n_params = len(steps)
+    return (mu[:n_params] - mu[n_params:]) / (2.0 * steps[:, None])
+
+
+def fisher_matrix(likelihood: SNLikelihood, fiducial: Sequence[float] = DEFAULT_FIDUCIAL,
+                  steps: Sequence[float] = DEFAULT_STEPS, omega_m_prior: Optional[float] = None) -> np.ndarray:
+    """
+    Fisher matrix of (Omega_m, w0, wa) for an SN likelihood.
+
+    Args:
+        likelihood (SNLikelihood): Likelihood of the HD/COV to forecast
+        fiducial (sequence): Fiducial (Omega_m, w0, wa)
+        steps (sequence): Finite-difference step per parameter
+        omega_m_prior (float, optional): Width of a Gaussian prior on Omega_m
+
+    Returns:
+        np.ndarray: (3, 3) Fisher matrix
+    """
+    fisher = likelihood.fisher_matrix(distance_modulus_derivatives(likelihood.z, fiducial, steps))
+    if omega_m_prior:
+        fisher[0, 0] += 1.0 / omega_m_prior ** 2
+    return fisher
+
+
+def fisher_forecast(likelihood: SNLikelihood, fiducial: Sequence[float] = DEFAULT_FIDUCIAL,
+                    steps: Sequence[float] = DEFAULT_STEPS, omega_m_prior: Optional[float] = None) -> Dict[str, object]:
+    """
+    Predicted Figure of Merit and marginal errors.
+
+    The FoM uses the same definition as FoM(): the inverse square root of the
+    determinant of the marginalized (w0, wa) covariance.
+
+    Returns:
+        dict: 'FoM', 'sigma' (parameter to marginal error) and 'fiducial'
+
+    Raises:
+        np.linalg.LinAlgError: If the Fisher matrix is singular
+    """
+    covariance = np.linalg.inv(fisher_matrix(likelihood, fiducial, steps, omega_m_prior))
+    w_block = covariance[1:, 1:]
+    sigma = np.sqrt(np.diag(covariance))
+    return {
+        "FoM": float(1.0 / np.sqrt(abs(np.linalg.det(w_block)))),
+        "sigma": {name: float(s) for name, s in zip(FISHER_PARAMETERS, sigma)},
+        "fiducial": {name: float(v) for name, v in zip(FISHER_PARAMETERS, fiducial)},
+    }
+
+
+def main(argv=None):
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description="Fisher-matrix FoM forecast for an HD/COV pair")
+    parser.add_argument("hd", help="Hubble diagram file")
+    parser.add_argument("cov", help="Covariance file")
+    parser.add_argument("--omega-m-prior", type=float, default=None, help="Gaussian prior width on Omega_m")
+    parser.add_argument("--fiducial", type=float, nargs=3, default=DEFAULT_FIDUCIAL,
+                        metavar=("OMEGA_M", "W0", "WA"), help="Fiducial cosmology")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    forecast = fisher_forecast(load_sn_likelihood(args.hd, args.cov), args.fiducial,
+                               omega_m_prior=args.omega_m_prior)
+    print(f"FoM = {forecast['FoM']:.2f}")
+    for name, sigma in forecast["sigma"].items():
+        print(f"sigma({name}) = {sigma:.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Posterior statistics updated while the Stage 1 chain is still growing.
+
+The Stage 1 telemetry thread (telemetry.py) already reads every complete row
+appended to the chain. With ``--incremental`` it also hands those bytes to
+an IncrementalChainStats, which keeps sufficient statistics per block of
+rows: total weight, weighted mean and scatter matrix (combined with Chan's
+parallel update, so no sums of squares cancel), plus the largest
+log-likelihood seen. The byte offset where each block starts is remembered.
+
+At every checkpoint the statistics after the burn-in (the same 15% of the
+rows as ``burnin()``) are assembled from the blocks. Only the block that
+contains the burn-in boundary is re-read from disk. Provisional
+``means.txt``, ``covmat.txt`` (cosmosis-postprocess layout) and a
+``stats.yaml`` with the FoM and the minimum -2 log L are written. When Stage 1
+ends the last checkpoint is final, so the numbers are available without
+re-reading the chain.
+
+Only a ``weight`` column is used as sample weight; the samplers that write
+``log_weight`` (nested samplers) write their chain only when they finish.
+"""
+
+import io
+import itertools
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import yaml
+
+from chain_io import open_chain, parameter_columns, parse_header
+
+logger = logging.getLogger(__name__)
+
+# Fraction of the rows discarded as burn-in, as in burnin()
+BURN_FRACTION = 0.15
+DEFAULT_BLOCK_SIZE = 1000
+FOM_PARAMETERS = ("cosmological_parameters--w", "cosmological_parameters--wa")
+
+
+class _Block:
+    """Sufficient statistics of consecutive chain rows."""
+
+    __slots__ = ("start_row", "offset", "rows", "weight", "mean", "scatter")
+
+    def __init__(self, start_row: int, offset: int, n_params: int):
+        self.start_row = start_row
+        self.offset = offset
+        self.rows = 0
+        self.weight = 0.0
+        self.mean = np.zeros(n_params)
+        self.scatter = np.zeros((n_params, n_params))
+
+    def add(self, samples: np.ndarray, weights: np.ndarray) -> None:
+        """Merge rows into the block."""
+        combine(self, samples.shape[0], *_moments(samples, weights))
+
+
+def _moments(samples: np.ndarray, weights: np.ndarray):
+    """Return (total weight, weighted mean, scatter matrix) of a set of rows."""
+    weight = float(weights.sum())
+    mean = weights @ samples / weight if weight > 0 else np.zeros(samples.shape[1])
+    centered = samples - mean
+    return weight, mean, (centered * weights[:, None]).T @ centered
+
+
+def combine(target, rows: int, weight: float, mean: np.ndarray, scatter: np.ndarray) -> None:
+    """Merge (weight, mean, scatter) of ``rows`` rows into ``target`` in place (Chan et al.)."""
+    total = target.weight + weight
+    if total > 0:
+        delta = mean - target.mean
+        target.mean = target.mean + delta * (weight / total)
+        target.scatter = target.scatter + scatter + np.outer(delta, delta) * (target.weight * weight / total)
+    target.rows += rows
+    target.weight = total
+
+
+class IncrementalChainStats:
+    """
+    Running weighted means and covariances of a growing chain.
+
+    Fed by ChainTelemetry through feed(), reset() and checkpoint().
+
+    Attributes:
+        chain_file (str): Chain written by the sampler
+        output_dir (str): Directory of the provisional means.txt, covmat.txt and stats.yaml
+        names (list): Column names from the chain header
+        rows (int): Sample rows seen so far
+        latest (dict): Record of the last checkpoint
+    """
+
+    def __init__(self, chain_file: str, output_dir: str, burn_fraction: float = BURN_FRACTION,
+                 block_size: int = DEFAULT_BLOCK_SIZE):
+        self.chain_file = chain_file
+        self.output_dir = output_dir
+        self.burn_fraction = burn_fraction
+        self.block_size = block_size
+        self.latest = None
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget everything; the chain was truncated or replaced."""
+        self.names: List[str] = []
+        self.columns: List[int] = []
+        self.rows = 0
+        self.max_like = -np.inf
+        self._blocks: List[_Block] = []
+        self._weight_index = None
+        self._like_index = None
+
+    def _set_names(self, names: List[str]) -> None:
+        self.names = names
+        self.columns = [names.index(name) for name in parameter_columns(names)]
+        self._weight_index = names.index("weight") if "weight" in names else None
+        if "like" in names:
+            self._like_index = names.index("like")
+        elif "post" in names:
+            # Without a likelihood column the posterior is the best available proxy
+            self._like_index = names.index("post")
+
+    def feed(self, chunk: bytes, offset: int) -> None:
+        """
+        Add complete chain lines.
+
+        Args:
+            chunk (bytes): Whole lines appended to the chain
+            offset (int): Byte offset of ``chunk`` in the chain file
+        """
+        lines = chunk.splitlines(keepends=True)
+        if not self.names:
+            header_names, _ = parse_header(line.decode() for line in lines if line.startswith(b"#"))
+            if header_names:
+                self._set_names(header_names)
+        starts = np.cumsum([0] + [len(line) for line in lines[:-1]]) + offset
+        data_lines = []
+        data_offsets = []
+        for line, start in zip(lines, starts):
+            if line.startswith(b"#") or not line.strip():
+                continue
+            data_lines.append(line)
+            data_offsets.append(int(start))
+        if not data_lines:
+            return
+        if not self.names:
+            raise ValueError(f"Chain {self.chain_file} has sample rows before its header")
+        data = np.loadtxt(io.BytesIO(b"".join(data_lines)), ndmin=2)
+        if self._like_index is not None:
+            self.max_like = max(self.max_like, float(data[:, self._like_index].max()))
+        samples = data[:, self.columns]
+        weights = data[:, self._weight_index] if self._weight_index is not None else np.ones(len(data))
+
+        position = 0
+        while position < len(data):
+            if not self._blocks or self._blocks[-1].rows == self.block_size:
+                self._blocks.append(_Block(self.rows, data_offsets[position], len(self.columns)))
+            block = self._blocks[-1]
+            end = min(len(data), position + self.block_size - block.rows)
+            block.add(samples[position:end], weights[position:end])
+            self.rows += end - position
+            position = end
+
+    def _read_rows(self, block: _Block, skip: int) -> np.ndarray:
+        """Re-read the rows of ``block`` after its first ``skip`` rows."""
+        with open_chain(self.chain_file, "rb") as handle:
+            handle.seek(block.offset)
+            sample_lines = (line for line in handle if line.strip() and not line.startswith(b"#"))
+            rows = list(itertools.islice(sample_lines, skip, block.rows))
+        return np.loadtxt(io.BytesIO(b"".join(rows)), ndmin=2)
+
+    def statistics(self, burn: Optional[int] = None) -> Dict[str, object]:
+        """
+        Weighted mean and covariance of the rows after the burn-in.
+
+        Args:
+            burn (int, optional): Rows to discard (Default: burn_fraction of the rows)
+
+        Returns:
+            dict: 'names', 'mean', 'cov', 'rows', 'burn' and 'weight'
+        """
+        if burn is None:
+            burn = int(self.burn_fraction * self.rows)
+        total = _Block(burn, 0, len(self.columns))
+        for block in self._blocks:
+            if block.start_row + block.rows <= burn:
+                continue
+            if block.start_row >= burn:
+                combine(total, block.rows, block.weight, block.mean, block.scatter)
+                continue
+            # The block holding the burn-in boundary is the only one re-read
+            data = self._read_rows(block, burn - block.start_row)
+            weights = data[:, self._weight_index] if self._weight_index is not None else np.ones(len(data))
+            combine(total, len(data), *_moments(data[:, self.columns], weights))
+        cov = total.scatter / total.weight if total.weight > 0 else np.full_like(total.scatter, np.nan)
+        return {
+            "names": [self.names[i] for i in self.columns],
+            "mean": total.mean,
+            "cov": cov,
+            "rows": self.rows,
+            "burn": burn,
+            "weight": total.weight,
+        }
+
+    def checkpoint(self, final: bool = False) -> Optional[Dict[str, object]]:
+        """
+        Write the provisional means.txt, covmat.txt and stats.yaml.
+
+        Args:
+            final (bool): The chain is complete
+
+        Returns:
+            dict or None: 'rows', 'burn', 'FoM', 'min_m2logl', 'means', 'covmat',
+                'final' and 'time', or None before the first sample row
+        """
+        if self.rows == 0:
+            return None
+        stats = self.statistics()
+        names = stats["names"]
+        os.makedirs(self.output_dir, exist_ok=True)
+        means_file = os.path.join(self.output_dir, "means.txt")
+        covmat_file = os.path.join(self.output_dir, "covmat.txt")
+        std = np.sqrt(np.diag(stats["cov"]))
+        _write_atomic(means_file, "#parameter mean std_dev\n" + "".join(
+            f"{name} {mean:.10g} {sigma:.10g}\n" for name, mean, sigma in zip(names, stats["mean"], std)))
+        _write_atomic(covmat_file, "#" + "\t".join(names) + "\n" + "".join(
+            "\t".join(f"{value:.10g}" for value in row) + "\n" for row in stats["cov"]))
+
+        fom = None
+        if all(name in names for name in FOM_PARAMETERS):
+            index = [names.index(name) for name in FOM_PARAMETERS]
+            det = np.linalg.det(stats["cov"][np.ix_(index, index)])
+            fom = float(1 / np.sqrt(abs(det))) if det != 0 else None
+        record = {
+            "rows": stats["rows"],
+            "burn": stats["burn"],
+            "FoM": fom,
+            "min_m2logl": None if not np.isfinite(self.max_like) else -2.0 * self.max_like,
+            "means": os.path.abspath(means_file),
+            "covmat": os.path.abspath(covmat_file),
+            "final": final,
+            "time": time.time(),
+        }
+        _write_atomic(os.path.join(self.output_dir, "stats.yaml"), yaml.safe_dump(record, sort_keys=False))
+        self.latest = record
+        return record
+
+
+def _write_atomic(path: str, text: str) -> None:
+    """Write ``text`` to ``path`` through a temporary file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as handle:
+        handle.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,272 @@
+"""
+Native renderer for 1-D and 2-D marginal posterior plots.
+
+An alternative to the plotting done by ``cosmosis-postprocess``: the chain is
+read once, every 1-D and 2-D density is computed with vectorized NumPy
+(weighted histograms smoothed by an FFT Gaussian convolution on the binned
+grid), and the figures are drawn with the headless Agg backend across a pool
+of processes. File names follow the ``cosmosis-postprocess`` convention
+(``<param>.png`` and ``2D_<param1>_<param2>.png``).
+
+Usage:
+    python marginal_plots.py <chain> -o <plot_dir> [--burn N] [--params ...] [--pairs a:b ...]
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from chain_io import chain_weights, parameter_columns, read_chain
+
+logger = logging.getLogger(__name__)
+
+CONTOUR_FRACTIONS = (0.68, 0.95)
+
+
+def _gaussian_kernel_fft(n: int, sigma_bins: float) -> np.ndarray:
+    """Return the real FFT of a periodic Gaussian kernel on ``n`` bins."""
+    freqs = np.fft.rfftfreq(n)
+    return np.exp(-2.0 * (np.pi * freqs * sigma_bins) ** 2)
+
+
+def fft_smooth(hist: np.ndarray, sigma_bins: Sequence[float]) -> np.ndarray:
+    """
+    Smooth a 1-D or 2-D histogram with a Gaussian kernel via FFT convolution.
+
+    The grid is zero-padded by four kernel widths on every axis so that mass
+    does not wrap around the edges.
+
+    Args:
+        hist (np.ndarray): Binned counts or weights
+        sigma_bins (sequence): Kernel width in bins, one per axis
+
+    Returns:
+        np.ndarray: Smoothed grid with the shape of ``hist``, clipped at zero
+    """
+    pads = [int(np.ceil(4 * s)) + 1 for s in sigma_bins]
+    padded = np.pad(hist, [(p, p) for p in pads])
+    spectrum = np.fft.rfftn(padded)
+    # rfftn halves the last axis; full frequencies on the others
+    kernel = _gaussian_kernel_fft(padded.shape[-1], sigma_bins[-1])
+    for axis in range(hist.ndim - 1):
+        freqs = np.fft.fftfreq(padded.shape[axis])
+        factor = np.exp(-2.0 * (np.pi * freqs * sigma_bins[axis]) ** 2)
+        shape = [1] * hist.ndim
+        shape[axis] = -1
+        kernel = kernel * factor.reshape(shape)
+    smoothed = np.fft.irfftn(spectrum * kernel, s=padded.shape, axes=tuple(range(hist.ndim)))
+    slices = tuple(slice(p, p + n) for p, n in zip(pads, hist.shape))
+    return np.clip(smoothed[slices], 0.0, None)
+
+
+def effective_sample_size(weights: np.ndarray) -> float:
+    """Return the Kish effective sample size of a set of weights."""
+    return weights.sum() ** 2 / np.square(weights).sum()
+
+
+def _bandwidth_bins(x: np.ndarray, weights: np.ndarray, edges: np.ndarray, dims: int) -> float:
+    """Scott's-rule kernel width for one axis, in bins."""
+    mean = np.average(x, weights=weights)
+    std = np.sqrt(np.average((x - mean) ** 2, weights=weights))
+    bandwidth = std * effective_sample_size(weights) ** (-1.0 / (dims + 4))
+    return max(bandwidth / (edges[1] - edges[0]), 0.5)
+
+
+def density_1d(x: np.ndarray, weights: np.ndarray, bins: int = 100) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute a smoothed, normalized 1-D marginal density.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (bin centres, density, raw histogram)
+    """
+    hist, edges = np.histogram(x, bins=bins, weights=weights, density=True)
+    smooth = fft_smooth(hist, [_bandwidth_bins(x, weights, edges, 1)])
+    width = edges[1] - edges[0]
+    smooth /= smooth.sum() * width
+    return 0.5 * (edges[1:] + edges[:-1]), smooth, hist
+
+
+def density_2d(x: np.ndarray, y: np.ndarray, weights: np.ndarray,
+               bins: int = 60) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute a smoothed 2-D marginal density.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (x centres, y centres,
+            density indexed as [x, y], normalized to unit sum)
+    """
+    hist, x_edges, y_edges = np.histogram2d(x, y, bins=bins, weights=weights)
+    sigma = [_bandwidth_bins(x, weights, x_edges, 2), _bandwidth_bins(y, weights, y_edges, 2)]
+    smooth = fft_smooth(hist, sigma)
+    smooth /= smooth.sum()
+    return 0.5 * (x_edges[1:] + x_edges[:-1]), 0.5 * (y_edges[1:] + y_edges[:-1]), smooth
+
+
+def contour_levels(density: np.ndarray, fractions: Sequence[float] = CONTOUR_FRACTIONS) -> np.ndarray:
+    """
+    Return the density thresholds enclosing the given probability fractions.
+
+    Returns:
+        np.ndarray: One level per fraction, in increasing order of level
+    """
+    flat = np.sort(density.ravel())[::-1]
+    cumulative = np.cumsum(flat)
+    cumulative /= cumulative[-1]
+    indices = np.searchsorted(cumulative, fractions)
+    levels = flat[np.minimum(indices, flat.size - 1)]
+    return np.sort(levels)
+
+
+def select_pairs(names: List[str], pairs: Optional[Sequence[str]] = None) -> List[Tuple[str, str]]:
+    """
+    Choose the parameter pairs to draw as 2-D contours.
+
+    Args:
+        names (list): Parameters available for plotting
+        pairs (sequence, optional): ``"a:b"`` specifications; ``None`` or
+            ``["all"]`` draws every pair, ``[]`` or ``["none"]`` none
+
+    Returns:
+        list: (a, b) tuples
+
+    Raises:
+        ValueError: If a pair names an unknown parameter
+    """
+    if pairs is None or list(pairs) == ["all"]:
+        return list(itertools.combinations(names, 2))
+    selected = []
+    for spec in pairs:
+        if spec == "none":
+            continue
+        first, sep, second = spec.partition(":")
+        if not sep or first not in names or second not in names:
+            raise ValueError(f"Invalid parameter pair '{spec}'; expected a:b with a, b among {names}")
+        selected.append((first, second))
+    return selected
+
+
+def _draw_1d(task) -> str:
+    """Draw one 1-D marginal (runs in a worker process)."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    name, centres, density, hist, filename = task
+    fig, ax = plt.subplots(figsize=(6, 4.5))
+    ax.step(centres, hist, where="mid", color="0.7", lw=0.8)
+    ax.plot(centres, density, color="C0", lw=2)
+    ax.set_xlabel(name)
+    ax.set_ylabel("Posterior")
+    ax.set_ylim(bottom=0)
+    fig.tight_layout()
+    fig.savefig(filename)
+    plt.close(fig)
+    return filename
+
+
+def _draw_2d(task) -> str:
+    """Draw one 2-D contour plot (runs in a worker process)."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    first, second, x_centres, y_centres, density, levels, filename = task
+    fig, ax = plt.subplots(figsize=(6, 6))
+    top = density.max()
+    bounds = list(levels) + [top * (1 + 1e-9)]
+    ax.contourf(x_centres, y_centres, density.T, levels=bounds, colors=["#a6c8ea", "#3f7fbf"])
+    ax.contour(x_centres, y_centres, density.T, levels=list(levels), colors="k", linewidths=0.8)
+    ax.set_xlabel(first)
+    ax.set_ylabel(second)
+    fig.tight_layout()
+    fig.savefig(filename)
+    plt.close(fig)
+    return filename
+
+
+def render_marginals(
+    chain: str,
+    plot_dir: str,
+    burn: int = 0,
+    params: Optional[Sequence[str]] = None,
+    pairs: Optional[Sequence[str]] = None,
+    processes: Optional[int] = None,
+    fmt: str = "png",
+) -> List[str]:
+    """
+    Render 1-D marginals and 2-D contours of a chain into ``plot_dir``.
+
+    Args:
+        chain (str): COSMOSIS text chain
+        plot_dir (str): Output directory (usually PLOTS/)
+        burn (int): Number of leading rows to discard
+        params (sequence, optional): Parameters to draw (Default: all sampled)
+        pairs (sequence, optional): ``"a:b"`` pairs for 2-D plots (see select_pairs)
+        processes (int, optional): Worker processes (Default: CPU count)
+        fmt (str): Image format / file extension
+
+    Returns:
+        list: Paths of the written figures
+
+    Raises:
+        ImportError: If matplotlib is not installed
+    """
+    import matplotlib  # noqa: F401  Fail early, before any work is done
+
+    names, data, _ = read_chain(chain)
+    data = data[burn:]
+    weights = chain_weights(names, data)
+    if weights is None:
+        weights = np.ones(data.shape[0])
+    selected = list(params) if params else parameter_columns(names)
+    columns = {name: data[:, names.index(name)] for name in selected}
+    os.makedirs(plot_dir, exist_ok=True)
+
+    tasks_1d = []
+    for name, x in columns.items():
+        centres, density, hist = density_1d(x, weights)
+        tasks_1d.append((name, centres, density, hist, os.path.join(plot_dir, f"{name}.{fmt}")))
+    tasks_2d = []
+    for first, second in select_pairs(selected, pairs):
+        x_centres, y_centres, density = density_2d(columns[first], columns[second], weights)
+        filename = os.path.join(plot_dir, f"2D_{first}_{second}.{fmt}")
+        tasks_2d.append((first, second, x_centres, y_centres, density, contour_levels(density), filename))
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        written = list(pool.map(_draw_1d, tasks_1d)) + list(pool.map(_draw_2d, tasks_2d))
+    logger.info(f"Rendered {len(written)} marginal plots into {plot_dir}")
+    return written
+
+
+def native_plot_command(chain: str, plot_dir: str, burn: int, pairs: Optional[Sequence[str]] = None) -> str:
+    """Return the shell command that renders a chain's plots with this module."""
+    command = f"{sys.executable} {os.path.abspath(__file__)} {chain} -o {plot_dir} --burn {burn}"
+    if pairs is not None:
+        command += " --pairs " + " ".join(pairs)
+    return command
+
+
+def main(argv=None):
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description="Render marginal posterior plots of a COSMOSIS chain")
+    parser.add_argument("chain", help="COSMOSIS text chain")
+    parser.add_argument("-o", "--outdir", required=True, help="Plot output directory")
+    parser.add_argument("--burn", type=int, default=0, help="Rows to discard at the start")
+    parser.add_argument("--params", nargs="*", default=None, help="Parameters to draw (Default: all)")
+    parser.add_argument("--pairs", nargs="*", default=None, help="2-D pairs as a:b, 'all' or 'none'")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes")
+    parser.add_argument("--format", default="png", help="Image format (Default: png)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    render_marginals(args.chain, args.outdir, args.burn, args.params, args.pairs, args.processes, args.format)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+Posterior summary statistics for Stage 3.
+
+All requested parameters are summarized in one vectorized pass over the
+post-burn-in chain: the columns are sorted together, cumulative weights are
+built once, and the percentiles and highest-posterior-density (HPD)
+intervals of every column are found with a single ``searchsorted`` over the
+stacked cumulative weights.
+"""
+
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from chain_io import chain_weights, read_chain
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARAMETERS = (
+    "cosmological_parameters--w",
+    "cosmological_parameters--wa",
+    "cosmological_parameters--omega_m",
+)
+DEFAULT_PERCENTILES = (2.5, 16.0, 50.0, 84.0, 97.5)
+DEFAULT_HPD_LEVELS = (0.68, 0.95)
+
+
+class ParameterSummary:
+    """
+    Posterior summary of one parameter.
+
+    Attributes:
+        name (str): Chain column name
+        mean (float): Weighted mean
+        std (float): Weighted standard deviation
+        median (float): Weighted median
+        percentiles (dict): Percentile (0-100) to value
+        hpd (dict): Probability level (0-1) to (lower, upper) HPD interval
+    """
+
+    __slots__ = ("name", "mean", "std", "median", "percentiles", "hpd")
+
+    def __init__(self, name: str, mean: float, std: float, median: float,
+                 percentiles: Dict[float, float], hpd: Dict[float, Tuple[float, float]]):
+        self.name = name
+        self.mean = mean
+        self.std = std
+        self.median = median
+        self.percentiles = percentiles
+        self.hpd = hpd
+
+    def __repr__(self):
+        return f"ParameterSummary({self.name!r}, mean={self.mean:.6g}, std={self.std:.6g})"
+
+    def to_dict(self) -> dict:
+        """Return plain Python types suitable for SUMMARY.YAML."""
+        return {
+            "mean": self.mean,
+            "std": self.std,
+            "median": self.median,
+            "percentiles": {float(p): v for p, v in self.percentiles.items()},
+            "hpd": {float(level): [lo, hi] for level, (lo, hi) in self.hpd.items()},
+        }
+
+
+def _stacked_searchsorted(cumulative: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    Run ``searchsorted`` on every column of ``cumulative`` at once.
+
+    Args:
+        cumulative (np.ndarray): (n, k) non-decreasing columns with values in [0, 1]
+        targets (np.ndarray): (m, k) values to locate in each column
+
+    Returns:
+        np.ndarray: (m, k) row indices, clipped to [0, n - 1]
+    """
+    n, k = cumulative.shape
+    # Offsetting column j by 2j keeps the flattened array sorted
+    offsets = 2.0 * np.arange(k)
+    flat = (cumulative + offsets).T.ravel()
+    idx = np.searchsorted(flat, (targets + offsets).T.ravel(), side="left")
+    idx = idx.reshape(k, -1).T - np.arange(k) * n
+    return np.clip(idx, 0, n - 1)
+
+
+def summarize_samples(
+    names: Sequence[str],
+    samples: np.ndarray,
+    weights: Optional[np.ndarray] = None,
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+    hpd_levels: Sequence[float] = DEFAULT_HPD_LEVELS,
+) -> List[ParameterSummary]:
+    """
+    Summarize weighted samples of several parameters in one vectorized pass.
+
+    Args:
+        names (sequence): Parameter names, one per column of ``samples``
+        samples (np.ndarray): (n_samples, n_params) array
+        weights (np.ndarray, optional): Sample weights (Default: equal weights)
+        percentiles (sequence): Percentiles (0-100) to report
+        hpd_levels (sequence): Probability levels (0-1) of the HPD intervals
+
+    Returns:
+        list: One ParameterSummary per column
+
+    Raises:
+        ValueError: If there are no samples or the weights do not match
+    """
+    samples = np.asarray(samples, dtype=float)
+    n, k = samples.shape
+    if n == 0:
+        raise ValueError("Cannot summarize an empty chain")
+    if weights is None:
+        weights = np.ones(n)
+    weights = np.asarray(weights, dtype=float)
+    if weights.shape != (n,):
+        raise ValueError(f"Expected {n} weights, got shape {weights.shape}")
+    weights = weights / weights.sum()
+
+    mean = weights @ samples
+    std = np.sqrt(weights @ (samples - mean) ** 2)
+
+    order = np.argsort(samples, axis=0, kind="stable")
+    sorted_samples = np.take_along_axis(samples, order, axis=0)
+    sorted_weights = weights[order]
+    # Midpoint cumulative weights: exact weighted quantiles for equal weights
+    cumulative = np.cumsum(sorted_weights, axis=0) - 0.5 * sorted_weights
+
+    quantiles = np.append(np.asarray(percentiles, dtype=float) / 100.0, 0.5)
+    targets = np.repeat(quantiles[:, None], k, axis=1)
+    upper = _stacked_searchsorted(cumulative, targets)
+    lower = np.maximum(upper - 1, 0)
+    c_lo = np.take_along_axis(cumulative, lower, axis=0)
+    c_hi = np.take_along_axis(cumulative, upper, axis=0)
+    x_lo = np.take_along_axis(sorted_samples, lower, axis=0)
+    x_hi = np.take_along_axis(sorted_samples, upper, axis=0)
+    span = np.where(c_hi > c_lo, c_hi - c_lo, 1.0)
+    frac = np.clip((targets - c_lo) / span, 0.0, 1.0)
+    quantile_values = x_lo + frac * (x_hi - x_lo)
+
+    # HPD: for each start row the shortest window holding the requested mass
+    hpd_values = {}
+    cumulative_end = np.cumsum(sorted_weights, axis=0)
+    cumulative_start = cumulative_end - sorted_weights
+    for level in hpd_levels:
+        ends = _stacked_searchsorted(cumulative_end, np.minimum(cumulative_start + level, 1.0))
+        widths = np.take_along_axis(sorted_samples, ends, axis=0) - sorted_samples
+        valid = cumulative_start + level <= 1.0 + 1e-12
+        widths = np.where(valid, widths, np.inf)
+        best = np.argmin(widths, axis=0)
+        lo = sorted_samples[best, np.arange(k)]
+        hi = sorted_samples[ends[best, np.arange(k)], np.arange(k)]
+        hpd_values[level] = (lo, hi)
+
+    results = []
+    for j, name in enumerate(names):
+        results.append(ParameterSummary(
+            name,
+            float(mean[j]),
+            float(std[j]),
+            float(quantile_values[-1, j]),
+            {float(p): float(quantile_values[i, j]) for i, p in enumerate(percentiles)},
+            {float(level): (float(lo[j]), float(hi[j])) for level, (lo, hi) in hpd_values.items()},
+        ))
+    return results
+
+
+def summarize_chain(
+    chain: str,
+    parameters: Sequence[str] = DEFAULT_PARAMETERS,
+    burn: int = 0,
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+    hpd_levels: Sequence[float] = DEFAULT_HPD_LEVELS,
+) -> List[ParameterSummary]:
+    """
+    Summarize the requested parameters of a COSMOSIS chain after burn-in.
+
+    Args:
+        chain (str): COSMOSIS text chain
+        parameters (sequence): Chain columns to summarize
+        burn (int): Number of leading rows to discard
+        percentiles (sequence): Percentiles (0-100) to report
+        hpd_levels (sequence): Probability levels (0-1) of the HPD intervals
+
+    Returns:
+        list: One ParameterSummary per requested parameter
+
+    Raises:
+        KeyError: If a parameter is not a column of the chain
+    """
+    names, data, _ = read_chain(chain)
+    missing = [p for p in parameters if p not in names]
+    if missing:
+        raise KeyError(f"Parameters not found in chain {chain}: {missing}")
+    data = data[burn:]
+    weights = chain_weights(names, data)
+    columns = [names.index(p) for p in parameters]
+    return summarize_samples(parameters, data[:, columns], weights, percentiles, hpd_levels)
@@ -0,0 +1,321 @@
+"""
+Historical performance database.
+
+Every wrapper run adds one row per stage (and a ``TOTAL`` row) to a local
+SQLite database: the run fingerprint (fingerprint.py), wall and CPU time,
+chain rows per second and peak resident memory. The database is opened in
+WAL mode with a busy timeout, so the concurrent jobs of a sweep or of a batch
+array can write to it safely.
+
+The history also sets the wall limits of the stage timeout policies
+(historical_wall_limit): a multiple of the slowest recent successful run of
+the same ini and stage.
+
+``python perfdb.py report`` compares the most recent runs of every ini and
+stage with a rolling baseline of the runs before them and flags
+regressions. For each flagged regression it lists the fingerprint fields that
+changed between the baseline and the recent runs (Firecrown or COSMOSIS
+version, node type, inputs).
+
+The database path defaults to ``$FIRECROWN_PERF_DB`` or
+``~/.firecrown/perf.sqlite``.
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import statistics
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DB_ENV_VARIABLE = "FIRECROWN_PERF_DB"
+DEFAULT_DB = os.path.join("~", ".firecrown", "perf.sqlite")
+BUSY_TIMEOUT_MS = 30000
+DEFAULT_RECENT = 3
+DEFAULT_BASELINE = 20
+DEFAULT_THRESHOLD = 1.25
+# Wall limits: a multiple of the slowest of the recent successful runs, once there are enough of them
+WALL_LIMIT_FACTOR = 3.0
+WALL_LIMIT_RUNS = 20
+WALL_LIMIT_MIN_RUNS = 3
+WALL_LIMIT_MIN_SECONDS = 300.0
+# Fingerprint fields reported when a stage slows down
+FINGERPRINT_FIELDS = ("firecrown_version", "cosmosis_version", "cpu_model", "host", "ini_hash", "input_hash")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    started REAL NOT NULL,
+    ini TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT,
+    wall_seconds REAL,
+    cpu_seconds REAL,
+    rows INTEGER,
+    rows_per_second REAL,
+    peak_rss_mb REAL,
+    input_hash TEXT,
+    ini_hash TEXT,
+    firecrown_version TEXT,
+    cosmosis_version TEXT,
+    python_version TEXT,
+    host TEXT,
+    cpu_model TEXT,
+    cpus INTEGER
+);
+CREATE INDEX IF NOT EXISTS stage_runs_ini_stage ON stage_runs (ini, stage, started);
+"""
+
+
+def default_db_path() -> str:
+    """Return $FIRECROWN_PERF_DB or ~/.firecrown/perf.sqlite."""
+    return os.path.expanduser(os.environ.get(DB_ENV_VARIABLE) or DEFAULT_DB)
+
+
+def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """
+    Open (and create) the database in WAL mode.
+
+    Args:
+        db_path (str, optional): Database file (Default: default_db_path())
+
+    Returns:
+        sqlite3.Connection: Connection with rows returned as sqlite3.Row
+    """
+    db_path = db_path or default_db_path()
+    directory = os.path.dirname(os.path.abspath(db_path))
+    os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+    connection.row_factory = sqlite3.Row
+    connection.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def record_run(
+    db_path: Optional[str],
+    fingerprint: Dict[str, object],
+    stage_records: Dict[str, dict],
+    statuses: Optional[Dict[str, str]] = None,
+    rows: Optional[int] = None,
+    started: Optional[float] = None,
+    run_id: Optional[str] = None,
+) -> str:
+    """
+    Add one row per stage of a run, in a single transaction.
+
+    Args:
+        db_path (str, optional): Database file (Default: default_db_path())
+        fingerprint (dict): run_fingerprint() of the run
+        stage_records (dict): Stage name to its StageProfiler record
+            ('wall_seconds', 'cpu_seconds', 'peak_rss_mb', ...)
+        statuses (dict, optional): Stage name to its SUMMARY.YAML status
+        rows (int, optional): Rows of the Stage 1 chain
+        started (float, optional): Start time of the run (Default: now)
+        run_id (str, optional): Identifier of the run (Default: random)
+
+    Returns:
+        str: The run identifier
+    """
+    run_id = run_id or uuid.uuid4().hex
+    started = time.time() if started is None else started
+    statuses = statuses or {}
+    values = []
+    for stage, record in stage_records.items():
+        wall = record.get("wall_seconds")
+        # Stage 0 runs before there is a chain
+        stage_rows = rows if stage != "STAGE0" else None
+        cpu = (record.get("cpu_seconds") or 0.0) + (record.get("child_cpu_seconds") or 0.0)
+        values.append((
+            run_id, started, fingerprint.get("ini"), stage, statuses.get(stage),
+            wall, cpu, stage_rows,
+            stage_rows / wall if stage_rows and wall else None,
+            record.get("peak_rss_mb"),
+            fingerprint.get("input_hash"), fingerprint.get("ini_hash"),
+            fingerprint.get("firecrown_version"), fingerprint.get("cosmosis_version"),
+            fingerprint.get("python_version"), fingerprint.get("host"),
+            fingerprint.get("cpu_model"), fingerprint.get("cpus"),
+        ))
+    connection = connect(db_path)
+    try:
+        with connection:
+            connection.executemany(
+                "INSERT INTO stage_runs (run_id, started, ini, stage, status, wall_seconds, cpu_seconds, rows, "
+                "rows_per_second, peak_rss_mb, input_hash, ini_hash, firecrown_version, cosmosis_version, "
+                "python_version, host, cpu_model, cpus) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                values,
+            )
+    finally:
+        connection.close()
+    return run_id
+
+
+def stage_history(connection: sqlite3.Connection, ini: str, stage: str, limit: Optional[int] = None,
+                  status: Optional[str] = None) -> List[sqlite3.Row]:
+    """
+    Return the recorded runs of one stage of an ini, oldest first.
+
+    Args:
+        connection (sqlite3.Connection): Open database
+        ini (str): Ini name (file stem)
+        stage (str): Stage name, e.g. "STAGE1"
+        limit (int, optional): Only the most recent ``limit`` runs
+        status (str, optional): Only runs with this status, e.g. "SUCCESSFUL"
+    """
+    query = "SELECT * FROM stage_runs WHERE ini = ? AND stage = ?"
+    parameters = [ini, stage]
+    if status is not None:
+        query += " AND status = ?"
+        parameters.append(status)
+    query += " ORDER BY started DESC, id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        parameters.append(limit)
+    return list(reversed(connection.execute(query, parameters).fetchall()))
+
+
+def historical_wall_limit(
+    db_path: Optional[str],
+    ini: str,
+    stage: str,
+    factor: float = WALL_LIMIT_FACTOR,
+    runs: int = WALL_LIMIT_RUNS,
+    min_runs: int = WALL_LIMIT_MIN_RUNS,
+    minimum: float = WALL_LIMIT_MIN_SECONDS,
+) -> Optional[float]:
+    """
+    Wall limit of a stage from its recorded runtimes for an ini.
+
+    Args:
+        db_path (str, optional): Database file (Default: default_db_path())
+        ini (str): Ini name (file stem)
+        stage (str): Stage name, e.g. "STAGE1"
+        factor (float): Multiple of the slowest recent successful run
+        runs (int): Number of recent successful runs considered
+        min_runs (int): Fewer successful runs give no limit
+        minimum (float): Lower bound of the limit in seconds
+
+    Returns:
+        float or None: The limit in seconds, or None without enough history
+    """
+    connection = connect(db_path)
+    try:
+        history = stage_history(connection, ini, stage, runs, status="SUCCESSFUL")
+    finally:
+        connection.close()
+    walls = [row["wall_seconds"] for row in history if row["wall_seconds"] is not None]
+    if len(walls) < min_runs:
+        return None
+    return max(minimum, factor * max(walls))
+
+
+def _changed_fields(baseline: List[sqlite3.Row], recent: List[sqlite3.Row]) -> Dict[str, str]:
+    """Fingerprint fields whose most common value differs between two sets of runs."""
+    changes = {}
+    for field in FINGERPRINT_FIELDS:
+        before = statistics.mode(row[field] for row in baseline)
+        after = statistics.mode(row[field] for row in recent)
+        if before != after:
+            changes[field] = f"{before} -> {after}"
+    return changes
+
+
+def find_regressions(
+    db_path: Optional[str] = None,
+    ini: Optional[str] = None,
+    recent: int = DEFAULT_RECENT,
+    baseline: int = DEFAULT_BASELINE,
+    threshold: float = DEFAULT_THRESHOLD,
+) -> List[Dict[str, object]]:
+    """
+    Compare the recent runs of every (ini, stage) with their rolling baseline.
+
+    The median wall time of the last ``recent`` runs is compared with the
+    median of up to ``baseline`` runs before them; only runs without a
+    FAILED status are used.
+
+    Args:
+        db_path (str, optional): Database file (Default: default_db_path())
+        ini (str, optional): Only this ini
+        recent (int): Number of recent runs
+        baseline (int): Number of earlier runs forming the baseline
+        threshold (float): Slowdown ratio above which a regression is flagged
+
+    Returns:
+        list: One dict per (ini, stage) with 'ini', 'stage', 'baseline_seconds',
+            'recent_seconds', 'ratio', 'regression', 'baseline_runs',
+            'recent_runs' and 'changes'
+    """
+    connection = connect(db_path)
+    try:
+        query = "SELECT DISTINCT ini, stage FROM stage_runs"
+        parameters = []
+        if ini is not None:
+            query += " WHERE ini = ?"
+            parameters.append(ini)
+        results = []
+        for row in connection.execute(query + " ORDER BY ini, stage", parameters).fetchall():
+            history = [run for run in stage_history(connection, row["ini"], row["stage"], recent + baseline)
+                       if run["status"] != "FAILED" and run["wall_seconds"] is not None]
+            latest, earlier = history[-recent:], history[:-recent]
+            if not latest or not earlier:
+                continue
+            baseline_seconds = statistics.median(run["wall_seconds"] for run in earlier)
+            recent_seconds = statistics.median(run["wall_seconds"] for run in latest)
+            ratio = recent_seconds / baseline_seconds if baseline_seconds > 0 else None
+            regression = ratio is not None and ratio > threshold
+            results.append({
+                "ini": row["ini"],
+                "stage": row["stage"],
+                "baseline_seconds": baseline_seconds,
+                "recent_seconds": recent_seconds,
+                "ratio": ratio,
+                "regression": regression,
+                "baseline_runs": len(earlier),
+                "recent_runs": len(latest),
+                "changes": _changed_fields(earlier, latest) if regression else {},
+            })
+        return results
+    finally:
+        connection.close()
+
+
+def format_report(results: List[Dict[str, object]]) -> str:
+    """Format find_regressions() results as a text table."""
+    lines = [f"{'ini':<24} {'stage':<12} {'baseline s':>11} {'recent s':>10} {'ratio':>7}  flag"]
+    for result in results:
+        ratio = f"{result['ratio']:.2f}" if result["ratio"] is not None else "-"
+        flag = "REGRESSION" if result["regression"] else ""
+        lines.append(f"{result['ini']:<24} {result['stage']:<12} {result['baseline_seconds']:>11.2f} "
+                     f"{result['recent_seconds']:>10.2f} {ratio:>7}  {flag}")
+        for field, change in result["changes"].items():
+            lines.append(f"{'':<38}{field}: {change}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """Command-line entry point: ``perfdb.py report``."""
+    parser = argparse.ArgumentParser(description="Firecrown wrapper performance history")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report = subparsers.add_parser("report", help="Flag stages that got slower than their rolling baseline")
+    report.add_argument("--db", default=None, help="Database file (Default: $FIRECROWN_PERF_DB or ~/.firecrown)")
+    report.add_argument("--ini", default=None, help="Only this ini (file stem)")
+    report.add_argument("--recent", type=int, default=DEFAULT_RECENT, help="Recent runs compared")
+    report.add_argument("--baseline", type=int, default=DEFAULT_BASELINE, help="Earlier runs in the baseline")
+    report.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Slowdown ratio flagged")
+    args = parser.parse_args(argv)
+    results = find_regressions(args.db, args.ini, args.recent, args.baseline, args.threshold)
+    print(format_report(results))
+    # Non-zero exit status so batch checks can alert on regressions
+    return 1 if any(result["regression"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Optional profiling of the wrapper's stages (``--profile``).
+
+Every stage runs inside a ``StageProfiler.span``. With profiling disabled a
+span does nothing. With profiling enabled:
+
+- in-process work (``burnin``, Stage 3 parsing, ``FoM``, ``write_summary``,
+  in-process Stage 0 and native plots) runs under cProfile and tracemalloc,
+  and the span writes a ``.pstats`` file, a collapsed-stack file readable by
+  flamegraph tools (``flamegraph.pl``, speedscope) and its peak traced memory;
+- subprocess stages are timed, together with the CPU time and peak resident
+  memory of the child processes taken from ``getrusage``.
+
+All records are written to ``PROFILE_<ini>.yaml`` next to the stage logs.
+
+With ``timing=True`` and profiling disabled, spans only record wall and CPU
+time and peak resident memory, at negligible cost; these records feed the
+performance database (perfdb.py).
+"""
+
+import cProfile
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import yaml
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Stacks deeper than this are truncated in the collapsed output
+MAX_STACK_DEPTH = 64
+# cProfile allows one active profiler per process (enable() raises on Python
+# 3.12+) and tracemalloc is process-wide, so profiled in-process spans of
+# concurrent runs (sweeps, queue workers) take turns
+_PROFILE_LOCK = threading.Lock()
+
+
+def _function_label(func) -> str:
+    """Return a flamegraph frame label for a pstats function key."""
+    filename, line, name = func
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def collapsed_stacks(stats: pstats.Stats) -> List[str]:
+    """
+    Convert profile statistics into collapsed stacks (``a;b;c <microseconds>``).
+
+    cProfile only records caller/callee pairs, so full stacks are rebuilt by
+    walking the call graph from the root functions and splitting each
+    function's own time between its callers in proportion to the cumulative
+    time spent through each call edge.
+
+    Args:
+        stats (pstats.Stats): Loaded profile statistics
+
+    Returns:
+        list: Lines in the collapsed-stack format
+    """
+    raw = stats.stats
+    callees: Dict[tuple, List[tuple]] = {}
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller in callers:
+            callees.setdefault(caller, []).append(func)
+    roots = [func for func, entry in raw.items() if not entry[4]]
+
+    totals: Dict[str, float] = {}
+
+    def walk(func, stack, fraction):
+        _, _, own_time, cumulative, _ = raw[func]
+        stack = stack + [_function_label(func)]
+        key = ";".join(stack)
+        totals[key] = totals.get(key, 0.0) + own_time * fraction
+        if len(stack) >= MAX_STACK_DEPTH or cumulative <= 0:
+            return
+        for callee in callees.get(func, []):
+            if _function_label(callee) in stack:
+                continue  # recursion is folded into the outermost frame
+            edge_cumulative = raw[callee][4][func][3]
+            callee_cumulative = raw[callee][3]
+            if callee_cumulative > 0:
+                walk(callee, stack, fraction * edge_cumulative / callee_cumulative)
+
+    for root in roots:
+        walk(root, [], 1.0)
+    return [f"{stack} {int(round(value * 1e6))}" for stack, value in sorted(totals.items()) if value > 0]
+
+
+def _self_peak_rss():
+    """Return the peak RSS of this process in MB, or None."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _children_usage():
+    """Return (CPU seconds, peak RSS in MB) of terminated child processes."""
+    if resource is None:
+        return 0.0, None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024.0
+
+
+class StageProfiler:
+    """
+    Collects per-stage profiles for one run.
+
+    Attributes:
+        enabled (bool): Whether spans profile anything
+        timing (bool): Record timings and peak RSS even when not enabled
+        output_dir (str): Directory for the profile artifacts (ERROR_LOGS)
+        prefix (str): File name prefix, usually the ini stem
+        records (dict): Span name to its measurements
+    """
+
+    def __init__(self, output_dir: Optional[str] = None, prefix: str = "run", enabled: bool = False,
+                 timing: bool = False):
+        self.enabled = enabled
+        self.timing = timing
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.records: Dict[str, dict] = {}
+
+    def _artifact(self, name: str, suffix: str) -> str:
+        """Return the path of a profile artifact."""
+        return os.path.join(self.output_dir, f"PROFILE_{self.prefix}_{name}{suffix}")
+
+    @contextmanager
+    def span(self, name: str, external: bool = False):
+        """
+        Profile the enclosed block as stage ``name``.
+
+        Only one cProfile profiler can be active in a process, so spans must
+        not be nested, and profiled in-process spans of concurrent runs in one
+        interpreter (RunContext thread pools) are serialized by a module-level
+        lock; their wall time excludes the wait. Timing-only and external
+        spans run concurrently.
+
+        Args:
+            name (str): Span name, e.g. "STAGE1" or "burnin"
+            external (bool): The block mostly waits for a child process;
+                only timings and child resource usage are recorded
+        """
+        if not (self.enabled or self.timing):
+            yield
+            return
+
+        profile = None
+        started_tracing = False
+        if self.enabled and not external:
+            _PROFILE_LOCK.acquire()
+            try:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    started_tracing = True
+                tracemalloc.clear_traces()
+                profile = cProfile.Profile()
+                # Raises if a profiler outside this module is active
+                profile.enable()
+            except BaseException:
+                if started_tracing:
+                    tracemalloc.stop()
+                _PROFILE_LOCK.release()
+                raise
+        child_cpu0, _ = _children_usage()
+        wall0 = time.perf_counter()
+        cpu0 = time.process_time()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            record = {
+                "wall_seconds": round(time.perf_counter() - wall0, 4),
+                "cpu_seconds": round(time.process_time() - cpu0, 4),
+            }
+            child_cpu1, child_maxrss = _children_usage()
+            if external:
+                record["child_cpu_seconds"] = round(child_cpu1 - child_cpu0, 4)
+                # Largest resident set of any child so far, not only of this stage
+                record["child_peak_rss_mb"] = child_maxrss
+                record["peak_rss_mb"] = child_maxrss
+            elif profile is not None:
+                try:
+                    record["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 3)
+                    if started_tracing:
+                        tracemalloc.stop()
+                    record.update(self._write_profile(name, profile))
+                finally:
+                    _PROFILE_LOCK.release()
+            if not external:
+                record["peak_rss_mb"] = _self_peak_rss()
+            self.records[name] = record
+            if self.enabled:
+                logger.info(f"Profile {name}: {record}")
+
+    def _write_profile(self, name: str, profile: cProfile.Profile) -> dict:
+        """Write the .pstats and collapsed-stack files of a span."""
+        if self.output_dir is None:
+            return {}
+        stats_file = self._artifact(name, ".pstats")
+        collapsed_file = self._artifact(name, ".collapsed")
+        profile.dump_stats(stats_file)
+        with open(collapsed_file, "w") as handle:
+            handle.write("\n".join(collapsed_stacks(pstats.Stats(stats_file))) + "\n")
+        return {"pstats": stats_file, "collapsed": collapsed_file}
+
+    def write_report(self) -> Optional[str]:
+        """Write all span records to PROFILE_<prefix>.yaml and return its path."""
+        if not self.enabled or self.output_dir is None:
+            return None
+        report = os.path.join(self.output_dir, f"PROFILE_{self.prefix}.yaml")
+        with open(report, "w") as handle:
+            yaml.safe_dump(self.records, handle, sort_keys=False)
+        return report
@@ -0,0 +1,240 @@
+"""
+Warm-start cache of proposal covariances and best-fit points for Stage 1.
+
+Without a tuned proposal the Metropolis sampler spends a large part of every
+chain adapting, although an earlier run on nearly the same data has already
+measured the posterior covariance (``PLOTS/covmat.txt``). After every
+successful Metropolis run the wrapper stores that covariance and the
+maximum-posterior sample:
+
+    <cache>/<parameter set hash>/<input hash>.yaml
+
+Entries are grouped by parameter set (the varied parameters of the values
+file). Within a group they are matched by dataset: an identical input hash
+first, otherwise the nearest Hubble diagram by number of supernovae and
+redshift distribution (dataset_distance), up to MAX_DATASET_DISTANCE. The
+match is passed to COSMOSIS through the Stage 1 overrides: the covariance as
+``metropolis.covmat`` (reordered to the values file) and the best fit as the
+starting point of every varied parameter (``-v``), clipped into its prior
+range.
+"""
+
+import configparser
+import hashlib
+import logging
+import os
+import shlex
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+
+from chain_io import read_chain
+from sacc_builder import load_hubble_diagram
+from warm_worker import parse_overrides
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENV_VARIABLE = "FIRECROWN_PROPOSAL_CACHE"
+MAX_DATASET_DISTANCE = 1.0
+# Samplers that take a proposal covariance through <sampler>.covmat
+PROPOSAL_SAMPLERS = ("metropolis",)
+
+
+def values_file(ini_file: str, param_override: str = "") -> Optional[str]:
+    """Return the values file of an ini (``[pipeline] values``), or None if it does not exist."""
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        parser.read(ini_file)
+        name = parse_overrides(param_override).get(("pipeline", "values"),
+                                                   parser.get("pipeline", "values", fallback=""))
+    except (configparser.Error, ValueError):
+        return None
+    name = name.strip()
+    for candidate in (name, os.path.join(os.path.dirname(ini_file), name)):
+        if name and os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def varied_parameters(ini_file: str, param_override: str = "") -> List[Tuple[str, float, float, float]]:
+    """
+    Return the varied parameters of an ini's values file, in file order.
+
+    Returns:
+        list: ``(section--name, lower, start, upper)`` for every parameter
+            given as three numbers
+    """
+    path = values_file(ini_file, param_override)
+    if path is None:
+        return []
+    parser = configparser.ConfigParser(interpolation=None, strict=False, inline_comment_prefixes=(";", "#"))
+    parser.optionxform = str
+    try:
+        parser.read(path)
+    except configparser.Error as e:
+        logger.warning(f"Cannot read the values file {path}: {str(e)}")
+        return []
+    parameters = []
+    for section in parser.sections():
+        for name, value in parser.items(section):
+            try:
+                numbers = [float(item) for item in value.split()]
+            except ValueError:
+                continue
+            if len(numbers) == 3:
+                parameters.append((f"{section}--{name}", *numbers))
+    return parameters
+
+
+def dataset_descriptor(hd_file: str) -> Dict[str, float]:
+    """Summarize a Hubble diagram for matching: number of supernovae and redshift distribution."""
+    z, _, _ = load_hubble_diagram(hd_file)
+    return {
+        "n_sn": int(z.size),
+        "z_min": float(z.min()),
+        "z_median": float(np.median(z)),
+        "z_max": float(z.max()),
+    }
+
+
+def dataset_distance(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """Distance between two dataset descriptors: log ratio of sizes plus redshift differences."""
+    return (abs(np.log(max(a["n_sn"], 1) / max(b["n_sn"], 1)))
+            + abs(a["z_median"] - b["z_median"]) + abs(a["z_max"] - b["z_max"]))
+
+
+def read_covmat(path: str) -> Tuple[List[str], np.ndarray]:
+    """Read a cosmosis-postprocess covmat.txt: a ``#name<TAB>name...`` header and the matrix."""
+    with open(path) as handle:
+        names = handle.readline().lstrip("#").split()
+    matrix = np.loadtxt(path, comments="#", ndmin=2)
+    if matrix.shape != (len(names), len(names)):
+        raise ValueError(f"Covariance {path} is {matrix.shape}, its header names {len(names)} parameters")
+    return names, matrix
+
+
+def best_fit(chain: str) -> Dict[str, float]:
+    """Return the sampled parameters of the maximum-posterior row of a chain."""
+    names, data, _ = read_chain(chain)
+    if "post" not in names or data.shape[0] == 0:
+        raise ValueError(f"Chain {chain} has no post column or no samples")
+    row = data[int(np.argmax(data[:, names.index("post")]))]
+    return {name: float(value) for name, value in zip(names, row) if "--" in name}
+
+
+def _parameter_set_key(names) -> str:
+    return hashlib.sha256("\n".join(sorted(names)).encode()).hexdigest()[:16]
+
+
+class ProposalCache:
+    """
+    Directory of posterior covariances and best fits of earlier runs.
+
+    Attributes:
+        root (str): Cache directory
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def store(self, names: List[str], cov: np.ndarray, bestfit: Dict[str, float], dataset: Dict[str, float],
+              input_hash: str, ini: str = "") -> str:
+        """
+        Add or replace the entry of a run.
+
+        Args:
+            names (list): Parameter names of ``cov``
+            cov (np.ndarray): Posterior covariance
+            bestfit (dict): Maximum-posterior point
+            dataset (dict): dataset_descriptor() of the HD file
+            input_hash (str): Input fingerprint of the run
+            ini (str): Ini name, for reference
+
+        Returns:
+            str: Path of the entry
+        """
+        directory = os.path.join(self.root, _parameter_set_key(names))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{input_hash}.yaml")
+        entry = {
+            "names": list(names),
+            "cov": np.asarray(cov, dtype=float).tolist(),
+            "bestfit": {name: float(value) for name, value in bestfit.items()},
+            "dataset": dataset,
+            "input_hash": input_hash,
+            "ini": ini,
+            "created": time.time(),
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as handle:
+            yaml.safe_dump(entry, handle, sort_keys=False)
+        os.replace(tmp_path, path)
+        return path
+
+    def nearest(self, names: List[str], dataset: Dict[str, float], input_hash: Optional[str] = None,
+                max_distance: float = MAX_DATASET_DISTANCE) -> Optional[dict]:
+        """
+        Return the stored entry for the same parameters and the nearest dataset.
+
+        Args:
+            names (list): Varied parameters of the run
+            dataset (dict): dataset_descriptor() of its HD file
+            input_hash (str, optional): Input fingerprint; an identical one always matches
+            max_distance (float): Largest dataset_distance() accepted
+
+        Returns:
+            dict or None: The entry with 'path' and 'distance' added, or None
+        """
+        directory = os.path.join(self.root, _parameter_set_key(names))
+        if not os.path.isdir(directory):
+            return None
+        best = None
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".yaml"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                with open(path) as handle:
+                    entry = yaml.safe_load(handle)
+            except (OSError, yaml.YAMLError):
+                continue
+            if set(entry["names"]) != set(names):
+                continue
+            distance = 0.0 if entry["input_hash"] == input_hash else dataset_distance(dataset, entry["dataset"])
+            if distance <= max_distance and (best is None or distance < best["distance"]):
+                best = dict(entry, path=path, distance=distance)
+        return best
+
+
+def write_proposal(entry: dict, parameters: List[Tuple[str, float, float, float]], path: str) -> None:
+    """
+    Write the entry's covariance in the order of the values file, as COSMOSIS reads it.
+
+    Raises:
+        ValueError: If the covariance is not positive definite
+    """
+    names = [parameter[0] for parameter in parameters]
+    index = [entry["names"].index(name) for name in names]
+    cov = np.asarray(entry["cov"])[np.ix_(index, index)]
+    np.linalg.cholesky(cov)  # raises LinAlgError (a ValueError) unless positive definite
+    np.savetxt(path, cov, header=" ".join(names))
+
+
+def start_overrides(entry: dict, parameters: List[Tuple[str, float, float, float]]) -> List[str]:
+    """
+    Return ``-v`` overrides starting every varied parameter at the entry's best fit.
+
+    The start is clipped inside the prior range; the range itself is unchanged.
+    """
+    overrides = []
+    for name, lower, _, upper in parameters:
+        if name not in entry["bestfit"]:
+            continue
+        margin = 1e-6 * (upper - lower)
+        start = min(max(entry["bestfit"][name], lower + margin), upper - margin)
+        section, _, option = name.partition("--")
+        overrides.append(shlex.quote(f"{section}.{option}={lower:.10g} {start:.10g} {upper:.10g}"))
+    return overrides
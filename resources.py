@@ -0,0 +1,207 @@
+"""
+CPU sets and thread counts for co-located wrapper runs.
+
+COSMOSIS and the numpy/pyccl libraries it loads start one OpenMP or BLAS
+thread per core they can see. Several wrapper runs packed onto one node
+therefore oversubscribe it many times over. A ResourceSpec confines a stage to
+a CPU set and sizes the thread pools to it:
+
+* the stage's process is started with the CPU set as its affinity mask;
+* OMP_NUM_THREADS, OPENBLAS_NUM_THREADS, MKL_NUM_THREADS (and the numexpr
+  and Accelerate equivalents) are set to the threads per process;
+* MPI binding hints restrict Open MPI (OMPI_MCA_hwloc_base_cpu_set) and
+  Intel MPI (I_MPI_PIN_PROCESSOR_LIST) to the same CPUs.
+
+Concurrent runs get disjoint CPU sets from allocate_cores(). Every core of a
+node has a lock file in a node-local registry directory, and a run holds an
+flock on the files of its cores for as long as it runs. The kernel drops the
+locks when the process exits, so the cores of a crashed run are free again
+without any cleanup.
+"""
+
+import contextlib
+import fcntl
+import logging
+import os
+import tempfile
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_ENV_VARIABLE = "FIRECROWN_CORE_REGISTRY"
+THREAD_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+
+def available_cpus() -> List[int]:
+    """Return the CPUs this process may run on (its affinity mask, e.g. a batch job's cgroup)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def format_cpu_list(cpus: Sequence[int]) -> str:
+    """Format CPUs as a list of ranges, e.g. ``0-3,8,10-11``."""
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(lo) if lo == hi else f"{lo}-{hi}" for lo, hi in ranges)
+
+
+def pin_thread(cpus: Sequence[int]) -> bool:
+    """
+    Restrict the calling thread, and the processes and threads it starts, to ``cpus``.
+
+    Returns:
+        bool: False if the platform has no affinity control
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        logger.debug("CPU affinity is not supported on this platform")
+        return False
+    # On Linux pid 0 is the calling thread; children inherit its mask
+    os.sched_setaffinity(0, set(cpus))
+    return True
+
+
+class ResourceSpec:
+    """
+    CPU set, thread count and MPI binding of one stage.
+
+    Attributes:
+        cpus (list, optional): CPUs the stage may run on (Default: unrestricted)
+        threads (int, optional): OpenMP/BLAS threads per process (Default: one per CPU)
+        mpi_bind (str, optional): Open MPI binding policy, e.g. "core" (Default: none)
+    """
+
+    __slots__ = ("cpus", "threads", "mpi_bind")
+
+    def __init__(self, cpus: Optional[Sequence[int]] = None, threads: Optional[int] = None,
+                 mpi_bind: Optional[str] = None):
+        self.cpus = sorted(cpus) if cpus else None
+        self.threads = threads if threads is not None else (len(self.cpus) if self.cpus else None)
+        self.mpi_bind = mpi_bind
+
+    def environment(self, base: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """
+        Return the environment of the stage: ``base`` (Default: os.environ) with the thread and binding variables.
+        """
+        env = dict(os.environ if base is None else base)
+        if self.threads is not None:
+            for variable in THREAD_VARIABLES:
+                env[variable] = str(self.threads)
+        if self.cpus:
+            cpu_list = format_cpu_list(self.cpus)
+            env["OMPI_MCA_hwloc_base_cpu_set"] = cpu_list
+            env["I_MPI_PIN_PROCESSOR_LIST"] = cpu_list
+        if self.mpi_bind:
+            env["OMPI_MCA_hwloc_base_binding_policy"] = self.mpi_bind
+        return env
+
+    @contextlib.contextmanager
+    def pinned(self):
+        """
+        Pin the calling thread to the CPU set while processes are started, then restore its mask.
+
+        Only the calling thread is affected, so concurrent runs in one
+        process (sweeps, queue workers) can each start pinned stages.
+        """
+        if not self.cpus or not hasattr(os, "sched_getaffinity"):
+            yield
+            return
+        previous = os.sched_getaffinity(0)
+        pin_thread(self.cpus)
+        try:
+            yield
+        finally:
+            os.sched_setaffinity(0, previous)
+
+    def describe(self) -> dict:
+        """Return the spec as a dict for SUMMARY.YAML."""
+        return {
+            "cpus": format_cpu_list(self.cpus) if self.cpus else None,
+            "threads": self.threads,
+            "mpi_bind": self.mpi_bind,
+        }
+
+
+def default_registry() -> str:
+    """Node-local lock directory: $FIRECROWN_CORE_REGISTRY, else per user in /dev/shm or the temp directory."""
+    root = os.environ.get(REGISTRY_ENV_VARIABLE)
+    if root:
+        return root
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"firecrown-cores-{os.getuid()}")
+
+
+class CoreAllocation:
+    """
+    Cores held by one run until release() or process exit.
+
+    Attributes:
+        cpus (list): The allocated CPUs; empty if none could be allocated
+        registry (str): Lock directory the cores are registered in
+    """
+
+    def __init__(self, cpus: List[int], handles: List[int], registry: str):
+        self.cpus = cpus
+        self.registry = registry
+        self._handles = handles
+
+    def release(self) -> None:
+        """Free the cores for other runs."""
+        for handle in self._handles:
+            with contextlib.suppress(OSError):
+                os.close(handle)
+        self._handles = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def allocate_cores(count: int, registry: Optional[str] = None, cpus: Optional[Sequence[int]] = None) -> CoreAllocation:
+    """
+    Take ``count`` cores no concurrent run on this node holds.
+
+    Free cores are taken in order, so a run's cores are contiguous where the
+    registry allows. If fewer are free, the run gets those (and a warning);
+    if none are, it gets an empty allocation and runs unpinned.
+
+    Args:
+        count (int): Cores wanted
+        registry (str, optional): Lock directory (Default: default_registry())
+        cpus (sequence, optional): Candidate CPUs (Default: available_cpus())
+
+    Returns:
+        CoreAllocation: The held cores
+    """
+    registry = registry or default_registry()
+    os.makedirs(registry, exist_ok=True)
+    taken, handles = [], []
+    for cpu in cpus if cpus is not None else available_cpus():
+        if len(taken) == count:
+            break
+        handle = os.open(os.path.join(registry, f"cpu{cpu}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(handle)
+            continue
+        taken.append(cpu)
+        handles.append(handle)
+    if len(taken) < count:
+        logger.warning(f"Only {len(taken)} of {count} cores are free in {registry}"
+                       + ("" if taken else "; running unpinned"))
+    else:
+        logger.info(f"Allocated cores {format_cpu_list(taken)} from {registry}")
+    return CoreAllocation(taken, handles, registry)
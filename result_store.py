@@ -0,0 +1,308 @@
+"""
+Shared store of finished runs, keyed by input and toolchain fingerprint.
+
+A successful run is published under its result key (fingerprint.result_key):
+the ERROR_LOGS, COSMOSIS-CHAINS and PLOTS directories (or the
+STAGED_OUTPUTS.tar of a ``--stage-out tar`` run) and SUMMARY.YAML are
+copied into ``<store>/<key[:2]>/<key>/`` and the stored files are made
+read-only. A later run with the same key restores them into its ``--outdir``
+in seconds instead of running COSMOSIS again. Files are restored as
+writable copies, never hard links: the wrapper rewrites some outputs in place
+(INPUT.INFO, logs), which through a shared inode would change the stored
+entry, and mode bits do not stop root. The summary is always rewritten, with
+paths relocated to the new output directory.
+
+Entries are published atomically (assembled in a temporary directory and
+renamed into place), so concurrent jobs with the same key never see a partial
+entry. Eviction removes entries not used for ``max_age_days`` and then the
+least recently used ones until the store fits in ``max_bytes``. The limits
+are read from ``<store>/STORE.yaml``, applied after every publish, and can
+be given on the command line::
+
+    python result_store.py init /shared/firecrown_store --max-age-days 30 --max-size 500G
+    python result_store.py evict /shared/firecrown_store
+    python result_store.py list /shared/firecrown_store
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import stat
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import yaml
+
+from staging import TAR_NAME, relocate_paths
+
+logger = logging.getLogger(__name__)
+
+STORE_ENV_VARIABLE = "FIRECROWN_RESULT_STORE"
+OUTPUT_DIRECTORIES = ("ERROR_LOGS", "COSMOSIS-CHAINS", "PLOTS")
+# Top-level output files, e.g. the archive of a tar-staged run
+OUTPUT_FILES = (TAR_NAME,)
+SUMMARY_NAME = "SUMMARY.YAML"
+ENTRY_NAME = "ENTRY.yaml"
+CONFIG_NAME = "STORE.yaml"
+SIZE_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(text: str) -> int:
+    """Parse a byte count such as ``500G`` or ``1024``."""
+    text = str(text).strip().upper().rstrip("B")
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def _tree_bytes(path: str) -> int:
+    """Total size of the files below ``path``."""
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(path) for name in names)
+
+
+def _restore_file(source: str, destination: str) -> None:
+    """Copy the stored ``source`` to ``destination`` as a writable output."""
+    if os.path.lexists(destination):
+        os.remove(destination)
+    shutil.copy2(source, destination)
+    # A copy of a read-only store file should be writable like any output
+    os.chmod(destination, os.stat(destination).st_mode | stat.S_IWUSR)
+
+
+class ResultStore:
+    """
+    A directory of published run outputs.
+
+    Attributes:
+        root (str): Store directory
+        max_age_days (float, optional): Evict entries unused for longer
+        max_bytes (int, optional): Evict least recently used entries above this size
+    """
+
+    def __init__(self, root: str, max_age_days: Optional[float] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            root (str): Store directory, created if needed
+            max_age_days (float, optional): Age limit (Default: STORE.yaml, else none)
+            max_bytes (int, optional): Size limit (Default: STORE.yaml, else none)
+        """
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        config = self._read_config()
+        self.max_age_days = max_age_days if max_age_days is not None else config.get("max_age_days")
+        self.max_bytes = max_bytes if max_bytes is not None else config.get("max_bytes")
+
+    def _read_config(self) -> dict:
+        path = os.path.join(self.root, CONFIG_NAME)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as handle:
+            return yaml.safe_load(handle) or {}
+
+    def write_config(self) -> None:
+        """Save the eviction limits to STORE.yaml, for every user of the store."""
+        with open(os.path.join(self.root, CONFIG_NAME), "w") as handle:
+            yaml.safe_dump({"max_age_days": self.max_age_days, "max_bytes": self.max_bytes}, handle)
+
+    def entry_path(self, key: str) -> str:
+        """Directory of the entry with this key."""
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Return the entry directory of ``key``, or None if it is not stored."""
+        path = self.entry_path(key)
+        if not os.path.exists(os.path.join(path, ENTRY_NAME)):
+            return None
+        # The entry's modification time is its last use, for eviction
+        os.utime(os.path.join(path, ENTRY_NAME))
+        return path
+
+    def publish(self, key: str, outdir: str, summary_path: str, metadata: Optional[dict] = None) -> Optional[str]:
+        """
+        Store the outputs of a finished run under ``key``.
+
+        Args:
+            key (str): Result key of the run
+            outdir (str): Output directory holding ERROR_LOGS, COSMOSIS-CHAINS and PLOTS
+            summary_path (str): The run's SUMMARY.YAML
+            metadata (dict, optional): Extra information kept in ENTRY.yaml
+
+        Returns:
+            str or None: The entry directory, or None if the key was already stored
+        """
+        destination = self.entry_path(key)
+        if os.path.exists(destination):
+            return None
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        incoming = os.path.join(self.root, f".incoming-{uuid.uuid4().hex}")
+        try:
+            os.makedirs(incoming)
+            for name in OUTPUT_DIRECTORIES:
+                source = os.path.join(outdir, name)
+                if os.path.isdir(source):
+                    shutil.copytree(source, os.path.join(incoming, name))
+            for name in OUTPUT_FILES:
+                if os.path.isfile(os.path.join(outdir, name)):
+                    shutil.copy2(os.path.join(outdir, name), os.path.join(incoming, name))
+            shutil.copy2(summary_path, os.path.join(incoming, SUMMARY_NAME))
+            entry = {
+                "key": key,
+                "created": time.time(),
+                "outdir": os.path.abspath(outdir),
+                "bytes": _tree_bytes(incoming),
+            }
+            entry.update(metadata or {})
+            with open(os.path.join(incoming, ENTRY_NAME), "w") as handle:
+                yaml.safe_dump(entry, handle, sort_keys=False)
+            # Keep the entry from being edited in place
+            for directory, _, names in os.walk(incoming):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    os.chmod(path, os.stat(path).st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+            os.rename(incoming, destination)
+        except OSError:
+            shutil.rmtree(incoming, ignore_errors=True)
+            if os.path.exists(destination):
+                # Another job published the same key first
+                return None
+            raise
+        logger.info(f"Published {outdir} to the result store as {key}")
+        self.evict()
+        return destination
+
+    def restore(self, key: str, outdir: str, summary_path: str) -> Dict[str, object]:
+        """
+        Recreate the outputs of a stored run in ``outdir``.
+
+        Args:
+            key (str): Result key
+            outdir (str): Output directory to fill
+            summary_path (str): Where the relocated SUMMARY.YAML is written
+
+        Returns:
+            dict: The restored summary
+
+        Raises:
+            KeyError: If the key is not stored
+        """
+        entry_dir = self.lookup(key)
+        if entry_dir is None:
+            raise KeyError(f"No stored result for {key}")
+        with open(os.path.join(entry_dir, ENTRY_NAME)) as handle:
+            entry = yaml.safe_load(handle)
+        outdir = os.path.abspath(outdir)
+        for name in OUTPUT_DIRECTORIES:
+            for directory, _, names in os.walk(os.path.join(entry_dir, name)):
+                target_dir = os.path.join(outdir, os.path.relpath(directory, entry_dir))
+                os.makedirs(target_dir, exist_ok=True)
+                for file_name in names:
+                    _restore_file(os.path.join(directory, file_name), os.path.join(target_dir, file_name))
+        for name in OUTPUT_FILES:
+            if os.path.isfile(os.path.join(entry_dir, name)):
+                os.makedirs(outdir, exist_ok=True)
+                _restore_file(os.path.join(entry_dir, name), os.path.join(outdir, name))
+        with open(os.path.join(entry_dir, SUMMARY_NAME)) as handle:
+            state = yaml.safe_load(handle) or {}
+        state = relocate_paths(state, entry["outdir"], outdir)
+        state["RESULT_STORE"] = {"key": key, "hit": True, "stored": entry["created"], "source": entry["outdir"]}
+        os.makedirs(os.path.dirname(os.path.abspath(summary_path)), exist_ok=True)
+        tmp_path = f"{summary_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as handle:
+            yaml.dump(state, handle)
+        os.replace(tmp_path, summary_path)
+        logger.info(f"Restored stored result {key} into {outdir}")
+        return state
+
+    def entries(self) -> List[Dict[str, object]]:
+        """Return 'key', 'path', 'bytes', 'created' and 'last_used' of every entry."""
+        entries = []
+        for prefix in sorted(os.listdir(self.root)):
+            prefix_dir = os.path.join(self.root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for key in sorted(os.listdir(prefix_dir)):
+                entry_file = os.path.join(prefix_dir, key, ENTRY_NAME)
+                try:
+                    with open(entry_file) as handle:
+                        entry = yaml.safe_load(handle)
+                    last_used = os.path.getmtime(entry_file)
+                except OSError:
+                    continue
+                entries.append({
+                    "key": key,
+                    "path": os.path.join(prefix_dir, key),
+                    "bytes": entry.get("bytes", 0),
+                    "created": entry.get("created"),
+                    "last_used": last_used,
+                })
+        return entries
+
+    def remove(self, key: str) -> None:
+        """Delete an entry; it disappears from lookups before its files are removed."""
+        path = self.entry_path(key)
+        trash = os.path.join(self.root, f".evicted-{uuid.uuid4().hex}")
+        try:
+            os.rename(path, trash)
+        except FileNotFoundError:
+            return
+        for directory, _, _ in os.walk(trash):
+            os.chmod(directory, os.stat(directory).st_mode | stat.S_IWUSR)
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def evict(self, now: Optional[float] = None) -> List[str]:
+        """
+        Apply the age and size limits.
+
+        Returns:
+            list: Keys of the evicted entries
+        """
+        now = time.time() if now is None else now
+        entries = sorted(self.entries(), key=lambda entry: entry["last_used"])
+        evicted = []
+        if self.max_age_days is not None:
+            cutoff = now - self.max_age_days * 86400
+            for entry in [entry for entry in entries if entry["last_used"] < cutoff]:
+                self.remove(entry["key"])
+                evicted.append(entry["key"])
+                entries.remove(entry)
+        if self.max_bytes is not None:
+            total = sum(entry["bytes"] for entry in entries)
+            while entries and total > self.max_bytes:
+                entry = entries.pop(0)
+                self.remove(entry["key"])
+                evicted.append(entry["key"])
+                total -= entry["bytes"]
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} entries from the result store {self.root}")
+        return evicted
+
+
+def main(argv=None):
+    """Command-line entry point: ``init``, ``list`` and ``evict``."""
+    parser = argparse.ArgumentParser(description="Manage the Firecrown wrapper result store")
+    parser.add_argument("command", choices=["init", "list", "evict"])
+    parser.add_argument("store", help="Store directory")
+    parser.add_argument("--max-age-days", type=float, default=None, help="Evict entries unused for longer")
+    parser.add_argument("--max-size", default=None, help="Evict least recently used entries above this size (e.g. 500G)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    store = ResultStore(args.store, args.max_age_days,
+                        parse_size(args.max_size) if args.max_size is not None else None)
+    if args.command == "init":
+        store.write_config()
+    elif args.command == "list":
+        for entry in store.entries():
+            print(f"{entry['key']}  {entry['bytes'] / 2 ** 20:10.1f} MB  "
+                  f"last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used']))}")
+    else:
+        for key in store.evict():
+            print(f"evicted {key}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Importance reweighting of an existing chain for a modified HD or COV.
+
+Small changes to the Hubble diagram or covariance (a calibration offset,
+extra systematic terms) do not need a new COSMOSIS chain. Every sample of the
+existing chain is re-evaluated under the reference and the new SN likelihood,
+both with the same vectorized model (sn_cosmology.py), and the importance
+weights
+
+    w_new = w_old * exp(-(chi2_new - chi2_old) / 2)
+
+give posterior estimates for the new data. The Kish effective sample size
+tells whether the reweighting can be trusted: when the two posteriors barely
+overlap, a few samples carry all the weight and a full rerun is needed.
+"""
+
+import logging
+import os
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from chain_io import chain_weights, open_chain, parameter_columns, read_chain
+from param_stats import DEFAULT_PARAMETERS, summarize_samples
+from sacc_builder import load_covariance, load_hubble_diagram, validate_covariance
+from sn_cosmology import SNLikelihood
+
+logger = logging.getLogger(__name__)
+
+OMEGA_M_COLUMN = "cosmological_parameters--omega_m"
+W0_COLUMN = "cosmological_parameters--w"
+WA_COLUMN = "cosmological_parameters--wa"
+
+# Below this ESS / N the reweighted estimates are flagged as unreliable
+MIN_ESS_FRACTION = 0.1
+
+
+def load_sn_likelihood(hd_file: str, cov_file: str, add_stat_errors: bool = True) -> SNLikelihood:
+    """
+    Build an SNLikelihood from HD and COV files, as Stage 0 would.
+
+    Args:
+        hd_file (str): Hubble diagram file
+        cov_file (str): Covariance file (text, .npy or .bin)
+        add_stat_errors (bool): Add the HD errors to the covariance diagonal
+
+    Returns:
+        SNLikelihood: The likelihood with its Cholesky factor cached
+    """
+    z, mu, mu_err = load_hubble_diagram(hd_file)
+    cov = load_covariance(cov_file)
+    validate_covariance(cov, z.size)
+    cov = np.array(cov, dtype=float)
+    if add_stat_errors:
+        cov[np.diag_indices_from(cov)] += mu_err ** 2
+    return SNLikelihood(z, mu, cov)
+
+
+def chain_cosmology(names: Sequence[str], data: np.ndarray):
+    """
+    Return the (Omega_m, w0, wa) columns of a chain; fixed w0/wa default to -1/0.
+
+    Raises:
+        KeyError: If the chain does not sample Omega_m
+    """
+    if OMEGA_M_COLUMN not in names:
+        raise KeyError(f"Chain does not contain {OMEGA_M_COLUMN}")
+    n = data.shape[0]
+    omega_m = data[:, names.index(OMEGA_M_COLUMN)]
+    w0 = data[:, names.index(W0_COLUMN)] if W0_COLUMN in names else np.full(n, -1.0)
+    wa = data[:, names.index(WA_COLUMN)] if WA_COLUMN in names else np.zeros(n)
+    return omega_m, w0, wa
+
+
+def importance_weights(
+    reference: SNLikelihood,
+    new: SNLikelihood,
+    omega_m: np.ndarray,
+    w0: np.ndarray,
+    wa: np.ndarray,
+    prior_weights: Optional[np.ndarray] = None,
+    batch_size: int = 4096,
+) -> np.ndarray:
+    """
+    Importance weights of chain samples for a new SN likelihood.
+
+    Returns:
+        np.ndarray: Weights normalized to unit sum
+    """
+    delta_chi2 = (new.chi2_params(omega_m, w0, wa, batch_size)
+                  - reference.chi2_params(omega_m, w0, wa, batch_size))
+    log_weights = -0.5 * delta_chi2
+    if prior_weights is not None:
+        with np.errstate(divide="ignore"):
+            log_weights = log_weights + np.log(prior_weights)
+    weights = np.exp(log_weights - np.max(log_weights))
+    return weights / weights.sum()
+
+
+def effective_sample_size(weights: np.ndarray) -> float:
+    """Return the Kish effective sample size of a set of weights."""
+    return float(weights.sum() ** 2 / np.square(weights).sum())
+
+
+def write_weighted_chain(source_chain: str, destination: str, names, data: np.ndarray,
+                         weights: np.ndarray) -> str:
+    """
+    Write a chain with its ``weight`` column replaced by (or extended with) new weights.
+
+    The header metadata of the source chain is kept, so the result reads like
+    any weighted COSMOSIS chain.
+    """
+    names = list(names)
+    if "weight" in names:
+        data = data.copy()
+        data[:, names.index("weight")] = weights
+    else:
+        names.append("weight")
+        data = np.column_stack([data, weights])
+    with open_chain(source_chain) as handle:
+        comments = [line for line in handle if line.startswith("#")][1:]
+    tmp_path = f"{destination}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as handle:
+        handle.write("#" + "\t".join(names) + "\n")
+        handle.writelines(line for line in comments if not line.startswith("#n_eff"))
+        handle.write(f"## importance-reweighted from {source_chain}\n")
+        np.savetxt(handle, data, delimiter="\t", fmt="%.10g")
+    os.replace(tmp_path, destination)
+    return destination
+
+
+def write_covmat(destination: str, names, samples: np.ndarray, weights: np.ndarray) -> str:
+    """Write a weighted parameter covariance in the cosmosis-postprocess covmat.txt layout."""
+    cov = np.atleast_2d(np.cov(samples, rowvar=False, aweights=weights, ddof=0))
+    with open(destination, "w") as handle:
+        handle.write("#" + "\t".join(names) + "\n")
+        np.savetxt(handle, cov, delimiter="\t")
+    return destination
+
+
+def reweight_chain(
+    chain: str,
+    reference: SNLikelihood,
+    new: SNLikelihood,
+    output_chain: str,
+    covmat_file: str,
+    burn: int = 0,
+    parameters: Sequence[str] = DEFAULT_PARAMETERS,
+    min_ess_fraction: float = MIN_ESS_FRACTION,
+    batch_size: int = 4096,
+) -> Dict[str, object]:
+    """
+    Reweight a chain to a new SN likelihood and summarize the result.
+
+    Args:
+        chain (str): Existing COSMOSIS chain sampled with the reference data
+        reference (SNLikelihood): Likelihood of the data the chain was sampled with
+        new (SNLikelihood): Likelihood of the modified data
+        output_chain (str): Path of the reweighted chain
+        covmat_file (str): Path of the reweighted parameter covariance
+        burn (int): Number of leading rows to discard
+        parameters (sequence): Chain columns to summarize
+        min_ess_fraction (float): ESS / N below which a warning is raised
+        batch_size (int): Samples per vectorized likelihood batch
+
+    Returns:
+        dict: 'params' (ParameterSummary list), 'ess', 'ess_fraction',
+            'n_samples' and 'warning' (str or None)
+    """
+    names, data, _ = read_chain(chain)
+    data = data[burn:]
+    omega_m, w0, wa = chain_cosmology(names, data)
+    weights = importance_weights(reference, new, omega_m, w0, wa, chain_weights(names, data), batch_size)
+
+    ess = effective_sample_size(weights)
+    ess_fraction = ess / max(len(weights), 1)
+    warning = None
+    if ess_fraction < min_ess_fraction:
+        warning = (f"Importance reweighting unreliable: ESS {ess:.0f} of {len(weights)} samples "
+                   f"({ess_fraction:.1%} < {min_ess_fraction:.0%}); rerun the chain instead")
+        logger.warning(warning)
+
+    write_weighted_chain(chain, output_chain, names, data, weights)
+    columns = parameter_columns(names)
+    write_covmat(covmat_file, columns, data[:, [names.index(c) for c in columns]], weights)
+    params = summarize_samples(parameters, data[:, [names.index(p) for p in parameters]], weights)
+    logger.info(f"Reweighted {chain}: ESS {ess:.0f} / {len(weights)}")
+    return {
+        "params": params,
+        "ess": ess,
+        "ess_fraction": ess_fraction,
+        "n_samples": len(weights),
+        "warning": warning,
+    }
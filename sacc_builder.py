@@ -0,0 +1,302 @@
+"""
+In-process Stage 0: build the supernova SACC file from NumPy arrays.
+
+This replaces the ``generate_sn_data.py`` subprocess of the Firecrown examples
+for the wrapper's own use: the Hubble diagram and covariance are parsed once,
+validated, turned into a SACC object and written to any path. Besides the text
+covariance format of the Firecrown example (the dimension N followed by the
+N*N entries), covariances may be given as ``.npy`` files, which are memory
+mapped, or as raw little-endian float64 ``.bin`` files.
+
+Joint analyses pass several surveys, each with its own Hubble diagram and
+covariance, plus optional cross-covariance blocks between them (load_surveys).
+The data vectors are concatenated in survey order and the covariance is kept
+as a BlockCovariance (block_cov.py), which is validated by block Cholesky
+factorization without forming the full matrix.
+"""
+
+import logging
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from block_cov import BlockCovariance
+
+logger = logging.getLogger(__name__)
+
+SN_TRACER = "sn_ddf_sample"
+SN_DATA_TYPE = "supernova_distance_mu"
+
+# Accepted column names, in order of preference, for the Hubble diagram
+REDSHIFT_COLUMNS = ("zcmb", "zHD", "z", "zCMB")
+DISTANCE_COLUMNS = ("mb", "MU", "mu")
+ERROR_COLUMNS = ("dmb", "MUERR", "muerr", "MUERR_RENORM")
+
+
+def _find_column(table: pd.DataFrame, candidates, hd_file: str) -> str:
+    """Return the first candidate column present in the table."""
+    for name in candidates:
+        if name in table.columns:
+            return name
+    raise ValueError(f"None of the columns {candidates} found in Hubble diagram {hd_file}")
+
+
+def load_hubble_diagram(hd_file: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Load redshifts, distance moduli and their errors from a Hubble diagram.
+
+    Args:
+        hd_file (str): Path to the whitespace-separated HD file
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (z, mu, mu_err)
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        ValueError: If a required column is missing or values are not finite
+    """
+    table = pd.read_csv(hd_file, comment="#", sep=r"\s+")
+    z = table[_find_column(table, REDSHIFT_COLUMNS, hd_file)].to_numpy(dtype=float)
+    mu = table[_find_column(table, DISTANCE_COLUMNS, hd_file)].to_numpy(dtype=float)
+    mu_err = table[_find_column(table, ERROR_COLUMNS, hd_file)].to_numpy(dtype=float)
+    if not (np.isfinite(z).all() and np.isfinite(mu).all() and np.isfinite(mu_err).all()):
+        raise ValueError(f"Hubble diagram contains non-finite values: {hd_file}")
+    return z, mu, mu_err
+
+
+def _square_from_flat(values: np.ndarray, cov_file: str) -> np.ndarray:
+    """Reshape flat covariance entries, with or without a leading dimension."""
+    n = int(round(np.sqrt(values.size)))
+    if n * n == values.size:
+        return values.reshape(n, n)
+    n = int(values[0])
+    if values.size == n * n + 1:
+        return values[1:].reshape(n, n)
+    raise ValueError(f"Cannot interpret {values.size} values as a square covariance: {cov_file}")
+
+
+def load_covariance(cov_file: str, mmap: bool = True) -> np.ndarray:
+    """
+    Load a covariance matrix from text, ``.npy`` or raw float64 ``.bin`` input.
+
+    Args:
+        cov_file (str): Path to the covariance file
+        mmap (bool): Memory-map binary input instead of reading it
+
+    Returns:
+        np.ndarray: The (N, N) covariance, possibly a read-only memory map
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        ValueError: If the contents do not form a square matrix
+    """
+    suffix = os.path.splitext(cov_file)[1].lower()
+    if suffix == ".npy":
+        cov = np.load(cov_file, mmap_mode="r" if mmap else None)
+        if cov.ndim == 1:
+            cov = _square_from_flat(cov, cov_file)
+    elif suffix == ".bin":
+        if mmap:
+            values = np.memmap(cov_file, dtype="<f8", mode="r")
+        else:
+            values = np.fromfile(cov_file, dtype="<f8")
+        cov = _square_from_flat(values, cov_file)
+    else:
+        with open(cov_file, "r") as handle:
+            tokens = [tok for line in handle if not line.lstrip().startswith("#") for tok in line.split()]
+        cov = _square_from_flat(np.array(tokens, dtype=float), cov_file)
+    if cov.ndim != 2 or cov.shape[0] != cov.shape[1]:
+        raise ValueError(f"Covariance is not square: shape {cov.shape} in {cov_file}")
+    return cov
+
+
+def load_cross_covariance(cov_file: str, shape: Tuple[int, int], mmap: bool = True) -> np.ndarray:
+    """
+    Load a rectangular cross-covariance block between two surveys.
+
+    Text files hold the entries row by row, optionally preceded by the two
+    dimensions; ``.npy`` files hold the 2-D array; ``.bin`` files hold the
+    raw little-endian float64 entries.
+
+    Args:
+        cov_file (str): Path to the block file
+        shape (tuple): Expected (rows, columns)
+        mmap (bool): Memory-map binary input instead of reading it
+
+    Returns:
+        np.ndarray: The block
+
+    Raises:
+        ValueError: If the contents do not match ``shape``
+    """
+    suffix = os.path.splitext(cov_file)[1].lower()
+    if suffix == ".npy":
+        values = np.load(cov_file, mmap_mode="r" if mmap else None)
+    elif suffix == ".bin":
+        values = np.memmap(cov_file, dtype="<f8", mode="r") if mmap else np.fromfile(cov_file, dtype="<f8")
+    else:
+        with open(cov_file, "r") as handle:
+            values = np.array([tok for line in handle if not line.lstrip().startswith("#") for tok in line.split()],
+                              dtype=float)
+        if values.size == shape[0] * shape[1] + 2 and tuple(values[:2]) == tuple(shape):
+            values = values[2:]
+    if values.size != shape[0] * shape[1]:
+        raise ValueError(f"Cross-covariance {cov_file} has {values.size} entries, expected {shape[0]}x{shape[1]}")
+    return values.reshape(shape)
+
+
+def load_surveys(path: str, surveys: Sequence[Tuple[str, str]],
+                 cross_covariances: Sequence[Tuple[int, int, str]] = (),
+                 add_stat_errors: bool = True) -> Tuple[np.ndarray, np.ndarray, BlockCovariance]:
+    """
+    Load and validate the joint data vector and block covariance of several surveys.
+
+    Args:
+        path (str): Directory the file names are relative to
+        surveys (sequence): (HD file, COV file) of every survey, in data vector order
+        cross_covariances (sequence): (i, j, file) cross-covariance blocks between
+            surveys i and j (indices into ``surveys``), of shape (n_i, n_j)
+        add_stat_errors (bool): Add the HD errors in quadrature to the diagonal
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, BlockCovariance]: (z, mu, covariance)
+
+    Raises:
+        ValueError: If a file is malformed or the joint covariance is not positive definite
+    """
+    z_parts, mu_parts, err_parts, blocks = [], [], [], []
+    for hd, cov in surveys:
+        z, mu, mu_err = load_hubble_diagram(os.path.join(path, hd))
+        block = load_covariance(os.path.join(path, cov))
+        validate_covariance(block, z.size)
+        z_parts.append(z)
+        mu_parts.append(mu)
+        err_parts.append(mu_err)
+        blocks.append(block)
+    sizes = [z.size for z in z_parts]
+    cross = {}
+    for i, j, cov_file in cross_covariances:
+        i, j = int(i), int(j)
+        if not (0 <= i < len(sizes) and 0 <= j < len(sizes)) or i == j:
+            raise ValueError(f"Cross-covariance {cov_file} names surveys ({i}, {j}) of {len(sizes)}")
+        cross[(i, j)] = load_cross_covariance(os.path.join(path, cov_file), (sizes[i], sizes[j]))
+    covariance = BlockCovariance(blocks, cross)
+    if add_stat_errors:
+        covariance.add_to_diagonal(np.concatenate(err_parts) ** 2)
+    covariance.cholesky()  # raises LinAlgError (a ValueError) unless positive definite
+    return np.concatenate(z_parts), np.concatenate(mu_parts), covariance
+
+
+def validate_covariance(cov: np.ndarray, n: int) -> None:
+    """
+    Check that a covariance matches the data vector and is usable.
+
+    Args:
+        cov (np.ndarray): The covariance matrix
+        n (int): Length of the data vector
+
+    Raises:
+        ValueError: If the shape, symmetry, finiteness or diagonal is wrong
+    """
+    if cov.shape != (n, n):
+        raise ValueError(f"Covariance shape {cov.shape} does not match {n} Hubble diagram entries")
+    if not np.isfinite(cov).all():
+        raise ValueError("Covariance contains non-finite values")
+    if not np.allclose(cov, cov.T, rtol=1e-8, atol=1e-12):
+        raise ValueError("Covariance is not symmetric")
+    if (np.diagonal(cov) <= 0).any():
+        raise ValueError("Covariance has non-positive diagonal entries")
+
+
+def build_sacc(z: np.ndarray, mu: np.ndarray, cov: np.ndarray, metadata: Optional[dict] = None):
+    """
+    Build the SACC object Firecrown's supernova likelihood expects.
+
+    Args:
+        z (np.ndarray): Redshifts
+        mu (np.ndarray): Distance moduli (or apparent magnitudes)
+        cov (np.ndarray or BlockCovariance): Covariance of ``mu``; a
+            BlockCovariance without cross blocks is stored block by block
+        metadata (dict, optional): Extra SACC metadata entries
+
+    Returns:
+        sacc.Sacc: The SACC data set
+
+    Raises:
+        ImportError: If the ``sacc`` package is not installed
+    """
+    import sacc
+
+    data = sacc.Sacc()
+    data.add_tracer("misc", SN_TRACER)
+    for z_i, mu_i in zip(z, mu):
+        data.add_data_point(SN_DATA_TYPE, (SN_TRACER,), float(mu_i), z=float(z_i))
+    data.add_covariance(cov.sacc_covariance() if isinstance(cov, BlockCovariance) else np.asarray(cov))
+    for key, value in (metadata or {}).items():
+        data.metadata[key] = value
+    return data
+
+
+def write_sacc(data, destination: str) -> str:
+    """
+    Write a SACC object to ``destination`` through an atomic rename.
+
+    Returns:
+        str: The absolute destination path
+    """
+    destination = os.path.abspath(destination)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmp_path = f"{destination}.{os.getpid()}.tmp"
+    data.save_fits(tmp_path, overwrite=True)
+    os.replace(tmp_path, destination)
+    return destination
+
+
+def generate_sacc_inprocess(path: str, hd: str, cov: str, destination: str,
+                            add_stat_errors: bool = True, surveys: Optional[List[Tuple[str, str]]] = None,
+                            cross_covariances: Optional[List[Tuple[int, int, str]]] = None) -> str:
+    """
+    Run Stage 0 in-process: load, validate, build and write the SACC file.
+
+    Args:
+        path (str): Path to HD and COV files
+        hd (str): HD file name
+        cov (str): COV file name (text, .npy or .bin)
+        destination (str): Output SACC path
+        add_stat_errors (bool): Add the HD errors in quadrature to the
+            covariance diagonal, as the Firecrown example script does
+        surveys (list, optional): (HD, COV) file names of further surveys,
+            appended to the data vector after ``hd``
+        cross_covariances (list, optional): (i, j, file) cross-covariance
+            blocks; survey 0 is ``hd``/``cov``, 1... follow ``surveys``
+
+    Returns:
+        str: The absolute path of the written SACC file
+    """
+    if surveys or cross_covariances:
+        all_surveys = [(hd, cov)] + [tuple(survey) for survey in surveys or []]
+        z, mu, covariance = load_surveys(path, all_surveys, cross_covariances or [], add_stat_errors)
+        metadata = {"n_surveys": len(all_surveys)}
+        for i, (survey_hd, survey_cov) in enumerate(all_surveys):
+            metadata[f"hd_{i}"] = os.path.join(path, survey_hd)
+            metadata[f"cov_{i}"] = os.path.join(path, survey_cov)
+        destination = write_sacc(build_sacc(z, mu, covariance, metadata=metadata), destination)
+        logger.info(f"Wrote SACC file with {z.size} supernovae from {len(all_surveys)} surveys "
+                    f"({len(covariance.cross)} cross blocks, log det {covariance.logdet():.3f}) to {destination}")
+        return destination
+
+    hd_file = os.path.join(path, hd)
+    cov_file = os.path.join(path, cov)
+    z, mu, mu_err = load_hubble_diagram(hd_file)
+    covariance = load_covariance(cov_file)
+    validate_covariance(covariance, z.size)
+    if add_stat_errors:
+        covariance = np.array(covariance, dtype=float)
+        covariance[np.diag_indices_from(covariance)] += mu_err ** 2
+
+    data = build_sacc(z, mu, covariance, metadata={"hd": hd_file, "cov": cov_file})
+    destination = write_sacc(data, destination)
+    logger.info(f"Wrote SACC file with {z.size} supernovae to {destination}")
+    return destination
@@ -0,0 +1,194 @@
+"""
+Sampler-aware post-processing choices.
+
+The COSMOSIS sampler determines how a chain must be post-processed:
+
+- Metropolis-Hastings style chains ("mcmc") discard the first 15% of the rows;
+- ensemble samplers ("walkers", e.g. emcee) interleave one row per walker per
+  step; the burn-in is found per walker from the log-posterior traces, in one
+  vectorized pass, and whole steps are discarded;
+- nested and importance samplers ("weighted") write independent weighted
+  samples: nothing is discarded and the log-evidence from the chain header
+  is reported.
+
+The sampler is taken from the ``#sampler=`` line of the chain header, which
+COSMOSIS writes at the top of every chain, and otherwise from the ini file.
+"""
+
+import configparser
+import logging
+from typing import Dict, Optional
+
+import numpy as np
+
+from chain_io import open_chain, parse_header, read_chain, read_header
+from warm_worker import parse_overrides
+
+logger = logging.getLogger(__name__)
+
+MCMC = "mcmc"
+WALKERS = "walkers"
+WEIGHTED = "weighted"
+
+# Samplers whose output rows carry weights and need no burn-in
+WEIGHTED_SAMPLERS = ("multinest", "polychord", "nautilus", "dynesty", "importance", "pmc")
+# Ensemble samplers and the ini option holding their number of walkers
+WALKER_SAMPLERS = {"emcee": "walkers", "zeus": "walkers"}
+# A walker is burnt in once its log-posterior reaches the median of the last half of the run
+MAX_WALKER_BURN_FRACTION = 0.5
+
+
+class SamplerInfo:
+    """
+    The sampler that wrote a chain and the post-processing it needs.
+
+    Attributes:
+        name (str): COSMOSIS sampler name, or "" if unknown
+        kind (str): MCMC, WALKERS or WEIGHTED
+        walkers (int): Number of interleaved walkers (1 unless WALKERS)
+    """
+
+    __slots__ = ("name", "kind", "walkers")
+
+    def __init__(self, name: str = "", walkers: int = 1):
+        self.name = name
+        if name in WEIGHTED_SAMPLERS:
+            self.kind = WEIGHTED
+        elif name in WALKER_SAMPLERS and walkers > 1:
+            self.kind = WALKERS
+        else:
+            self.kind = MCMC
+        self.walkers = walkers if self.kind == WALKERS else 1
+
+    def __repr__(self):
+        return f"SamplerInfo({self.name!r}, kind={self.kind!r}, walkers={self.walkers})"
+
+
+def sampler_from_ini(ini_file: str, param_override: str = "") -> SamplerInfo:
+    """
+    Read the sampler and its number of walkers from an ini file.
+
+    Args:
+        ini_file (str): COSMOSIS ini file
+        param_override (str): ``-p`` overrides applied on top of the ini
+
+    Returns:
+        SamplerInfo: The sampler, or an unknown (MCMC) one if the ini cannot be read
+    """
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    name = ""
+    walkers = 1
+    try:
+        parser.read(ini_file)
+        overrides = parse_overrides(param_override)
+        name = overrides.get(("runtime", "sampler"), parser.get("runtime", "sampler", fallback="")).strip()
+        if name in WALKER_SAMPLERS:
+            option = WALKER_SAMPLERS[name]
+            walkers = int(overrides.get((name, option), parser.get(name, option)))
+    except (configparser.Error, ValueError) as e:
+        logger.debug(f"Cannot read the sampler from {ini_file}: {str(e)}")
+    return SamplerInfo(name, walkers)
+
+
+def chain_sampler_name(chain: str) -> Optional[str]:
+    """Return the ``#sampler=`` header value of a chain, reading only its leading comments."""
+    lines = []
+    with open_chain(chain) as handle:
+        for line in handle:
+            if not line.startswith("#"):
+                break
+            lines.append(line)
+    return parse_header(lines)[1].get("sampler")
+
+
+def detect_sampler(chain: str, ini_file: Optional[str] = None, param_override: str = "") -> SamplerInfo:
+    """
+    Identify the sampler of a finished chain: chain header first, ini file second.
+
+    The number of walkers always comes from the ini file, as COSMOSIS does not
+    write it into the ``#key=value`` header.
+
+    Args:
+        chain (str): Chain written by Stage 1
+        ini_file (str, optional): COSMOSIS ini file
+        param_override (str): ``-p`` overrides applied on top of the ini
+
+    Returns:
+        SamplerInfo: The detected sampler
+    """
+    from_ini = sampler_from_ini(ini_file, param_override) if ini_file else SamplerInfo()
+    try:
+        name = chain_sampler_name(chain)
+    except OSError:
+        name = None
+    if not name or name == from_ini.name:
+        return from_ini
+    logger.info(f"Chain {chain} was written by {name}, the ini names {from_ini.name or 'no sampler'}")
+    return SamplerInfo(name, from_ini.walkers if name in WALKER_SAMPLERS else 1)
+
+
+def walker_burn_in(log_post: np.ndarray, walkers: int, max_fraction: float = MAX_WALKER_BURN_FRACTION) -> int:
+    """
+    Burn-in of an ensemble chain, in rows (a whole number of steps).
+
+    Each walker is burnt in at the first step where its log-posterior reaches
+    the median log-posterior of all walkers over the last half of the run;
+    the slowest walker sets the burn-in of the ensemble.
+
+    Args:
+        log_post (np.ndarray): ``post`` column, rows interleaved walker by walker
+        walkers (int): Number of walkers
+        max_fraction (float): Upper limit of the burn-in as a fraction of the steps
+
+    Returns:
+        int: Rows to discard
+    """
+    n_steps = log_post.shape[0] // walkers
+    if n_steps < 2:
+        return 0
+    trace = log_post[:n_steps * walkers].reshape(n_steps, walkers)
+    target = np.median(trace[n_steps // 2:])
+    reached = trace >= target
+    first = np.where(reached.any(axis=0), reached.argmax(axis=0), n_steps)
+    burn_steps = min(int(first.max()), int(max_fraction * n_steps))
+    return burn_steps * walkers
+
+
+def chain_burn_in(chain: str, sampler: SamplerInfo) -> Optional[int]:
+    """
+    Sampler-specific burn-in in rows.
+
+    Args:
+        chain (str): Chain written by Stage 1
+        sampler (SamplerInfo): Its sampler
+
+    Returns:
+        int or None: 0 for weighted samplers, the walker burn-in for ensemble
+            samplers, None for MCMC chains (use burnin())
+    """
+    if sampler.kind == WEIGHTED:
+        return 0
+    if sampler.kind == WALKERS:
+        names, data, _ = read_chain(chain)
+        if "post" not in names:
+            raise ValueError(f"Chain {chain} has no post column for the walker burn-in")
+        return walker_burn_in(data[:, names.index("post")], sampler.walkers)
+    return None
+
+
+def log_evidence(chain: str) -> Dict[str, float]:
+    """
+    Return the log-evidence recorded by a nested sampler in the chain header.
+
+    Returns:
+        dict: 'LOGZ' and 'LOGZ_ERR' when present
+    """
+    _, metadata = read_header(chain)
+    evidence = {}
+    for key, summary_key in (("log_z", "LOGZ"), ("log_z_error", "LOGZ_ERR")):
+        if key in metadata:
+            try:
+                evidence[summary_key] = float(metadata[key])
+            except ValueError:
+                logger.warning(f"Unreadable {key} '{metadata[key]}' in {chain}")
+    return evidence
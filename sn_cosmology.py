@@ -0,0 +1,163 @@
+"""
+Vectorized supernova cosmology for in-process likelihood evaluations.
+
+Distance moduli are computed for a whole batch of (Omega_m, w0, wa) points at
+once in a flat w0waCDM cosmology, integrating 1/E(z) with a cumulative
+trapezoid rule on a shared redshift grid. The SN likelihood caches the
+Cholesky factor of the covariance and analytically marginalizes over the
+constant magnitude offset (absolute magnitude and H0 are degenerate with it),
+so evaluating a batch of models costs one matrix product. A joint
+multi-survey covariance (block_cov.BlockCovariance) is factorized and
+applied block by block instead.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from block_cov import BlockCovariance
+
+SPEED_OF_LIGHT_KM_S = 299792.458
+
+
+def _integration_grid(z: np.ndarray, n_grid: int) -> tuple:
+    """Return a sorted grid containing ``z`` and the positions of ``z`` on it."""
+    base = np.linspace(0.0, float(np.max(z)), n_grid)
+    grid, inverse = np.unique(np.concatenate([base, z]), return_inverse=True)
+    return grid, inverse[n_grid:]
+
+
+def luminosity_distance(z: np.ndarray, omega_m, w0, wa, h0: float = 70.0, n_grid: int = 1000) -> np.ndarray:
+    """
+    Luminosity distance in Mpc for a batch of flat w0waCDM cosmologies.
+
+    Args:
+        z (np.ndarray): (N,) redshifts
+        omega_m, w0, wa (array-like): Parameters, scalars or (B,) arrays
+        h0 (float): Hubble constant in km/s/Mpc
+        n_grid (int): Number of uniform integration nodes up to max(z)
+
+    Returns:
+        np.ndarray: (B, N) distances, or (N,) for scalar parameters
+    """
+    z = np.asarray(z, dtype=float)
+    scalar = np.ndim(omega_m) == 0 and np.ndim(w0) == 0 and np.ndim(wa) == 0
+    omega_m, w0, wa = (np.atleast_1d(np.asarray(p, dtype=float))[:, None] for p in (omega_m, w0, wa))
+
+    grid, positions = _integration_grid(z, n_grid)
+    a_factor = 1.0 + grid
+    # CPL dark energy density relative to today
+    de_density = a_factor ** (3.0 * (1.0 + w0 + wa)) * np.exp(-3.0 * wa * grid / a_factor)
+    e_z = np.sqrt(omega_m * a_factor ** 3 + (1.0 - omega_m) * de_density)
+    inv_e = 1.0 / e_z
+    steps = np.diff(grid)
+    comoving = np.concatenate(
+        [np.zeros((inv_e.shape[0], 1)), np.cumsum(0.5 * steps * (inv_e[:, 1:] + inv_e[:, :-1]), axis=1)],
+        axis=1,
+    )
+    distance = (1.0 + z) * comoving[:, positions] * SPEED_OF_LIGHT_KM_S / h0
+    return distance[0] if scalar else distance
+
+
+def distance_modulus(z: np.ndarray, omega_m, w0, wa, h0: float = 70.0, n_grid: int = 1000) -> np.ndarray:
+    """
+    Distance modulus for a batch of flat w0waCDM cosmologies.
+
+    Returns:
+        np.ndarray: (B, N) distance moduli, or (N,) for scalar parameters
+    """
+    return 5.0 * np.log10(luminosity_distance(z, omega_m, w0, wa, h0, n_grid)) + 25.0
+
+
+class SNLikelihood:
+    """
+    Gaussian SN likelihood with a cached Cholesky factor.
+
+    Attributes:
+        z (np.ndarray): Redshifts of the supernovae
+        mu (np.ndarray): Observed distance moduli
+        logdet (float): Log-determinant of the covariance
+    """
+
+    def __init__(self, z: np.ndarray, mu: np.ndarray, cov: np.ndarray):
+        """
+        Factorize the covariance once.
+
+        Args:
+            z (np.ndarray): (N,) redshifts
+            mu (np.ndarray): (N,) observed distance moduli
+            cov (np.ndarray or BlockCovariance): (N, N) covariance
+
+        Raises:
+            np.linalg.LinAlgError: If the covariance is not positive definite
+        """
+        self.z = np.asarray(z, dtype=float)
+        self.mu = np.asarray(mu, dtype=float)
+        if isinstance(cov, BlockCovariance):
+            self._blocks = cov
+            self.logdet = cov.logdet()
+            self._whiten = None
+        else:
+            self._blocks = None
+            chol = np.linalg.cholesky(np.asarray(cov, dtype=float))
+            self.logdet = 2.0 * float(np.sum(np.log(np.diag(chol))))
+            # Whitening operator L^-1, applied to whole batches as one matrix product
+            self._whiten = np.linalg.solve(chol, np.eye(chol.shape[0]))
+        self._ones_w = self.whiten(np.ones_like(self.mu))
+        self._ones_norm = float(self._ones_w @ self._ones_w)
+
+    def whiten(self, vectors: np.ndarray) -> np.ndarray:
+        """Apply L^-1 to each row of ``vectors``."""
+        if self._blocks is not None:
+            return self._blocks.whiten(vectors)
+        return vectors @ self._whiten.T
+
+    def chi2(self, mu_theory: np.ndarray, marginalize_offset: bool = True) -> np.ndarray:
+        """
+        Chi-square of a batch of model distance moduli.
+
+        Args:
+            mu_theory (np.ndarray): (B, N) or (N,) model distance moduli
+            marginalize_offset (bool): Analytically marginalize a constant offset
+
+        Returns:
+            np.ndarray: (B,) chi-square values, or a float for one model
+        """
+        residual_w = self.whiten(self.mu - np.atleast_2d(mu_theory))
+        chi2 = np.einsum("bi,bi->b", residual_w, residual_w)
+        if marginalize_offset:
+            chi2 = chi2 - (residual_w @ self._ones_w) ** 2 / self._ones_norm
+        return chi2[0] if np.ndim(mu_theory) == 1 else chi2
+
+    def fisher_matrix(self, derivatives: np.ndarray, marginalize_offset: bool = True) -> np.ndarray:
+        """
+        Fisher matrix of the parameters whose distance-modulus derivatives are given.
+
+        Args:
+            derivatives (np.ndarray): (P, N) derivatives of the model distance moduli
+            marginalize_offset (bool): Project out a constant magnitude offset
+
+        Returns:
+            np.ndarray: (P, P) Fisher matrix D C^-1 D^T
+        """
+        derivatives_w = self.whiten(np.atleast_2d(derivatives))
+        if marginalize_offset:
+            derivatives_w = derivatives_w - np.outer(derivatives_w @ self._ones_w, self._ones_w) / self._ones_norm
+        return derivatives_w @ derivatives_w.T
+
+    def chi2_params(self, omega_m, w0, wa, batch_size: Optional[int] = 4096) -> np.ndarray:
+        """
+        Chi-square for batches of (Omega_m, w0, wa), evaluated in chunks.
+
+        Returns:
+            np.ndarray: (B,) chi-square values
+        """
+        omega_m, w0, wa = (np.atleast_1d(np.asarray(p, dtype=float)) for p in (omega_m, w0, wa))
+        omega_m, w0, wa = np.broadcast_arrays(omega_m, w0, wa)
+        batch_size = batch_size or omega_m.size
+        result = np.empty(omega_m.size)
+        for start in range(0, omega_m.size, batch_size):
+            chunk = slice(start, start + batch_size)
+            mu_theory = distance_modulus(self.z, omega_m[chunk], w0[chunk], wa[chunk])
+            result[chunk] = self.chi2(np.atleast_2d(mu_theory))
+        return result
@@ -0,0 +1,234 @@
+"""
+Node-local scratch staging of a run (``--stage-dir``).
+
+Every stage writes into a private directory on node-local storage
+(``$TMPDIR`` or ``/dev/shm``): chains, logs, plots and the repeated
+SUMMARY.YAML rewrites never touch the shared filesystem while the run is in
+progress. At checkpoints and at the end the results are moved to
+``--outdir`` in one bulk transfer:
+
+- ``copy``: the run directory is copied into a hidden staging directory
+  inside ``--outdir`` and each top-level directory is then swapped into place
+  with a rename, so readers see either the old or the new tree;
+- ``tar``: the run directory is written as one uncompressed
+  ``STAGED_OUTPUTS.tar`` (a single file for the metadata servers) and
+  renamed into place.
+
+The summary is published last and is the only file written on the shared
+filesystem outside the bulk transfer. Its paths are rewritten from the
+scratch directory to ``--outdir`` (``copy``) or to member names of the
+archive, recorded as ``STAGING.archive`` (``tar``).
+"""
+
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import uuid
+from typing import Dict, Optional
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+STAGE_OUT_METHODS = ("copy", "tar")
+TAR_NAME = "STAGED_OUTPUTS.tar"
+SUMMARY_NAME = "SUMMARY.YAML"
+# Candidate node-local roots for --stage-dir auto, in order of preference
+SCRATCH_ROOT_VARIABLES = ("TMPDIR", "SLURM_TMPDIR")
+SHM_ROOT = "/dev/shm"
+
+
+def resolve_scratch_root(root: Optional[str] = None) -> str:
+    """
+    Choose the node-local directory that holds the run directories.
+
+    Args:
+        root (str, optional): Explicit directory, or None/"auto" to pick
+            ``$TMPDIR``, ``$SLURM_TMPDIR``, ``/dev/shm`` or the system default
+
+    Returns:
+        str: An existing, writable directory
+    """
+    if root and root != "auto":
+        os.makedirs(root, exist_ok=True)
+        return root
+    for variable in SCRATCH_ROOT_VARIABLES:
+        candidate = os.environ.get(variable)
+        if candidate and os.path.isdir(candidate) and os.access(candidate, os.W_OK):
+            return candidate
+    if os.path.isdir(SHM_ROOT) and os.access(SHM_ROOT, os.W_OK):
+        return SHM_ROOT
+    return tempfile.gettempdir()
+
+
+def relocate_paths(value, old: str, new: str):
+    """Rewrite paths under ``old`` to ``new`` in a nested summary structure."""
+    if isinstance(value, str):
+        return new + value[len(old):] if value.startswith(old) else value
+    if isinstance(value, dict):
+        return {key: relocate_paths(item, old, new) for key, item in value.items()}
+    if isinstance(value, list):
+        return [relocate_paths(item, old, new) for item in value]
+    return value
+
+
+def _tree_size(path: str):
+    """Return (number of files, total bytes) below ``path``."""
+    files = 0
+    size = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(directory, name))
+    return files, size
+
+
+class ScratchStage:
+    """
+    A run directory on node-local storage and its transfer to ``outdir``.
+
+    Attributes:
+        outdir (str): Final output directory on the shared filesystem
+        summary_path (str): Final SUMMARY.YAML path
+        method (str): "copy" or "tar"
+        run_dir (str): Scratch directory of the run, set by start()
+    """
+
+    def __init__(self, outdir: str, summary_path: str, root: Optional[str] = None,
+                 method: str = "copy", keep: bool = False):
+        """
+        Args:
+            outdir (str): Final output directory
+            summary_path (str): Final SUMMARY.YAML path
+            root (str, optional): Scratch root or "auto" (see resolve_scratch_root)
+            method (str): Bulk transfer method, "copy" or "tar"
+            keep (bool): Keep the scratch directory after finish()
+
+        Raises:
+            ValueError: If the method is unknown
+        """
+        if method not in STAGE_OUT_METHODS:
+            raise ValueError(f"Unknown stage-out method '{method}', expected one of {STAGE_OUT_METHODS}")
+        self.outdir = os.path.abspath(outdir)
+        self.summary_path = os.path.abspath(summary_path)
+        self.root = root
+        self.method = method
+        self.keep = keep
+        self.run_dir = None
+        self.transfers = []
+
+    @property
+    def scratch_summary(self) -> str:
+        """SUMMARY.YAML inside the scratch directory."""
+        return os.path.join(self.run_dir, SUMMARY_NAME)
+
+    def start(self) -> str:
+        """Create the scratch run directory and return its path."""
+        self.run_dir = tempfile.mkdtemp(prefix="firecrown_", dir=resolve_scratch_root(self.root))
+        logger.info(f"Staging run in {self.run_dir}, stage-out to {self.outdir} ({self.method})")
+        return self.run_dir
+
+    def _copy_out(self) -> None:
+        """Copy the run directory next to outdir's contents and swap it in by renames."""
+        token = uuid.uuid4().hex[:8]
+        incoming = os.path.join(self.outdir, f".stage-in-{token}")
+        shutil.copytree(self.run_dir, incoming, ignore=shutil.ignore_patterns(SUMMARY_NAME))
+        for name in os.listdir(incoming):
+            target = os.path.join(self.outdir, name)
+            retired = None
+            if os.path.isdir(target) and not os.path.islink(target):
+                retired = os.path.join(self.outdir, f".stage-old-{token}-{name}")
+                os.rename(target, retired)
+            os.replace(os.path.join(incoming, name), target)
+            if retired is not None:
+                shutil.rmtree(retired)
+        os.rmdir(incoming)
+
+    def _tar_out(self) -> None:
+        """Write the run directory as one tar file and rename it into outdir."""
+        destination = os.path.join(self.outdir, TAR_NAME)
+        tmp_path = f"{destination}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with tarfile.open(tmp_path, "w") as archive:
+                for name in sorted(os.listdir(self.run_dir)):
+                    if name != SUMMARY_NAME:
+                        archive.add(os.path.join(self.run_dir, name), arcname=name)
+            os.replace(tmp_path, destination)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def stage_out(self, label: str = "final") -> Dict[str, object]:
+        """
+        Transfer the current contents of the run directory to outdir.
+
+        Args:
+            label (str): Checkpoint name recorded with the transfer
+
+        Returns:
+            dict: 'label', 'method', 'files', 'bytes' and 'seconds'
+        """
+        start = time.time()
+        os.makedirs(self.outdir, exist_ok=True)
+        if self.method == "tar":
+            self._tar_out()
+        else:
+            self._copy_out()
+        files, size = _tree_size(self.run_dir)
+        record = {
+            "label": label,
+            "method": self.method,
+            "files": files,
+            "bytes": size,
+            "seconds": round(time.time() - start, 2),
+        }
+        self.transfers.append(record)
+        logger.info(f"Staged out {files} files ({size} bytes) to {self.outdir} at {label}")
+        return record
+
+    def publish_summary(self) -> Optional[str]:
+        """
+        Publish the scratch summary to the final path, with paths relocated.
+
+        With ``tar`` the files exist only inside the archive, so their paths
+        become member names (relative to the run directory) instead.
+
+        Returns:
+            str or None: The published path, or None if there is no summary yet
+        """
+        if not os.path.exists(self.scratch_summary):
+            return None
+        with open(self.scratch_summary, "r", encoding="utf-8") as handle:
+            state = yaml.safe_load(handle) or {}
+        staging = {"scratch": self.run_dir, "transfers": self.transfers}
+        if self.method == "tar":
+            state = relocate_paths(state, self.run_dir + os.sep, "")
+            staging["archive"] = os.path.join(self.outdir, TAR_NAME)
+        else:
+            state = relocate_paths(state, self.run_dir, self.outdir)
+        state["STAGING"] = staging
+        os.makedirs(os.path.dirname(self.summary_path), exist_ok=True)
+        tmp_path = f"{self.summary_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            yaml.dump(state, handle)
+        os.replace(tmp_path, self.summary_path)
+        return self.summary_path
+
+    def finish(self) -> None:
+        """
+        Stage out, publish the summary and remove the scratch directory.
+
+        If the transfer fails the scratch directory is kept, so nothing is lost.
+        """
+        try:
+            self.stage_out("final")
+            self.publish_summary()
+        except Exception:
+            logger.error(f"Stage-out to {self.outdir} failed; results kept in {self.run_dir}")
+            raise
+        if not self.keep:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
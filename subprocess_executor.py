@@ -4,16 +4,231 @@ Subprocess orchestration and execution utilities for Firecrown wrapper.
 This module provides a clean abstraction for managing subprocess execution,
 logging, and error handling. It decouples subprocess management from the
 main pipeline logic.
+
+A TimeoutPolicy with a Heartbeat (files the stage is expected to grow or
+create) replaces the fixed timeout: the stage is killed when it stops making
+progress, not when a clock runs out, and the attempt records why.
+
+A ResourceSpec (resources.py) confines a command to a CPU set and sizes its
+OpenMP/BLAS thread pools, so runs sharing a node do not oversubscribe it.
 """
 
+import contextlib
+import os
+import re
+import signal
 import subprocess
 import logging
-from typing import Optional, Tuple
+import time
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
 
+class RetryPolicy:
+    """
+    Describes when and how often a failed subprocess should be retried.
+
+    A failure is only retried if it is classified as transient: either the
+    return code is listed in ``transient_returncodes`` or the captured stderr
+    matches one of ``transient_patterns``. Timeouts are retried only if
+    ``retry_on_timeout`` is set.
+
+    Attributes:
+        max_attempts (int): Total number of attempts, including the first one
+        backoff_initial (float): Delay in seconds before the first retry
+        backoff_factor (float): Multiplier applied to the delay after each retry
+        backoff_max (float): Upper bound on the delay between attempts
+        transient_returncodes (tuple): Return codes that count as transient
+        transient_patterns (list): Compiled regexes matched against stderr
+        retry_on_timeout (bool): Whether a timeout counts as transient
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 1,
+        backoff_initial: float = 10.0,
+        backoff_factor: float = 2.0,
+        backoff_max: float = 600.0,
+        transient_returncodes: Iterable[int] = (),
+        transient_patterns: Iterable[str] = (),
+        retry_on_timeout: bool = False,
+    ):
+        if max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1, got {max_attempts}")
+        self.max_attempts = max_attempts
+        self.backoff_initial = backoff_initial
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.transient_returncodes = tuple(transient_returncodes)
+        self.transient_patterns = [re.compile(p) for p in transient_patterns]
+        self.retry_on_timeout = retry_on_timeout
+
+    def delay(self, attempt: int) -> float:
+        """
+        Return the backoff delay in seconds after the given (1-based) attempt.
+        """
+        delay = self.backoff_initial * self.backoff_factor ** (attempt - 1)
+        return min(delay, self.backoff_max)
+
+    def is_transient(self, returncode: int, stderr_text: str = "") -> bool:
+        """
+        Classify a failed attempt as transient (worth retrying) or fatal.
+
+        Args:
+            returncode (int): Return code of the failed attempt
+            stderr_text (str): Captured stderr of the failed attempt
+
+        Returns:
+            bool: True if the failure should be retried
+        """
+        if returncode in self.transient_returncodes:
+            return True
+        return any(p.search(stderr_text) for p in self.transient_patterns)
+
+
+class TimeoutPolicy:
+    """
+    Describes when a running subprocess counts as hung and is killed.
+
+    A stage is killed when its heartbeat (see Heartbeat) shows no progress for
+    ``stall_seconds``. Once it runs longer than ``wall_seconds`` it is only
+    given ``overrun_stall_seconds`` without progress. A stage without a
+    heartbeat is killed at ``wall_seconds``. A limit of None is never applied.
+
+    Attributes:
+        wall_seconds (float, optional): Expected upper bound on the runtime
+        stall_seconds (float, optional): Longest time without progress
+        overrun_stall_seconds (float): Longest time without progress past wall_seconds
+        poll_interval (float): Seconds between heartbeat checks
+        source (str): Where wall_seconds comes from, e.g. "default" or "history"
+    """
+
+    def __init__(
+        self,
+        wall_seconds: Optional[float] = None,
+        stall_seconds: Optional[float] = None,
+        overrun_stall_seconds: float = 120.0,
+        poll_interval: float = 5.0,
+        source: str = "default",
+    ):
+        self.wall_seconds = wall_seconds
+        self.stall_seconds = stall_seconds
+        self.overrun_stall_seconds = overrun_stall_seconds
+        self.poll_interval = poll_interval
+        self.source = source
+
+    def kill_reason(self, elapsed: float, silent: float, watched: bool = True) -> Optional[str]:
+        """
+        Decide whether a running stage should be killed.
+
+        Args:
+            elapsed (float): Seconds since the stage started
+            silent (float): Seconds since the heartbeat last showed progress
+            watched (bool): The stage has a heartbeat
+
+        Returns:
+            str or None: "stalled", "stalled_past_wall_limit" or "wall_limit", or None to keep it running
+        """
+        past_wall = self.wall_seconds is not None and elapsed >= self.wall_seconds
+        if not watched:
+            return "wall_limit" if past_wall else None
+        if self.stall_seconds is not None and silent >= self.stall_seconds:
+            return "stalled"
+        if past_wall and silent >= self.overrun_stall_seconds:
+            return "stalled_past_wall_limit"
+        return None
+
+    def describe(self) -> dict:
+        """Return the limits as a dict for SUMMARY.YAML."""
+        return {
+            "wall_seconds": self.wall_seconds,
+            "stall_seconds": self.stall_seconds,
+            "overrun_stall_seconds": self.overrun_stall_seconds,
+            "source": self.source,
+        }
+
+
+class Heartbeat:
+    """
+    Liveness signal of a running stage: files growing or appearing.
+
+    Each watched path is a file (its size and modification time count) or a
+    directory (the names, sizes and modification times of its entries count).
+    Paths may not exist yet; their appearance is progress.
+
+    Attributes:
+        paths (list): Watched files and directories
+    """
+
+    def __init__(self, paths: Sequence[str]):
+        self.paths = list(paths)
+        self._last = None
+
+    def _state(self, path: str):
+        try:
+            if os.path.isdir(path):
+                return tuple(sorted(
+                    (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in os.scandir(path)
+                ))
+            status = os.stat(path)
+            return status.st_size, status.st_mtime_ns
+        except OSError:
+            return None
+
+    def beat(self) -> bool:
+        """Return True if any watched path changed since the previous call."""
+        state = tuple(self._state(path) for path in self.paths)
+        changed = state != self._last
+        self._last = state
+        return changed
+
+
+class StageKilled(subprocess.TimeoutExpired):
+    """
+    A subprocess killed by its TimeoutPolicy.
+
+    Attributes:
+        details (dict): 'reason', 'elapsed_seconds', 'silent_seconds' and the policy limits
+    """
+
+    def __init__(self, cmd, timeout, details):
+        super().__init__(cmd, timeout)
+        self.details = details
+
+
+def _terminate(process: subprocess.Popen, grace: float = 10.0) -> None:
+    """Terminate a process and its children (its own session), then kill them if they linger."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return
+        try:
+            process.wait(timeout=grace)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def _pinning(resources):
+    """Context pinning the calling thread to the CPU set of a ResourceSpec, if any."""
+    return resources.pinned() if resources is not None else contextlib.nullcontext()
+
+
+def _read_tail(path: str, max_bytes: int = 65536) -> str:
+    """Return the last ``max_bytes`` of a text file, or '' if unreadable."""
+    try:
+        with open(path, "rb") as handle:
+            handle.seek(0, os.SEEK_END)
+            size = handle.tell()
+            handle.seek(max(0, size - max_bytes))
+            return handle.read().decode("utf-8", errors="replace")
+    except OSError:
+        return ""
+
+
 class SubprocessExecutor:
     """
     Manages subprocess execution with consistent error handling and logging.
@@ -22,14 +237,16 @@ class SubprocessExecutor:
         default_timeout (int): Default timeout in seconds for all subprocess calls
     """
     
-    def __init__(self, default_timeout: int = 3600):
+    def __init__(self, default_timeout: int = 3600, sleep: Callable[[float], None] = time.sleep):
         """
         Initialize the subprocess executor.
         
         Args:
             default_timeout (int): Default timeout in seconds (default: 1 hour)
+            sleep (callable, optional): Function used to wait between retries
         """
         self.default_timeout = default_timeout
+        self._sleep = sleep
     
     def run(
         self,
@@ -37,7 +254,12 @@ class SubprocessExecutor:
         output_file: str,
         error_file: str,
         timeout: Optional[int] = None,
-        description: str = ""
+        description: str = "",
+        monitor=None,
+        cwd: Optional[str] = None,
+        timeout_policy: Optional[TimeoutPolicy] = None,
+        heartbeat: Optional[Heartbeat] = None,
+        resources=None
     ) -> int:
         """
         Execute a command in a subprocess with captured output.
@@ -48,41 +270,71 @@ class SubprocessExecutor:
             error_file (str): Path to file for stderr
             timeout (int, optional): Override default timeout in seconds
             description (str, optional): Human-readable description of the command
+            monitor (optional): Object with start() and stop(), e.g. a
+                telemetry.ChainTelemetry, running while the command runs
+            cwd (str, optional): Working directory of the command
+            timeout_policy (TimeoutPolicy, optional): Kill the command when it
+                stops making progress instead of after ``timeout``
+            heartbeat (Heartbeat, optional): Progress signal for ``timeout_policy``
+            resources (ResourceSpec, optional): CPU set, thread counts and MPI
+                binding of the command (Default: inherited from this process)
             
         Returns:
             int: The return code from the subprocess
             
         Raises:
-            subprocess.TimeoutExpired: If command exceeds timeout
-            RuntimeError: If subprocess execution fails
+            RuntimeError: If the command times out, is killed by its timeout
+                policy (caused by StageKilled) or cannot be executed
         """
         timeout = timeout or self.default_timeout
         cmd_desc = description or command[:80]
+        if monitor is not None:
+            monitor.start()
         
         try:
             logger.info(f"Starting subprocess: {cmd_desc}")
             logger.debug(f"Full command: {command}")
             
+            env = resources.environment() if resources is not None else None
             with open(output_file, "w") as out_f, open(error_file, "w") as err_f:
-                process = subprocess.run(
-                    command,
-                    shell=True,
-                    stdout=out_f,
-                    stderr=err_f,
-                    timeout=timeout,
-                    text=True
-                )
+                if timeout_policy is None:
+                    # Children inherit the CPU set of the thread that starts them
+                    with _pinning(resources):
+                        returncode = subprocess.run(
+                            command,
+                            shell=True,
+                            stdout=out_f,
+                            stderr=err_f,
+                            timeout=timeout,
+                            text=True,
+                            cwd=cwd,
+                            env=env
+                        ).returncode
+                else:
+                    returncode = self._run_watched(
+                        command, out_f, err_f, cwd, timeout_policy, heartbeat, env, resources
+                    )
             
-            if process.returncode == 0:
+            if returncode == 0:
                 logger.info(f"Subprocess completed successfully: {cmd_desc}")
             else:
                 logger.warning(
-                    f"Subprocess exited with code {process.returncode}: {cmd_desc}\n"
+                    f"Subprocess exited with code {returncode}: {cmd_desc}\n"
                     f"  stdout: {output_file}\n"
                     f"  stderr: {error_file}"
                 )
             
-            return process.returncode
+            return returncode
+            
+        except StageKilled as e:
+            logger.error(
+                f"Subprocess killed ({e.details['reason']}) after {e.details['elapsed_seconds']}s, "
+                f"{e.details['silent_seconds']}s without progress: {cmd_desc}\n"
+                f"  Command: {command}"
+            )
+            raise RuntimeError(
+                f"Subprocess killed ({e.details['reason']}) after {e.details['elapsed_seconds']}s: {cmd_desc}"
+            ) from e
             
         except subprocess.TimeoutExpired as e:
             logger.error(
@@ -101,6 +353,150 @@ class SubprocessExecutor:
             raise RuntimeError(
                 f"Subprocess execution failed: {str(e)}"
             ) from e
+        
+        finally:
+            if monitor is not None:
+                monitor.stop()
+    
+    def _run_watched(self, command, out_f, err_f, cwd, policy, heartbeat, env=None, resources=None) -> int:
+        """
+        Run a command until it exits or its TimeoutPolicy kills it.
+        
+        The command runs in its own session so that killing it also kills
+        the processes it started (e.g. mpirun and its ranks).
+        
+        Raises:
+            StageKilled: If the policy killed the command
+        """
+        with _pinning(resources):
+            process = subprocess.Popen(
+                command, shell=True, stdout=out_f, stderr=err_f, text=True, cwd=cwd, env=env,
+                start_new_session=True
+            )
+        start = last_progress = time.monotonic()
+        if heartbeat is not None:
+            heartbeat.beat()
+        try:
+            while True:
+                try:
+                    return process.wait(timeout=policy.poll_interval)
+                except subprocess.TimeoutExpired:
+                    pass
+                now = time.monotonic()
+                if heartbeat is not None and heartbeat.beat():
+                    last_progress = now
+                reason = policy.kill_reason(now - start, now - last_progress, watched=heartbeat is not None)
+                if reason is not None:
+                    details = dict(policy.describe(), reason=reason, elapsed_seconds=round(now - start, 1),
+                                   silent_seconds=round(now - last_progress, 1))
+                    _terminate(process)
+                    raise StageKilled(command, now - start, details)
+        except BaseException:
+            if process.poll() is None:
+                _terminate(process)
+            raise
+    
+    def run_with_retry(
+        self,
+        command: str,
+        output_file: str,
+        error_file: str,
+        retry_policy: Optional[RetryPolicy] = None,
+        retry_command: Optional[Callable[[int], str]] = None,
+        timeout: Optional[int] = None,
+        description: str = "",
+        monitor=None,
+        cwd: Optional[str] = None,
+        timeout_policy: Optional[TimeoutPolicy] = None,
+        heartbeat: Optional[Heartbeat] = None,
+        resources=None
+    ) -> Tuple[int, List[dict]]:
+        """
+        Execute a command, retrying transient failures according to a policy.
+        
+        The logs of every failed attempt are kept next to the final ones with
+        an ``.attempt<N>`` suffix, so the regular output and error files always
+        belong to the last attempt.
+        
+        Args:
+            command (str): The shell command for the first attempt
+            output_file (str): Path to file for stdout
+            error_file (str): Path to file for stderr
+            retry_policy (RetryPolicy, optional): Policy to apply (default: no retries)
+            retry_command (callable, optional): Called with the attempt number
+                (2, 3, ...) to build the command for a retry; defaults to ``command``
+            timeout (int, optional): Override default timeout in seconds
+            description (str, optional): Human-readable description of the command
+            monitor (optional): Passed to run() for every attempt
+            cwd (str, optional): Working directory of the command
+            timeout_policy (TimeoutPolicy, optional): Passed to run() for every attempt
+            heartbeat (Heartbeat, optional): Passed to run() for every attempt
+            resources (ResourceSpec, optional): Passed to run() for every attempt
+            
+        Returns:
+            Tuple[int, List[dict]]: The final return code and one record per
+                attempt with 'attempt', 'returncode', 'seconds', 'transient'
+                and, for timeouts, 'error' (and 'killed', the StageKilled
+                details, if the timeout policy killed it)
+            
+        Raises:
+            RuntimeError: If the last attempt times out or cannot be executed
+        """
+        policy = retry_policy or RetryPolicy()
+        cmd_desc = description or command[:80]
+        attempts = []
+        
+        for attempt in range(1, policy.max_attempts + 1):
+            attempt_command = command
+            if attempt > 1 and retry_command is not None:
+                attempt_command = retry_command(attempt)
+            
+            record = {'attempt': attempt, 'returncode': None, 'transient': False}
+            start = time.time()
+            try:
+                returncode = self.run(
+                    attempt_command,
+                    output_file,
+                    error_file,
+                    timeout=timeout,
+                    description=description,
+                    monitor=monitor,
+                    cwd=cwd,
+                    timeout_policy=timeout_policy,
+                    heartbeat=heartbeat,
+                    resources=resources
+                )
+            except RuntimeError as e:
+                record['seconds'] = round(time.time() - start, 2)
+                record['error'] = str(e)
+                if isinstance(e.__cause__, StageKilled):
+                    record['killed'] = e.__cause__.details
+                timed_out = isinstance(e.__cause__, subprocess.TimeoutExpired)
+                record['transient'] = timed_out and policy.retry_on_timeout
+                attempts.append(record)
+                if not record['transient'] or attempt == policy.max_attempts:
+                    e.attempts = attempts
+                    raise
+            else:
+                record['seconds'] = round(time.time() - start, 2)
+                record['returncode'] = returncode
+                if returncode != 0:
+                    record['transient'] = policy.is_transient(returncode, _read_tail(error_file))
+                attempts.append(record)
+                if returncode == 0 or not record['transient'] or attempt == policy.max_attempts:
+                    return returncode, attempts
+            
+            for path in (output_file, error_file):
+                if os.path.exists(path):
+                    os.replace(path, f"{path}.attempt{attempt}")
+            delay = policy.delay(attempt)
+            logger.warning(
+                f"Transient failure on attempt {attempt}/{policy.max_attempts}: {cmd_desc}; "
+                f"retrying in {delay:.1f}s"
+            )
+            self._sleep(delay)
+        
+        return returncode, attempts
     
     def run_pipeline(
         self,
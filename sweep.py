@@ -0,0 +1,258 @@
+"""
+Parameter-sweep expansion for the Firecrown wrapper.
+
+A sweep specification expands into one wrapper job per override set (and per
+ini variant). Stage 0 runs once and every job reuses the resulting SACC file;
+Stages 1-3 of the jobs then run in parallel, bounded by a core budget, and the
+per-job SUMMARY.YAML files are gathered into one results table. Every job
+runs with ``--cpus cores_per_job`` and so on its own cores (resources.py).
+
+Example specification (YAML)::
+
+    grid:
+      pipeline.values: [values_lcdm.ini, values_w0wa.ini]
+      metropolis.samples: [20000, 50000]
+    ini: [sn_only.ini, sn_only_wide.ini]
+    cores_per_job: 4
+
+Instead of ``grid`` a ``list`` of override mappings may be given, one entry
+per job. Override keys use the COSMOSIS ``section.option`` syntax of ``-p``
+and so address options of the ini file. Parameters of the values file (such
+as ``cosmological_parameters.w``) are not changed by ``-p``; sweep over
+values files through ``pipeline.values`` instead.
+"""
+
+import itertools
+import logging
+import os
+import shlex
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import pandas as pd
+import yaml
+
+logger = logging.getLogger(__name__)
+
+RESULT_KEYS = [
+    "ABORT_IF_ZERO",
+    "STAGE3",
+    "FoM",
+    "w0",
+    "w0sig_marg",
+    "wa",
+    "wasig_marg",
+    "OM",
+    "OMsig_marg",
+]
+
+
+class SweepJob:
+    """
+    One expanded job of a parameter sweep.
+
+    Attributes:
+        label (str): Unique job label, also the name of its output directory
+        ini (str): COSMOSIS ini file for the job
+        overrides (dict): COSMOSIS ``section.option`` overrides for the job
+    """
+
+    def __init__(self, label: str, ini: str, overrides: Dict[str, object]):
+        self.label = label
+        self.ini = ini
+        self.overrides = overrides
+
+    def param_string(self, base_param: str = "") -> str:
+        """
+        Return the ``-p`` override string for this job.
+
+        Args:
+            base_param (str): Overrides shared by every job (the ``--param`` value)
+        """
+        return " ".join(filter(None, [base_param.strip(), format_overrides(self.overrides)]))
+
+
+def format_overrides(overrides: Dict[str, object]) -> str:
+    """Format an override mapping as space-separated ``section.option=value`` items."""
+    return " ".join(f"{key}={value}" for key, value in overrides.items())
+
+
+def load_sweep_spec(spec_file: str) -> dict:
+    """
+    Load and validate a sweep specification file.
+
+    Args:
+        spec_file (str): Path to the YAML specification
+
+    Returns:
+        dict: The parsed specification
+
+    Raises:
+        ValueError: If the specification is malformed
+    """
+    with open(spec_file, "r", encoding="utf-8") as handle:
+        spec = yaml.safe_load(handle) or {}
+    if not isinstance(spec, dict):
+        raise ValueError(f"Sweep specification must be a mapping: {spec_file}")
+    if "grid" in spec and "list" in spec:
+        raise ValueError("Sweep specification takes either 'grid' or 'list', not both")
+    if "grid" in spec and not isinstance(spec["grid"], dict):
+        raise ValueError("Sweep 'grid' must map override keys to lists of values")
+    if "list" in spec and not isinstance(spec["list"], list):
+        raise ValueError("Sweep 'list' must be a list of override mappings")
+    return spec
+
+
+def expand_sweep(spec: dict, default_ini: str) -> List[SweepJob]:
+    """
+    Expand a sweep specification into jobs.
+
+    Args:
+        spec (dict): Parsed sweep specification
+        default_ini (str): Ini file used when the specification lists none
+
+    Returns:
+        list: SweepJob objects, ini variants outermost
+    """
+    if "grid" in spec:
+        keys = list(spec["grid"])
+        values = [v if isinstance(v, list) else [v] for v in spec["grid"].values()]
+        override_sets = [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+    else:
+        override_sets = [dict(entry or {}) for entry in spec.get("list", [{}])]
+
+    inis = spec.get("ini") or [default_ini]
+    if isinstance(inis, str):
+        inis = [inis]
+
+    jobs = []
+    for ini, overrides in itertools.product(inis, override_sets):
+        jobs.append(SweepJob(f"job_{len(jobs):04d}", ini, overrides))
+    return jobs
+
+
+def wrapper_command() -> List[str]:
+    """Return the argv prefix that launches the wrapper (script or frozen executable)."""
+    if getattr(sys, "frozen", False):
+        return [sys.executable]
+    return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Firecrown_wrapper.py")]
+
+
+def job_command(job: SweepJob, path: str, hd: str, cov: str, job_dir: str, sacc_file: str,
+                base_param: str = "", extra_args: Optional[List[str]] = None) -> str:
+    """Build the shell command running Stages 1-3 of one sweep job."""
+    argv = wrapper_command() + [
+        path, hd, cov, job.ini,
+        "-O", job_dir,
+        "-s", os.path.join(job_dir, "SUMMARY.YAML"),
+        "--sacc", sacc_file,
+    ]
+    argv += list(extra_args or [])
+    param = job.param_string(base_param)
+    if param:
+        argv += ["-p", param]
+    return " ".join(shlex.quote(str(a)) for a in argv)
+
+
+def collect_results(jobs: List[SweepJob], sweep_dir: str) -> pd.DataFrame:
+    """
+    Gather the SUMMARY.YAML of every job into one table.
+
+    Args:
+        jobs (list): The sweep jobs
+        sweep_dir (str): Directory holding one subdirectory per job
+
+    Returns:
+        pd.DataFrame: One row per job, indexed by ini and override values
+    """
+    rows = []
+    for job in jobs:
+        row = {"label": job.label, "ini": job.ini}
+        row.update(job.overrides)
+        summary_file = os.path.join(sweep_dir, job.label, "SUMMARY.YAML")
+        try:
+            with open(summary_file, "r", encoding="utf-8") as handle:
+                job_summary = yaml.safe_load(handle) or {}
+        except FileNotFoundError:
+            logger.warning(f"No summary for sweep job {job.label}: {summary_file}")
+            job_summary = {}
+        for key in RESULT_KEYS:
+            row[key] = job_summary.get(key)
+        rows.append(row)
+
+    table = pd.DataFrame(rows)
+    override_keys = sorted({key for job in jobs for key in job.overrides})
+    return table.set_index(["ini"] + override_keys)
+
+
+def run_sweep(
+    spec_file: str,
+    executor,
+    path: str,
+    hd: str,
+    cov: str,
+    ini: str,
+    outdir: str,
+    sacc_file: str,
+    base_param: str = "",
+    cores: Optional[int] = None,
+    extra_args: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Run every job of a sweep against a shared SACC file and tabulate the results.
+
+    Args:
+        spec_file (str): Path to the YAML sweep specification
+        executor (SubprocessExecutor): Executor used to launch the jobs
+        path (str): Path to HD and COV files
+        hd (str): HD file name
+        cov (str): COV file name
+        ini (str): Default COSMOSIS ini file
+        outdir (str): Sweep output directory
+        sacc_file (str): SACC file produced by the shared Stage 0
+        base_param (str): Overrides shared by every job
+        cores (int, optional): Core budget (Default: all cores of the node)
+        extra_args (list, optional): Extra wrapper arguments passed to every job
+
+    Returns:
+        pd.DataFrame: Results table, also written to SWEEP_RESULTS.csv
+    """
+    spec = load_sweep_spec(spec_file)
+    jobs = expand_sweep(spec, ini)
+    cores = cores or os.cpu_count() or 1
+    cores_per_job = max(1, int(spec.get("cores_per_job", 1)))
+    max_workers = max(1, cores // cores_per_job)
+    sweep_dir = os.path.join(outdir, "SWEEP")
+    logger.info(f"Sweep {spec_file}: {len(jobs)} jobs, {max_workers} in parallel")
+
+    job_args = list(extra_args or [])
+    if "--cpus" not in job_args:
+        # Each job takes cores no other job holds, with thread pools sized to them
+        job_args += ["--cpus", str(cores_per_job)]
+
+    def run_job(job):
+        job_dir = os.path.join(sweep_dir, job.label)
+        os.makedirs(job_dir, exist_ok=True)
+        command = job_command(job, path, hd, cov, job_dir, sacc_file, base_param, job_args)
+        try:
+            return executor.run(
+                command,
+                os.path.join(job_dir, "sweep_job.log"),
+                os.path.join(job_dir, "sweep_job.err"),
+                description=f"Sweep {job.label}",
+            )
+        except RuntimeError as e:
+            logger.error(f"Sweep job {job.label} failed: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        returncodes = list(pool.map(run_job, jobs))
+
+    failed = [job.label for job, rc in zip(jobs, returncodes) if rc != 0]
+    if failed:
+        logger.warning(f"{len(failed)} sweep jobs failed: {', '.join(failed)}")
+
+    table = collect_results(jobs, sweep_dir)
+    table.to_csv(os.path.join(outdir, "SWEEP_RESULTS.csv"))
+    return table
@@ -0,0 +1,276 @@
+"""
+Live sampling telemetry for Stage 1.
+
+While COSMOSIS runs, a background thread polls the growing chain file. Each
+poll reads only the bytes appended since the previous one and counts complete
+sample rows (comment lines are skipped). The thread rewrites a small
+OpenMetrics text file with:
+
+- rows written, rows per rank and rows per second (sliding window),
+- the estimated remaining time and completion timestamp, when the expected
+  number of rows is known from the ini file,
+- a stall flag, raised when no row has been written for ``stall_after`` seconds.
+
+Node monitors (e.g. the Prometheus node exporter textfile collector) can
+scrape the file directly; nothing has to parse the COSMOSIS logs.
+
+An optional ``consumer`` (e.g. incremental_stats.IncrementalChainStats)
+receives the same newly appended lines, so the chain is read only once.
+"""
+
+import configparser
+import logging
+import math
+import numbers
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from warm_worker import parse_overrides
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "firecrown_chain"
+DEFAULT_INTERVAL = 15.0
+DEFAULT_STALL_AFTER = 900.0
+# Number of polls over which the sampling rate is averaged
+RATE_WINDOW = 8
+
+# Environment variables holding the MPI world size, by launcher
+RANK_COUNT_VARIABLES = ("OMPI_COMM_WORLD_SIZE", "PMI_SIZE", "PMIX_SIZE", "SLURM_NTASKS")
+
+
+def mpi_ranks() -> int:
+    """Return the MPI world size advertised by the launcher, or 1."""
+    for variable in RANK_COUNT_VARIABLES:
+        value = os.environ.get(variable, "")
+        if value.isdigit() and int(value) > 0:
+            return int(value)
+    return 1
+
+
+def expected_rows_from_ini(ini_file: str, param_override: str = "", n_ranks: int = 1) -> Optional[int]:
+    """
+    Estimate the number of rows a COSMOSIS run will write.
+
+    Only samplers with a fixed length are supported: ``metropolis`` writes
+    ``samples`` rows per rank and ``emcee`` writes ``walkers * samples`` rows.
+
+    Args:
+        ini_file (str): COSMOSIS ini file
+        param_override (str): ``-p`` overrides applied on top of the ini
+        n_ranks (int): Number of MPI ranks
+
+    Returns:
+        int or None: Expected rows, or None if it cannot be determined
+    """
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        parser.read(ini_file)
+        for (section, option), value in parse_overrides(param_override).items():
+            if not parser.has_section(section):
+                parser.add_section(section)
+            parser.set(section, option, value)
+        sampler = parser.get("runtime", "sampler", fallback="").strip()
+        if sampler == "metropolis":
+            return parser.getint("metropolis", "samples") * n_ranks
+        if sampler == "emcee":
+            return parser.getint("emcee", "walkers") * parser.getint("emcee", "samples")
+    except (configparser.Error, ValueError) as e:
+        logger.debug(f"Cannot estimate the chain length from {ini_file}: {str(e)}")
+    return None
+
+
+def _format_value(value) -> str:
+    """Format a sample value exactly: integers as such, floats with all digits (repr), NaN and +/-Inf as named."""
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class ChainTelemetry:
+    """
+    Polls a growing chain file and publishes throughput metrics.
+
+    Usable as a context manager, or through start() and stop(); the
+    SubprocessExecutor starts and stops it around a command when passed as
+    ``monitor``.
+
+    Attributes:
+        chain_file (str): Chain written by the sampler
+        metrics_file (str): OpenMetrics text file to (re)write
+        rows (int): Complete sample rows seen so far
+        stalled (bool): No new rows for ``stall_after`` seconds
+    """
+
+    def __init__(
+        self,
+        chain_file: str,
+        metrics_file: str,
+        expected_rows: Optional[int] = None,
+        n_ranks: int = 1,
+        interval: float = DEFAULT_INTERVAL,
+        stall_after: float = DEFAULT_STALL_AFTER,
+        labels: Optional[Dict[str, str]] = None,
+        clock: Callable[[], float] = time.time,
+        consumer=None,
+    ):
+        """
+        Args:
+            chain_file (str): Chain written by the sampler
+            metrics_file (str): OpenMetrics text file to (re)write
+            expected_rows (int, optional): Rows of the finished chain, for the ETA
+            n_ranks (int): Number of MPI ranks
+            interval (float): Seconds between polls
+            stall_after (float): Seconds without new rows before ``stalled`` is set
+            labels (dict, optional): Extra metric labels
+            clock (callable): Time source
+            consumer (optional): Object with feed(chunk, offset), reset() and
+                checkpoint(final); gets every batch of complete new lines
+        """
+        self.chain_file = chain_file
+        self.metrics_file = metrics_file
+        self.expected_rows = expected_rows
+        self.n_ranks = max(1, n_ranks)
+        self.interval = interval
+        self.stall_after = stall_after
+        self.labels = dict(labels or {})
+        self.labels.setdefault("chain", os.path.basename(chain_file))
+        self._clock = clock
+        self.consumer = consumer
+        self.rows = 0
+        self.stalled = False
+        self._offset = 0
+        self._history = deque(maxlen=RATE_WINDOW)
+        self._last_progress = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read_new_rows(self) -> int:
+        """Count the complete sample rows appended since the previous poll."""
+        try:
+            size = os.path.getsize(self.chain_file)
+        except OSError:
+            return 0
+        if size < self._offset:
+            # The chain was truncated or replaced (e.g. a restarted attempt)
+            self._offset = 0
+            self.rows = 0
+            if self.consumer is not None:
+                self.consumer.reset()
+        if size == self._offset:
+            return 0
+        with open(self.chain_file, "rb") as handle:
+            handle.seek(self._offset)
+            data = handle.read(size - self._offset)
+        complete = data[:data.rfind(b"\n") + 1]
+        if self.consumer is not None and complete:
+            self.consumer.feed(complete, self._offset)
+        self._offset += len(complete)
+        # ``complete`` starts at a line start and ends with a newline
+        comments = int(complete.startswith(b"#")) + complete.count(b"\n#")
+        return complete.count(b"\n") - comments
+
+    def rate(self) -> float:
+        """Rows per second over the sliding window of polls."""
+        if len(self._history) < 2:
+            return 0.0
+        (t0, rows0), (t1, rows1) = self._history[0], self._history[-1]
+        return (rows1 - rows0) / (t1 - t0) if t1 > t0 else 0.0
+
+    def poll(self, final: bool = False) -> Dict[str, float]:
+        """
+        Update the counters and rewrite the metrics file.
+
+        Args:
+            final (bool): Last poll after the sampler exited; the consumer
+                checkpoints even without new rows
+
+        Returns:
+            dict: The metric values that were written
+        """
+        now = self._clock()
+        new_rows = self._read_new_rows()
+        self.rows += new_rows
+        if self._last_progress is None or new_rows > 0:
+            self._last_progress = now
+        self._history.append((now, self.rows))
+        self.stalled = now - self._last_progress >= self.stall_after
+
+        rate = self.rate()
+        eta = math.nan
+        if self.expected_rows is not None:
+            remaining = max(self.expected_rows - self.rows, 0)
+            if remaining == 0:
+                eta = 0.0
+            elif rate > 0:
+                eta = remaining / rate
+        metrics = {
+            "rows": self.rows,
+            "rows_per_rank": self.rows / self.n_ranks,
+            "rows_per_second": rate,
+            "expected_rows": math.nan if self.expected_rows is None else self.expected_rows,
+            "eta_seconds": eta,
+            "expected_completion_timestamp_seconds": now + eta,
+            "stalled": int(self.stalled),
+            "last_update_timestamp_seconds": now,
+        }
+        self._write_metrics(metrics)
+        if self.consumer is not None and (new_rows > 0 or final):
+            self.consumer.checkpoint(final=final)
+        return metrics
+
+    def _write_metrics(self, metrics: Dict[str, float]) -> None:
+        """Write the metrics atomically in the OpenMetrics text format."""
+        labels = ",".join(f'{key}="{value}"' for key, value in sorted(self.labels.items()))
+        lines = []
+        for name, value in metrics.items():
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric}{{{labels}}} {_format_value(value)}")
+        lines.append("# EOF")
+        tmp_path = f"{self.metrics_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as handle:
+            handle.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.metrics_file)
+
+    def _loop(self) -> None:
+        """Poll until stopped."""
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except OSError as e:
+                logger.warning(f"Telemetry poll of {self.chain_file} failed: {str(e)}")
+
+    def start(self) -> None:
+        """Start polling in a daemon thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self.poll()
+        self._thread = threading.Thread(target=self._loop, name="chain-telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop polling and write the final metrics."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.poll(final=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
@@ -11,7 +11,11 @@ Tests cover:
 """
 
 import argparse
+import copy
+import json
+import os
 import sys
+import time
 
 import pytest
 import pandas as pd
@@ -21,15 +25,153 @@ from unittest.mock import patch
 from Firecrown_wrapper import (
     parse_arguments,
     setup_directories,
+    stage_timeout_policies,
     redirect_stdout,
     check_files_and_paths,
     FoM,
     burnin,
+    chain_has_samples,
+    generate_sacc,
+    generate_sacc_inprocess_stage,
+    main,
+    publish_result,
+    record_performance,
+    RunContext,
+    run_fisher_mode,
+    run_result_key,
+    run_subprocess_stage,
+    run_reweight_mode,
+    run_warm_worker_stage,
+    schedule_plots,
+    run_stages,
+    stage_resource_specs,
     summary,
     valid_directory_path,
     write_summary,
 )
-from subprocess_executor import get_executor
+from subprocess_executor import Heartbeat, RetryPolicy, StageKilled, SubprocessExecutor, TimeoutPolicy, get_executor
+from work_queue import QueueWorker, queue_status, reclaim_expired
+from work_queue import submit_job as submit_queue_job
+from warm_worker import WarmWorker, parse_overrides, setup_queue, submit_job, wait_for_job
+from chain_thinning import integrated_autocorr_time, thin_chain, walkers_from_ini
+from incremental_stats import IncrementalChainStats
+from chain_io import chain_weights, compress_chain, open_chain, parameter_columns, read_chain, resolve_chain
+from deferred_plots import run_plots, update_summary_fields
+from param_stats import DEFAULT_PARAMETERS, ParameterSummary, summarize_chain, summarize_samples
+from marginal_plots import contour_levels, density_1d, fft_smooth, render_marginals, select_pairs
+from fisher import distance_modulus_derivatives, fisher_forecast, fisher_matrix
+from fingerprint import input_fingerprint, result_key, run_fingerprint
+from perfdb import connect, find_regressions, format_report, historical_wall_limit, record_run
+from perfdb import main as perfdb_main
+from profiling import StageProfiler, collapsed_stacks
+from telemetry import ChainTelemetry, expected_rows_from_ini
+from block_cov import BlockCovariance
+from resources import ResourceSpec, allocate_cores, available_cpus, format_cpu_list
+from result_store import ResultStore, parse_size
+from proposal_cache import ProposalCache, dataset_descriptor, start_overrides, varied_parameters
+from reweight import effective_sample_size, load_sn_likelihood, reweight_chain
+from staging import TAR_NAME, ScratchStage, resolve_scratch_root
+from samplers import MCMC, WALKERS, WEIGHTED, SamplerInfo, detect_sampler, log_evidence, walker_burn_in
+from sn_cosmology import SNLikelihood, distance_modulus, luminosity_distance
+from sacc_builder import generate_sacc_inprocess, load_covariance, load_hubble_diagram, validate_covariance
+from sacc_builder import load_surveys
+from sweep import collect_results, expand_sweep, job_command, load_sweep_spec, run_sweep
+
+
+CHAIN_COLUMNS = [
+    "cosmological_parameters--omega_m",
+    "cosmological_parameters--w",
+    "cosmological_parameters--wa",
+    "prior",
+    "post",
+]
+
+
+def write_fake_chain(chain_file, n_rows=200, seed=1):
+    """Write a small COSMOSIS-style text chain."""
+    rng = np.random.default_rng(seed)
+    samples = np.column_stack([
+        rng.normal(0.3, 0.02, n_rows),
+        rng.normal(-1.0, 0.1, n_rows),
+        rng.normal(0.0, 0.3, n_rows),
+        np.zeros(n_rows),
+        -rng.chisquare(3, n_rows) / 2,
+    ])
+    header = "#" + "\t".join(CHAIN_COLUMNS) + "\n#sampler=metropolis\n"
+    with open(chain_file, "w") as handle:
+        handle.write(header)
+        np.savetxt(handle, samples, delimiter="\t")
+    return samples
+
+
+class FakePipelineExecutor:
+    """Executor stand-in that fakes the outputs of the external stages."""
+
+    def __init__(self, plot_path, default_timeout=3600):
+        self.plot_path = plot_path
+        self.default_timeout = default_timeout
+        self.commands = []
+
+    def run_with_retry(self, command, output_file, error_file, **kwargs):
+        self.commands.append(command)
+        open(output_file, "w").close()
+        open(error_file, "w").close()
+        if command.startswith("cosmosis "):
+            chain_file = command.split("output.filename=")[1].split()[0]
+            monitor = kwargs.get("monitor")
+            if monitor is not None:
+                monitor.start()
+            write_fake_chain(chain_file)
+            if monitor is not None:
+                monitor.stop()
+        elif command.startswith("cosmosis-postprocess"):
+            with open(f"{self.plot_path}/means.txt", "w") as handle:
+                handle.write("#parameter mean std_dev\n")
+                handle.write("cosmological_parameters--omega_m 0.3 0.02\n")
+                handle.write("cosmological_parameters--w -1.0 0.1\n")
+                handle.write("cosmological_parameters--wa 0.0 0.3\n")
+            with open(f"{self.plot_path}/covmat.txt", "w") as handle:
+                handle.write("#" + "\t".join(CHAIN_COLUMNS[:3]) + "\n")
+                np.savetxt(handle, np.diag([0.02, 0.1, 0.3]) ** 2, delimiter="\t")
+        return 0, [{'attempt': 1, 'returncode': 0, 'transient': False, 'seconds': 0.0}]
+
+
+@pytest.fixture
+def pipeline_dirs(tmp_path):
+    """Input files and output directories for run_stages."""
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    (input_dir / "hd.txt").write_text("zcmb mb dmb\n0.1 38.3 0.1\n0.5 42.3 0.1\n")
+    (input_dir / "cov.txt").write_text("2\n0.01\n0\n0\n0.01\n")
+    ini_file = tmp_path / "sn_only.ini"
+    ini_file.write_text("[runtime]\nsampler = metropolis\n")
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    setup_directories(str(output_dir))
+    original_summary = copy.deepcopy(summary)
+    yield {
+        "path": str(input_dir),
+        "ini": str(ini_file),
+        "error_path": str(output_dir / "ERROR_LOGS"),
+        "output_path": str(output_dir / "COSMOSIS-CHAINS"),
+        "plot_path": str(output_dir / "PLOTS"),
+        "summary_path": output_dir / "SUMMARY.YAML",
+    }
+    summary.clear()
+    summary.update(original_summary)
+
+
+def run_fake_pipeline(dirs, **kwargs):
+    """Run run_stages end to end with FakePipelineExecutor."""
+    executor = FakePipelineExecutor(dirs["plot_path"])
+    with patch('Firecrown_wrapper.get_executor', return_value=executor):
+        run_stages(
+            dirs["path"], "hd.txt", "cov.txt", dirs["ini"],
+            dirs["error_path"], dirs["output_path"], dirs["plot_path"],
+            summary_path=dirs["summary_path"],
+            **kwargs,
+        )
+    return executor, yaml.safe_load(dirs["summary_path"].read_text())
 
 
 class TestArgumentParsing:
@@ -257,6 +399,1925 @@ class TestSubprocessExecutor:
         assert failure_results[0]['index'] == 1
 
 
+class TestRetryPolicy:
+    """Test retry policies and SubprocessExecutor.run_with_retry."""
+
+    def test_retry_policy_backoff(self):
+        """Test exponential backoff is capped at backoff_max."""
+        policy = RetryPolicy(max_attempts=5, backoff_initial=1.0, backoff_factor=3.0, backoff_max=5.0)
+        assert [policy.delay(n) for n in (1, 2, 3)] == [1.0, 3.0, 5.0]
+
+    def test_retry_policy_classifier(self):
+        """Test transient classification by return code and stderr pattern."""
+        policy = RetryPolicy(transient_returncodes=(75,), transient_patterns=[r"Stale file handle"])
+        assert policy.is_transient(75)
+        assert policy.is_transient(1, "OSError: [Errno 116] Stale file handle")
+        assert not policy.is_transient(1, "KeyError: 'w'")
+
+    def test_run_with_retry_recovers_from_transient_failure(self, tmp_path):
+        """Test a transient failure is retried and every attempt is recorded."""
+        delays = []
+        executor = SubprocessExecutor(sleep=delays.append)
+        marker = tmp_path / "marker"
+        command = (
+            f"{sys.executable} -c \"import os, sys; "
+            f"m = r'{marker}'; "
+            f"ok = os.path.exists(m); open(m, 'w').close(); "
+            f"sys.stderr.write('' if ok else 'Input/output error'); sys.exit(0 if ok else 1)\""
+        )
+        policy = RetryPolicy(max_attempts=3, backoff_initial=2.0, transient_patterns=[r"Input/output error"])
+
+        returncode, attempts = executor.run_with_retry(
+            command,
+            str(tmp_path / "out.log"),
+            str(tmp_path / "err.log"),
+            retry_policy=policy,
+        )
+
+        assert returncode == 0
+        assert [a['returncode'] for a in attempts] == [1, 0]
+        assert attempts[0]['transient'] is True
+        assert delays == [2.0]
+        assert (tmp_path / "err.log.attempt1").read_text() == "Input/output error"
+
+    def test_run_with_retry_fatal_failure_not_retried(self, tmp_path):
+        """Test a non-transient failure returns after one attempt."""
+        executor = SubprocessExecutor(sleep=lambda _: None)
+        returncode, attempts = executor.run_with_retry(
+            f"{sys.executable} -c \"import sys; sys.exit(2)\"",
+            str(tmp_path / "out.log"),
+            str(tmp_path / "err.log"),
+            retry_policy=RetryPolicy(max_attempts=3, transient_returncodes=(75,)),
+        )
+        assert returncode == 2
+        assert len(attempts) == 1
+
+    def test_run_with_retry_uses_retry_command(self, tmp_path):
+        """Test retries use the command built by retry_command."""
+        executor = SubprocessExecutor(sleep=lambda _: None)
+        returncode, attempts = executor.run_with_retry(
+            "exit 75",
+            str(tmp_path / "out.log"),
+            str(tmp_path / "err.log"),
+            retry_policy=RetryPolicy(max_attempts=2, transient_returncodes=(75,)),
+            retry_command=lambda attempt: "echo resumed",
+        )
+        assert returncode == 0
+        assert len(attempts) == 2
+        assert (tmp_path / "out.log").read_text().strip() == "resumed"
+
+    def test_chain_has_samples(self, tmp_path):
+        """Test detection of a partial chain to resume from."""
+        chain = tmp_path / "chain.txt"
+        assert not chain_has_samples(str(chain))
+        chain.write_text("#omega_m\tpost\n")
+        assert not chain_has_samples(str(chain))
+        chain.write_text("#omega_m\tpost\n0.3\t-1.0\n")
+        assert chain_has_samples(str(chain))
+
+    def test_run_stages_records_attempts_on_failure(self, tmp_path):
+        """Test a failed stage records its attempts in the summary."""
+        attempts = [{'attempt': 1, 'returncode': 1, 'transient': True, 'seconds': 0.1},
+                    {'attempt': 2, 'returncode': 1, 'transient': True, 'seconds': 0.1}]
+        original_summary = copy.deepcopy(summary)
+        try:
+            with patch('Firecrown_wrapper.get_executor') as mock_get:
+                mock_get.return_value.run_with_retry.return_value = (1, attempts)
+                with pytest.raises(RuntimeError, match="Stage 0"):
+                    run_stages(
+                        str(tmp_path), "hd.txt", "cov.txt", "sn_only.ini",
+                        str(tmp_path), str(tmp_path), str(tmp_path),
+                        summary_path=tmp_path / "SUMMARY.YAML",
+                    )
+            loaded = yaml.safe_load((tmp_path / "SUMMARY.YAML").read_text())
+            assert loaded["STAGE0"] == "FAILED"
+            assert loaded["ATTEMPTS"]["STAGE0"] == attempts
+        finally:
+            summary.clear()
+            summary.update(original_summary)
+
+
+class TestSweep:
+    """Test parameter-sweep expansion and result collection."""
+
+    def test_expand_grid_with_ini_variants(self):
+        """Test a grid expands to the Cartesian product for every ini."""
+        spec = {
+            "grid": {"cosmological_parameters.w": [-1.1, -0.9], "cosmological_parameters.wa": [0.0, 0.5]},
+            "ini": ["a.ini", "b.ini"],
+        }
+        jobs = expand_sweep(spec, "default.ini")
+        assert len(jobs) == 8
+        assert len({job.label for job in jobs}) == 8
+        assert jobs[0].ini == "a.ini"
+        assert jobs[0].overrides == {"cosmological_parameters.w": -1.1, "cosmological_parameters.wa": 0.0}
+
+    def test_expand_list_uses_default_ini(self):
+        """Test a list of override sets uses the default ini."""
+        jobs = expand_sweep({"list": [{"a.x": 1}, {"a.x": 2, "b.y": 3}]}, "default.ini")
+        assert [job.ini for job in jobs] == ["default.ini", "default.ini"]
+        assert jobs[1].param_string("c.z=4") == "c.z=4 a.x=2 b.y=3"
+
+    def test_load_sweep_spec_rejects_grid_and_list(self, tmp_path):
+        """Test a specification with both grid and list is rejected."""
+        spec_file = tmp_path / "sweep.yaml"
+        spec_file.write_text("grid: {a.x: [1]}\nlist: [{a.x: 1}]\n")
+        with pytest.raises(ValueError, match="either 'grid' or 'list'"):
+            load_sweep_spec(str(spec_file))
+
+    def test_job_command_reuses_shared_sacc(self, tmp_path):
+        """Test each job skips Stage 0 through --sacc."""
+        job = expand_sweep({"list": [{"a.x": 1}]}, "sn.ini")[0]
+        command = job_command(job, "/data", "hd.txt", "cov.txt", str(tmp_path), "/data/shared.sacc")
+        assert "--sacc /data/shared.sacc" in command
+        assert "-p a.x=1" in command
+
+    def test_run_sweep_collects_results(self, tmp_path):
+        """Test sweep jobs run in parallel and are gathered into one table."""
+        spec_file = tmp_path / "sweep.yaml"
+        spec_file.write_text("grid:\n  cosmological_parameters.w: [-1.0, -0.9]\n")
+
+        def fake_run(command, output_file, error_file, timeout=None, description=""):
+            job_dir = tmp_path / "SWEEP" / description.split()[-1]
+            w = -1.0 if "w=-1.0" in command else -0.9
+            assert "--cpus 1" in command
+            (job_dir / "SUMMARY.YAML").write_text(yaml.dump({"STAGE3": "SUCCESSFUL", "w0": w, "FoM": 10.0}))
+            return 0
+
+        executor = get_executor()
+        with patch.object(executor, "run", side_effect=fake_run):
+            table = run_sweep(str(spec_file), executor, str(tmp_path), "hd.txt", "cov.txt",
+                              "sn.ini", str(tmp_path), "shared.sacc", cores=2)
+
+        assert table.loc[("sn.ini", -0.9), "w0"] == -0.9
+        assert (table["STAGE3"] == "SUCCESSFUL").all()
+        assert (tmp_path / "SWEEP_RESULTS.csv").exists()
+
+    def test_collect_results_missing_summary(self, tmp_path):
+        """Test a job without a summary still gets a row."""
+        jobs = expand_sweep({"list": [{"a.x": 1}]}, "sn.ini")
+        table = collect_results(jobs, str(tmp_path))
+        assert table["STAGE3"].isna().all()
+
+
+class TestWarmWorker:
+    """Test the warm worker queue and job execution."""
+
+    def _worker(self, queue_dir, run_cosmosis):
+        """Build a WarmWorker without importing COSMOSIS."""
+        worker = WarmWorker.__new__(WarmWorker)
+        worker.queue_dir = str(queue_dir)
+        worker.poll_interval = 0.01
+        worker._run_cosmosis = run_cosmosis
+        worker._inifile = lambda filename, override=None: (filename, override)
+        setup_queue(str(queue_dir))
+        return worker
+
+    def test_parse_overrides(self):
+        """Test -p override strings map to Inifile override keys."""
+        overrides = parse_overrides("firecrown_likelihood.sacc_file=/x.sacc output.filename=/c.txt")
+        assert overrides == {
+            ("firecrown_likelihood", "sacc_file"): "/x.sacc",
+            ("output", "filename"): "/c.txt",
+        }
+
+    def test_parse_overrides_invalid(self):
+        """Test a malformed override is rejected."""
+        with pytest.raises(ValueError, match="section.option=value"):
+            parse_overrides("no_section=1")
+
+    def test_worker_runs_submitted_job(self, tmp_path):
+        """Test a submitted job is claimed, run in-process and reported done."""
+        calls = []
+
+        def fake_run_cosmosis(ini):
+            calls.append(ini)
+            print("sampling")
+            return 0
+
+        worker = self._worker(tmp_path / "queue", fake_run_cosmosis)
+        job_id = submit_job(str(tmp_path / "queue"), {
+            "ini": "sn_only.ini",
+            "overrides": "output.filename=/tmp/chain.txt",
+            "output_file": str(tmp_path / "out.log"),
+            "error_file": str(tmp_path / "err.log"),
+        })
+
+        assert worker.serve_forever(max_jobs=1) == 1
+        result = wait_for_job(str(tmp_path / "queue"), job_id, timeout=1, poll_interval=0.01)
+        assert result["returncode"] == 0
+        assert calls == [("sn_only.ini", {("output", "filename"): "/tmp/chain.txt"})]
+        assert "sampling" in (tmp_path / "out.log").read_text()
+        assert not list((tmp_path / "queue" / "running").iterdir())
+
+    def test_worker_reports_pipeline_exception(self, tmp_path):
+        """Test an exception inside the pipeline fails only that job."""
+        def failing_run_cosmosis(ini):
+            raise ValueError("bad sampler")
+
+        worker = self._worker(tmp_path / "queue", failing_run_cosmosis)
+        job_id = submit_job(str(tmp_path / "queue"), {
+            "ini": "sn_only.ini",
+            "overrides": "",
+            "output_file": str(tmp_path / "out.log"),
+            "error_file": str(tmp_path / "err.log"),
+        })
+        worker.serve_forever(max_jobs=1)
+        result = wait_for_job(str(tmp_path / "queue"), job_id, timeout=1, poll_interval=0.01)
+        assert result["returncode"] == 1
+        assert "bad sampler" in (tmp_path / "err.log").read_text()
+
+    def test_worker_reports_malformed_override(self, tmp_path):
+        """Test a job with a malformed override fails without stopping the worker."""
+        worker = self._worker(tmp_path / "queue", lambda ini: 0)
+        bad_id = submit_job(str(tmp_path / "queue"), {
+            "ini": "sn_only.ini",
+            "overrides": "no_section=1",
+            "output_file": str(tmp_path / "out.log"),
+            "error_file": str(tmp_path / "err.log"),
+        })
+        good_id = submit_job(str(tmp_path / "queue"), {
+            "ini": "sn_only.ini",
+            "overrides": "",
+            "output_file": str(tmp_path / "out2.log"),
+            "error_file": str(tmp_path / "err2.log"),
+        })
+        assert worker.serve_forever(max_jobs=2) == 2
+        result = wait_for_job(str(tmp_path / "queue"), bad_id, timeout=1, poll_interval=0.01)
+        assert result["returncode"] == 1
+        assert "section.option=value" in (tmp_path / "err.log").read_text()
+        assert wait_for_job(str(tmp_path / "queue"), good_id, timeout=1, poll_interval=0.01)["returncode"] == 0
+        assert not list((tmp_path / "queue" / "running").iterdir())
+
+    def test_wait_for_job_timeout(self, tmp_path):
+        """Test waiting for a job nobody runs times out."""
+        with pytest.raises(RuntimeError, match="did not finish"):
+            wait_for_job(str(tmp_path), "missing", timeout=0.05, poll_interval=0.01)
+        with pytest.raises(RuntimeError, match=r"abandoned \(wall_limit\)"):
+            wait_for_job(str(tmp_path), "missing", timeout_policy=TimeoutPolicy(wall_seconds=0.05), poll_interval=0.01)
+
+    def test_stage_retries_transient_failures(self, tmp_path):
+        """Test a transient warm worker failure is resubmitted and the timeout policy replaces the fixed timeout."""
+        import threading
+
+        outcomes = [1, 0]
+        calls = []
+
+        def flaky_run_cosmosis(ini):
+            calls.append(ini)
+            returncode = outcomes.pop(0)
+            if returncode:
+                print("MPI_Init failed", file=sys.stderr)
+            return returncode
+
+        worker = self._worker(tmp_path / "queue", flaky_run_cosmosis)
+        thread = threading.Thread(target=worker.serve_forever, kwargs={"max_jobs": 2, "idle_timeout": 5})
+        thread.start()
+        context = RunContext(str(tmp_path))
+        job = {"ini": "sn_only.ini", "overrides": "", "output_file": str(tmp_path / "out.log"),
+               "error_file": str(tmp_path / "err.log")}
+        run_warm_worker_stage(
+            str(tmp_path / "queue"),
+            job,
+            "STAGE1",
+            "Stage 1 (COSMOSIS, warm worker)",
+            "Stage 1 failed",
+            timeout=0,
+            retry_policy=RetryPolicy(max_attempts=2, backoff_initial=0, transient_patterns=["MPI_Init"]),
+            retry_job=lambda attempt: dict(job, overrides="runtime.resume=T"),
+            timeout_policy=TimeoutPolicy(wall_seconds=60, poll_interval=0.01),
+            context=context,
+        )
+        thread.join()
+        assert [attempt["returncode"] for attempt in context.summary["ATTEMPTS"]["STAGE1"]] == [1, 0]
+        assert context.summary["STAGE1"] == "SUCCESSFUL"
+        assert context.summary["TIMEOUTS"]["STAGE1"]["wall_seconds"] == 60
+        assert "MPI_Init" in (tmp_path / "err.log.attempt1").read_text()
+        assert calls[1] == ("sn_only.ini", {("runtime", "resume"): "T"})
+
+    def test_worker_runs_in_submitter_directory(self, tmp_path):
+        """Test relative paths of a job resolve against the submitter's directory, not the worker's."""
+        submit_dir = tmp_path / "submit"
+        submit_dir.mkdir()
+        seen = []
+        worker = self._worker(tmp_path / "queue", lambda ini: seen.append(os.getcwd()) or 0)
+        submit_job(str(tmp_path / "queue"), {
+            "ini": "sn_only.ini",
+            "overrides": "output.filename=out/chain.txt",
+            "output_file": str(tmp_path / "out.log"),
+            "error_file": str(tmp_path / "err.log"),
+            "cwd": str(submit_dir),
+        })
+        before = os.getcwd()
+        worker.serve_forever(max_jobs=1)
+        assert seen == [str(submit_dir)]
+        assert os.getcwd() == before
+
+
+class TestSaccBuilder:
+    """Test the in-process Stage 0 loaders and validation."""
+
+    COV = np.array([[0.04, 0.01, 0.0], [0.01, 0.09, 0.0], [0.0, 0.0, 0.01]])
+
+    def _write_hd(self, path):
+        path.write_text("# HD\nzcmb zhel mb dmb\n0.1 0.1 38.3 0.1\n0.5 0.5 42.3 0.1\n1.0 1.0 44.1 0.2\n")
+
+    def test_load_hubble_diagram(self, tmp_path):
+        """Test redshift, distance and error columns are found by name."""
+        self._write_hd(tmp_path / "hd.txt")
+        z, mu, mu_err = load_hubble_diagram(str(tmp_path / "hd.txt"))
+        np.testing.assert_allclose(z, [0.1, 0.5, 1.0])
+        np.testing.assert_allclose(mu, [38.3, 42.3, 44.1])
+        np.testing.assert_allclose(mu_err, [0.1, 0.1, 0.2])
+
+    def test_load_hubble_diagram_missing_column(self, tmp_path):
+        """Test a Hubble diagram without a distance column is rejected."""
+        (tmp_path / "hd.txt").write_text("zcmb dmb\n0.1 0.1\n")
+        with pytest.raises(ValueError, match="None of the columns"):
+            load_hubble_diagram(str(tmp_path / "hd.txt"))
+
+    def test_load_covariance_text_with_dimension(self, tmp_path):
+        """Test the Firecrown text format: N followed by N*N entries."""
+        cov_file = tmp_path / "cov.txt"
+        cov_file.write_text("3\n" + "\n".join(str(v) for v in self.COV.ravel()))
+        np.testing.assert_allclose(load_covariance(str(cov_file)), self.COV)
+
+    def test_load_covariance_text_square(self, tmp_path):
+        """Test a plain square text matrix."""
+        cov_file = tmp_path / "cov.txt"
+        np.savetxt(cov_file, self.COV)
+        np.testing.assert_allclose(load_covariance(str(cov_file)), self.COV)
+
+    def test_load_covariance_npy_is_memory_mapped(self, tmp_path):
+        """Test .npy covariances are memory mapped."""
+        cov_file = tmp_path / "cov.npy"
+        np.save(cov_file, self.COV)
+        cov = load_covariance(str(cov_file))
+        assert isinstance(cov, np.memmap)
+        np.testing.assert_allclose(cov, self.COV)
+
+    def test_load_covariance_raw_binary(self, tmp_path):
+        """Test raw float64 covariances."""
+        cov_file = tmp_path / "cov.bin"
+        self.COV.astype("<f8").tofile(cov_file)
+        np.testing.assert_allclose(load_covariance(str(cov_file)), self.COV)
+
+    def test_validate_covariance(self):
+        """Test shape and symmetry checks."""
+        validate_covariance(self.COV, 3)
+        with pytest.raises(ValueError, match="does not match"):
+            validate_covariance(self.COV, 4)
+        asymmetric = self.COV.copy()
+        asymmetric[0, 1] = 0.5
+        with pytest.raises(ValueError, match="not symmetric"):
+            validate_covariance(asymmetric, 3)
+
+    def test_generate_sacc_inprocess_writes_any_path(self, tmp_path):
+        """Test the SACC file is built from arrays and written to the given path."""
+        sacc = pytest.importorskip("sacc")
+        self._write_hd(tmp_path / "hd.txt")
+        np.save(tmp_path / "cov.npy", self.COV)
+        destination = generate_sacc_inprocess(str(tmp_path), "hd.txt", "cov.npy", str(tmp_path / "out" / "run.sacc"))
+        data = sacc.Sacc.load_fits(destination)
+        np.testing.assert_allclose(data.mean, [38.3, 42.3, 44.1])
+        np.testing.assert_allclose(np.diag(data.covariance.covmat), np.diag(self.COV) + [0.01, 0.01, 0.04])
+
+    def test_inprocess_stage_failure_updates_summary(self, tmp_path):
+        """Test an invalid input marks Stage 0 as failed."""
+        (tmp_path / "hd.txt").write_text("zcmb dmb\n0.1 0.1\n")
+        np.save(tmp_path / "cov.npy", self.COV)
+        original_summary = copy.deepcopy(summary)
+        try:
+            with pytest.raises(RuntimeError, match="Stage 0"):
+                generate_sacc_inprocess_stage(str(tmp_path), "hd.txt", "cov.npy", str(tmp_path / "x.sacc"),
+                                              [], tmp_path / "SUMMARY.YAML")
+            assert summary["STAGE0"] == "FAILED"
+        finally:
+            summary.clear()
+            summary.update(original_summary)
+
+
+class TestPlotModes:
+    """Test plot scheduling relative to the summary."""
+
+    def test_inline_plots(self, pipeline_dirs):
+        """Test inline mode renders plots in Stage 2 as before."""
+        executor, loaded = run_fake_pipeline(pipeline_dirs)
+        assert "--no-plots" not in executor.commands[-1]
+        assert loaded["STAGE3"] == "SUCCESSFUL"
+        assert loaded["PLOT_STATUS"] == "INLINE"
+
+    def test_deferred_plots_publish_numbers_first(self, pipeline_dirs):
+        """Test deferred mode skips plots in Stage 2 and records a plot job."""
+        executor, loaded = run_fake_pipeline(pipeline_dirs, plot_mode="deferred")
+        assert executor.commands[-1].endswith("--no-plots")
+        assert loaded["STAGE3"] == "SUCCESSFUL"
+        assert loaded["w0"] == pytest.approx(-1.0, abs=0.05)
+        assert loaded["PLOT_STATUS"] == "DEFERRED"
+        assert "--no-plots" not in loaded["PLOT_COMMAND"]
+        assert os.access(os.path.join(pipeline_dirs["plot_path"], "make_plots.sh"), os.X_OK)
+
+    def test_run_plots_updates_status(self, tmp_path):
+        """Test the deferred plot runner tracks PLOT_STATUS in the summary."""
+        summary_file = tmp_path / "SUMMARY.YAML"
+        summary_file.write_text(yaml.dump({
+            "STAGE3": "SUCCESSFUL",
+            "PLOT_STATUS": "DEFERRED",
+            "PLOT_COMMAND": "echo plotted",
+            "PLOT_LOG": str(tmp_path / "plots.log"),
+            "PLOT_ERR": str(tmp_path / "plots.err"),
+        }))
+        assert run_plots(str(summary_file)) == 0
+        loaded = yaml.safe_load(summary_file.read_text())
+        assert loaded["PLOT_STATUS"] == "SUCCESSFUL"
+        assert loaded["STAGE3"] == "SUCCESSFUL"
+        assert (tmp_path / "plots.log").read_text().strip() == "plotted"
+
+    def test_run_plots_in_recorded_directory(self, pipeline_dirs, tmp_path, monkeypatch):
+        """Test a deferred plot job runs in the wrapper's directory, where the command's relative paths point."""
+        run_dir = tmp_path / "run_dir"
+        (run_dir / "out").mkdir(parents=True)
+        (run_dir / "out" / "chain.txt").write_text("#a\n1\n")
+        monkeypatch.chdir(run_dir)
+        schedule_plots("deferred", "cat out/chain.txt", pipeline_dirs["error_path"], pipeline_dirs["plot_path"],
+                       "sn_only", [], summary_path=pipeline_dirs["summary_path"])
+        monkeypatch.chdir(tmp_path)
+        assert run_plots(str(pipeline_dirs["summary_path"])) == 0
+        loaded = yaml.safe_load(pipeline_dirs["summary_path"].read_text())
+        assert loaded["PLOT_CWD"] == str(run_dir)
+        assert open(loaded["PLOT_LOG"]).read() == "#a\n1\n"
+
+    def test_run_plots_failure(self, tmp_path):
+        """Test a failing plot job is marked FAILED without touching the stages."""
+        summary_file = tmp_path / "SUMMARY.YAML"
+        summary_file.write_text(yaml.dump({
+            "STAGE3": "SUCCESSFUL",
+            "PLOT_COMMAND": "exit 3",
+            "PLOT_LOG": str(tmp_path / "plots.log"),
+            "PLOT_ERR": str(tmp_path / "plots.err"),
+        }))
+        assert run_plots(str(summary_file)) == 3
+        assert yaml.safe_load(summary_file.read_text())["PLOT_STATUS"] == "FAILED"
+
+
+class TestChainIO:
+    """Test the COSMOSIS chain reader."""
+
+    def test_read_chain_header_and_metadata(self, tmp_path):
+        """Test column names, metadata and samples are parsed."""
+        chain = tmp_path / "chain.txt"
+        samples = write_fake_chain(chain, n_rows=20)
+        names, data, metadata = read_chain(str(chain))
+        assert names == CHAIN_COLUMNS
+        assert metadata["sampler"] == "metropolis"
+        np.testing.assert_allclose(data, samples)
+        assert parameter_columns(names) == CHAIN_COLUMNS[:3]
+        assert chain_weights(names, data) is None
+
+    def test_read_chain_log_weights(self, tmp_path):
+        """Test log weights are exponentiated relative to their maximum."""
+        chain = tmp_path / "chain.txt"
+        chain.write_text("#a\tlog_weight\n1.0\t0.0\n2.0\t-1.0\n")
+        names, data, _ = read_chain(str(chain))
+        np.testing.assert_allclose(chain_weights(names, data), [1.0, np.exp(-1.0)])
+
+    def test_read_chain_empty(self, tmp_path):
+        """Test a chain with only a header has no rows."""
+        chain = tmp_path / "chain.txt"
+        chain.write_text("#a\tb\n")
+        names, data, _ = read_chain(str(chain))
+        assert data.shape == (0, 2)
+
+
+class TestMarginalPlots:
+    """Test the native marginal-plot renderer."""
+
+    def test_fft_smooth_conserves_mass(self):
+        """Test FFT smoothing conserves mass and spreads a delta into a Gaussian."""
+        hist = np.zeros(101)
+        hist[50] = 1.0
+        smooth = fft_smooth(hist, [3.0])
+        assert smooth.sum() == pytest.approx(1.0)
+        expected = np.exp(-0.5 * ((np.arange(101) - 50) / 3.0) ** 2)
+        np.testing.assert_allclose(smooth, expected / expected.sum(), atol=1e-10)
+
+    def test_density_1d_peaks_at_mean(self):
+        """Test the 1-D density of a normal sample peaks near its mean."""
+        x = np.random.default_rng(0).normal(2.0, 0.5, 20000)
+        centres, density, _ = density_1d(x, np.ones_like(x))
+        assert centres[np.argmax(density)] == pytest.approx(2.0, abs=0.1)
+        assert (density * (centres[1] - centres[0])).sum() == pytest.approx(1.0, rel=0.02)
+
+    def test_contour_levels_enclose_fractions(self):
+        """Test contour levels enclose the requested probability mass."""
+        grid = np.linspace(-4, 4, 201)
+        xx, yy = np.meshgrid(grid, grid, indexing="ij")
+        density = np.exp(-0.5 * (xx ** 2 + yy ** 2))
+        density /= density.sum()
+        low, high = contour_levels(density, (0.68, 0.95))
+        assert density[density >= high].sum() == pytest.approx(0.68, abs=0.01)
+        assert density[density >= low].sum() == pytest.approx(0.95, abs=0.01)
+
+    def test_select_pairs(self):
+        """Test pair selection: all pairs by default, or explicit a:b pairs."""
+        names = ["a", "b", "c"]
+        assert select_pairs(names) == [("a", "b"), ("a", "c"), ("b", "c")]
+        assert select_pairs(names, ["c:a"]) == [("c", "a")]
+        assert select_pairs(names, ["none"]) == []
+        with pytest.raises(ValueError, match="Invalid parameter pair"):
+            select_pairs(names, ["a:z"])
+
+    def test_render_marginals_writes_plots(self, tmp_path):
+        """Test 1-D and selected 2-D plots are written with cosmosis-style names."""
+        pytest.importorskip("matplotlib")
+        chain = tmp_path / "chain.txt"
+        write_fake_chain(chain, n_rows=500)
+        written = render_marginals(
+            str(chain), str(tmp_path / "PLOTS"), burn=50,
+            pairs=["cosmological_parameters--w:cosmological_parameters--wa"], processes=2,
+        )
+        assert len(written) == 4
+        assert (tmp_path / "PLOTS" / "cosmological_parameters--w.png").exists()
+        assert (tmp_path / "PLOTS" / "2D_cosmological_parameters--w_cosmological_parameters--wa.png").exists()
+
+    def test_native_inline_plots_in_pipeline(self, pipeline_dirs):
+        """Test native inline plots run after the numbers-only Stage 2."""
+        pytest.importorskip("matplotlib")
+        executor, loaded = run_fake_pipeline(pipeline_dirs, plot_backend="native", plot_pairs=["none"])
+        assert executor.commands[-1].endswith("--no-plots")
+        assert loaded["PLOT_STATUS"] == "SUCCESSFUL"
+        assert os.path.exists(os.path.join(pipeline_dirs["plot_path"], "cosmological_parameters--w.png"))
+
+
+class TestParameterStatistics:
+    """Test vectorized posterior summaries for Stage 3."""
+
+    def test_unweighted_matches_numpy(self):
+        """Test mean, std and percentiles match NumPy for equal weights."""
+        samples = np.random.default_rng(3).normal([0.0, 5.0], [1.0, 2.0], size=(4001, 2))
+        results = summarize_samples(["a", "b"], samples, percentiles=(16.0, 84.0))
+        for j, result in enumerate(results):
+            assert result.mean == pytest.approx(samples[:, j].mean())
+            assert result.std == pytest.approx(samples[:, j].std())
+            assert result.median == pytest.approx(np.median(samples[:, j]), abs=1e-3)
+            assert result.percentiles[16.0] == pytest.approx(np.percentile(samples[:, j], 16), abs=1e-2)
+
+    def test_weights_equal_repeated_samples(self):
+        """Test integer weights give the same result as repeated samples."""
+        rng = np.random.default_rng(4)
+        samples = rng.normal(size=(300, 1))
+        weights = rng.integers(1, 4, size=300)
+        weighted = summarize_samples(["a"], samples, weights)[0]
+        repeated = summarize_samples(["a"], np.repeat(samples, weights, axis=0))[0]
+        assert weighted.mean == pytest.approx(repeated.mean)
+        assert weighted.std == pytest.approx(repeated.std)
+        assert weighted.hpd[0.68] == pytest.approx(repeated.hpd[0.68])
+
+    def test_hpd_of_normal_and_skewed(self):
+        """Test HPD intervals: about +-1 sigma for a normal, shifted for a skewed posterior."""
+        rng = np.random.default_rng(5)
+        samples = np.column_stack([rng.normal(size=50000), rng.exponential(size=50000)])
+        normal, skewed = summarize_samples(["n", "e"], samples, hpd_levels=(0.68,))
+        lo, hi = normal.hpd[0.68]
+        assert lo == pytest.approx(-0.99, abs=0.05)
+        assert hi == pytest.approx(0.99, abs=0.05)
+        lo, hi = skewed.hpd[0.68]
+        assert lo == pytest.approx(0.0, abs=0.01)
+        assert hi == pytest.approx(-np.log(0.32), abs=0.05)
+
+    def test_records_use_slots(self):
+        """Test result records are slotted and serialize to plain types."""
+        result = summarize_samples(["a"], np.arange(10.0)[:, None])[0]
+        assert isinstance(result, ParameterSummary)
+        with pytest.raises(AttributeError):
+            result.extra = 1
+        assert yaml.safe_load(yaml.safe_dump(result.to_dict()))["mean"] == pytest.approx(4.5)
+
+    def test_summarize_chain_missing_parameter(self, tmp_path):
+        """Test a parameter absent from the chain is reported."""
+        chain = tmp_path / "chain.txt"
+        write_fake_chain(chain, n_rows=20)
+        with pytest.raises(KeyError, match="sigma_8"):
+            summarize_chain(str(chain), ["cosmological_parameters--sigma_8"])
+
+    def test_stage3_fills_ranges_and_params(self, pipeline_dirs):
+        """Test Stage 3 writes per-parameter records and the range fields."""
+        _, loaded = run_fake_pipeline(pipeline_dirs)
+        samples = write_fake_chain(os.path.join(pipeline_dirs["output_path"], "check.txt"))[30:]
+        assert loaded["w0"] == pytest.approx(samples[:, 1].mean())
+        assert loaded["w0sig_marg"] == pytest.approx(samples[:, 1].std())
+        assert len(loaded["w0ran"]) == 2
+        assert loaded["w0ran"][0] < loaded["w0"] < loaded["w0ran"][1]
+        assert set(loaded["PARAMS"]) == set(CHAIN_COLUMNS[:3])
+        assert set(loaded["PARAMS"]["cosmological_parameters--wa"]["hpd"]) == {0.68, 0.95}
+
+
+class TestReweight:
+    """Test importance reweighting of existing chains."""
+
+    Z = np.linspace(0.05, 1.2, 40)
+
+    def _write_inputs(self, directory, name, shift=None):
+        """Write an HD generated at the fiducial cosmology plus an optional shift."""
+        mu = distance_modulus(self.Z, 0.3, -1.0, 0.0) - 19.3
+        if shift is not None:
+            mu = mu + shift
+        lines = ["zcmb mb dmb"] + [f"{z} {m} 0.02" for z, m in zip(self.Z, mu)]
+        (directory / f"{name}_hd.txt").write_text("\n".join(lines) + "\n")
+        np.save(directory / f"{name}_cov.npy", np.eye(self.Z.size) * 1e-4)
+        return str(directory / f"{name}_hd.txt"), str(directory / f"{name}_cov.npy")
+
+    def test_matter_only_distance(self):
+        """Test the Einstein-de Sitter luminosity distance against its closed form."""
+        z = np.array([0.1, 0.5, 1.0, 2.0])
+        expected = 2 * 299792.458 / 70.0 * (1 + z) * (1 - 1 / np.sqrt(1 + z))
+        np.testing.assert_allclose(luminosity_distance(z, 1.0, -1.0, 0.0), expected, rtol=1e-5)
+
+    def test_batched_distance_matches_scalar(self):
+        """Test a batch of cosmologies matches evaluating them one by one."""
+        omega_m = np.array([0.25, 0.3, 0.35])
+        w0 = np.array([-1.1, -1.0, -0.8])
+        wa = np.array([0.3, 0.0, -0.5])
+        batch = distance_modulus(self.Z, omega_m, w0, wa)
+        for i in range(3):
+            np.testing.assert_allclose(batch[i], distance_modulus(self.Z, omega_m[i], w0[i], wa[i]))
+
+    def test_chi2_marginalizes_offset(self):
+        """Test the chi-square is invariant under a constant magnitude offset."""
+        rng = np.random.default_rng(8)
+        cov = np.diag(rng.uniform(0.01, 0.04, self.Z.size))
+        mu = distance_modulus(self.Z, 0.3, -1.0, 0.0) + rng.normal(0, 0.1, self.Z.size)
+        likelihood = SNLikelihood(self.Z, mu, cov)
+        chi2 = likelihood.chi2_params([0.3, 0.31], [-1.0, -0.9], [0.0, 0.1])
+        shifted = SNLikelihood(self.Z, mu + 0.7, cov)
+        np.testing.assert_allclose(shifted.chi2_params([0.3, 0.31], [-1.0, -0.9], [0.0, 0.1]), chi2)
+        np.testing.assert_allclose(likelihood.chi2_params([0.3], [-1.0], [0.0], batch_size=1), chi2[:1])
+
+    def test_same_data_gives_equal_weights(self, tmp_path):
+        """Test reweighting to the reference data leaves the posterior unchanged."""
+        chain = tmp_path / "chain.txt"
+        samples = write_fake_chain(chain, n_rows=300)
+        reference = load_sn_likelihood(*self._write_inputs(tmp_path, "ref"))
+        result = reweight_chain(str(chain), reference, reference,
+                                str(tmp_path / "out.txt"), str(tmp_path / "covmat.txt"))
+        assert result["ess"] == pytest.approx(300)
+        assert result["warning"] is None
+        assert result["params"][0].mean == pytest.approx(samples[:, 1].mean())
+        names, data, metadata = read_chain(str(tmp_path / "out.txt"))
+        assert names[-1] == "weight"
+        assert metadata["sampler"] == "metropolis"
+        np.testing.assert_allclose(data[:, -1], 1 / 300)
+        assert FoM(str(tmp_path / "covmat.txt")) == pytest.approx(1 / (samples[:, 1].std() * samples[:, 2].std()),
+                                                                  rel=0.1)
+
+    def test_incompatible_data_warns(self, tmp_path):
+        """Test a large change of the data is flagged by a low effective sample size."""
+        chain = tmp_path / "chain.txt"
+        write_fake_chain(chain, n_rows=300)
+        reference = load_sn_likelihood(*self._write_inputs(tmp_path, "ref"))
+        new = load_sn_likelihood(*self._write_inputs(tmp_path, "new", shift=0.3 * self.Z))
+        result = reweight_chain(str(chain), reference, new,
+                                str(tmp_path / "out.txt"), str(tmp_path / "covmat.txt"))
+        assert result["ess"] < 30
+        assert "unreliable" in result["warning"]
+        assert effective_sample_size(np.ones(10)) == pytest.approx(10)
+
+    def test_reweight_mode_writes_summary(self, pipeline_dirs, tmp_path):
+        """Test the wrapper mode skips Stages 0-2 and fills the summary."""
+        chain = tmp_path / "chain.txt"
+        write_fake_chain(chain, n_rows=300)
+        ref_hd, ref_cov = self._write_inputs(tmp_path, "ref")
+        new_hd, new_cov = self._write_inputs(tmp_path, "new", shift=0.002 * self.Z)
+        args = argparse.Namespace(
+            path=str(tmp_path), hd=os.path.basename(new_hd), cov=os.path.basename(new_cov),
+            ini=pipeline_dirs["ini"], summary=pipeline_dirs["summary_path"], reweight=str(chain),
+            reference_hd=ref_hd, reference_cov=ref_cov, extract_params=DEFAULT_PARAMETERS,
+        )
+        run_reweight_mode(args, pipeline_dirs["output_path"], pipeline_dirs["plot_path"])
+        loaded = yaml.safe_load(pipeline_dirs["summary_path"].read_text())
+        assert loaded["STAGE1"] == "SKIPPED"
+        assert loaded["STAGE3"] == "SUCCESSFUL"
+        assert loaded["REWEIGHT_ESS_FRACTION"] > 0.5
+        assert loaded["FoM"] > 0
+        assert "cosmological_parameters--w" in loaded["PARAMS"]
+        assert os.path.exists(os.path.join(pipeline_dirs["output_path"], "REWEIGHTED_sn_only.txt"))
+
+    def test_reweight_mode_burns_in_by_sampler(self, pipeline_dirs, tmp_path):
+        """Test weighted (nested) chains are reweighted without a burn-in, Markov chains with one."""
+        chain = tmp_path / "chain.txt"
+        write_fake_chain(chain, n_rows=300)
+        ref_hd, ref_cov = self._write_inputs(tmp_path, "ref")
+        new_hd, new_cov = self._write_inputs(tmp_path, "new")
+        args = argparse.Namespace(
+            path=str(tmp_path), hd=os.path.basename(new_hd), cov=os.path.basename(new_cov),
+            ini=pipeline_dirs["ini"], summary=pipeline_dirs["summary_path"], reweight=str(chain),
+            reference_hd=ref_hd, reference_cov=ref_cov, extract_params=DEFAULT_PARAMETERS,
+        )
+        burns = {}
+        for sampler in ("metropolis", "multinest"):
+            chain.write_text(chain.read_text().replace("#sampler=metropolis", f"#sampler={sampler}"))
+            with patch("reweight.reweight_chain", side_effect=RuntimeError("stop")) as reweight:
+                with pytest.raises(RuntimeError):
+                    run_reweight_mode(args, pipeline_dirs["output_path"], pipeline_dirs["plot_path"])
+            burns[sampler] = reweight.call_args.kwargs["burn"]
+        assert burns["metropolis"] > 0 and burns["multinest"] == 0
+
+
+class TestFisher:
+    """Test the Fisher-matrix FoM forecast."""
+
+    Z = np.linspace(0.02, 1.0, 60)
+
+    def test_derivatives_match_finer_differences(self):
+        """Test the batched central differences against a one-sided fine difference."""
+        derivatives = distance_modulus_derivatives(self.Z)
+        fine = (distance_modulus(self.Z, 0.3, -1.0 + 1e-5, 0.0) - distance_modulus(self.Z, 0.3, -1.0, 0.0)) / 1e-5
+        np.testing.assert_allclose(derivatives[1], fine, rtol=1e-3, atol=1e-6)
+
+    def test_fisher_matches_explicit_solve(self):
+        """Test the whitened contraction equals D C^-1 D^T without offset marginalization."""
+        rng = np.random.default_rng(9)
+        a = rng.normal(size=(self.Z.size, self.Z.size)) * 0.01
+        cov = a @ a.T + np.eye(self.Z.size) * 0.01
+        likelihood = SNLikelihood(self.Z, np.zeros(self.Z.size), cov)
+        derivatives = distance_modulus_derivatives(self.Z)
+        expected = derivatives @ np.linalg.solve(cov, derivatives.T)
+        np.testing.assert_allclose(likelihood.fisher_matrix(derivatives, marginalize_offset=False), expected,
+                                   rtol=1e-8)
+
+    def test_fom_scales_with_errors(self):
+        """Test halving every error quadruples the FoM, and a prior tightens Omega_m."""
+        cov = np.eye(self.Z.size) * 0.01
+        wide = fisher_forecast(SNLikelihood(self.Z, np.zeros(self.Z.size), cov))
+        narrow = fisher_forecast(SNLikelihood(self.Z, np.zeros(self.Z.size), cov / 4))
+        assert narrow["FoM"] == pytest.approx(4 * wide["FoM"])
+        assert narrow["sigma"]["w0"] == pytest.approx(wide["sigma"]["w0"] / 2)
+        prior = fisher_forecast(SNLikelihood(self.Z, np.zeros(self.Z.size), cov), omega_m_prior=0.01)
+        assert prior["sigma"]["omega_m"] < 0.01 < wide["sigma"]["omega_m"]
+        assert prior["FoM"] > wide["FoM"]
+        assert fisher_matrix(SNLikelihood(self.Z, np.zeros(self.Z.size), cov)).shape == (3, 3)
+
+    def test_fisher_mode_writes_summary(self, pipeline_dirs, tmp_path):
+        """Test the wrapper mode skips every stage and records the forecast."""
+        lines = ["zcmb mb dmb"] + [f"{z} 0.0 0.1" for z in self.Z]
+        (tmp_path / "hd.txt").write_text("\n".join(lines) + "\n")
+        np.save(tmp_path / "cov.npy", np.eye(self.Z.size) * 0.01)
+        args = argparse.Namespace(path=str(tmp_path), hd="hd.txt", cov="cov.npy",
+                                  summary=pipeline_dirs["summary_path"], omega_m_prior=0.02)
+        run_fisher_mode(args)
+        loaded = yaml.safe_load(pipeline_dirs["summary_path"].read_text())
+        assert loaded["STAGE1"] == "SKIPPED"
+        assert loaded["FISHER_FoM"] > 0
+        assert set(loaded["FISHER_SIGMA"]) == {"omega_m", "w0", "wa"}
+
+
+class TestProfiling:
+    """Test the --profile stage profiler."""
+
+    @staticmethod
+    def _busy_work():
+        return sum(np.sort(np.random.default_rng(0).normal(size=20000)).cumsum()[:10])
+
+    def test_disabled_profiler_records_nothing(self, tmp_path):
+        """Test spans are no-ops when profiling is off."""
+        profiler = StageProfiler(str(tmp_path), "run")
+        with profiler.span("burnin"):
+            self._busy_work()
+        assert profiler.records == {}
+        assert profiler.write_report() is None
+        assert list(tmp_path.iterdir()) == []
+
+    def test_in_process_span_writes_artifacts(self, tmp_path):
+        """Test in-process spans write pstats, collapsed stacks and peak memory."""
+        profiler = StageProfiler(str(tmp_path), "run", enabled=True)
+        with profiler.span("STAGE3"):
+            self._busy_work()
+            buffer = np.ones(2 ** 20)  # 8 MB traced by tracemalloc
+            del buffer
+        record = profiler.records["STAGE3"]
+        assert record["peak_traced_mb"] >= 8
+        assert os.path.exists(record["pstats"])
+        lines = open(record["collapsed"]).read().split("\n")
+        assert any("_busy_work" in line for line in lines)
+        stack, _, value = next(line for line in lines if "_busy_work" in line).rpartition(" ")
+        assert int(value) >= 0 and stack
+        assert yaml.safe_load(open(profiler.write_report()))["STAGE3"]["wall_seconds"] >= 0
+
+    def test_concurrent_profiled_spans_take_turns(self, tmp_path):
+        """Test profiled spans of concurrent runs in one process do not clash over the single cProfile slot."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def profiled_run(index):
+            profiler = StageProfiler(str(tmp_path), f"run{index}", enabled=True)
+            for _ in range(3):
+                with profiler.span("STAGE3"):
+                    self._busy_work()
+            return profiler.records["STAGE3"]
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            records = list(pool.map(profiled_run, range(4)))
+        assert all(os.path.exists(record["pstats"]) for record in records)
+
+    def test_external_span_records_child_usage(self, tmp_path):
+        """Test subprocess spans record timings and child resource usage without cProfile."""
+        profiler = StageProfiler(str(tmp_path), "run", enabled=True)
+        with profiler.span("STAGE1", external=True):
+            SubprocessExecutor().run("python -c 'sum(range(10**6))'", str(tmp_path / "o.log"),
+                                     str(tmp_path / "e.err"))
+        record = profiler.records["STAGE1"]
+        assert record["child_cpu_seconds"] > 0
+        assert "pstats" not in record
+
+    def test_collapsed_stacks_split_time_by_caller(self, tmp_path):
+        """Test a function's own time is split between its callers."""
+        import cProfile
+        import pstats
+
+        def leaf():
+            return sum(range(20000))
+
+        def first():
+            for _ in range(30):
+                leaf()
+
+        def second():
+            for _ in range(10):
+                leaf()
+
+        profile = cProfile.Profile()
+        profile.runcall(lambda: (first(), second()))
+        lines = collapsed_stacks(pstats.Stats(profile))
+        leaf_lines = {line.rpartition(" ")[0].split(";")[-2].split(" ")[0]: int(line.rpartition(" ")[2])
+                      for line in lines if line.rpartition(" ")[0].split(";")[-1].startswith("leaf ")}
+        assert set(leaf_lines) == {"first", "second"}
+        assert leaf_lines["first"] > leaf_lines["second"]
+
+    def test_pipeline_profile_report(self, pipeline_dirs):
+        """Test every stage is profiled into ERROR_LOGS when enabled."""
+        profiler = StageProfiler(pipeline_dirs["error_path"], "sn_only", enabled=True)
+        _, loaded = run_fake_pipeline(pipeline_dirs, profiler=profiler)
+        assert loaded["PROFILE"].endswith("PROFILE_sn_only.yaml")
+        report = yaml.safe_load(open(loaded["PROFILE"]))
+        assert list(report) == ["STAGE0", "STAGE1", "burnin", "thinning", "STAGE2", "STAGE3"]
+        assert os.path.exists(os.path.join(pipeline_dirs["error_path"], "PROFILE_sn_only_STAGE3.collapsed"))
+
+
+class TestTelemetry:
+    """Test the Stage 1 chain telemetry."""
+
+    class Clock:
+        def __init__(self):
+            self.now = 1000.0
+
+        def __call__(self):
+            return self.now
+
+    def test_incremental_row_count(self, tmp_path):
+        """Test only complete sample rows are counted, across partial writes."""
+        chain = tmp_path / "chain.txt"
+        chain.write_text("#a\tb\n#sampler=metropolis\n1 2\n3 ")
+        telemetry = ChainTelemetry(str(chain), str(tmp_path / "t.prom"))
+        assert telemetry.poll()["rows"] == 1
+        with open(chain, "a") as handle:
+            handle.write("4\n## comment\n5 6\n#n_eff=2\n")
+        assert telemetry.poll()["rows"] == 3
+        chain.write_text("#a\tb\n7 8\n")
+        assert telemetry.poll()["rows"] == 1
+
+    def test_rate_eta_and_stall(self, tmp_path):
+        """Test throughput, ETA and the stall flag with a controlled clock."""
+        chain = tmp_path / "chain.txt"
+        chain.write_text("#a\n")
+        clock = self.Clock()
+        telemetry = ChainTelemetry(str(chain), str(tmp_path / "t.prom"), expected_rows=100, n_ranks=2,
+                                   stall_after=60, clock=clock)
+        telemetry.poll()
+        with open(chain, "a") as handle:
+            handle.write("1\n" * 20)
+        clock.now += 10
+        metrics = telemetry.poll()
+        assert metrics["rows_per_second"] == pytest.approx(2.0)
+        assert metrics["rows_per_rank"] == 10
+        assert metrics["eta_seconds"] == pytest.approx(40.0)
+        assert metrics["stalled"] == 0
+        clock.now += 61
+        assert telemetry.poll()["stalled"] == 1
+
+    def test_openmetrics_file(self, tmp_path):
+        """Test the metrics file is OpenMetrics text with labels and an EOF marker."""
+        chain = tmp_path / "chain.txt"
+        chain.write_text("#a\n1\n")
+        metrics_file = tmp_path / "t.prom"
+        ChainTelemetry(str(chain), str(metrics_file), labels={"stage": "STAGE1"}).poll()
+        lines = metrics_file.read_text().splitlines()
+        assert lines[-1] == "# EOF"
+        assert 'firecrown_chain_rows{chain="chain.txt",stage="STAGE1"} 1' in lines
+        assert 'firecrown_chain_eta_seconds{chain="chain.txt",stage="STAGE1"} NaN' in lines
+        assert "# TYPE firecrown_chain_stalled gauge" in lines
+
+    def test_metric_values_keep_all_digits(self, tmp_path):
+        """Test large counts and timestamps are written exactly, not rounded to six digits."""
+        chain = tmp_path / "chain.txt"
+        chain.write_text("#a\n" + "1\n" * 1234567)
+        clock = self.Clock()
+        clock.now = 1792431234.5678
+        metrics_file = tmp_path / "t.prom"
+        ChainTelemetry(str(chain), str(metrics_file), expected_rows=2000000, clock=clock).poll()
+        lines = metrics_file.read_text().splitlines()
+        assert 'firecrown_chain_rows{chain="chain.txt"} 1234567' in lines
+        assert 'firecrown_chain_last_update_timestamp_seconds{chain="chain.txt"} 1792431234.5678' in lines
+
+    def test_expected_rows_from_ini(self, tmp_path):
+        """Test the chain length is read from the ini and -p overrides."""
+        ini = tmp_path / "run.ini"
+        ini.write_text("[runtime]\nsampler = metropolis\n[metropolis]\nsamples = 5000\n"
+                       "[emcee]\nwalkers = 32\nsamples = 100\n")
+        assert expected_rows_from_ini(str(ini), n_ranks=4) == 20000
+        assert expected_rows_from_ini(str(ini), "metropolis.samples=10") == 10
+        assert expected_rows_from_ini(str(ini), "runtime.sampler=emcee") == 3200
+        assert expected_rows_from_ini(str(ini), "runtime.sampler=multinest") is None
+
+    def test_executor_runs_monitor(self, tmp_path):
+        """Test the executor polls the chain while the command runs."""
+        chain = tmp_path / "chain.txt"
+        telemetry = ChainTelemetry(str(chain), str(tmp_path / "t.prom"), interval=0.01)
+        command = f"printf '#a\\n1\\n2\\n' > {chain}; sleep 0.1"
+        returncode = SubprocessExecutor().run(command, str(tmp_path / "o.log"), str(tmp_path / "e.err"),
+                                              monitor=telemetry)
+        assert returncode == 0
+        assert telemetry.rows == 2
+        assert telemetry._thread is None
+
+    def test_pipeline_writes_telemetry(self, pipeline_dirs):
+        """Test Stage 1 publishes its telemetry file."""
+        _, loaded = run_fake_pipeline(pipeline_dirs)
+        assert loaded["TELEMETRY"].endswith("TELEMETRY_sn_only.prom")
+        lines = open(loaded["TELEMETRY"]).read().splitlines()
+        assert 'firecrown_chain_rows{chain="sn_only.txt",ini="sn_only",stage="STAGE1"} 200' in lines
+
+
+class TestRunContext:
+    """Test per-run state for concurrent pipelines in one interpreter."""
+
+    def _write_inputs(self, tmp_path):
+        input_dir = tmp_path / "input"
+        input_dir.mkdir()
+        (input_dir / "hd.txt").write_text("zcmb mb dmb\n0.1 38.3 0.1\n0.5 42.3 0.1\n")
+        (input_dir / "cov.txt").write_text("2\n0.01\n0\n0\n0.01\n")
+        ini_file = tmp_path / "sn_only.ini"
+        ini_file.write_text("[runtime]\nsampler = metropolis\n")
+        return str(input_dir), str(ini_file)
+
+    def test_concurrent_runs_share_no_state(self, tmp_path):
+        """Test runs on a thread pool keep separate summaries and leave the global one alone."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        path, ini = self._write_inputs(tmp_path)
+        original = copy.deepcopy(summary)
+        contexts = []
+        for i in range(4):
+            outdir = tmp_path / f"run{i}"
+            outdir.mkdir()
+            contexts.append(RunContext(str(outdir), executor=FakePipelineExecutor(str(outdir / "PLOTS"))))
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda c: c.run_stages(path, "hd.txt", "cov.txt", ini, plot_mode="off"), contexts))
+
+        for context in contexts:
+            loaded = yaml.safe_load(context.summary_path.read_text())
+            assert loaded["STAGE3"] == "SUCCESSFUL"
+            assert loaded["PLOT_STATUS"] == "DISABLED"
+            assert context.summary["FoM"] == loaded["FoM"]
+            assert os.path.dirname(context.executor.commands[1].split("output.filename=")[1].split()[0]) == \
+                context.output_path
+        assert summary == original
+
+    def test_stage0_runs_in_workdir(self, tmp_path):
+        """Test generate_sn_data.py runs in the context's working directory."""
+        calls = []
+
+        class RecordingExecutor:
+            def run_with_retry(self, command, output_file, error_file, **kwargs):
+                calls.append(kwargs["cwd"])
+                (tmp_path / "srd-y1-converted.sacc").write_text("sacc")
+                return 0, [{"attempt": 1, "returncode": 0, "transient": False, "seconds": 0.0}]
+
+        context = RunContext(str(tmp_path))
+        sacc_file = generate_sacc(RecordingExecutor(), "input", "hd.txt", "cov.txt", str(tmp_path), "run", [],
+                                  destination=str(tmp_path / "run.sacc"), context=context)
+        assert calls == [str(tmp_path)]
+        assert sacc_file == str(tmp_path / "run.sacc")
+        assert context.summary["STAGE0"] == "SUCCESSFUL"
+        assert yaml.safe_load(context.summary_path.read_text())["STAGE0"] == "SUCCESSFUL"
+
+
+class TestChainCompression:
+    """Test compressed chains and the readers that stream from them."""
+
+    @pytest.mark.parametrize("method", ["gzip", "xz"])
+    def test_compress_round_trip(self, tmp_path, method):
+        """Test a compressed chain reads back identically and the raw file is removed."""
+        chain = str(tmp_path / "chain.txt")
+        write_fake_chain(chain, n_rows=500)
+        names, data, metadata = read_chain(chain)
+        result = compress_chain(chain, method)
+        assert not os.path.exists(chain)
+        assert resolve_chain(chain) == result["path"]
+        assert result["compressed_bytes"] < result["raw_bytes"] / 2
+        names2, data2, metadata2 = read_chain(chain)
+        assert names2 == names and metadata2 == metadata
+        np.testing.assert_array_equal(data2, data)
+        assert burnin(chain) == 75
+        assert chain_has_samples(chain)
+
+    def test_zstd_when_available(self, tmp_path):
+        """Test zstd compression when the stdlib module or zstandard is present."""
+        chain = str(tmp_path / "chain.txt")
+        write_fake_chain(chain, n_rows=50)
+        try:
+            result = compress_chain(chain, "zstd")
+        except ImportError:
+            pytest.skip("No zstd implementation available")
+        assert result["path"].endswith(".zst")
+        assert read_chain(chain)[1].shape == (50, len(CHAIN_COLUMNS))
+
+    def test_unknown_method_and_missing_chain(self, tmp_path):
+        """Test invalid methods are rejected and missing chains still raise FileNotFoundError."""
+        chain = str(tmp_path / "chain.txt")
+        write_fake_chain(chain, n_rows=5)
+        with pytest.raises(ValueError, match="Unknown chain compression"):
+            compress_chain(chain, "bz2")
+        assert os.path.exists(chain)
+        assert os.listdir(tmp_path) == ["chain.txt"]
+        with pytest.raises(FileNotFoundError):
+            open_chain(str(tmp_path / "missing.txt"))
+
+    def test_pipeline_compresses_after_stage2(self, pipeline_dirs):
+        """Test Stage 3 reads the compressed chain."""
+        _, loaded = run_fake_pipeline(pipeline_dirs, compress_chains="gzip")
+        chain = os.path.join(pipeline_dirs["output_path"], "sn_only.txt")
+        assert not os.path.exists(chain)
+        assert loaded["CHAIN_COMPRESSION"]["path"] == chain + ".gz"
+        assert loaded["STAGE3"] == "SUCCESSFUL"
+        assert loaded["w0"] is not None
+
+    def test_deferred_cosmosis_plots_keep_raw_chain(self, pipeline_dirs):
+        """Test the chain stays uncompressed when cosmosis-postprocess still has to read it."""
+        with patch("deferred_plots.launch_background"):
+            _, loaded = run_fake_pipeline(pipeline_dirs, compress_chains="gzip", plot_mode="background")
+        assert os.path.exists(os.path.join(pipeline_dirs["output_path"], "sn_only.txt"))
+        assert "CHAIN_COMPRESSION" not in loaded
+
+
+class TestBlockCovariance:
+    """Test block-structured joint covariances of several surveys."""
+
+    @staticmethod
+    def _spd(rng, n):
+        a = rng.normal(size=(n, n))
+        return a @ a.T + n * np.eye(n)
+
+    def test_factor_matches_dense(self):
+        """Test the block Cholesky log-determinant and whitening equal those of the dense matrix."""
+        rng = np.random.default_rng(3)
+        blocks = [self._spd(rng, 4), self._spd(rng, 3), self._spd(rng, 5)]
+        cov = BlockCovariance(blocks, {(0, 2): 0.2 * rng.normal(size=(4, 5)), (2, 1): 0.2 * rng.normal(size=(5, 3))})
+        dense = cov.dense()
+        assert np.allclose(dense, dense.T) and cov.n == 12
+        assert cov.logdet() == pytest.approx(np.linalg.slogdet(dense)[1])
+        vectors = rng.normal(size=(6, 12))
+        np.testing.assert_allclose(cov.whiten(vectors), np.linalg.solve(np.linalg.cholesky(dense), vectors.T).T)
+        # Independent surveys are factorized one block at a time
+        assert sorted(BlockCovariance(blocks).cholesky()) == [(0, 0), (1, 1), (2, 2)]
+        with pytest.raises(ValueError, match="shape"):
+            BlockCovariance(blocks, {(1, 0): np.zeros((4, 3))})
+
+    def test_joint_stage0_and_likelihood(self, tmp_path):
+        """Test two surveys with a cross block give the same SACC data and chi-square as one dense input."""
+        (tmp_path / "a.txt").write_text("zcmb mb dmb\n0.1 38.3 0.1\n0.5 42.3 0.1\n")
+        (tmp_path / "b.txt").write_text("zcmb mb dmb\n0.8 43.5 0.2\n")
+        np.save(tmp_path / "a.npy", np.array([[0.04, 0.01], [0.01, 0.09]]))
+        np.save(tmp_path / "b.npy", np.array([[0.05]]))
+        (tmp_path / "ab.txt").write_text("2 1\n0.01\n-0.02\n")
+        z, mu, cov = load_surveys(str(tmp_path), [("a.txt", "a.npy"), ("b.txt", "b.npy")], [(0, 1, "ab.txt")])
+        np.testing.assert_allclose(z, [0.1, 0.5, 0.8])
+        expected = np.array([[0.05, 0.01, 0.01], [0.01, 0.1, -0.02], [0.01, -0.02, 0.09]])
+        np.testing.assert_allclose(cov.dense(), expected)
+        mu_theory = mu + np.array([[0.1, -0.2, 0.3], [0.0, 0.1, 0.0]])
+        np.testing.assert_allclose(SNLikelihood(z, mu, cov).chi2(mu_theory),
+                                   SNLikelihood(z, mu, expected).chi2(mu_theory))
+        (tmp_path / "bad.txt").write_text("1.0\n1.0\n")
+        with pytest.raises(ValueError, match="positive definite"):
+            load_surveys(str(tmp_path), [("a.txt", "a.npy"), ("b.txt", "b.npy")], [(1, 0, "bad.txt")])
+
+        sacc = pytest.importorskip("sacc")
+        joint = generate_sacc_inprocess(str(tmp_path), "a.txt", "a.npy", str(tmp_path / "joint.sacc"),
+                                        surveys=[("b.txt", "b.npy")], cross_covariances=[(0, 1, "ab.txt")])
+        np.testing.assert_allclose(sacc.Sacc.load_fits(joint).covariance.dense, expected)
+        separate = generate_sacc_inprocess(str(tmp_path), "a.txt", "a.npy", str(tmp_path / "blocks.sacc"),
+                                           surveys=[("b.txt", "b.npy")])
+        data = sacc.Sacc.load_fits(separate)
+        assert type(data.covariance).__name__ == "BlockDiagonalCovariance"
+        np.testing.assert_allclose(data.mean, [38.3, 42.3, 43.5])
+
+
+class TestResources:
+    """Test CPU sets, thread counts and core allocation for co-located runs."""
+
+    def test_environment(self):
+        """Test a spec sets every thread pool to its threads and the MPI hints to its CPUs."""
+        assert format_cpu_list([11, 0, 1, 2, 3, 8, 10]) == "0-3,8,10-11"
+        env = ResourceSpec([4, 5, 6, 7], threads=2, mpi_bind="core").environment({"PATH": "/bin"})
+        assert env["PATH"] == "/bin"
+        assert env["OMP_NUM_THREADS"] == env["OPENBLAS_NUM_THREADS"] == env["MKL_NUM_THREADS"] == "2"
+        assert env["OMPI_MCA_hwloc_base_cpu_set"] == env["I_MPI_PIN_PROCESSOR_LIST"] == "4-7"
+        assert env["OMPI_MCA_hwloc_base_binding_policy"] == "core"
+        assert ResourceSpec().environment({}) == {}
+        assert ResourceSpec([0, 1]).threads == 2
+
+    def test_allocations_are_disjoint(self, tmp_path):
+        """Test concurrent allocations never share a core and released cores are reused."""
+        registry = str(tmp_path / "cores")
+        first = allocate_cores(2, registry, cpus=[0, 1, 2, 3])
+        second = allocate_cores(3, registry, cpus=[0, 1, 2, 3])
+        assert first.cpus == [0, 1]
+        assert second.cpus == [2, 3]
+        assert allocate_cores(1, registry, cpus=[0, 1, 2, 3]).cpus == []
+        first.release()
+        with allocate_cores(2, registry, cpus=[0, 1, 2, 3]) as third:
+            assert third.cpus == [0, 1]
+        second.release()
+
+    @pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="no CPU affinity control")
+    def test_executor_pins_command(self, tmp_path):
+        """Test the command sees the spec's CPUs and thread counts and the caller's mask is restored."""
+        cpus = available_cpus()
+        spec = ResourceSpec(cpus[:1], threads=1)
+        out_file = tmp_path / "out.log"
+        returncode = SubprocessExecutor().run(
+            f"echo $OMP_NUM_THREADS $OPENBLAS_NUM_THREADS; "
+            f"{sys.executable} -c 'import os; print(sorted(os.sched_getaffinity(0)))'",
+            str(out_file),
+            str(tmp_path / "err.log"),
+            resources=spec,
+        )
+        assert returncode == 0
+        assert out_file.read_text().splitlines() == ["1 1", str(cpus[:1])]
+        assert available_cpus() == cpus
+
+    def test_pipeline_records_resources(self, pipeline_dirs):
+        """Test Stage 1 splits the run's cores between MPI ranks and the summary records the specs."""
+        specs = stage_resource_specs([0, 1, 2, 3], n_ranks=2)
+        _, loaded = run_fake_pipeline(pipeline_dirs, plot_mode="off", resource_specs=specs)
+        assert loaded["RESOURCES"]["STAGE1"] == {"cpus": "0-3", "threads": 2, "mpi_bind": "core"}
+        assert loaded["RESOURCES"]["STAGE2"]["threads"] == 4
+        assert stage_resource_specs([]) == {}
+
+
+class TestProposalCache:
+    """Test the proposal covariance warm-start cache for Stage 1."""
+
+    VALUES = ("[cosmological_parameters]\nomega_m = 0.1 0.3 0.5  ; matter\nw = -2.0 -1.0 0.0\n"
+              "wa = -1.0 0.0 1.0\nh0 = 0.7\n")
+
+    def test_varied_parameters_and_start_points(self, tmp_path):
+        """Test varied parameters come from the values file and starts are clipped into the prior."""
+        (tmp_path / "values.ini").write_text(self.VALUES)
+        (tmp_path / "run.ini").write_text("[pipeline]\nvalues = values.ini\n")
+        parameters = varied_parameters(str(tmp_path / "run.ini"))
+        assert [p[0] for p in parameters] == ["cosmological_parameters--omega_m", "cosmological_parameters--w",
+                                              "cosmological_parameters--wa"]
+        assert parameters[0][1:] == (0.1, 0.3, 0.5)
+        entry = {"bestfit": {"cosmological_parameters--omega_m": 0.31, "cosmological_parameters--w": -2.5}}
+        overrides = start_overrides(entry, parameters)
+        assert overrides[0] == "'cosmological_parameters.omega_m=0.1 0.31 0.5'"
+        assert float(overrides[1].strip("'").split()[1]) == pytest.approx(-2.0, abs=1e-5)
+        assert varied_parameters(str(tmp_path / "values.ini")) == []
+
+    def test_nearest_dataset(self, tmp_path):
+        """Test an identical input matches first, then the nearest dataset within the limit."""
+        cache = ProposalCache(str(tmp_path / "cache"))
+        names = ["a--x", "a--y"]
+        near = {"n_sn": 1000, "z_min": 0.01, "z_median": 0.4, "z_max": 1.2}
+        far = {"n_sn": 40, "z_min": 0.01, "z_median": 0.1, "z_max": 0.2}
+        cache.store(names, np.eye(2), {"a--x": 1.0}, near, "near")
+        cache.store(names, 2 * np.eye(2), {"a--x": 2.0}, far, "far")
+        query = {"n_sn": 1100, "z_min": 0.01, "z_median": 0.42, "z_max": 1.1}
+        assert cache.nearest(["a--y", "a--x"], query)["input_hash"] == "near"
+        assert cache.nearest(names, query, input_hash="far")["distance"] == 0.0
+        assert cache.nearest(names, {"n_sn": 5, "z_min": 0.0, "z_median": 2.0, "z_max": 3.0}) is None
+        assert cache.nearest(["a--x"], query) is None
+
+    def test_pipeline_warm_starts_second_run(self, pipeline_dirs, tmp_path):
+        """Test a finished Metropolis run seeds the proposal and start point of the next one."""
+        (tmp_path / "values.ini").write_text(self.VALUES)
+        with open(pipeline_dirs["ini"], "a") as handle:
+            handle.write(f"[pipeline]\nvalues = {tmp_path / 'values.ini'}\n")
+        cache_dir = str(tmp_path / "cache")
+        executor, loaded = run_fake_pipeline(pipeline_dirs, plot_mode="off", proposal_cache=cache_dir)
+        assert loaded["PROPOSAL"] is None
+        assert "metropolis.covmat" not in executor.commands[1]
+
+        executor, loaded = run_fake_pipeline(pipeline_dirs, plot_mode="off", proposal_cache=cache_dir)
+        proposal = loaded["PROPOSAL"]
+        assert proposal["distance"] == 0.0
+        assert f"metropolis.covmat={proposal['covmat']}" in executor.commands[1]
+        assert " -v 'cosmological_parameters.omega_m=0.1 " in executor.commands[1]
+        assert executor.commands[1].endswith("--mpi")
+        cov = np.loadtxt(proposal["covmat"])
+        assert np.allclose(cov, np.diag([0.02, 0.1, 0.3]) ** 2)
+        assert dataset_descriptor(os.path.join(pipeline_dirs["path"], "hd.txt"))["n_sn"] == 2
+
+
+class TestWorkQueue:
+    """Test the shared-filesystem work queue with leases."""
+
+    JOB = {"path": "/data", "hd": "hd.txt", "cov": "cov.txt", "ini": "sn_only.ini", "outdir": "/out"}
+
+    def test_concurrent_claims_are_exclusive(self, tmp_path):
+        """Test every job is claimed by exactly one of many concurrent workers."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        queue = str(tmp_path / "queue")
+        job_ids = {submit_queue_job(queue, self.JOB) for _ in range(20)}
+
+        def drain(i):
+            worker = QueueWorker(queue, worker_id=f"w{i}")
+            claimed = []
+            while True:
+                job = worker.claim_next()
+                if job is None:
+                    return claimed
+                assert worker.holds_lease(job)
+                claimed.append(job["id"])
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            claims = [job_id for claimed in pool.map(drain, range(8)) for job_id in claimed]
+        assert sorted(claims) == sorted(job_ids)
+        assert queue_status(queue)["running"] == 20
+        with pytest.raises(ValueError, match="missing ini"):
+            submit_queue_job(queue, {"path": "/data", "hd": "hd.txt", "cov": "cov.txt", "outdir": "/out"})
+
+    def test_expired_leases_are_reclaimed(self, tmp_path):
+        """Test a crashed worker's job returns to pending and is abandoned after too many claims."""
+        queue = str(tmp_path / "queue")
+        job_id = submit_queue_job(queue, self.JOB)
+        crashed = QueueWorker(queue, lease_seconds=60, max_claims=2, worker_id="crashed")
+        job = crashed.claim_next()
+        assert reclaim_expired(queue, lease_seconds=60) == []
+        assert reclaim_expired(queue, lease_seconds=60, now=time.time() + 120) == [job_id]
+        assert queue_status(queue) == {"pending": 1, "running": 0, "done": 0, "workers": []}
+        assert not crashed.finish_job(job, {"status": "SUCCESSFUL", "returncode": 0})
+
+        second = QueueWorker(queue, lease_seconds=60, max_claims=2, worker_id="second")
+        job = second.claim_next()
+        assert job["claims"] == 2 and job["reclaimed"][0]["worker"] == "crashed"
+        reclaim_expired(queue, lease_seconds=60, max_claims=2, now=time.time() + 120)
+        done = json.loads((tmp_path / "queue" / "done" / f"{job_id}.json").read_text())
+        assert done["status"] == "ABANDONED"
+
+    def test_worker_runs_stages(self, pipeline_dirs, tmp_path):
+        """Test a worker runs a queued job through run_stages and records its outcome."""
+        queue = str(tmp_path / "queue")
+        outdir = os.path.dirname(pipeline_dirs["error_path"])
+        job_id = submit_queue_job(queue, {
+            "path": pipeline_dirs["path"], "hd": "hd.txt", "cov": "cov.txt", "ini": pipeline_dirs["ini"],
+            "outdir": outdir, "options": {"plot_mode": "off"},
+        })
+        worker = QueueWorker(queue, lease_seconds=4, poll_interval=0.1)
+        with patch("Firecrown_wrapper.get_executor", return_value=FakePipelineExecutor(pipeline_dirs["plot_path"])):
+            assert worker.serve_forever(max_jobs=5, idle_timeout=0.2) == 1
+        done = json.loads((tmp_path / "queue" / "done" / f"{job_id}.json").read_text())
+        assert done["status"] == "SUCCESSFUL" and done["worker"] == worker.worker_id
+        assert yaml.safe_load((pipeline_dirs["summary_path"]).read_text())["STAGE3"] == "SUCCESSFUL"
+        assert queue_status(queue) == {"pending": 0, "running": 0, "done": 1, "workers": []}
+
+    def test_worker_applies_submitted_run_options(self, pipeline_dirs, tmp_path):
+        """Test a queued job runs in its submitter's directory with its retry and stall limits, and is recorded."""
+        class RecordingExecutor(FakePipelineExecutor):
+            def run_with_retry(self, command, output_file, error_file, **kwargs):
+                self.calls.append((os.getcwd(), kwargs))
+                return super().run_with_retry(command, output_file, error_file, **kwargs)
+
+        queue = str(tmp_path / "queue")
+        submit_dir = tmp_path / "submit"
+        submit_dir.mkdir()
+        submit_queue_job(queue, {
+            "path": pipeline_dirs["path"], "hd": "hd.txt", "cov": "cov.txt", "ini": pipeline_dirs["ini"],
+            "outdir": os.path.dirname(pipeline_dirs["error_path"]), "options": {"plot_mode": "off"},
+            "cwd": str(submit_dir), "argv": ["Firecrown_wrapper.py", "--queue", queue],
+            "max_attempts": 4, "stall_timeout": 42.0,
+        })
+        executor = RecordingExecutor(pipeline_dirs["plot_path"])
+        executor.calls = []
+        worker = QueueWorker(queue, lease_seconds=4, poll_interval=0.1, perf_db=str(tmp_path / "perf.sqlite"))
+        before = os.getcwd()
+        with patch("Firecrown_wrapper.get_executor", return_value=executor):
+            assert worker.serve_forever(max_jobs=1, idle_timeout=0.2) == 1
+        assert os.getcwd() == before
+        cwd, kwargs = [call for call in executor.calls if call[1].get("monitor") is not None][0]
+        assert cwd == str(submit_dir)
+        assert kwargs["retry_policy"].max_attempts == 4 and kwargs["timeout_policy"].stall_seconds == 42.0
+        info = open(os.path.join(pipeline_dirs["error_path"], "INPUT.INFO")).read()
+        assert f"CWR: {submit_dir}" in info and "--queue" in info
+        assert yaml.safe_load(pipeline_dirs["summary_path"].read_text())["PERF_RUN_ID"] is not None
+
+    def test_wrapper_rejects_worker_options_with_queue(self, pipeline_dirs, tmp_path, monkeypatch):
+        """Test options the queue worker cannot honour are rejected at submission."""
+        monkeypatch.setattr(sys, "argv", [
+            "Firecrown_wrapper.py", pipeline_dirs["path"], "hd.txt", "cov.txt", pipeline_dirs["ini"],
+            "-O", str(tmp_path / "queued"), "--queue", str(tmp_path / "queue"), "--cpus", "2",
+        ])
+        with pytest.raises(SystemExit):
+            main()
+        assert not (tmp_path / "queue" / "pending").exists()
+
+    def test_wrapper_submits_to_queue(self, pipeline_dirs, tmp_path, monkeypatch):
+        """Test --queue writes a job spec instead of running the stages."""
+        queue = tmp_path / "queue"
+        outdir = tmp_path / "queued"
+        outdir.mkdir()
+        monkeypatch.setattr(sys, "argv", [
+            "Firecrown_wrapper.py", pipeline_dirs["path"], "hd.txt", "cov.txt", pipeline_dirs["ini"],
+            "-O", str(outdir), "--queue", str(queue), "--plots", "off",
+        ])
+        with patch("Firecrown_wrapper.get_executor") as executor:
+            main()
+        executor.assert_not_called()
+        [name] = os.listdir(queue / "pending")
+        job = json.loads((queue / "pending" / name).read_text())
+        assert job["outdir"] == str(outdir) and job["summary"] == str(outdir / "SUMMARY.YAML")
+        assert job["options"]["plot_mode"] == "off" and job["options"]["thin_chains"]
+        assert job["cwd"] == os.getcwd() and job["max_attempts"] is None
+
+
+class TestTimeoutPolicy:
+    """Test heartbeat-based stall detection and history-based wall limits."""
+
+    def test_kill_reasons(self):
+        """Test stalls kill at any time, and past the wall limit only a shorter stall does."""
+        policy = TimeoutPolicy(wall_seconds=100, stall_seconds=50, overrun_stall_seconds=10)
+        assert policy.kill_reason(elapsed=30, silent=5) is None
+        assert policy.kill_reason(elapsed=30, silent=50) == "stalled"
+        assert policy.kill_reason(elapsed=500, silent=5) is None
+        assert policy.kill_reason(elapsed=500, silent=10) == "stalled_past_wall_limit"
+        assert policy.kill_reason(elapsed=100, silent=0, watched=False) == "wall_limit"
+        assert TimeoutPolicy().kill_reason(elapsed=1e6, silent=1e6) is None
+
+    def test_stalled_stage_is_killed_and_recorded(self, tmp_path):
+        """Test a silent command is killed quickly and the reason lands in the summary."""
+        context = RunContext(str(tmp_path), executor=SubprocessExecutor())
+        context.summary["ATTEMPTS"] = {}
+        policy = TimeoutPolicy(wall_seconds=3600, stall_seconds=0.5, poll_interval=0.1)
+        with pytest.raises(RuntimeError, match=r"killed \(stalled\)") as error:
+            run_subprocess_stage(
+                context.executor, "STAGE0", "sleep 30", str(tmp_path / "out.log"), str(tmp_path / "err.log"),
+                "Stage 0", "Stage 0 hung", timeout_policy=policy,
+                heartbeat=Heartbeat([str(tmp_path / "out.log")]), context=context,
+            )
+        assert isinstance(error.value.__cause__, StageKilled)
+        loaded = yaml.safe_load((tmp_path / "SUMMARY.YAML").read_text())
+        assert loaded["STAGE0"] == "FAILED"
+        killed = loaded["TIMEOUTS"]["STAGE0"]["killed"]
+        assert killed["reason"] == "stalled" and killed["elapsed_seconds"] < 10
+        assert loaded["ATTEMPTS"]["STAGE0"][0]["killed"]["reason"] == "stalled"
+
+    def test_progressing_stage_runs_past_wall_limit(self, tmp_path):
+        """Test a command whose output keeps growing is not killed at its wall limit."""
+        chain = tmp_path / "chain.txt"
+        command = f"{sys.executable} -c \"import time\nfor i in range(12):\n" \
+                  f"    open('{chain}', 'a').write('1\\n'); time.sleep(0.1)\""
+        policy = TimeoutPolicy(wall_seconds=0.2, stall_seconds=1.0, overrun_stall_seconds=0.5, poll_interval=0.05)
+        returncode = SubprocessExecutor().run(command, str(tmp_path / "out.log"), str(tmp_path / "err.log"),
+                                              timeout_policy=policy, heartbeat=Heartbeat([str(chain)]))
+        assert returncode == 0
+        assert len(chain.read_text().split()) == 12
+
+    def test_wall_limits_from_history(self, tmp_path):
+        """Test wall limits follow the slowest recent successful runs once there are enough."""
+        db = str(tmp_path / "perf.sqlite")
+        fingerprint = {"ini": "sn_only"}
+        for i, wall in enumerate([200.0, 400.0]):
+            record_run(db, fingerprint, {"STAGE1": {"wall_seconds": wall}}, {"STAGE1": "SUCCESSFUL"}, started=i)
+        assert historical_wall_limit(db, "sn_only", "STAGE1") is None
+        record_run(db, fingerprint, {"STAGE1": {"wall_seconds": 9000.0}}, {"STAGE1": "FAILED"}, started=2)
+        record_run(db, fingerprint, {"STAGE1": {"wall_seconds": 300.0}}, {"STAGE1": "SUCCESSFUL"}, started=3)
+        assert historical_wall_limit(db, "sn_only", "STAGE1") == 1200.0
+        policies = stage_timeout_policies(db, "sn_only", stall_timeout=60)
+        assert policies["STAGE1"].wall_seconds == 1200.0 and policies["STAGE1"].source == "history"
+        assert policies["STAGE0"].wall_seconds == 3600 and policies["STAGE0"].source == "default"
+        assert all(policy.stall_seconds == 60 for policy in policies.values())
+
+
+class TestResultStore:
+    """Test whole-run memoization in the shared result store."""
+
+    @staticmethod
+    def store_args(dirs, store_dir, outdir=None):
+        """Command-line arguments of a plain run on the pipeline_dirs inputs."""
+        return argparse.Namespace(
+            path=dirs["path"], hd="hd.txt", cov="cov.txt", ini=dirs["ini"], param="",
+            outdir=outdir or os.path.dirname(dirs["error_path"]),
+            summary=str(dirs["summary_path"]) if outdir is None else os.path.join(outdir, "SUMMARY.YAML"),
+            plots="inline", plot_backend="cosmosis", plot_pairs=None, extract_params=list(DEFAULT_PARAMETERS),
+            compress_chains=None, no_thin=False, incremental=False, sacc=None, result_store=str(store_dir),
+        )
+
+    def test_result_key(self, tmp_path):
+        """Test the key follows file contents, ini dependencies and options, not paths."""
+        for directory in ("a", "b"):
+            (tmp_path / directory).mkdir()
+            (tmp_path / directory / "hd.txt").write_text("zcmb mb\n0.1 38.3\n")
+            (tmp_path / directory / "values.ini").write_text("[cosmological_parameters]\nw = -1.5 -1.0 -0.5\n")
+            (tmp_path / directory / "run.ini").write_text("[pipeline]\nvalues = values.ini\n")
+        keys = [result_key(str(tmp_path / d / "hd.txt"), str(tmp_path / d / "hd.txt"), str(tmp_path / d / "run.ini"),
+                           options={"plots": "inline"}) for d in ("a", "b")]
+        assert keys[0] == keys[1]
+        (tmp_path / "b" / "values.ini").write_text("[cosmological_parameters]\nw = -2.0 -1.0 0.0\n")
+        paths = [str(tmp_path / "b" / name) for name in ("hd.txt", "hd.txt", "run.ini")]
+        assert result_key(*paths, options={"plots": "inline"}) != keys[0]
+        assert result_key(*paths, options={"plots": "off"}) != result_key(*paths, options={"plots": "inline"})
+        assert parse_size("500G") == 500 * 2 ** 30 and parse_size("1024") == 1024
+
+    def test_tar_staged_runs_have_their_own_key(self, pipeline_dirs, tmp_path):
+        """Test a tar-staged run is not restored into a plain run, while copy staging shares the key."""
+        plain = self.store_args(pipeline_dirs, tmp_path / "store")
+        staged = argparse.Namespace(**vars(plain), stage_dir=str(tmp_path), stage_out="tar")
+        copied = argparse.Namespace(**vars(plain), stage_dir=str(tmp_path), stage_out="copy")
+        assert run_result_key(staged) != run_result_key(plain)
+        assert run_result_key(copied) == run_result_key(plain)
+
+    def test_publish_and_restore(self, pipeline_dirs, tmp_path):
+        """Test a published run is copied into a new outdir with its summary relocated."""
+        run_fake_pipeline(pipeline_dirs, plot_mode="off")
+        store = ResultStore(str(tmp_path / "store"))
+        args = self.store_args(pipeline_dirs, store.root)
+        key = run_result_key(args)
+        publish_result(store, key, args)
+        entry = store.lookup(key)
+        stored_chain = os.path.join(entry, "COSMOSIS-CHAINS", "sn_only.txt")
+        assert not os.access(stored_chain, os.W_OK) or os.geteuid() == 0
+
+        outdir = tmp_path / "second"
+        state = store.restore(key, str(outdir), str(outdir / "SUMMARY.YAML"))
+        restored_chain = outdir / "COSMOSIS-CHAINS" / "sn_only.txt"
+        assert os.stat(restored_chain).st_ino != os.stat(stored_chain).st_ino
+        # Rewriting a restored output (as main() does with INPUT.INFO) leaves the entry untouched
+        stored_text = open(stored_chain).read()
+        restored_chain.write_text("rewritten\n")
+        assert open(stored_chain).read() == stored_text
+        loaded = yaml.safe_load((outdir / "SUMMARY.YAML").read_text())
+        assert loaded == state
+        assert loaded["RESULT_STORE"]["hit"] and loaded["RESULT_STORE"]["key"] == key
+        assert loaded["TELEMETRY"].startswith(str(outdir))
+        assert store.publish(key, os.path.dirname(pipeline_dirs["error_path"]), str(pipeline_dirs["summary_path"])) \
+            is None
+
+    def test_unfinished_plots_are_not_published(self, pipeline_dirs, tmp_path):
+        """Test only runs whose plot job has finished are published."""
+        run_fake_pipeline(pipeline_dirs, plot_mode="off")
+        store = ResultStore(str(tmp_path / "store"))
+        args = self.store_args(pipeline_dirs, store.root)
+        key = run_result_key(args)
+        for status in ("QUEUED", "RUNNING", "DEFERRED", "FAILED"):
+            update_summary_fields(str(pipeline_dirs["summary_path"]), PLOT_STATUS=status)
+            publish_result(store, key, args)
+            assert store.lookup(key) is None
+        update_summary_fields(str(pipeline_dirs["summary_path"]), PLOT_STATUS="SUCCESSFUL")
+        publish_result(store, key, args)
+        assert store.lookup(key) is not None
+
+    def test_eviction_by_age_and_size(self, tmp_path):
+        """Test entries unused for too long go first, then the least recently used above the size limit."""
+        outdir = tmp_path / "run"
+        setup_directories(str(outdir))
+        (outdir / "COSMOSIS-CHAINS" / "chain.txt").write_text("0.3 -1.0\n" * 1000)
+        (outdir / "SUMMARY.YAML").write_text("STAGE3: SUCCESSFUL\n")
+        store = ResultStore(str(tmp_path / "store"))
+        now = 1.0e9
+        for i, key in enumerate(["aa" + "0" * 62, "bb" + "0" * 62, "cc" + "0" * 62]):
+            store.publish(key, str(outdir), str(outdir / "SUMMARY.YAML"))
+            os.utime(os.path.join(store.entry_path(key), "ENTRY.yaml"), (now - 86400 * (40 - 10 * i),) * 2)
+        size = store.entries()[0]["bytes"]
+        store.max_age_days = 35
+        store.max_bytes = size
+        assert store.evict(now=now) == ["aa" + "0" * 62, "bb" + "0" * 62]
+        assert [entry["key"] for entry in store.entries()] == ["cc" + "0" * 62]
+        assert not [name for name in os.listdir(store.root) if name.startswith(".")]
+
+    def test_main_restores_without_running(self, pipeline_dirs, tmp_path, monkeypatch):
+        """Test main() returns a stored result for an identical run without starting any stage."""
+        run_fake_pipeline(pipeline_dirs, plot_mode="off")
+        store = ResultStore(str(tmp_path / "store"))
+        args = self.store_args(pipeline_dirs, store.root)
+        publish_result(store, run_result_key(args), args)
+
+        outdir = tmp_path / "second"
+        outdir.mkdir()
+        monkeypatch.setattr(sys, "argv", [
+            "Firecrown_wrapper.py", pipeline_dirs["path"], "hd.txt", "cov.txt", pipeline_dirs["ini"],
+            "-O", str(outdir), "-s", str(outdir / "SUMMARY.YAML"), "--result-store", store.root,
+        ])
+        with patch("Firecrown_wrapper.get_executor") as executor:
+            main()
+        executor.assert_not_called()
+        assert (outdir / "COSMOSIS-CHAINS" / "sn_only.txt").exists()
+        assert yaml.safe_load((outdir / "SUMMARY.YAML").read_text())["RESULT_STORE"]["hit"]
+
+
+class TestPerformanceDatabase:
+    """Test run fingerprints, the SQLite performance history and regression reports."""
+
+    FINGERPRINT = {"ini": "sn_only", "input_hash": "abc", "ini_hash": "def", "firecrown_version": "1.7",
+                   "cosmosis_version": "3.0", "host": "node1", "cpu_model": "cpu", "cpus": 8}
+
+    def test_fingerprints(self, tmp_path):
+        """Test the input fingerprint depends on contents and overrides, not on paths."""
+        for directory in ("a", "b"):
+            (tmp_path / directory).mkdir()
+            (tmp_path / directory / "hd.txt").write_text("zcmb mb\n0.1 38.3\n")
+        first = input_fingerprint([str(tmp_path / "a" / "hd.txt")], "x.y=1 z.w=2")
+        assert first == input_fingerprint([str(tmp_path / "b" / "hd.txt")], "z.w=2 x.y=1")
+        assert first != input_fingerprint([str(tmp_path / "b" / "hd.txt")], "x.y=2")
+        (tmp_path / "run.ini").write_text("[runtime]\nsampler = emcee\n")
+        fingerprint = run_fingerprint(str(tmp_path / "a" / "hd.txt"), str(tmp_path / "b" / "hd.txt"),
+                                      str(tmp_path / "run.ini"))
+        assert fingerprint["ini"] == "run"
+        assert fingerprint["cpus"] == os.cpu_count()
+
+    def test_concurrent_writers_in_wal_mode(self, tmp_path):
+        """Test concurrent record_run calls all land in a WAL-mode database."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        db = str(tmp_path / "perf.sqlite")
+        records = {"STAGE1": {"wall_seconds": 10.0, "cpu_seconds": 1.0, "child_cpu_seconds": 9.0}}
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: record_run(db, self.FINGERPRINT, records, rows=1000), range(32)))
+        connection = connect(db)
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        rows = connection.execute("SELECT * FROM stage_runs").fetchall()
+        connection.close()
+        assert len(rows) == 32
+        assert rows[0]["rows_per_second"] == 100.0 and rows[0]["cpu_seconds"] == 10.0
+
+    def test_regression_report(self, tmp_path, capsys):
+        """Test a slower Stage 1 after a version change is flagged and the change named."""
+        db = str(tmp_path / "perf.sqlite")
+        for i in range(13):
+            fingerprint = dict(self.FINGERPRINT, firecrown_version="1.8" if i >= 10 else "1.7")
+            wall = 150.0 if i >= 10 else 100.0 + i % 3
+            record_run(db, fingerprint, {"STAGE1": {"wall_seconds": wall}, "STAGE2": {"wall_seconds": 5.0}},
+                       statuses={"STAGE1": "SUCCESSFUL", "STAGE2": "SUCCESSFUL"}, started=1000.0 + i)
+        results = {result["stage"]: result for result in find_regressions(db)}
+        assert results["STAGE1"]["regression"]
+        assert results["STAGE1"]["ratio"] == pytest.approx(150.0 / 101.0)
+        assert results["STAGE1"]["changes"] == {"firecrown_version": "1.7 -> 1.8"}
+        assert not results["STAGE2"]["regression"]
+        assert "REGRESSION" in format_report(list(results.values()))
+        assert perfdb_main(["report", "--db", db]) == 1
+        assert "firecrown_version: 1.7 -> 1.8" in capsys.readouterr().out
+
+    def test_pipeline_run_is_recorded(self, pipeline_dirs, tmp_path):
+        """Test a run adds one row per timed stage plus TOTAL with chain throughput."""
+        profiler = StageProfiler(timing=True)
+        run_fake_pipeline(pipeline_dirs, profiler=profiler)
+        assert "pstats" not in profiler.records["STAGE3"]
+        assert profiler.records["STAGE3"]["peak_rss_mb"] > 0
+        args = argparse.Namespace(path=pipeline_dirs["path"], hd="hd.txt", cov="cov.txt", ini=pipeline_dirs["ini"],
+                                  param="", summary=str(pipeline_dirs["summary_path"]))
+        db = str(tmp_path / "perf.sqlite")
+        record_performance(db, args, profiler)
+        connection = connect(db)
+        rows = {row["stage"]: row for row in connection.execute("SELECT * FROM stage_runs").fetchall()}
+        connection.close()
+        assert {"STAGE0", "STAGE1", "STAGE2", "STAGE3", "TOTAL"} <= set(rows)
+        assert rows["STAGE1"]["rows"] == 200 and rows["STAGE0"]["rows"] is None
+        assert rows["STAGE1"]["status"] == "SUCCESSFUL" and rows["TOTAL"]["status"] == "SUCCESSFUL"
+        assert yaml.safe_load(pipeline_dirs["summary_path"].read_text())["PERF_RUN_ID"] == rows["TOTAL"]["run_id"]
+
+    def test_recording_keeps_background_plot_status(self, pipeline_dirs, tmp_path):
+        """Test recording a run after the background plot job started does not reset PLOT_STATUS."""
+        def plot_job(summary_path, log_file):
+            update_summary_fields(summary_path, PLOT_STATUS="SUCCESSFUL")
+
+        profiler = StageProfiler(timing=True)
+        with patch("deferred_plots.launch_background", side_effect=plot_job):
+            run_fake_pipeline(pipeline_dirs, plot_mode="background", profiler=profiler)
+        args = argparse.Namespace(path=pipeline_dirs["path"], hd="hd.txt", cov="cov.txt", ini=pipeline_dirs["ini"],
+                                  param="", summary=str(pipeline_dirs["summary_path"]))
+        record_performance(str(tmp_path / "perf.sqlite"), args, profiler)
+        loaded = yaml.safe_load(pipeline_dirs["summary_path"].read_text())
+        assert loaded["PLOT_STATUS"] == "SUCCESSFUL"
+        assert loaded["PERF_RUN_ID"] is not None
+
+
+class TestSamplers:
+    """Test sampler detection and sampler-specific post-processing."""
+
+    def test_sampler_kinds_and_detection(self, tmp_path):
+        """Test the chain header takes precedence over the ini file."""
+        assert SamplerInfo("metropolis").kind == MCMC
+        assert SamplerInfo("multinest").kind == WEIGHTED
+        assert SamplerInfo("emcee", walkers=16).kind == WALKERS
+        assert SamplerInfo("", walkers=16).walkers == 1
+
+        ini = tmp_path / "emcee.ini"
+        ini.write_text("[runtime]\nsampler = emcee\n[emcee]\nwalkers = 16\nsamples = 10\n")
+        chain = str(tmp_path / "chain.txt")
+        write_fake_chain(chain, n_rows=10)
+        detected = detect_sampler(chain, str(ini))
+        assert (detected.name, detected.kind) == ("metropolis", MCMC)
+        with open(chain, "w") as handle:
+            handle.write("#cosmological_parameters--omega_m\tpost\n#sampler=emcee\n0.3\t-1\n")
+        detected = detect_sampler(chain, str(ini), "emcee.walkers=32")
+        assert (detected.kind, detected.walkers) == (WALKERS, 32)
+        os.remove(chain)
+        assert detect_sampler(chain, str(ini)).name == "emcee"
+
+    def test_walker_burn_in(self):
+        """Test the slowest walker sets the burn-in, in whole steps."""
+        n_steps, walkers = 200, 8
+        steps = np.arange(n_steps)[:, None]
+        delay = np.full(walkers, 5)
+        delay[3] = 20
+        trace = -5.0 * np.exp(-steps / delay) + np.random.default_rng(5).normal(0, 0.5, (n_steps, walkers))
+        burn = walker_burn_in(trace.reshape(-1), walkers)
+        assert burn % walkers == 0
+        assert 30 <= burn // walkers <= 70
+        assert walker_burn_in(np.full(n_steps * walkers, -1.0), walkers) == 0
+        stuck = np.zeros((n_steps, walkers))
+        stuck[:, 0] = -100.0
+        assert walker_burn_in(stuck.reshape(-1), walkers) == n_steps // 2 * walkers
+
+    def test_weighted_sampler_pipeline(self, pipeline_dirs, tmp_path):
+        """Test nested-sampler chains skip the burn-in and thinning and report the evidence."""
+        class NestedExecutor(FakePipelineExecutor):
+            def run_with_retry(self, command, output_file, error_file, **kwargs):
+                result = super().run_with_retry(command, output_file, error_file, **kwargs)
+                if command.startswith("cosmosis "):
+                    chain_file = command.split("output.filename=")[1].split()[0]
+                    rows = open(chain_file).read().splitlines()[2:]
+                    with open(chain_file, "w") as handle:
+                        handle.write("#" + "\t".join(CHAIN_COLUMNS + ["weight"]) + "\n#sampler=multinest\n")
+                        handle.writelines(f"{row}\t{0.5}\n" for row in rows)
+                        handle.write("#log_z=-12.5\n#log_z_error=0.1\n")
+                return result
+
+        executor = NestedExecutor(pipeline_dirs["plot_path"])
+        with patch("Firecrown_wrapper.get_executor", return_value=executor):
+            run_stages(pipeline_dirs["path"], "hd.txt", "cov.txt", pipeline_dirs["ini"],
+                       pipeline_dirs["error_path"], pipeline_dirs["output_path"], pipeline_dirs["plot_path"],
+                       summary_path=pipeline_dirs["summary_path"])
+        loaded = yaml.safe_load(pipeline_dirs["summary_path"].read_text())
+        assert loaded["SAMPLER"] == {"name": "multinest", "kind": WEIGHTED, "walkers": 1}
+        assert loaded["LOGZ"] == -12.5 and loaded["LOGZ_ERR"] == 0.1
+        assert executor.commands[2].endswith("--burn 0")
+        assert "THINNED_CHAIN" not in loaded
+        assert loaded["STAGE3"] == "SUCCESSFUL"
+        assert log_evidence(os.path.join(pipeline_dirs["output_path"], "sn_only.txt"))["LOGZ"] == -12.5
+
+
+class TestIncrementalStats:
+    """Test posterior statistics updated while the chain grows."""
+
+    def test_growing_chain_with_partial_lines(self, tmp_path):
+        """Test running statistics match a full read after arbitrary partial writes."""
+        chain = str(tmp_path / "chain.txt")
+        full = str(tmp_path / "full.txt")
+        write_fake_chain(full, n_rows=503)
+        content = open(full, "rb").read()
+        stats = IncrementalChainStats(chain, str(tmp_path / "PROVISIONAL"), block_size=7)
+        telemetry = ChainTelemetry(chain, str(tmp_path / "metrics.prom"), consumer=stats)
+        cuts = sorted(np.random.default_rng(3).choice(len(content), 25, replace=False)) + [len(content)]
+        start = 0
+        with open(chain, "wb") as handle:
+            for cut in cuts:
+                handle.write(content[start:cut])
+                handle.flush()
+                start = cut
+                telemetry.poll()
+        telemetry.poll(final=True)
+
+        names, data, _ = read_chain(full)
+        assert stats.rows == 503
+        result = stats.statistics()
+        assert result["burn"] == burnin(full) == 75
+        columns = [names.index(name) for name in result["names"]]
+        expected = data[75:, columns]
+        np.testing.assert_allclose(result["mean"], expected.mean(axis=0))
+        np.testing.assert_allclose(result["cov"], np.cov(expected, rowvar=False, ddof=0), atol=1e-12)
+        assert stats.latest["final"] is True
+        assert stats.latest["min_m2logl"] == pytest.approx(-2 * data[:, names.index("post")].max())
+        means = pd.read_csv(stats.latest["means"], sep=r"\s+")
+        assert len(means) == len(result["names"])
+        assert float(FoM(stats.latest["covmat"])) == pytest.approx(stats.latest["FoM"])
+
+    def test_weighted_chain_and_truncation(self, tmp_path):
+        """Test weight columns are used and a truncated chain starts the statistics over."""
+        chain = str(tmp_path / "chain.txt")
+        rng = np.random.default_rng(4)
+        samples = np.column_stack([rng.normal(size=(300, 2)), rng.uniform(0.1, 2.0, 300), rng.normal(size=300)])
+        with open(chain, "w") as handle:
+            handle.write("#cosmological_parameters--w\tcosmological_parameters--wa\tweight\tlike\n")
+            np.savetxt(handle, samples, delimiter="\t")
+        stats = IncrementalChainStats(chain, str(tmp_path / "PROVISIONAL"), block_size=50)
+        telemetry = ChainTelemetry(chain, str(tmp_path / "metrics.prom"), consumer=stats)
+        telemetry.poll()
+        result = stats.statistics(burn=20)
+        kept = samples[20:]
+        np.testing.assert_allclose(result["mean"], np.average(kept[:, :2], axis=0, weights=kept[:, 2]))
+        np.testing.assert_allclose(result["cov"], np.cov(kept[:, :2], rowvar=False, aweights=kept[:, 2], ddof=0))
+        assert stats.latest["min_m2logl"] == pytest.approx(-2 * samples[:, 3].max())
+
+        with open(chain, "w") as handle:
+            handle.write("#cosmological_parameters--w\tcosmological_parameters--wa\tweight\tlike\n")
+            np.savetxt(handle, samples[:10], delimiter="\t")
+        telemetry.poll()
+        assert stats.rows == 10
+
+    def test_pipeline_uses_incremental_statistics(self, pipeline_dirs):
+        """Test the final incremental statistics are recorded and supply the burn-in."""
+        _, loaded = run_fake_pipeline(pipeline_dirs, incremental=True)
+        record = loaded["INCREMENTAL"]
+        assert record["final"] is True
+        assert record["rows"] == 200 and record["burn"] == 30
+        assert os.path.exists(os.path.join(pipeline_dirs["plot_path"], "PROVISIONAL", "covmat.txt"))
+        assert loaded["THINNED_CHAIN"]["burn"] == 30
+        assert loaded["STAGE3"] == "SUCCESSFUL"
+
+
+class TestChainThinning:
+    """Test autocorrelation times and thinned chain products."""
+
+    @staticmethod
+    def _ar1(n, rho, seed=0, columns=1):
+        """AR(1) series with integrated autocorrelation time (1 + rho) / (1 - rho)."""
+        rng = np.random.default_rng(seed)
+        noise = rng.normal(size=(n, columns))
+        x = np.empty((n, columns))
+        x[0] = noise[0]
+        for i in range(1, n):
+            x[i] = rho * x[i - 1] + noise[i]
+        return x
+
+    def test_integrated_autocorr_time(self):
+        """Test tau of AR(1) series, per walker and with a constant column."""
+        x = self._ar1(100000, 0.9)
+        assert integrated_autocorr_time(x)[0] == pytest.approx(19.0, rel=0.15)
+        walkers = self._ar1(20000, 0.9, columns=4)
+        assert integrated_autocorr_time(walkers.reshape(-1, 1), walkers=4)[0] == pytest.approx(19.0, rel=0.15)
+        with_constant = np.column_stack([x[:1000, 0], np.ones(1000)])
+        assert np.isnan(integrated_autocorr_time(with_constant)[1])
+
+    def test_thin_chain_keeps_rows_verbatim(self, tmp_path):
+        """Test the thinned chain keeps the header, the weights and exact rows."""
+        chain = str(tmp_path / "chain.txt")
+        samples = np.column_stack([self._ar1(20000, 0.95, columns=2), np.linspace(0.5, 1.5, 20000)])
+        with open(chain, "w") as handle:
+            handle.write("#cosmological_parameters--omega_m\tcosmological_parameters--w\tweight\n")
+            handle.write("#sampler=metropolis\n")
+            np.savetxt(handle, samples, delimiter="\t")
+
+        destination = str(tmp_path / "THINNED_chain.txt")
+        result = thin_chain(chain, destination, burn=2000)
+        assert result["tau"] == pytest.approx(39.0, rel=0.25)
+        assert result["thin"] == int(0.5 * result["tau"])
+        assert result["thinned_bytes"] * 10 < result["raw_bytes"]
+        names, data, metadata = read_chain(destination)
+        assert names == ["cosmological_parameters--omega_m", "cosmological_parameters--w", "weight"]
+        assert metadata["sampler"] == "metropolis"
+        assert int(metadata["thin"]) == result["thin"] and int(metadata["burn"]) == 2000
+        rows = open(chain).read().splitlines()[2:]
+        kept = open(destination).read().splitlines()[2:-3]
+        assert kept == rows[2000::result["thin"]]
+        assert data.shape[0] == result["thinned_rows"]
+
+    def test_thin_chain_keeps_whole_walker_steps(self, tmp_path):
+        """Test emcee chains are thinned by steps and the walker count comes from the ini."""
+        ini = tmp_path / "emcee.ini"
+        ini.write_text("[runtime]\nsampler = emcee\n[emcee]\nwalkers = 8\nsamples = 100\n")
+        assert walkers_from_ini(str(ini)) == 8
+        assert walkers_from_ini(str(ini), "emcee.walkers=16") == 16
+        assert walkers_from_ini(str(tmp_path / "missing.ini")) == 1
+
+        chain = str(tmp_path / "chain.txt")
+        with open(chain, "w") as handle:
+            handle.write("#cosmological_parameters--omega_m\tpost\n")
+            np.savetxt(handle, np.column_stack([self._ar1(16000, 0.9, columns=8).reshape(-1), np.zeros(128000)]))
+        result = thin_chain(chain, str(tmp_path / "thinned.txt"), burn=1000, walkers=8)
+        assert result["burn"] == 1000
+        assert result["thinned_rows"] % 8 == 0
+        with pytest.raises(ValueError, match="no samples"):
+            thin_chain(chain, str(tmp_path / "none.txt"), burn=128000, walkers=8)
+
+    def test_pipeline_writes_thinned_chain(self, pipeline_dirs):
+        """Test run_stages writes THINNED_<ini>.txt after Stage 1 unless disabled."""
+        executor, loaded = run_fake_pipeline(pipeline_dirs)
+        thinned = os.path.join(pipeline_dirs["output_path"], "THINNED_sn_only.txt")
+        assert loaded["THINNED_CHAIN"]["path"] == thinned
+        assert loaded["THINNED_CHAIN"]["burn"] == 30
+        assert os.path.exists(thinned)
+        # cosmosis-postprocess globs <ini>*.txt and must not see the thinned chain
+        assert "THINNED" not in executor.commands[2]
+        os.remove(thinned)
+        summary.pop("THINNED_CHAIN")
+        _, loaded = run_fake_pipeline(pipeline_dirs, thin_chains=False)
+        assert "THINNED_CHAIN" not in loaded
+        assert not os.path.exists(thinned)
+
+
+class TestStaging:
+    """Test node-local scratch staging and the bulk stage-out."""
+
+    def test_resolve_scratch_root(self, tmp_path, monkeypatch):
+        """Test explicit roots are created and 'auto' prefers $TMPDIR."""
+        explicit = tmp_path / "explicit"
+        assert resolve_scratch_root(str(explicit)) == str(explicit)
+        assert explicit.is_dir()
+        monkeypatch.setenv("TMPDIR", str(tmp_path))
+        assert resolve_scratch_root("auto") == str(tmp_path)
+
+    def test_copy_stage_out_replaces_directories(self, tmp_path):
+        """Test copy stage-out swaps directories in and relocates summary paths."""
+        outdir = tmp_path / "final"
+        (outdir / "ERROR_LOGS").mkdir(parents=True)
+        (outdir / "ERROR_LOGS" / "stale.log").write_text("old run")
+        stager = ScratchStage(str(outdir), str(outdir / "SUMMARY.YAML"), root=str(tmp_path / "scratch"))
+        run_dir = stager.start()
+        setup_directories(run_dir)
+        chain = os.path.join(run_dir, "COSMOSIS-CHAINS", "run.txt")
+        write_fake_chain(chain, n_rows=10)
+        with open(stager.scratch_summary, "w") as handle:
+            yaml.dump({"STAGE3": "SUCCESSFUL", "CHAIN": chain}, handle)
+
+        stager.finish()
+        assert not os.path.exists(run_dir)
+        assert not (outdir / "ERROR_LOGS" / "stale.log").exists()
+        assert (outdir / "COSMOSIS-CHAINS" / "run.txt").exists()
+        assert not [name for name in os.listdir(outdir) if name.startswith(".stage-")]
+        loaded = yaml.safe_load((outdir / "SUMMARY.YAML").read_text())
+        assert loaded["CHAIN"] == str(outdir / "COSMOSIS-CHAINS" / "run.txt")
+        assert loaded["STAGING"]["transfers"][0]["label"] == "final"
+
+    def test_tar_stage_out(self, tmp_path):
+        """Test tar stage-out writes one archive without the summary."""
+        import tarfile
+
+        outdir = tmp_path / "final"
+        stager = ScratchStage(str(outdir), str(outdir / "SUMMARY.YAML"), root=str(tmp_path), method="tar")
+        run_dir = stager.start()
+        setup_directories(run_dir)
+        chain = os.path.join(run_dir, "COSMOSIS-CHAINS", "run.txt")
+        write_fake_chain(chain, n_rows=10)
+        with open(stager.scratch_summary, "w") as handle:
+            yaml.dump({"STAGE3": "SUCCESSFUL", "CHAIN": chain}, handle)
+        stager.finish()
+        with tarfile.open(outdir / TAR_NAME) as archive:
+            names = archive.getnames()
+        assert "COSMOSIS-CHAINS/run.txt" in names
+        loaded = yaml.safe_load((outdir / "SUMMARY.YAML").read_text())
+        assert loaded["CHAIN"] == "COSMOSIS-CHAINS/run.txt"
+        assert loaded["STAGING"]["archive"] == str(outdir / TAR_NAME)
+
+        store = ResultStore(str(tmp_path / "store"))
+        store.publish("ab" + "0" * 62, str(outdir), str(outdir / "SUMMARY.YAML"))
+        restored = tmp_path / "restored"
+        state = store.restore("ab" + "0" * 62, str(restored), str(restored / "SUMMARY.YAML"))
+        assert (restored / TAR_NAME).is_file()
+        assert state["STAGING"]["archive"] == str(restored / TAR_NAME)
+        assert state["CHAIN"] == "COSMOSIS-CHAINS/run.txt"
+        assert "SUMMARY.YAML" not in names
+        assert sorted(os.listdir(outdir)) == sorted([TAR_NAME, "SUMMARY.YAML"])
+        with pytest.raises(ValueError, match="Unknown stage-out method"):
+            ScratchStage(str(outdir), str(outdir / "SUMMARY.YAML"), method="rsync")
+
+    def test_pipeline_publishes_only_final_summary(self, tmp_path):
+        """Test a staged run checkpoints the chain after Stage 1 and publishes the summary at the end."""
+        input_dir = tmp_path / "input"
+        input_dir.mkdir()
+        (input_dir / "hd.txt").write_text("zcmb mb dmb\n0.1 38.3 0.1\n0.5 42.3 0.1\n")
+        (input_dir / "cov.txt").write_text("2\n0.01\n0\n0\n0.01\n")
+        ini_file = tmp_path / "sn_only.ini"
+        ini_file.write_text("[runtime]\nsampler = metropolis\n")
+        outdir = tmp_path / "final"
+
+        stager = ScratchStage(str(outdir), str(outdir / "SUMMARY.YAML"), root=str(tmp_path / "scratch"))
+        run_dir = stager.start()
+        context = RunContext(run_dir, summary_path=stager.scratch_summary,
+                             executor=FakePipelineExecutor(os.path.join(run_dir, "PLOTS")))
+        context.stager = stager
+        context.run_stages(str(input_dir), "hd.txt", "cov.txt", str(ini_file), plot_mode="off")
+        assert [record["label"] for record in stager.transfers] == ["STAGE1"]
+        assert (outdir / "COSMOSIS-CHAINS" / "sn_only.txt").exists()
+        assert not (outdir / "SUMMARY.YAML").exists()
+
+        stager.finish()
+        loaded = yaml.safe_load((outdir / "SUMMARY.YAML").read_text())
+        assert loaded["STAGE3"] == "SUCCESSFUL"
+        assert loaded["TELEMETRY"].startswith(str(outdir))
+        assert (outdir / "PLOTS" / "covmat.txt").exists()
+        assert not os.path.exists(run_dir)
+
+
 class TestFilePathValidation:
     """Test file and path checking."""
 
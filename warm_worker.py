@@ -0,0 +1,305 @@
+"""
+Persistent warm worker that runs COSMOSIS pipelines in-process.
+
+Starting a fresh ``cosmosis`` interpreter for every Stage 1 run means paying
+for the imports of COSMOSIS, Firecrown and pyccl each time. A warm worker
+imports them once and then takes Stage 1 jobs from a queue directory:
+
+    <queue>/incoming/<job>.json   submitted jobs
+    <queue>/running/<job>.json    claimed by a worker (atomic rename)
+    <queue>/done/<job>.json       finished jobs with their return code
+
+Each job names the ini file, the ``section.option=value`` overrides (including
+the SACC file and ``output.filename``) and the stdout/stderr log files, so the
+worker writes the same chain and log files as the subprocess path.
+
+Start a worker with:
+
+    python warm_worker.py <queue_dir> [--max-jobs N] [--idle-timeout SECONDS]
+
+and point the wrapper at it with ``--warm-worker <queue_dir>``. Jobs run
+serially in the worker process, without MPI.
+"""
+
+import argparse
+import contextlib
+import importlib
+import json
+import logging
+import os
+import shlex
+import sys
+import time
+import traceback
+import uuid
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SUBDIRS = ("incoming", "running", "done")
+
+# Modules imported once at worker start-up so every job finds them warm
+PRELOAD_MODULES = (
+    "numpy",
+    "sacc",
+    "pyccl",
+    "firecrown.likelihood.likelihood",
+    "firecrown.connector.cosmosis.likelihood",
+)
+
+
+def parse_overrides(param_string: str) -> Dict[Tuple[str, str], str]:
+    """
+    Parse COSMOSIS ``-p`` overrides into the mapping used by ``Inifile``.
+
+    Args:
+        param_string (str): Space-separated ``section.option=value`` items
+
+    Returns:
+        dict: ``{(section, option): value}``
+
+    Raises:
+        ValueError: If an item is not of the form ``section.option=value``
+    """
+    overrides = {}
+    for item in shlex.split(param_string or ""):
+        key, sep, value = item.partition("=")
+        section, dot, option = key.partition(".")
+        if not sep or not dot or not section or not option:
+            raise ValueError(f"Invalid COSMOSIS override '{item}', expected section.option=value")
+        overrides[(section, option)] = value
+    return overrides
+
+
+def setup_queue(queue_dir: str) -> None:
+    """Create the queue subdirectories if they do not exist."""
+    for subdir in QUEUE_SUBDIRS:
+        os.makedirs(os.path.join(queue_dir, subdir), exist_ok=True)
+
+
+def _write_json_atomic(path: str, payload: dict) -> None:
+    """Write JSON to ``path`` through a temporary file and an atomic rename."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle, indent=2)
+    os.replace(tmp_path, path)
+
+
+def submit_job(queue_dir: str, job: dict) -> str:
+    """
+    Submit a Stage 1 job to a warm worker queue.
+
+    Args:
+        queue_dir (str): Queue directory
+        job (dict): Job with 'ini', 'overrides', 'output_file' and 'error_file',
+            and optionally the 'cwd' the pipeline runs in
+
+    Returns:
+        str: The job id
+    """
+    setup_queue(queue_dir)
+    job_id = f"{int(time.time() * 1000):d}-{uuid.uuid4().hex[:8]}"
+    _write_json_atomic(os.path.join(queue_dir, "incoming", f"{job_id}.json"), dict(job, id=job_id))
+    logger.info(f"Submitted warm worker job {job_id} to {queue_dir}")
+    return job_id
+
+
+def wait_for_job(queue_dir: str, job_id: str, timeout: Optional[float] = None,
+                 poll_interval: float = 2.0, timeout_policy=None, heartbeat=None) -> dict:
+    """
+    Wait for a submitted job to finish.
+
+    A job runs inside the worker process and cannot be killed from here; when
+    a limit is hit the caller stops waiting and the worker finishes the job
+    on its own.
+
+    Args:
+        queue_dir (str): Queue directory
+        job_id (str): Id returned by submit_job
+        timeout (float, optional): Give up after this many seconds
+        poll_interval (float): Seconds between checks
+        timeout_policy (TimeoutPolicy, optional): Give up when it would kill
+            the job (subprocess_executor.TimeoutPolicy)
+        heartbeat (Heartbeat, optional): Progress signal for the policy
+
+    Returns:
+        dict: The finished job, including 'returncode'
+
+    Raises:
+        RuntimeError: If the job does not finish within the timeout or the
+            policy's limits
+    """
+    done_file = os.path.join(queue_dir, "done", f"{job_id}.json")
+    start = time.time()
+    last_progress = start
+    while not os.path.exists(done_file):
+        now = time.time()
+        if timeout is not None and now - start > timeout:
+            raise RuntimeError(f"Warm worker job {job_id} did not finish within {timeout}s")
+        if timeout_policy is not None:
+            if heartbeat is not None and heartbeat.beat():
+                last_progress = now
+            reason = timeout_policy.kill_reason(now - start, now - last_progress, watched=heartbeat is not None)
+            if reason is not None:
+                raise RuntimeError(f"Warm worker job {job_id} abandoned ({reason}) after {now - start:.0f}s")
+        time.sleep(poll_interval)
+    with open(done_file, "r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+class WarmWorker:
+    """
+    Long-running worker that executes queued COSMOSIS jobs in-process.
+
+    Attributes:
+        queue_dir (str): Queue directory served by this worker
+        poll_interval (float): Seconds between checks of the incoming queue
+    """
+
+    def __init__(self, queue_dir: str, poll_interval: float = 1.0):
+        """
+        Import COSMOSIS and the likelihood stack once and prepare the queue.
+
+        Args:
+            queue_dir (str): Queue directory to serve
+            poll_interval (float): Seconds between checks of the incoming queue
+
+        Raises:
+            ImportError: If COSMOSIS is not installed
+        """
+        self.queue_dir = queue_dir
+        self.poll_interval = poll_interval
+        setup_queue(queue_dir)
+
+        from cosmosis.main import run_cosmosis
+        from cosmosis.runtime.config import Inifile
+        self._run_cosmosis = run_cosmosis
+        self._inifile = Inifile
+
+        for module in PRELOAD_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                logger.warning(f"Could not preload {module}: {e}")
+
+    def claim_next(self) -> Optional[dict]:
+        """
+        Atomically claim the oldest incoming job.
+
+        Returns:
+            dict or None: The claimed job, or None if the queue is empty
+        """
+        incoming = os.path.join(self.queue_dir, "incoming")
+        for name in sorted(n for n in os.listdir(incoming) if n.endswith(".json")):
+            running_file = os.path.join(self.queue_dir, "running", name)
+            try:
+                os.rename(os.path.join(incoming, name), running_file)
+            except FileNotFoundError:
+                continue  # Claimed by another worker
+            with open(running_file, "r", encoding="utf-8") as handle:
+                return json.load(handle)
+        return None
+
+    def run_job(self, job: dict) -> int:
+        """
+        Run one COSMOSIS pipeline through the Python API.
+
+        The pipeline runs in the job's 'cwd' (the submitter's working
+        directory), so relative paths in the ini and the overrides resolve as
+        they would for ``cosmosis`` started by the submitter. A job that cannot
+        even be set up (malformed overrides, unwritable log files, missing
+        directory) fails like a pipeline error; the worker keeps serving.
+
+        Args:
+            job (dict): Claimed job
+
+        Returns:
+            int: 0 on success, 1 on failure
+        """
+        try:
+            overrides = parse_overrides(job.get("overrides", ""))
+            with open(job["output_file"], "w") as out_f, open(job["error_file"], "w") as err_f:
+                with contextlib.redirect_stdout(out_f), contextlib.redirect_stderr(err_f):
+                    previous_cwd = os.getcwd()
+                    try:
+                        if job.get("cwd"):
+                            os.chdir(job["cwd"])
+                        ini = self._inifile(job["ini"], override=overrides)
+                        status = self._run_cosmosis(ini)
+                        return int(status or 0)
+                    except Exception:
+                        traceback.print_exc()
+                        return 1
+                    finally:
+                        os.chdir(previous_cwd)
+        except Exception as e:
+            logger.error(f"Warm worker job {job.get('id')} failed before the pipeline started: {e}")
+            try:
+                with open(job["error_file"], "w") as err_f:
+                    traceback.print_exc(file=err_f)
+            except Exception:
+                pass  # Already in the worker log
+            return 1
+
+    def finish_job(self, job: dict, returncode: int, seconds: float) -> None:
+        """Move a job from running/ to done/ with its outcome."""
+        name = f"{job['id']}.json"
+        _write_json_atomic(
+            os.path.join(self.queue_dir, "done", name),
+            dict(job, returncode=returncode, seconds=round(seconds, 2)),
+        )
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(self.queue_dir, "running", name))
+
+    def serve_forever(self, max_jobs: Optional[int] = None, idle_timeout: Optional[float] = None) -> int:
+        """
+        Process jobs until ``max_jobs`` are done or the queue stays idle too long.
+
+        Args:
+            max_jobs (int, optional): Stop after this many jobs
+            idle_timeout (float, optional): Stop after this many idle seconds
+
+        Returns:
+            int: Number of jobs processed
+        """
+        processed = 0
+        idle_since = time.time()
+        while max_jobs is None or processed < max_jobs:
+            job = self.claim_next()
+            if job is None:
+                if idle_timeout is not None and time.time() - idle_since > idle_timeout:
+                    break
+                time.sleep(self.poll_interval)
+                continue
+
+            logger.info(f"Running warm worker job {job['id']}: {job['ini']}")
+            start = time.time()
+            returncode = 1
+            try:
+                returncode = self.run_job(job)
+            finally:
+                # Never leave a claimed job in running/, or its submitter waits forever
+                self.finish_job(job, returncode, time.time() - start)
+            processed += 1
+            idle_since = time.time()
+        return processed
+
+
+def main(argv=None):
+    """Command-line entry point for a warm worker."""
+    parser = argparse.ArgumentParser(description="Warm COSMOSIS worker serving a queue directory")
+    parser.add_argument("queue_dir", help="Queue directory")
+    parser.add_argument("--max-jobs", type=int, default=None, help="Stop after N jobs")
+    parser.add_argument("--idle-timeout", type=float, default=None, help="Stop after S idle seconds")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between queue checks")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    worker = WarmWorker(args.queue_dir, poll_interval=args.poll_interval)
+    processed = worker.serve_forever(max_jobs=args.max_jobs, idle_timeout=args.idle_timeout)
+    logger.info(f"Warm worker exiting after {processed} jobs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
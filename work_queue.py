@@ -0,0 +1,422 @@
+"""
+Pull-based work queue on a shared filesystem for multi-node allocations.
+
+Instead of spreading wrapper invocations over nodes with hand-written
+``srun`` scripts, jobs are submitted as files to a queue directory and any
+number of workers, on any node, pull them one at a time, so nodes that finish
+short jobs simply take the next one:
+
+    <queue>/pending/<job>.json    submitted jobs
+    <queue>/running/<job>.json    claimed by a worker (atomic rename)
+    <queue>/running/<job>.lease   the claiming worker; its mtime is the lease heartbeat
+    <queue>/done/<job>.json       finished jobs with their status
+    <queue>/workers/<id>.json     worker heartbeats (host, pid, current job)
+
+A worker runs each job in-process through ``RunContext.run_stages`` and
+touches the job's lease while it runs. A job whose lease has not been renewed
+for ``lease_seconds`` belongs to a crashed worker: the next worker to notice
+moves it back to pending/ (after ``max_claims`` claims it is abandoned). The
+lease is compared with the local clock, so ``lease_seconds`` should be well
+above any clock skew between nodes. No broker service is needed, only
+rename() on the shared filesystem.
+
+Submit a run with ``Firecrown_wrapper.py ... --queue <queue_dir>`` and start
+workers with:
+
+    srun python work_queue.py worker <queue_dir> [--idle-timeout SECONDS] [--lease-seconds SECONDS]
+    python work_queue.py status <queue_dir>
+
+Several workers can share a node: with ``--cpus N`` each one holds N cores
+no other worker or wrapper run on the node holds (resources.py) and runs its
+jobs' stages on them.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+import uuid
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SUBDIRS = ("pending", "running", "done", "workers")
+REQUIRED_JOB_KEYS = ("path", "hd", "cov", "ini", "outdir")
+DEFAULT_LEASE_SECONDS = 300.0
+# A job claimed this many times without finishing is not handed out again
+MAX_CLAIMS = 3
+
+
+def setup_queue(queue_dir: str) -> None:
+    """Create the queue subdirectories if they do not exist."""
+    for subdir in QUEUE_SUBDIRS:
+        os.makedirs(os.path.join(queue_dir, subdir), exist_ok=True)
+
+
+def _write_json_atomic(path: str, payload: dict) -> None:
+    """Write JSON to ``path`` through a temporary file and an atomic rename."""
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Optional[dict]:
+    """Return the JSON contents of ``path``, or None if it is gone or half-written."""
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def submit_job(queue_dir: str, job: dict) -> str:
+    """
+    Submit a run to the queue.
+
+    Args:
+        queue_dir (str): Queue directory
+        job (dict): 'path', 'hd', 'cov', 'ini' and 'outdir', optionally
+            'param', 'summary' and 'options' (further run_stages() keywords)
+
+    Returns:
+        str: The job id
+
+    Raises:
+        ValueError: If a required key is missing
+    """
+    missing = [key for key in REQUIRED_JOB_KEYS if key not in job]
+    if missing:
+        raise ValueError(f"Queue job is missing {', '.join(missing)}")
+    setup_queue(queue_dir)
+    job_id = f"{int(time.time() * 1000):d}-{uuid.uuid4().hex[:8]}"
+    _write_json_atomic(os.path.join(queue_dir, "pending", f"{job_id}.json"),
+                       dict(job, id=job_id, submitted=time.time(), claims=0))
+    logger.info(f"Submitted queue job {job_id} to {queue_dir}")
+    return job_id
+
+
+def reclaim_expired(queue_dir: str, lease_seconds: float = DEFAULT_LEASE_SECONDS, max_claims: int = MAX_CLAIMS,
+                    now: Optional[float] = None) -> List[str]:
+    """
+    Return the jobs of crashed workers to pending/.
+
+    A running job whose lease was last renewed more than ``lease_seconds``
+    ago is moved aside with an atomic rename (so only one worker reclaims
+    it), then written back to pending/, or to done/ as ABANDONED once it has
+    been claimed ``max_claims`` times.
+
+    Returns:
+        list: Ids of the reclaimed jobs
+    """
+    now = time.time() if now is None else now
+    running = os.path.join(queue_dir, "running")
+    reclaimed = []
+    for name in sorted(n for n in os.listdir(running) if n.endswith(".json")):
+        job_id = name[:-len(".json")]
+        job_file = os.path.join(running, name)
+        lease_file = os.path.join(running, f"{job_id}.lease")
+        try:
+            last_beat = os.path.getmtime(lease_file)
+        except FileNotFoundError:
+            # Claimed but the lease is not written yet: the claim renamed the job file
+            try:
+                last_beat = os.stat(job_file).st_ctime
+            except FileNotFoundError:
+                continue
+        if now - last_beat < lease_seconds:
+            continue
+        private = os.path.join(running, f"{job_id}.reclaim-{uuid.uuid4().hex[:8]}")
+        try:
+            os.rename(job_file, private)
+        except FileNotFoundError:
+            continue  # Finished, or reclaimed by another worker
+        job = _read_json(private) or {"id": job_id}
+        lease = _read_json(lease_file) or {}
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(lease_file)
+        job.setdefault("reclaimed", []).append({"worker": lease.get("worker"), "time": now})
+        if job.get("claims", 0) >= max_claims:
+            logger.error(f"Queue job {job_id} abandoned after {job['claims']} claims")
+            _write_json_atomic(os.path.join(queue_dir, "done", name), dict(job, status="ABANDONED", returncode=None))
+        else:
+            logger.warning(f"Reclaimed queue job {job_id} from worker {lease.get('worker')}")
+            _write_json_atomic(os.path.join(queue_dir, "pending", name), job)
+        os.remove(private)
+        reclaimed.append(job_id)
+    return reclaimed
+
+
+def queue_status(queue_dir: str) -> Dict[str, object]:
+    """Return the number of jobs per state and the worker heartbeats."""
+    status = {}
+    for subdir in ("pending", "running", "done"):
+        directory = os.path.join(queue_dir, subdir)
+        status[subdir] = len([n for n in os.listdir(directory) if n.endswith(".json")])
+    workers_dir = os.path.join(queue_dir, "workers")
+    status["workers"] = [worker for worker in (_read_json(os.path.join(workers_dir, n))
+                                               for n in sorted(os.listdir(workers_dir)) if n.endswith(".json"))
+                         if worker is not None]
+    return status
+
+
+class QueueWorker:
+    """
+    Worker that pulls jobs from a shared queue directory and runs them in-process.
+
+    Attributes:
+        queue_dir (str): Queue directory
+        worker_id (str): Unique id (host, pid and a random suffix)
+        lease_seconds (float): Lease duration; renewed every quarter of it
+        poll_interval (float): Seconds between checks of an empty queue
+        max_claims (int): Claims after which a reclaimed job is abandoned
+        perf_db (str, optional): Performance database the stage wall limits come from
+        resource_specs (dict, optional): ResourceSpec per subprocess stage of every job
+        current (dict): Job being run, or None
+    """
+
+    def __init__(self, queue_dir: str, lease_seconds: float = DEFAULT_LEASE_SECONDS, poll_interval: float = 5.0,
+                 max_claims: int = MAX_CLAIMS, worker_id: Optional[str] = None, perf_db: Optional[str] = None,
+                 resource_specs: Optional[dict] = None):
+        self.queue_dir = queue_dir
+        self.perf_db = perf_db
+        self.resource_specs = resource_specs
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_claims = max_claims
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.current = None
+        self.processed = 0
+        self._stop = threading.Event()
+        setup_queue(queue_dir)
+
+    def _lease_file(self, job: dict) -> str:
+        return os.path.join(self.queue_dir, "running", f"{job['id']}.lease")
+
+    def claim_next(self) -> Optional[dict]:
+        """
+        Atomically claim the oldest pending job and take its lease.
+
+        Returns:
+            dict or None: The claimed job, or None if the queue is empty
+        """
+        pending = os.path.join(self.queue_dir, "pending")
+        for name in sorted(n for n in os.listdir(pending) if n.endswith(".json")):
+            running_file = os.path.join(self.queue_dir, "running", name)
+            try:
+                os.rename(os.path.join(pending, name), running_file)
+            except FileNotFoundError:
+                continue  # Claimed by another worker
+            os.utime(running_file)
+            job = _read_json(running_file)
+            job["claims"] = job.get("claims", 0) + 1
+            job["worker"] = self.worker_id
+            _write_json_atomic(running_file, job)
+            _write_json_atomic(self._lease_file(job), {
+                "worker": self.worker_id,
+                "host": socket.gethostname(),
+                "pid": os.getpid(),
+                "claimed": time.time(),
+            })
+            return job
+        return None
+
+    def holds_lease(self, job: dict) -> bool:
+        """Return True if this worker still holds the lease of ``job``."""
+        lease = _read_json(self._lease_file(job))
+        return lease is not None and lease.get("worker") == self.worker_id
+
+    def heartbeat(self) -> None:
+        """Renew the lease of the current job and publish this worker's state."""
+        job = self.current
+        if job is not None:
+            if self.holds_lease(job):
+                with contextlib.suppress(FileNotFoundError):
+                    os.utime(self._lease_file(job))
+            else:
+                logger.warning(f"Worker {self.worker_id} lost the lease of queue job {job['id']}")
+        _write_json_atomic(os.path.join(self.queue_dir, "workers", f"{self.worker_id}.json"), {
+            "worker": self.worker_id,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "job": job["id"] if job is not None else None,
+            "processed": self.processed,
+            "time": time.time(),
+        })
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 4):
+            try:
+                self.heartbeat()
+            except OSError as e:
+                logger.warning(f"Worker heartbeat failed: {str(e)}")
+
+    def run_job(self, job: dict) -> dict:
+        """
+        Run Stages 0-3 of a job in this process.
+
+        The job runs in its submitter's directory ('cwd'), so relative paths
+        in the ini resolve as for a direct run, with the submitter's
+        --max-attempts and --stall-timeout. Its stage timings are recorded in
+        this worker's performance database.
+
+        Returns:
+            dict: 'status', 'returncode', 'seconds', 'summary' and, on failure, 'error'
+        """
+        from Firecrown_wrapper import (RunContext, record_performance, setup_directories, stage_retry_policies,
+                                       stage_timeout_policies, write_input_info)
+        from profiling import StageProfiler
+
+        options = dict(job.get("options") or {})
+        ini_stem = os.path.splitext(os.path.basename(job["ini"]))[0]
+        options.setdefault("timeout_policies", stage_timeout_policies(self.perf_db, ini_stem, job.get("stall_timeout")))
+        options.setdefault("retry_policies", stage_retry_policies(job.get("max_attempts")))
+        if self.resource_specs:
+            options.setdefault("resource_specs", self.resource_specs)
+        context = RunContext(job["outdir"], summary_path=job.get("summary"))
+        profiler = StageProfiler(context.error_path, ini_stem, timing=True)
+        options.setdefault("profiler", profiler)
+        start = time.time()
+        result = {"summary": str(context.summary_path)}
+        previous_cwd = os.getcwd()
+        try:
+            if job.get("cwd"):
+                os.chdir(job["cwd"])
+            setup_directories(context.outdir)
+            write_input_info(context.error_path, job["outdir"], job.get("argv"))
+            context.run_stages(job["path"], job["hd"], job["cov"], job["ini"], param_override=job.get("param") or "",
+                               **options)
+            result.update(status="SUCCESSFUL", returncode=0)
+        except Exception as e:
+            logger.error(f"Queue job {job['id']} failed: {traceback.format_exc()}")
+            result.update(status="FAILED", returncode=1, error=str(e))
+        finally:
+            if self.perf_db is not None:
+                run_args = argparse.Namespace(path=job["path"], hd=job["hd"], cov=job["cov"], ini=job["ini"],
+                                              param=job.get("param") or "", summary=str(context.summary_path))
+                record_performance(self.perf_db, run_args, profiler, context=context)
+            os.chdir(previous_cwd)
+        result["seconds"] = round(time.time() - start, 2)
+        return result
+
+    def finish_job(self, job: dict, result: dict) -> bool:
+        """
+        Move a job from running/ to done/ with its outcome.
+
+        Returns:
+            bool: False if the lease was lost (the job was reclaimed) and nothing was recorded
+        """
+        if not self.holds_lease(job):
+            logger.warning(f"Queue job {job['id']} was reclaimed while {self.worker_id} ran it; result discarded")
+            return False
+        name = f"{job['id']}.json"
+        _write_json_atomic(os.path.join(self.queue_dir, "done", name), dict(job, finished=time.time(), **result))
+        for path in (os.path.join(self.queue_dir, "running", name), self._lease_file(job)):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        return True
+
+    def serve_forever(self, max_jobs: Optional[int] = None, idle_timeout: Optional[float] = None) -> int:
+        """
+        Process jobs until ``max_jobs`` are done or the queue stays empty too long.
+
+        Args:
+            max_jobs (int, optional): Stop after this many jobs
+            idle_timeout (float, optional): Stop after this many seconds with nothing pending or running
+
+        Returns:
+            int: Number of jobs processed
+        """
+        self.heartbeat()
+        beat = threading.Thread(target=self._heartbeat_loop, name=f"heartbeat-{self.worker_id}", daemon=True)
+        beat.start()
+        idle_since = time.time()
+        try:
+            while max_jobs is None or self.processed < max_jobs:
+                reclaim_expired(self.queue_dir, self.lease_seconds, self.max_claims)
+                job = self.claim_next()
+                if job is None:
+                    # Jobs still running elsewhere may come back if their worker dies
+                    if queue_status(self.queue_dir)["running"]:
+                        idle_since = time.time()
+                    if idle_timeout is not None and time.time() - idle_since > idle_timeout:
+                        break
+                    time.sleep(self.poll_interval)
+                    continue
+
+                logger.info(f"Worker {self.worker_id} running queue job {job['id']}: {job['ini']}")
+                self.current = job
+                try:
+                    result = self.run_job(job)
+                    self.finish_job(job, result)
+                finally:
+                    self.current = None
+                self.processed += 1
+                idle_since = time.time()
+        finally:
+            self._stop.set()
+            beat.join()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.queue_dir, "workers", f"{self.worker_id}.json"))
+        return self.processed
+
+
+def main(argv=None):
+    """Command-line entry point: ``worker`` and ``status``."""
+    parser = argparse.ArgumentParser(description="Shared-filesystem work queue for Firecrown wrapper runs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker = subparsers.add_parser("worker", help="Pull and run jobs until the queue is drained")
+    worker.add_argument("queue_dir", help="Queue directory")
+    worker.add_argument("--max-jobs", type=int, default=None, help="Stop after N jobs")
+    worker.add_argument("--idle-timeout", type=float, default=60.0,
+                        help="Stop after S seconds with nothing pending or running (Default: 60)")
+    worker.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS,
+                        help="Lease duration; a job not renewed for this long is reclaimed (Default: 300)")
+    worker.add_argument("--poll-interval", type=float, default=5.0, help="Seconds between queue checks")
+    worker.add_argument("--perf-db", default=None,
+                        help="Performance database for the stage wall limits and the timings of every job, or 'none' "
+                        "(Default: $FIRECROWN_PERF_DB or ~/.firecrown/perf.sqlite)")
+    worker.add_argument("--cpus", type=int, default=None,
+                        help="Cores of this worker, not shared with other workers or runs on the node")
+    status = subparsers.add_parser("status", help="Show job counts and worker heartbeats")
+    status.add_argument("queue_dir", help="Queue directory")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "status":
+        setup_queue(args.queue_dir)
+        state = queue_status(args.queue_dir)
+        print(f"pending {state['pending']}  running {state['running']}  done {state['done']}")
+        for entry in state["workers"]:
+            print(f"{entry['worker']}  job {entry['job'] or '-'}  processed {entry['processed']}  "
+                  f"last beat {time.time() - entry['time']:.0f}s ago")
+        return 0
+    from perfdb import default_db_path
+
+    perf_db = None if args.perf_db == "none" else args.perf_db or default_db_path()
+    resource_specs = None
+    if args.cpus:
+        from Firecrown_wrapper import stage_resource_specs
+        from resources import allocate_cores, pin_thread
+        from telemetry import mpi_ranks
+
+        # Held until the worker exits
+        cores = allocate_cores(args.cpus)
+        if cores.cpus:
+            pin_thread(cores.cpus)
+        resource_specs = stage_resource_specs(cores.cpus, mpi_ranks())
+    queue_worker = QueueWorker(args.queue_dir, lease_seconds=args.lease_seconds, poll_interval=args.poll_interval,
+                               perf_db=perf_db, resource_specs=resource_specs)
+    processed = queue_worker.serve_forever(max_jobs=args.max_jobs, idle_timeout=args.idle_timeout)
+    logger.info(f"Queue worker {queue_worker.worker_id} exiting after {processed} jobs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())